@@ -4,6 +4,9 @@ Endpoints (no trailing slashes; APPEND_SLASH=False):
 - POST /api/chat/conversations
 - POST /api/chat/conversations/{id}/messages
 - POST /api/chat/conversations/{id}/messages:stream   (SSE)
+- GET  /api/chat/conversations/{id}/stage            (server-side stage mirror; see stage/mirror.py)
+- POST /api/chat/conversations/{id}/jobs             (detached; see chat_job_api)
+- WS   /api/chat/ws                                 (multiplexed turns, ASGI only; see chat_ws)
 
 Designed to be easy to read for rapid iteration.
 """
@@ -12,9 +15,11 @@ from __future__ import annotations
 
 import json
 import os
+import time
 import uuid
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Any, Dict, Generator, Iterable, List, Optional
+from typing import TYPE_CHECKING, AbstractSet, Any, Dict, Generator, Iterable, List, Optional, Tuple
 
 from django.http import HttpRequest, HttpResponseNotAllowed, StreamingHttpResponse
 from django.http.response import HttpResponseBase
@@ -23,23 +28,48 @@ from rest_framework.decorators import api_view
 from rest_framework.request import Request
 from rest_framework.response import Response
 
-from . import deepseek_secrets
+from . import capture, compact_dialect, fast_path, metrics, profiling, routing, similar_cache, streams
 from .ai_prompts import build_messages
+from .prompts.intent import RequestScope, classify_request
+from .sse import apply_sse_headers as _apply_sse_headers
+from .stage import instantiate, layout
+from .stage import mirror as stage_mirror
+from .sse import sse_event as _sse
+from .streams import LiveProgress, LiveStream, StreamCanceled
+
+if TYPE_CHECKING:
+    from .profiling import Probe
+    from .stage.tools import StageTools
+
+# Stage-tools mode (see stage/tools.py): opt in per request with `stageTools: true`.
+STAGE_TOOLS_DEFAULT = os.environ.get("DWEB_STAGE_TOOLS", "0") == "1"
+# Tool rounds per turn; the round after the last one is sent without tools so the model must answer.
+STAGE_TOOL_MAX_ROUNDS = int(os.environ.get("DWEB_STAGE_TOOL_MAX_ROUNDS", "4"))
+# Auto-layout prompt (see stage/layout.py): opt in per request with `autoLayout: true`.
+# Layout intents in templates are solved either way.
+AUTO_LAYOUT_DEFAULT = os.environ.get("DWEB_AUTO_LAYOUT", "0") == "1"
 
 
 def _iso_now() -> str:
     return datetime.utcnow().isoformat() + "Z"
 
 
-def _env_or_secret(name: str, fallback: str) -> str:
+def _env_or_secret(name: str) -> str:
     v = os.environ.get(name)
-    return v if v else fallback
+    if v:
+        return v
+    # Optional, git-ignored local file (copy deepseek_secrets.example.py).
+    try:
+        from . import deepseek_secrets
+    except ImportError:
+        return ""
+    return str(getattr(deepseek_secrets, name, "") or "")
 
 
 def _deepseek_cfg() -> Dict[str, str]:
-    base_url = _env_or_secret("DEEPSEEK_BASE_URL", deepseek_secrets.DEEPSEEK_BASE_URL).rstrip("/")
-    api_key = _env_or_secret("DEEPSEEK_API_KEY", deepseek_secrets.DEEPSEEK_API_KEY)
-    model = _env_or_secret("DEEPSEEK_MODEL", deepseek_secrets.DEEPSEEK_MODEL)
+    base_url = _env_or_secret("DEEPSEEK_BASE_URL").rstrip("/")
+    api_key = _env_or_secret("DEEPSEEK_API_KEY")
+    model = _env_or_secret("DEEPSEEK_MODEL")
     return {"base_url": base_url, "api_key": api_key, "model": model}
 
 
@@ -68,7 +98,9 @@ def _agent_to_ui_error(code: str, message: str, *, details: Optional[Dict[str, A
     return out
 
 
-def _agent_to_ui_task_status(phase: str, *, message: Optional[str] = None) -> Dict[str, Any]:
+def _agent_to_ui_task_status(
+    phase: str, *, message: Optional[str] = None, meta: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
     out: Dict[str, Any] = {
         "schemaVersion": 1,
         "type": "agentToUi/taskStatus",
@@ -79,6 +111,8 @@ def _agent_to_ui_task_status(phase: str, *, message: Optional[str] = None) -> Di
     }
     if message:
         out["payload"]["message"] = message
+    if meta:
+        out["meta"] = meta
     return out
 
 
@@ -127,6 +161,96 @@ def _wrap_short_agent_to_ui(obj: Dict[str, Any], *, source_model: Optional[str]
     return out
 
 
+def _solve_layout(env: Dict[str, Any], stats: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Resolve the layout intents of a componentTemplate envelope into transforms (see stage/layout.py)."""
+
+    payload = env.get("payload")
+    template = payload.get("template") if isinstance(payload, dict) else None
+    if env.get("type") != "agentToUi/componentTemplate" or not layout.has_layout(template):
+        return env
+    solved, info = layout.solve_template(template)
+    metrics.observe("chat.layout_solve_ms", info["ms"])
+    metrics.incr("chat.layout_templates", overflow=bool(info["overflow"]))
+    if stats is not None:
+        stats["templates"] += 1
+        stats["nodes"] += info["nodes"]
+        stats["containers"] += info["containers"]
+        stats["ms"] = round(stats["ms"] + info["ms"], 3)
+        stats["overflow"].extend(info["overflow"][: max(0, 20 - len(stats["overflow"]))])
+    return dict(env, payload=dict(payload, template=solved))
+
+
+def _stage_node_ids(context_pack: Any) -> AbstractSet[str]:
+    """Node ids of the contextPack's active layer (instantiated ids must not collide with them)."""
+
+    layer = context_pack.get("activeLayer") if isinstance(context_pack, dict) else None
+    if not isinstance(layer, dict) or not isinstance(layer.get("nodeTree"), list):
+        return frozenset()
+    from .stage.spatial import get_spatial_index
+
+    index, _ = get_spatial_index(layer["nodeTree"])
+    return index.index_of.keys()
+
+
+def _expand_instantiate(
+    env: Dict[str, Any],
+    *,
+    templates: Dict[str, Dict[str, Any]],
+    taken: set,
+    stats: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """insertNode envelopes for an instantiateTemplate envelope (see stage/instantiate.py).
+
+    payload: {templateId, template?, rows?: [params...], params?, parentId?, layerId?}; the
+    template is the inline one, else one sent earlier in the turn, else the library's.
+    Assigned stage ids are added to `taken`.
+    """
+
+    payload = env.get("payload") if isinstance(env.get("payload"), dict) else {}
+    template_id = payload.get("templateId")
+    template = instantiate.resolve_template(payload.get("template"), template_id, templates)
+    if template is None:
+        metrics.incr("chat.instantiate_envelopes", ok=False)
+        return [
+            _agent_to_ui_error(
+                "instantiate_template_error",
+                "找不到要实例化的模板，已忽略。",
+                details={"templateId": template_id if isinstance(template_id, str) else None},
+            )
+        ]
+    rows, reason = instantiate.parse_rows(payload)
+    try:
+        if rows is None:
+            raise instantiate.InvalidTemplate([str(reason)])
+        instances, info = instantiate.instantiate(template, rows, taken=taken)
+    except instantiate.InvalidTemplate as e:
+        metrics.incr("chat.instantiate_envelopes", ok=False)
+        return [
+            _agent_to_ui_error(
+                "instantiate_template_error",
+                "模板实例化失败，已忽略。",
+                details={"templateId": template.get("templateId"), "errors": e.errors[:20]},
+            )
+        ]
+    for inst in instances:
+        taken.update(inst["localIdToNodeId"].values())
+    metrics.incr("chat.instantiate_envelopes", ok=True, cached=info["cached"])
+    metrics.observe("chat.instantiate_ms", info["ms"])
+    if stats is not None:
+        stats["envelopes"] += 1
+        stats["rows"] += info["rows"]
+        stats["nodes"] += info["nodes"]
+        stats["cached"] += int(info["cached"])
+        stats["ms"] = round(stats["ms"] + info["ms"], 3)
+    return instantiate.insert_node_envelopes(
+        instances,
+        template_id=info["templateId"],
+        parent_id=payload.get("parentId"),
+        layer_id=payload.get("layerId"),
+        source=env.get("source") if isinstance(env.get("source"), dict) else None,
+    )
+
+
 def _build_messages(
     content: str,
     context_pack: Any,
@@ -134,6 +258,12 @@ def _build_messages(
     *,
     default_intent: str = "insert",
     viewport: Optional[Dict[str, Any]] = None,
+    report: Optional[Dict[str, Any]] = None,
+    prompt_scope: Optional[str] = None,
+    stage_tools: Optional["StageTools"] = None,
+    output_dialect: str = "verbose",
+    auto_layout: bool = False,
+    request_scope: Optional[RequestScope] = None,
 ) -> List[Dict[str, str]]:
     return build_messages(
         content=content,
@@ -141,6 +271,12 @@ def _build_messages(
         response_mode=response_mode,
         default_intent=default_intent,
         viewport=viewport,
+        report=report,
+        prompt_scope=prompt_scope,
+        stage_tools=stage_tools,
+        output_dialect=output_dialect,
+        auto_layout=auto_layout,
+        request_scope=request_scope,
     )
 
 
@@ -149,14 +285,25 @@ def _openai_stream_chat(
     base_url: str,
     api_key: str,
     model: str,
-    messages: List[Dict[str, str]],
+    messages: List[Dict[str, Any]],
     response_format: Optional[Dict[str, Any]] = None,
     timeout_s: int = 60,
+    live: Optional[LiveProgress] = None,
+    tools: Optional[List[Dict[str, Any]]] = None,
+    tool_calls: Optional[List[Dict[str, str]]] = None,
+    max_tokens: Optional[int] = None,
+    recording: Optional[capture.Recording] = None,
 ) -> Iterable[str]:
     """Yield delta text from an OpenAI-compatible streaming endpoint.
 
     Uses stdlib urllib to avoid extra deps.
     Expected upstream response is SSE with lines: "data: {...}" and "data: [DONE]".
+    With `live`, the open response is registered on it (so an ops cancel can
+    shut the socket down) and StreamCanceled is raised once it is canceled.
+    With `tools`, streamed tool-call fragments are merged by index into
+    `tool_calls` as {"id", "name", "arguments"} (no text is yielded for them).
+    `max_tokens` caps the completion length (see routing.py).
+    With `recording`, the raw SSE lines are recorded with arrival times (see capture.py).
     """
 
     import urllib.request
@@ -167,6 +314,10 @@ def _openai_stream_chat(
     body: Dict[str, Any] = {"model": model, "messages": messages, "stream": True}
     if response_format is not None:
         body["response_format"] = response_format
+    if tools:
+        body["tools"] = tools
+    if max_tokens is not None:
+        body["max_tokens"] = max_tokens
     req_body = json.dumps(body).encode("utf-8")
     req = urllib.request.Request(
         url,
@@ -179,35 +330,161 @@ def _openai_stream_chat(
         },
     )
 
+    if live is not None and live.canceled:
+        raise StreamCanceled()
+    call = recording.begin_call(model=model, messages=messages) if recording is not None else None
     with urllib.request.urlopen(req, timeout=timeout_s) as resp:
-        for raw in resp:
-            try:
-                line = raw.decode("utf-8", errors="ignore").strip()
-            except Exception:
-                continue
-            if not line:
-                continue
-            if not line.startswith("data:"):
-                continue
-            data = line[len("data:") :].strip()
-            if data == "[DONE]":
-                break
-            try:
-                obj = json.loads(data)
-            except json.JSONDecodeError:
-                continue
+        if live is not None:
+            live.attach_upstream(resp)
+        try:
+            lines = recording.tap(call, resp) if recording is not None and call is not None else resp
+            yield from _iter_sse_deltas(lines, live=live, tool_calls=tool_calls)
+        except StreamCanceled:
+            raise
+        except Exception as e:
+            # A canceled stream's socket was shut down under us; report that, not the read error.
+            if live is not None and live.canceled:
+                raise StreamCanceled() from e
+            raise
+        finally:
+            if live is not None:
+                live.detach_upstream(resp)
+        if live is not None and live.canceled:
+            raise StreamCanceled()
+
+
+def _iter_sse_deltas(
+    lines: Iterable[bytes],
+    *,
+    live: Optional[LiveProgress] = None,
+    tool_calls: Optional[List[Dict[str, str]]] = None,
+) -> Generator[str, None, None]:
+    """Delta texts of an OpenAI-compatible SSE body, one raw line at a time (stops at [DONE])."""
+
+    for raw in lines:
+        if live is not None and live.canceled:
+            raise StreamCanceled()
+        try:
+            line = raw.decode("utf-8", errors="ignore").strip()
+        except Exception:
+            continue
+        if not line:
+            continue
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:") :].strip()
+        if data == "[DONE]":
+            return
+        try:
+            obj = json.loads(data)
+        except json.JSONDecodeError:
+            continue
 
-            # OpenAI-compatible streaming shape
-            try:
-                choices = obj.get("choices") or []
-                if not choices:
-                    continue
-                delta = choices[0].get("delta") or {}
-                content = delta.get("content")
-                if isinstance(content, str) and content:
-                    yield content
-            except Exception:
+        # OpenAI-compatible streaming shape
+        try:
+            choices = obj.get("choices") or []
+            if not choices:
                 continue
+            delta = choices[0].get("delta") or {}
+            if tool_calls is not None and delta.get("tool_calls"):
+                _merge_tool_call_deltas(tool_calls, delta["tool_calls"])
+            content = delta.get("content")
+            if isinstance(content, str) and content:
+                yield content
+        except Exception:
+            continue
+
+
+def _merge_tool_call_deltas(calls: List[Dict[str, str]], deltas: List[Any]) -> None:
+    for d in deltas:
+        if not isinstance(d, dict):
+            continue
+        i = d.get("index") if isinstance(d.get("index"), int) else len(calls)
+        while len(calls) <= i:
+            calls.append({"id": "", "name": "", "arguments": ""})
+        fn = d.get("function") if isinstance(d.get("function"), dict) else {}
+        if isinstance(d.get("id"), str):
+            calls[i]["id"] = d["id"]
+        if isinstance(fn.get("name"), str):
+            calls[i]["name"] += fn["name"]
+        if isinstance(fn.get("arguments"), str):
+            calls[i]["arguments"] += fn["arguments"]
+
+
+def _message_tokens(m: Dict[str, Any]) -> int:
+    from .prompts.tokens import estimate_tokens
+
+    content = m.get("content")
+    n = estimate_tokens(content) if isinstance(content, str) else 0
+    if m.get("tool_calls"):
+        n += estimate_tokens(json.dumps(m["tool_calls"], ensure_ascii=False))
+    return n
+
+
+def _openai_stream_with_tools(
+    *,
+    base_url: str,
+    api_key: str,
+    model: str,
+    messages: List[Dict[str, Any]],
+    stage_tools: "StageTools",
+    stats: Dict[str, Any],
+    live: Optional[LiveProgress] = None,
+    max_tokens: Optional[int] = None,
+    recording: Optional[capture.Recording] = None,
+) -> Iterable[str]:
+    """_openai_stream_chat with stage tools answered in-process.
+
+    Each round that ends in tool calls is answered from `stage_tools` and sent
+    back as `tool` messages; only the model's text reaches the caller. `stats`
+    collects round trips, calls and the input tokens of every round.
+    """
+
+    from .prompts.tokens import estimate_tokens
+    from .stage.tools import TOOL_SPECS
+
+    spec_tokens = estimate_tokens(json.dumps(TOOL_SPECS, ensure_ascii=False))
+    convo = list(messages)
+    for round_no in range(STAGE_TOOL_MAX_ROUNDS + 1):
+        offer = round_no < STAGE_TOOL_MAX_ROUNDS
+        calls: List[Dict[str, str]] = []
+        streamed: List[str] = []  # this round's text, already sent to the client
+        stats["inputTokensAllRounds"] += sum(_message_tokens(m) for m in convo) + (spec_tokens if offer else 0)
+        for delta in _openai_stream_chat(
+            base_url=base_url,
+            api_key=api_key,
+            model=model,
+            messages=convo,
+            live=live,
+            tools=TOOL_SPECS if offer else None,
+            tool_calls=calls,
+            max_tokens=max_tokens,
+            recording=recording,
+        ):
+            streamed.append(delta)
+            yield delta
+        calls = [c for c in calls if c["name"]]
+        if not calls:
+            return
+        stats["roundTrips"] += 1
+        convo.append(
+            {
+                "role": "assistant",
+                # The next round must see what the client already got, or the model repeats it.
+                "content": "".join(streamed) or None,
+                "tool_calls": [
+                    {"id": c["id"], "type": "function", "function": {"name": c["name"], "arguments": c["arguments"]}}
+                    for c in calls
+                ],
+            }
+        )
+        for c in calls:
+            result = stage_tools.call(c["name"], c["arguments"])
+            text = json.dumps(result, ensure_ascii=False)
+            stats["calls"] += 1
+            stats["toolResultTokens"] += estimate_tokens(text)
+            metrics.incr("chat.stage_tool_calls", tool=c["name"], ok="error" not in result)
+            convo.append({"role": "tool", "tool_call_id": c["id"], "content": text})
 
 
 def _openai_chat(
@@ -259,6 +536,18 @@ def create_conversation(_: Request) -> Response:
 @csrf_exempt
 @api_view(["POST"])
 def send_message(request: Request, conversation_id: str) -> Response:
+    if not profiling.requested(request.headers.get(profiling.PROFILE_HEADER)):
+        return _send_message(request, conversation_id)
+    session = profiling.ProfileSession(endpoint="messages", conversation_id=conversation_id)
+    with session.active():
+        resp = _send_message(request, conversation_id)
+    session.finish()
+    if isinstance(resp.data, dict):
+        resp.data["profileId"] = session.id
+    return resp
+
+
+def _send_message(request: Request, conversation_id: str) -> Response:
     data: Any = request.data
     body = data if isinstance(data, dict) else {}
     content = str(body.get("content") or "")
@@ -327,526 +616,1012 @@ def send_message(request: Request, conversation_id: str) -> Response:
                 first = envs[0]
                 if isinstance(first, dict):
                     env = first if _is_agent_to_ui_envelope(first) else _wrap_short_agent_to_ui(first, source_model=model)
-                    return Response({"conversationId": conversation_id, "assistant": env})
+                    return Response({"conversationId": conversation_id, "assistant": _solve_layout(env)})
 
         return Response({"conversationId": conversation_id, "assistant": _agent_to_ui_text(text, source_model=model)})
     except Exception as e:
         return Response(_agent_to_ui_error("upstream_error", str(e)), status=502)
 
 
-@csrf_exempt
-def stream_message(request: HttpRequest, conversation_id: str) -> HttpResponseBase:
-    # NOTE: This endpoint is intentionally a plain Django view.
-    # DRF's content negotiation may return 406 for `Accept: text/event-stream`.
-    if request.method != "POST":
-        return HttpResponseNotAllowed(["POST"])
+@api_view(["GET"])
+def stage_mirror_detail(request: Request, conversation_id: str) -> Response:
+    """The conversation's stage mirror; `?tree=0` leaves out the nodeTree (hash check only)."""
 
-    try:
-        raw = request.body.decode("utf-8") if request.body else ""
-        data: Any = json.loads(raw) if raw else {}
-    except Exception:
-        data = {}
-    body = data if isinstance(data, dict) else {}
-    content = str(body.get("content") or "")
-    context_pack = body.get("contextPack")
-    viewport = body.get("viewport")
-    provider = str(body.get("provider") or "deepseek")
-    model_override = body.get("model")
-    response_mode = str(body.get("responseMode") or "agentToUi-jsonl")
+    mirror = stage_mirror.load(conversation_id) if stage_mirror.ENABLED else None
+    if mirror is None:
+        return Response(_agent_to_ui_error("not_found", "stage mirror not found"), status=404)
+    data = mirror.to_dict()
+    if request.query_params.get("tree") == "0":
+        del data["nodeTree"]
+    return Response(dict(data, conversationId=conversation_id))
 
-    if not content.strip():
-        def bad_req() -> Generator[bytes, None, None]:
-            yield _sse("error", {"message": "content is required"}).encode("utf-8")
-            yield _sse("done", "{}").encode("utf-8")
 
-        resp = StreamingHttpResponse(bad_req(), content_type="text/event-stream")
-        _apply_sse_headers(resp)
-        return resp
+def _upstream_error_details(e: Exception) -> Optional[Dict[str, Any]]:
+    """HTTP status / Retry-After of an upstream failure, so callers can back off on 429/5xx."""
 
-    if provider != "deepseek":
-        def bad_provider() -> Generator[bytes, None, None]:
-            yield _sse("error", {"message": f"unsupported provider: {provider}"}).encode("utf-8")
-            yield _sse("done", "{}").encode("utf-8")
+    import urllib.error
 
-        resp = StreamingHttpResponse(bad_provider(), content_type="text/event-stream")
-        _apply_sse_headers(resp)
-        return resp
+    if not isinstance(e, urllib.error.HTTPError):
+        return None
+    details: Dict[str, Any] = {"status": e.code}
+    retry_after = e.headers.get("Retry-After") if e.headers is not None else None
+    if retry_after:
+        details["retryAfter"] = retry_after
+    return details
 
-    cfg = _deepseek_cfg()
-    if not cfg["base_url"] or not cfg["api_key"] or not cfg["model"]:
-        def missing_cfg() -> Generator[bytes, None, None]:
-            yield _sse(
-                "msg",
-                _agent_to_ui_error(
-                    "missing_config",
-                    "DeepSeek config missing. Please fill dwebapp/deepseek_secrets.py or set env vars.",
-                    details={"need": ["DEEPSEEK_BASE_URL", "DEEPSEEK_API_KEY", "DEEPSEEK_MODEL"]},
-                ),
-            ).encode("utf-8")
-            yield _sse("done", "{}").encode("utf-8")
 
-        resp = StreamingHttpResponse(missing_cfg(), content_type="text/event-stream")
-        _apply_sse_headers(resp)
-        return resp
+def _iter_stream_events(
+    *,
+    cfg: Dict[str, str],
+    provider: str,
+    model: str,
+    response_mode: str,
+    msgs: List[Dict[str, str]],
+    prompt_report: Dict[str, Any],
+    started_at: float,
+    live: Optional[LiveProgress] = None,
+    stage_tools: Optional["StageTools"] = None,
+    probe: Optional["Probe"] = None,
+    output_dialect: str = "verbose",
+    max_tokens: Optional[int] = None,
+    recording: Optional[capture.Recording] = None,
+    stage_ids: Optional[AbstractSet[str]] = None,
+) -> Generator[Tuple[str, Any], None, None]:
+    """Run one upstream turn and yield (sse_event, data) pairs.
+
+    This is the whole envelope pipeline of stream_message (phase statuses,
+    JSON / JSONL envelope extraction, dedupe, repair re-prompt); callers decide
+    how to deliver the events (SSE response, batch result file, ...).
+    `live` (see streams.py) receives progress and can cancel the turn.
+    `stage_tools` (JSONL only) lets the model query the stage via tool calls.
+    `probe` (see profiling.py) counts buffer scans for a profiled request.
+    With `output_dialect` "compact" (JSONL only) short lines are expanded into
+    full envelopes as they arrive (see compact_dialect.py).
+    `max_tokens` is the completion budget of the routed tier (see routing.py).
+    `recording` (see capture.py) captures every upstream call of the turn.
+    instantiateTemplate envelopes are expanded into insertNode envelopes whose
+    ids avoid `stage_ids` (see stage/instantiate.py).
+    """
 
-    model = str(model_override) if isinstance(model_override, str) and model_override else cfg["model"]
-    viewport_dict = viewport if isinstance(viewport, dict) else None
-    msgs = _build_messages(content, context_pack, response_mode, default_intent="insert", viewport=viewport_dict)
+    metric_labels = {"intent": prompt_report.get("intent", response_mode), "scope": prompt_report.get("scope", "full")}
+    current_phase: Optional[str] = None
+    timing: Dict[str, int] = {}
 
-    def gen() -> Generator[bytes, None, None]:
-        current_phase: Optional[str] = None
+    def mark_first_token() -> None:
+        if "ttftMs" in timing:
+            return
+        timing["ttftMs"] = int((time.monotonic() - started_at) * 1000)
+        if live is not None:
+            live.note_first_token(timing["ttftMs"])
+        metrics.observe("chat.ttft_ms", timing["ttftMs"], **metric_labels)
+
+    tool_stats: Optional[Dict[str, Any]] = None
+    output_stats: Optional[Dict[str, Any]] = None
+    if response_mode == "agentToUi-jsonl":
+        output_stats = {"dialect": output_dialect, "upstreamChars": 0}
+        if output_dialect == "compact":
+            output_stats.update(compactLines=0, expandFailed=0)
+    if stage_tools is not None:
+        tool_stats = {"roundTrips": 0, "calls": 0, "toolResultTokens": 0, "inputTokensAllRounds": 0}
+    layout_stats: Dict[str, Any] = {"templates": 0, "nodes": 0, "containers": 0, "ms": 0.0, "overflow": []}
+    instantiate_stats: Dict[str, Any] = {"envelopes": 0, "rows": 0, "nodes": 0, "cached": 0, "ms": 0.0}
+    turn_templates: Dict[str, Dict[str, Any]] = {}
+    turn_ids = set(stage_ids or ())
+
+    def done_meta() -> Dict[str, Any]:
+        timing["totalMs"] = int((time.monotonic() - started_at) * 1000)
+        meta: Dict[str, Any] = {"timing": dict(timing), "intent": metric_labels["intent"]}
+        if tool_stats is not None:
+            full = (prompt_report.get("stageTools") or {}).get("fullInputTokens", 0)
+            meta["stageTools"] = dict(
+                tool_stats,
+                fullInputTokens=full,
+                savedTokens=full - tool_stats["inputTokensAllRounds"],
+                toolMs=round(sum(c["ms"] for c in stage_tools.calls), 3) if stage_tools is not None else 0,
+            )
+        if output_stats is not None:
+            meta["output"] = dict(output_stats)
+        if layout_stats["templates"]:
+            meta["layout"] = dict(layout_stats)
+        if instantiate_stats["envelopes"]:
+            meta["instantiate"] = dict(instantiate_stats)
+        return meta
+
+    def deliver(env: Dict[str, Any]) -> Generator[Tuple[str, Any], None, None]:
+        # Templates sent this turn can be instantiated by id later in the turn.
+        if env.get("type") == "agentToUi/instantiateTemplate":
+            for expanded in _expand_instantiate(env, templates=turn_templates, taken=turn_ids, stats=instantiate_stats):
+                yield ("msg", expanded)
+            return
+        if env.get("type") == "agentToUi/componentTemplate":
+            template = (env.get("payload") or {}).get("template")
+            if isinstance(template, dict) and isinstance(template.get("templateId"), str):
+                turn_templates[template["templateId"]] = template
+                turn_ids.update(instantiate.template_node_ids(template))
+        yield ("msg", env)
+
+    def emit_phase(
+        phase: str, *, message: Optional[str] = None, meta: Optional[Dict[str, Any]] = None
+    ) -> Generator[Tuple[str, Any], None, None]:
+        nonlocal current_phase
+        if current_phase == phase:
+            return
+        current_phase = phase
+        if live is not None:
+            live.set_phase(phase)
+        yield ("msg", _agent_to_ui_task_status(phase, message=message, meta=meta))
 
-        def emit_phase(phase: str, *, message: Optional[str] = None) -> Generator[bytes, None, None]:
-            nonlocal current_phase
-            if current_phase == phase:
-                return
-            current_phase = phase
-            yield _sse("msg", _agent_to_ui_task_status(phase, message=message)).encode("utf-8")
+    try:
+        for out in emit_phase("started", message="已开始", meta={"prompt": prompt_report}):
+            yield out
+
+        # DeepSeek JSON Output mode: one-shot JSON, then emit envelopes as SSE msgs.
+        if response_mode == "agentToUi-json":
+            buf = ""
+            search_pos = 0
+            array_start: Optional[int] = None
+            scan_pos = 0
+            in_string = False
+            escape = False
+            depth = 0
+            obj_start: Optional[int] = None
+
+            seen_ids: set[str] = set()
+
+            saw_any_delta = False
+            emitted_any = False
+
+            def drive_phase_by_type(t0: Optional[str]) -> Generator[Tuple[str, Any], None, None]:
+                if t0 in ("agentToUi/text", "agentToUi/chatMessage"):
+                    for out in emit_phase("writing", message="生成说明"):
+                        yield out
+                elif t0 in ("agentToUi/componentTemplate", "agentToUi/instantiateTemplate"):
+                    for out in emit_phase("template", message="生成组件"):
+                        yield out
+                else:
+                    # default
+                    for out in emit_phase("writing", message="生成内容"):
+                        yield out
 
-        try:
-            for out in emit_phase("started", message="已开始"):
-                yield out
+            def try_emit_from_buffer() -> Generator[Tuple[str, Any], None, None]:
+                nonlocal buf, search_pos, array_start, scan_pos, in_string, escape, depth, obj_start, emitted_any
+                if probe is not None:
+                    probe.note_emit_call("json", len(buf))
+
+                # 1) locate envelopes array start
+                if array_start is None:
+                    # Find "envelopes" key then the first '[' after it.
+                    k = buf.find('"envelopes"', search_pos)
+                    if k == -1:
+                        # keep buffer bounded
+                        if len(buf) > 200_000:
+                            buf = buf[-50_000:]
+                            search_pos = 0
+                        return
+                    b = buf.find('[', k)
+                    if b == -1:
+                        search_pos = max(0, k)
+                        return
+                    array_start = b + 1
+                    scan_pos = array_start
+
+                # 2) scan for complete JSON objects inside envelopes array
+                i = scan_pos
+                while i < len(buf):
+                    ch = buf[i]
+                    if in_string:
+                        if escape:
+                            escape = False
+                        elif ch == '\\':
+                            escape = True
+                        elif ch == '"':
+                            in_string = False
+                        i += 1
+                        continue
 
-            # DeepSeek JSON Output mode: one-shot JSON, then emit envelopes as SSE msgs.
-            if response_mode == "agentToUi-json":
-                buf = ""
-                search_pos = 0
-                array_start: Optional[int] = None
-                scan_pos = 0
-                in_string = False
-                escape = False
-                depth = 0
-                obj_start: Optional[int] = None
-
-                seen_ids: set[str] = set()
-
-                saw_any_delta = False
-                emitted_any = False
-
-                def drive_phase_by_type(t0: Optional[str]) -> Generator[bytes, None, None]:
-                    if t0 in ("agentToUi/text", "agentToUi/chatMessage"):
-                        for out in emit_phase("writing", message="生成说明"):
-                            yield out
-                    elif t0 == "agentToUi/componentTemplate":
-                        for out in emit_phase("template", message="生成组件"):
-                            yield out
-                    else:
-                        # default
-                        for out in emit_phase("writing", message="生成内容"):
-                            yield out
+                    if ch == '"':
+                        in_string = True
+                        i += 1
+                        continue
 
-                def try_emit_from_buffer() -> Generator[bytes, None, None]:
-                    nonlocal buf, search_pos, array_start, scan_pos, in_string, escape, depth, obj_start, emitted_any
-
-                    # 1) locate envelopes array start
-                    if array_start is None:
-                        # Find "envelopes" key then the first '[' after it.
-                        k = buf.find('"envelopes"', search_pos)
-                        if k == -1:
-                            # keep buffer bounded
-                            if len(buf) > 200_000:
-                                buf = buf[-50_000:]
+                    if ch == '{':
+                        if depth == 0:
+                            obj_start = i
+                        depth += 1
+                        i += 1
+                        continue
+
+                    if ch == '}':
+                        if depth > 0:
+                            depth -= 1
+                            if depth == 0 and obj_start is not None:
+                                obj_text = buf[obj_start : i + 1]
+                                obj_start = None
+                                try:
+                                    env0 = json.loads(obj_text)
+                                except Exception:
+                                    # Keep scanning; we may have split or malformed object.
+                                    # Do not advance scan_pos past this '}' yet.
+                                    depth = 0
+                                    return
+                                if isinstance(env0, dict):
+                                    if _is_agent_to_ui_envelope(env0):
+                                        env_id = env0.get("id")
+                                        if isinstance(env_id, str) and env_id:
+                                            if env_id in seen_ids:
+                                                # Skip duplicates to avoid repeated UI side effects.
+                                                continue
+                                            seen_ids.add(env_id)
+                                        t0 = env0.get("type") if isinstance(env0.get("type"), str) else None
+                                        for out in drive_phase_by_type(t0):
+                                            yield out
+                                        for out in deliver(_solve_layout(env0, layout_stats)):
+                                            yield out
+                                        emitted_any = True
+                                    elif isinstance(env0.get("type"), str) and "payload" in env0:
+                                        # Short-form messages should also carry id; if present, dedupe.
+                                        env_id = env0.get("id")
+                                        if isinstance(env_id, str) and env_id:
+                                            if env_id in seen_ids:
+                                                continue
+                                            seen_ids.add(env_id)
+
+                                        wrapped = _wrap_short_agent_to_ui(env0, source_model=model)
+                                        t0 = wrapped.get("type") if isinstance(wrapped.get("type"), str) else None
+                                        for out in drive_phase_by_type(t0):
+                                            yield out
+                                        for out in deliver(_solve_layout(wrapped, layout_stats)):
+                                            yield out
+                                        emitted_any = True
+
+                                # We can safely drop everything up to i+1 to keep buffer small.
+                                buf = buf[i + 1 :]
+                                # Reset scan to start of remaining buffer.
                                 search_pos = 0
-                            return
-                        b = buf.find('[', k)
-                        if b == -1:
-                            search_pos = max(0, k)
-                            return
-                        array_start = b + 1
-                        scan_pos = array_start
-
-                    # 2) scan for complete JSON objects inside envelopes array
-                    i = scan_pos
-                    while i < len(buf):
-                        ch = buf[i]
-                        if in_string:
-                            if escape:
-                                escape = False
-                            elif ch == '\\':
-                                escape = True
-                            elif ch == '"':
+                                array_start = 0  # since buf is now inside array content
+                                scan_pos = 0
+                                i = 0
                                 in_string = False
-                            i += 1
-                            continue
-
-                        if ch == '"':
-                            in_string = True
-                            i += 1
-                            continue
-
-                        if ch == '{':
-                            if depth == 0:
-                                obj_start = i
-                            depth += 1
-                            i += 1
-                            continue
+                                escape = False
+                                depth = 0
+                                continue
+                        i += 1
+                        continue
 
-                        if ch == '}':
-                            if depth > 0:
-                                depth -= 1
-                                if depth == 0 and obj_start is not None:
-                                    obj_text = buf[obj_start : i + 1]
-                                    obj_start = None
-                                    try:
-                                        env0 = json.loads(obj_text)
-                                    except Exception:
-                                        # Keep scanning; we may have split or malformed object.
-                                        # Do not advance scan_pos past this '}' yet.
-                                        depth = 0
-                                        return
-                                    if isinstance(env0, dict):
-                                        if _is_agent_to_ui_envelope(env0):
-                                            env_id = env0.get("id")
-                                            if isinstance(env_id, str) and env_id:
-                                                if env_id in seen_ids:
-                                                    # Skip duplicates to avoid repeated UI side effects.
-                                                    continue
-                                                seen_ids.add(env_id)
-                                            t0 = env0.get("type") if isinstance(env0.get("type"), str) else None
-                                            for out in drive_phase_by_type(t0):
-                                                yield out
-                                            yield _sse("msg", env0).encode("utf-8")
-                                            emitted_any = True
-                                        elif isinstance(env0.get("type"), str) and "payload" in env0:
-                                            # Short-form messages should also carry id; if present, dedupe.
-                                            env_id = env0.get("id")
-                                            if isinstance(env_id, str) and env_id:
-                                                if env_id in seen_ids:
-                                                    continue
-                                                seen_ids.add(env_id)
-
-                                            wrapped = _wrap_short_agent_to_ui(env0, source_model=model)
-                                            t0 = wrapped.get("type") if isinstance(wrapped.get("type"), str) else None
-                                            for out in drive_phase_by_type(t0):
-                                                yield out
-                                            yield _sse("msg", wrapped).encode("utf-8")
-                                            emitted_any = True
-
-                                    # We can safely drop everything up to i+1 to keep buffer small.
-                                    buf = buf[i + 1 :]
-                                    # Reset scan to start of remaining buffer.
-                                    search_pos = 0
-                                    array_start = 0  # since buf is now inside array content
-                                    scan_pos = 0
-                                    i = 0
-                                    in_string = False
-                                    escape = False
-                                    depth = 0
-                                    continue
-                            i += 1
-                            continue
+                    # If envelopes array ends, we can stop.
+                    if ch == ']':
+                        scan_pos = i
+                        return
 
-                        # If envelopes array ends, we can stop.
-                        if ch == ']':
-                            scan_pos = i
-                            return
+                    i += 1
 
-                        i += 1
+                scan_pos = i
 
-                    scan_pos = i
+            for out in emit_phase("streaming", message="连接模型"):
+                yield out
 
-                for out in emit_phase("streaming", message="连接模型"):
+            for delta in _openai_stream_chat(
+                base_url=cfg["base_url"],
+                api_key=cfg["api_key"],
+                model=model,
+                messages=msgs,
+                response_format={"type": "json_object"},
+                live=live,
+                max_tokens=max_tokens,
+                recording=recording,
+            ):
+                if not saw_any_delta:
+                    saw_any_delta = True
+                    mark_first_token()
+                buf += delta
+                if live is not None:
+                    live.note_delta(len(delta), len(buf))
+                for out in try_emit_from_buffer():
                     yield out
 
-                for delta in _openai_stream_chat(
-                    base_url=cfg["base_url"],
-                    api_key=cfg["api_key"],
-                    model=model,
-                    messages=msgs,
-                    response_format={"type": "json_object"},
-                ):
-                    if not saw_any_delta:
-                        saw_any_delta = True
-                    buf += delta
-                    for out in try_emit_from_buffer():
-                        yield out
+            if not saw_any_delta:
+                yield (
+                    "msg",
+                    _agent_to_ui_error(
+                        "empty_content",
+                        "DeepSeek JSON Output returned empty content; try adjusting prompt or max_tokens.",
+                        details={"provider": provider, "responseMode": response_mode},
+                    ),
+                )
+            elif not emitted_any:
+                # Fallback: if we couldn't extract any envelope, surface raw tail.
+                tail = buf.strip()
+                if tail:
+                    yield ("msg", _agent_to_ui_text(tail[:8000], source_model=model))
 
-                if not saw_any_delta:
-                    yield _sse(
-                        "msg",
-                        _agent_to_ui_error(
-                            "empty_content",
-                            "DeepSeek JSON Output returned empty content; try adjusting prompt or max_tokens.",
-                            details={"provider": provider, "responseMode": response_mode},
-                        ),
-                    ).encode("utf-8")
-                elif not emitted_any:
-                    # Fallback: if we couldn't extract any envelope, surface raw tail.
-                    tail = buf.strip()
-                    if tail:
-                        yield _sse("msg", _agent_to_ui_text(tail[:8000], source_model=model)).encode("utf-8")
-
-                for out in emit_phase("done", message="完成"):
-                    yield out
-                yield _sse("done", "{}").encode("utf-8")
-                return
-
-            if response_mode == "agentToUi-jsonl":
-                buf = ""
-                decoder = json.JSONDecoder()
-
-                # Track emitted envelopes so we can ask the model to continue after a parse error.
-                seen_ids: set[str] = set()
-                emitted: list[dict[str, str]] = []  # [{"id":..., "type":...}, ...]
-                last_discarded_prefix_preview: str | None = None
-                flushed_buffer_due_to_size: bool = False
-
-                saw_any_delta = False
-
-                def _build_tail_debug_details(*, tail: str) -> dict[str, Any]:
-                    import hashlib
-
-                    tail_safe = tail
-                    # Keep payload bounded; do not stream huge raw blobs.
-                    if len(tail_safe) > 8000:
-                        tail_safe = tail_safe[:8000]
-                    return {
-                        "provider": provider,
-                        "responseMode": response_mode,
-                        "model": model,
-                        "tailLen": len(tail),
-                        "tailPreview": tail_safe,
-                        "tailSha256": hashlib.sha256(tail.encode("utf-8", errors="ignore")).hexdigest(),
-                        "discardedPrefixPreview": last_discarded_prefix_preview,
-                        "flushedBufferDueToSize": flushed_buffer_due_to_size,
-                        "emittedEnvelopes": emitted[-30:],
-                    }
-
-                def _build_repair_messages(*, tail: str) -> list[dict[str, str]]:
-                    # Ask the model to continue without terminating the conversation.
-                    tail_preview = tail
-                    if len(tail_preview) > 2000:
-                        tail_preview = tail_preview[:2000]
-                    emitted_lines = "\n".join([f"- {m.get('type')} id={m.get('id')}" for m in emitted[-30:]])
-                    repair_sys = (
-                        "你正在进行一次‘后端自动纠错续写’：上一次输出因 JSONL 解析失败而被后端中止解析。"
-                        "你必须继续完成用户任务，且必须严格只输出 JSONL（每行一个完整 AgentToUI envelope JSON 对象），"
-                        "禁止输出任何非 JSON 内容。"
-                    )
-                    repair_user = (
-                        "上一次输出触发 jsonl_parse_error。以下是无法解析的残留内容预览（仅供你定位问题；不要原样输出）：\n"
-                        f"{tail_preview}\n\n"
-                        "以下是已成功发送到前端的最近消息（避免重复）：\n"
-                        f"{emitted_lines if emitted_lines else '(none)'}\n\n"
-                        "现在请：\n"
-                        "1) 先输出一条 agentToUi/chatMessage 简短说明你将纠正并继续；\n"
-                        "2) 然后继续输出你原本应该输出的剩余消息（如 componentTemplate/applyFilter/patchNode 等）；\n"
-                        "3) 严格遵守 JSONL 约束，不要输出任何额外文本。"
-                    )
+            for out in emit_phase("done", message="完成", meta=done_meta()):
+                yield out
+            yield ("done", "{}")
+            return
 
-                    # Append to the original conversation.
-                    return [
-                        *msgs,
-                        {"role": "system", "content": repair_sys},
-                        {"role": "user", "content": repair_user},
-                    ]
-
-                def try_emit_from_buffer() -> Generator[bytes, None, None]:
-                    nonlocal buf, last_discarded_prefix_preview, flushed_buffer_due_to_size
-                    while True:
-                        s = buf.lstrip()
-                        if not s:
-                            buf = ""
-                            return
+        if response_mode == "agentToUi-jsonl":
+            buf = ""
+            decoder = json.JSONDecoder()
+
+            # Track emitted envelopes so we can ask the model to continue after a parse error.
+            seen_ids: set[str] = set()
+            emitted: list[dict[str, str]] = []  # [{"id":..., "type":...}, ...]
+            last_discarded_prefix_preview: str | None = None
+            flushed_buffer_due_to_size: bool = False
+
+            saw_any_delta = False
+
+            def _build_tail_debug_details(*, tail: str) -> dict[str, Any]:
+                import hashlib
+
+                tail_safe = tail
+                # Keep payload bounded; do not stream huge raw blobs.
+                if len(tail_safe) > 8000:
+                    tail_safe = tail_safe[:8000]
+                return {
+                    "provider": provider,
+                    "responseMode": response_mode,
+                    "model": model,
+                    "tailLen": len(tail),
+                    "tailPreview": tail_safe,
+                    "tailSha256": hashlib.sha256(tail.encode("utf-8", errors="ignore")).hexdigest(),
+                    "discardedPrefixPreview": last_discarded_prefix_preview,
+                    "flushedBufferDueToSize": flushed_buffer_due_to_size,
+                    "emittedEnvelopes": emitted[-30:],
+                }
+
+            def _build_repair_messages(*, tail: str) -> list[dict[str, str]]:
+                # Ask the model to continue without terminating the conversation.
+                tail_preview = tail
+                if len(tail_preview) > 2000:
+                    tail_preview = tail_preview[:2000]
+                emitted_lines = "\n".join([f"- {m.get('type')} id={m.get('id')}" for m in emitted[-30:]])
+                repair_sys = (
+                    "你正在进行一次‘后端自动纠错续写’：上一次输出因 JSONL 解析失败而被后端中止解析。"
+                    "你必须继续完成用户任务，且必须严格只输出 JSONL（每行一个完整 AgentToUI envelope JSON 对象），"
+                    "禁止输出任何非 JSON 内容。"
+                )
+                repair_user = (
+                    "上一次输出触发 jsonl_parse_error。以下是无法解析的残留内容预览（仅供你定位问题；不要原样输出）：\n"
+                    f"{tail_preview}\n\n"
+                    "以下是已成功发送到前端的最近消息（避免重复）：\n"
+                    f"{emitted_lines if emitted_lines else '(none)'}\n\n"
+                    "现在请：\n"
+                    "1) 先输出一条 agentToUi/chatMessage 简短说明你将纠正并继续；\n"
+                    "2) 然后继续输出你原本应该输出的剩余消息（如 componentTemplate/applyFilter/patchNode 等）；\n"
+                    "3) 严格遵守 JSONL 约束，不要输出任何额外文本。"
+                )
 
-                        # Strict JSONL-only: if model leaks any non-JSON text (e.g. Chinese prose)
-                        # before a JSON object, discard it until the next '{'.
-                        if s and not s.startswith("{"):
-                            brace = s.find("{")
-                            if brace == -1:
-                                # No JSON object start yet; keep buffer bounded but don't emit text.
-                                if len(s) > 50_000:
-                                    last_discarded_prefix_preview = s[:2000]
-                                    flushed_buffer_due_to_size = True
-                                    buf = ""
-                                return
-                            # Drop everything before the next object start.
-                            last_discarded_prefix_preview = s[: min(brace, 2000)]
-                            buf = s[brace:]
+                # Append to the original conversation.
+                return [
+                    *msgs,
+                    {"role": "system", "content": repair_sys},
+                    {"role": "user", "content": repair_user},
+                ]
+
+            def try_emit_from_buffer() -> Generator[Tuple[str, Any], None, None]:
+                nonlocal buf, last_discarded_prefix_preview, flushed_buffer_due_to_size
+                if probe is not None:
+                    probe.note_emit_call("jsonl", len(buf))
+                while True:
+                    s = buf.lstrip()
+                    if not s:
+                        buf = ""
+                        return
+
+                    # Strict JSONL-only: if model leaks any non-JSON text (e.g. Chinese prose)
+                    # before a JSON object, discard it until the next '{'.
+                    if s and not s.startswith("{"):
+                        brace = s.find("{")
+                        if brace == -1:
+                            # No JSON object start yet; keep buffer bounded but don't emit text.
+                            if len(s) > 50_000:
+                                last_discarded_prefix_preview = s[:2000]
+                                flushed_buffer_due_to_size = True
+                                buf = ""
+                            return
+                        # Drop everything before the next object start.
+                        last_discarded_prefix_preview = s[: min(brace, 2000)]
+                        buf = s[brace:]
+                        continue
+                    try:
+                        obj, end = decoder.raw_decode(s)
+                    except json.JSONDecodeError:
+                        # Need more data.
+                        return
+                    consumed = (len(buf) - len(s)) + end
+                    buf = buf[consumed:]
+
+                    if output_dialect == "compact" and output_stats is not None and compact_dialect.is_compact_line(obj):
+                        expanded = compact_dialect.expand(obj, model=model)
+                        metrics.incr("chat.compact_lines", kind=obj.get("t"), ok=expanded is not None)
+                        if expanded is None:
+                            output_stats["expandFailed"] += 1
+                            yield (
+                                "msg",
+                                _agent_to_ui_error(
+                                    "compact_expand_error",
+                                    "模型输出的紧凑格式行缺少必要字段，已忽略。",
+                                    details={"kind": obj.get("t"), "responseMode": response_mode},
+                                ),
+                            )
                             continue
+                        output_stats["compactLines"] += 1
+                        obj = expanded
+
+                    if _is_agent_to_ui_envelope(obj):
                         try:
-                            obj, end = decoder.raw_decode(s)
-                        except json.JSONDecodeError:
-                            # Need more data.
-                            return
-                        consumed = (len(buf) - len(s)) + end
-                        buf = buf[consumed:]
+                            mid = obj.get("id")
+                            if isinstance(mid, str) and mid:
+                                if mid in seen_ids:
+                                    continue
+                                seen_ids.add(mid)
+                            t_emit = obj.get("type")
+                            if isinstance(mid, str) and isinstance(t_emit, str):
+                                emitted.append({"id": mid, "type": t_emit})
+                        except Exception:
+                            pass
+                        t0 = obj.get("type")
+                        if t0 in ("agentToUi/text", "agentToUi/chatMessage"):
+                            for out in emit_phase("writing", message="生成说明"):
+                                yield out
+                        elif t0 in ("agentToUi/componentTemplate", "agentToUi/instantiateTemplate"):
+                            for out in emit_phase("template", message="生成组件"):
+                                yield out
+                        for out in deliver(_solve_layout(obj, layout_stats)):
+                            yield out
+                        continue
 
-                        if _is_agent_to_ui_envelope(obj):
+                    if isinstance(obj, dict) and isinstance(obj.get("type"), str) and "payload" in obj:
+                        t = obj.get("type")
+                        if isinstance(t, str) and t.startswith("agentToUi/"):
                             try:
-                                mid = obj.get("id")
-                                if isinstance(mid, str) and mid:
-                                    if mid in seen_ids:
+                                mid2 = obj.get("id")
+                                if isinstance(mid2, str) and mid2:
+                                    if mid2 in seen_ids:
                                         continue
-                                    seen_ids.add(mid)
-                                t_emit = obj.get("type")
-                                if isinstance(mid, str) and isinstance(t_emit, str):
-                                    emitted.append({"id": mid, "type": t_emit})
+                                    seen_ids.add(mid2)
+                                if isinstance(mid2, str) and isinstance(t, str):
+                                    emitted.append({"id": mid2, "type": t})
                             except Exception:
                                 pass
-                            t0 = obj.get("type")
-                            if t0 in ("agentToUi/text", "agentToUi/chatMessage"):
+                            if t in ("agentToUi/text", "agentToUi/chatMessage"):
                                 for out in emit_phase("writing", message="生成说明"):
                                     yield out
-                            elif t0 == "agentToUi/componentTemplate":
+                            elif t in ("agentToUi/componentTemplate", "agentToUi/instantiateTemplate"):
                                 for out in emit_phase("template", message="生成组件"):
                                     yield out
-                            yield _sse("msg", obj).encode("utf-8")
+                            for out in deliver(_solve_layout(_wrap_short_agent_to_ui(obj, source_model=model), layout_stats)):
+                                yield out
                             continue
 
-                        if isinstance(obj, dict) and isinstance(obj.get("type"), str) and "payload" in obj:
-                            t = obj.get("type")
-                            if isinstance(t, str) and t.startswith("agentToUi/"):
-                                try:
-                                    mid2 = obj.get("id")
-                                    if isinstance(mid2, str) and mid2:
-                                        if mid2 in seen_ids:
-                                            continue
-                                        seen_ids.add(mid2)
-                                    if isinstance(mid2, str) and isinstance(t, str):
-                                        emitted.append({"id": mid2, "type": t})
-                                except Exception:
-                                    pass
-                                if t in ("agentToUi/text", "agentToUi/chatMessage"):
-                                    for out in emit_phase("writing", message="生成说明"):
-                                        yield out
-                                elif t == "agentToUi/componentTemplate":
-                                    for out in emit_phase("template", message="生成组件"):
-                                        yield out
-                                yield _sse("msg", _wrap_short_agent_to_ui(obj, source_model=model)).encode("utf-8")
-                                continue
-
-                        # Unexpected JSON shape: do NOT stringify JSON into user-visible text.
-                        # Surface a structured error instead.
-                        yield _sse(
-                            "msg",
-                            _agent_to_ui_error(
-                                "unexpected_json_shape",
-                                "模型输出了非 AgentToUI 的 JSON 对象，已忽略。",
-                                details={"provider": provider, "responseMode": response_mode},
-                            ),
-                        ).encode("utf-8")
+                    # Unexpected JSON shape: do NOT stringify JSON into user-visible text.
+                    # Surface a structured error instead.
+                    yield (
+                        "msg",
+                        _agent_to_ui_error(
+                            "unexpected_json_shape",
+                            "模型输出了非 AgentToUI 的 JSON 对象，已忽略。",
+                            details={"provider": provider, "responseMode": response_mode},
+                        ),
+                    )
 
-                for delta in _openai_stream_chat(
+            if stage_tools is not None and tool_stats is not None:
+                upstream = _openai_stream_with_tools(
                     base_url=cfg["base_url"],
                     api_key=cfg["api_key"],
                     model=model,
                     messages=msgs,
-                ):
-                    if not saw_any_delta:
-                        saw_any_delta = True
-                        for out in emit_phase("streaming", message="连接模型"):
-                            yield out
-                    buf += delta
-                    for out in try_emit_from_buffer():
+                    stage_tools=stage_tools,
+                    stats=tool_stats,
+                    live=live,
+                    max_tokens=max_tokens,
+                    recording=recording,
+                )
+            else:
+                upstream = _openai_stream_chat(
+                    base_url=cfg["base_url"],
+                    api_key=cfg["api_key"],
+                    model=model,
+                    messages=msgs,
+                    live=live,
+                    max_tokens=max_tokens,
+                    recording=recording,
+                )
+            for delta in upstream:
+                if not saw_any_delta:
+                    saw_any_delta = True
+                    mark_first_token()
+                    for out in emit_phase("streaming", message="连接模型"):
                         yield out
+                buf += delta
+                if output_stats is not None:
+                    output_stats["upstreamChars"] += len(delta)
+                if live is not None:
+                    live.note_delta(len(delta), len(buf))
+                for out in try_emit_from_buffer():
+                    yield out
 
-                tail = buf.strip()
-                if tail:
-                    # Flush tail: try to emit any remaining JSON object.
-                    for out in try_emit_from_buffer():
-                        yield out
+            if tool_stats is not None:
+                metrics.observe("chat.stage_tool_rounds", tool_stats["roundTrips"])
+                metrics.observe("chat.stage_tool_saved_tokens", done_meta()["stageTools"]["savedTokens"])
 
-                    # Still have tail but cannot parse: fallback.
-                    tail2 = buf.strip()
-                    if tail2:
-                        # Best-effort recovery FIRST: ask the model to correct the error and continue.
-                        # If recovery succeeds, do NOT emit agentToUi/error (to avoid interrupting UI flow).
-                        emitted_before_repair = len(emitted)
-                        for out in emit_phase("streaming", message="检测到输出残留，尝试让模型修复并继续"):
-                            yield out
+            tail = buf.strip()
+            if tail:
+                # Flush tail: try to emit any remaining JSON object.
+                for out in try_emit_from_buffer():
+                    yield out
 
-                        # Reset buffer and parse the repair stream.
-                        buf = ""
-                        repair_msgs = _build_repair_messages(tail=tail2)
-                        repaired_any = False
-                        for delta2 in _openai_stream_chat(
-                            base_url=cfg["base_url"],
-                            api_key=cfg["api_key"],
-                            model=model,
-                            messages=repair_msgs,
-                        ):
-                            repaired_any = True
-                            buf += delta2
-                            for out in try_emit_from_buffer():
-                                yield out
+                # Still have tail but cannot parse: fallback.
+                tail2 = buf.strip()
+                if tail2:
+                    # Best-effort recovery FIRST: ask the model to correct the error and continue.
+                    # If recovery succeeds, do NOT emit agentToUi/error (to avoid interrupting UI flow).
+                    emitted_before_repair = len(emitted)
+                    for out in emit_phase("streaming", message="检测到输出残留，尝试让模型修复并继续"):
+                        yield out
 
-                        # Flush whatever we can after repair.
+                    # Reset buffer and parse the repair stream.
+                    buf = ""
+                    repair_msgs = _build_repair_messages(tail=tail2)
+                    repaired_any = False
+                    for delta2 in _openai_stream_chat(
+                        base_url=cfg["base_url"],
+                        api_key=cfg["api_key"],
+                        model=model,
+                        messages=repair_msgs,
+                        live=live,
+                        max_tokens=max_tokens,
+                        recording=recording,
+                    ):
+                        repaired_any = True
+                        buf += delta2
+                        if live is not None:
+                            live.note_delta(len(delta2), len(buf))
                         for out in try_emit_from_buffer():
                             yield out
 
-                        repair_added_messages = len(emitted) > emitted_before_repair
+                    # Flush whatever we can after repair.
+                    for out in try_emit_from_buffer():
+                        yield out
+
+                    repair_added_messages = len(emitted) > emitted_before_repair
 
-                        if repair_added_messages:
-                            # Non-fatal note for operator; avoid emitting an error envelope that may stop the UI.
-                            yield _sse(
-                                "msg",
-                                _agent_to_ui_task_status("repair", message="检测到模型输出被截断/残留，后端已自动修复并继续"),
-                            ).encode("utf-8")
-
-                            # If repair still leaves tail, drop it but only warn (do not error).
-                            tail4 = buf.strip()
-                            if repaired_any and tail4:
-                                yield _sse(
-                                    "msg",
-                                    _agent_to_ui_task_status(
-                                        "repair_warning",
-                                        message="修复续写后仍有少量残留内容被丢弃（未中断任务）",
-                                    ),
-                                ).encode("utf-8")
-                        else:
-                            # Recovery failed: emit a structured error WITH tail preview for debugging.
-                            yield _sse(
+                    if repair_added_messages:
+                        # Non-fatal note for operator; avoid emitting an error envelope that may stop the UI.
+                        yield (
+                            "msg",
+                            _agent_to_ui_task_status("repair", message="检测到模型输出被截断/残留，后端已自动修复并继续"),
+                        )
+
+                        # If repair still leaves tail, drop it but only warn (do not error).
+                        tail4 = buf.strip()
+                        if repaired_any and tail4:
+                            yield (
                                 "msg",
-                                _agent_to_ui_error(
-                                    "jsonl_parse_error",
-                                    "模型输出包含无法解析的残留内容（已丢弃）。",
-                                    details=_build_tail_debug_details(tail=tail2),
+                                _agent_to_ui_task_status(
+                                    "repair_warning",
+                                    message="修复续写后仍有少量残留内容被丢弃（未中断任务）",
                                 ),
-                            ).encode("utf-8")
-            else:
-                saw_any_delta = False
-                for delta in _openai_stream_chat(
-                    base_url=cfg["base_url"],
-                    api_key=cfg["api_key"],
-                    model=model,
-                    messages=msgs,
-                ):
-                    if not saw_any_delta:
-                        saw_any_delta = True
-                        for out in emit_phase("streaming", message="连接模型"):
-                            yield out
-                        for out in emit_phase("writing", message="生成说明"):
-                            yield out
-                    yield _sse("msg", _agent_to_ui_text(delta, source_model=model)).encode("utf-8")
+                            )
+                    else:
+                        # Recovery failed: emit a structured error WITH tail preview for debugging.
+                        yield (
+                            "msg",
+                            _agent_to_ui_error(
+                                "jsonl_parse_error",
+                                "模型输出包含无法解析的残留内容（已丢弃）。",
+                                details=dict(
+                                    _build_tail_debug_details(tail=tail2),
+                                    **({"captureId": recording.id} if recording is not None else {}),
+                                ),
+                            ),
+                        )
+        else:
+            saw_any_delta = False
+            for delta in _openai_stream_chat(
+                base_url=cfg["base_url"],
+                api_key=cfg["api_key"],
+                model=model,
+                messages=msgs,
+                live=live,
+                max_tokens=max_tokens,
+                recording=recording,
+            ):
+                if not saw_any_delta:
+                    saw_any_delta = True
+                    mark_first_token()
+                    for out in emit_phase("streaming", message="连接模型"):
+                        yield out
+                    for out in emit_phase("writing", message="生成说明"):
+                        yield out
+                if live is not None:
+                    live.note_delta(len(delta))
+                yield ("msg", _agent_to_ui_text(delta, source_model=model))
+
+        for out in emit_phase("done", message="完成", meta=done_meta()):
+            yield out
+        yield ("done", "{}")
+    except StreamCanceled:
+        reason = live.cancel_reason if live is not None else None
+        for out in emit_phase("canceled", message="已被取消", meta=dict(done_meta(), reason=reason)):
+            yield out
+        yield ("done", "{}")
+    except (GeneratorExit, BrokenPipeError):
+        # Client disconnected / aborted.
+        return
+    except Exception as e:
+        for out in emit_phase("error", message="发生错误"):
+            yield out
+        yield ("msg", _agent_to_ui_error("upstream_error", str(e), details=_upstream_error_details(e)))
+        yield ("done", "{}")
 
-            for out in emit_phase("done", message="完成"):
-                yield out
-            yield _sse("done", "{}").encode("utf-8")
-        except (GeneratorExit, BrokenPipeError):
-            # Client disconnected / aborted.
-            return
-        except Exception as e:
-            for out in emit_phase("error", message="发生错误"):
-                yield out
-            yield _sse("msg", _agent_to_ui_error("upstream_error", str(e))).encode("utf-8")
-            yield _sse("done", "{}").encode("utf-8")
 
-    resp = StreamingHttpResponse(gen(), content_type="text/event-stream")
-    _apply_sse_headers(resp)
-    return resp
+@dataclass
+class _Turn:
+    """One chat turn, independent of the transport that delivers it (SSE, WebSocket)."""
+
+    events: Generator[Tuple[str, Any], None, None]
+    live: Optional[LiveStream] = None
+
+
+def _rejected_turn(*events: Tuple[str, Any]) -> _Turn:
+    def gen() -> Generator[Tuple[str, Any], None, None]:
+        yield from events
+        yield ("done", "{}")
 
+    return _Turn(events=gen())
 
-def _sse(event: str, data: Any) -> str:
-    if isinstance(data, str):
-        payload = data
+
+def _turn_options(body: Dict[str, Any]) -> Dict[str, Any]:
+    """The per-turn switches of a messages:stream body, with the server defaults applied.
+
+    Feeding the result back as body keys reproduces the same turn (chat_jobs.py
+    stores it so a queued job runs with the options resolved at submit time).
+    """
+
+    response_mode = str(body.get("responseMode") or "agentToUi-jsonl")
+    planner = body.get("planner") is True
+    # Planner modules build their own prompts; the compact dialect and the auto-layout rules apply to single-stream JSONL turns.
+    output_dialect = compact_dialect.resolve(body.get("outputDialect"))
+    if response_mode != "agentToUi-jsonl" or planner:
+        output_dialect = "verbose"
+    auto_layout = body["autoLayout"] is True if isinstance(body.get("autoLayout"), bool) else AUTO_LAYOUT_DEFAULT
+    return {
+        "responseMode": response_mode,
+        "promptScope": body.get("promptScope") if body.get("promptScope") in ("auto", "full") else None,
+        "planner": planner,
+        "stageTools": body["stageTools"] is True if isinstance(body.get("stageTools"), bool) else STAGE_TOOLS_DEFAULT,
+        "outputDialect": output_dialect,
+        "autoLayout": auto_layout and response_mode == "agentToUi-jsonl" and not planner,
+        "fastPath": body.get("fastPath") is not False,
+        "similarCache": body.get("similarCache") is not False,
+        "modelRouting": body.get("modelRouting") is not False,
+    }
+
+
+def _open_turn(
+    conversation_id: str, body: Dict[str, Any], *, started_at: float, probe: Optional["Probe"] = None
+) -> _Turn:
+    """Validate a messages:stream body and set up its event pipeline.
+
+    The returned events register the turn in streams.py on first iteration and
+    unregister it when exhausted or closed; the caller reports client writes
+    on `live` and must close `events` when the client goes away.
+    """
+
+    content = str(body.get("content") or "")
+    context_pack = body.get("contextPack")
+    viewport = body.get("viewport")
+    provider = str(body.get("provider") or "deepseek")
+    model_override = body.get("model")
+    options = _turn_options(body)
+    response_mode = options["responseMode"]
+    prompt_scope = options["promptScope"]
+    planner = options["planner"]
+    use_stage_tools = options["stageTools"]
+    output_dialect = options["outputDialect"]
+    auto_layout = options["autoLayout"]
+
+    if not content.strip():
+        return _rejected_turn(("error", {"message": "content is required"}))
+
+    if provider != "deepseek":
+        return _rejected_turn(("error", {"message": f"unsupported provider: {provider}"}))
+
+    cfg = _deepseek_cfg()
+    if not cfg["base_url"] or not cfg["api_key"] or not cfg["model"]:
+        return _rejected_turn(
+            (
+                "msg",
+                _agent_to_ui_error(
+                    "missing_config",
+                    "DeepSeek config missing. Please fill dwebapp/deepseek_secrets.py or set env vars.",
+                    details={"need": ["DEEPSEEK_BASE_URL", "DEEPSEEK_API_KEY", "DEEPSEEK_MODEL"]},
+                ),
+            )
+        )
+
+    model = str(model_override) if isinstance(model_override, str) and model_override else cfg["model"]
+    viewport_dict = viewport if isinstance(viewport, dict) else None
+    prompt_report: Dict[str, Any] = {}
+
+    # Server-side stage mirror (see stage/mirror.py), opt-in through `stageHash`: an uploaded
+    # nodeTree matching it seeds the mirror, a turn without a nodeTree runs on the mirror.
+    mirror: Optional[stage_mirror.StageMirror] = None
+    if stage_mirror.ENABLED:
+        mirror, context_pack, mirror_report = stage_mirror.resolve(conversation_id, context_pack, body.get("stageHash"))
+        metrics.incr("chat.stage_mirror", status=mirror_report["status"])
+        if mirror_report["status"] == "missing":
+            return _rejected_turn(
+                (
+                    "msg",
+                    _agent_to_ui_error(
+                        "stage_mirror_missing",
+                        "服务端没有该会话的舞台镜像，请在 contextPack.activeLayer 中重新上传 nodeTree。",
+                        details=mirror_report,
+                    ),
+                )
+            )
+        if mirror_report["status"] == "diverged":
+            return _rejected_turn(
+                (
+                    "msg",
+                    _agent_to_ui_error(
+                        "stage_mirror_diverged",
+                        "舞台与服务端镜像不一致，请在 contextPack.activeLayer 中重新上传 nodeTree。",
+                        details=mirror_report,
+                    ),
+                )
+            )
+        if mirror_report["status"] != "off":
+            prompt_report["stageMirror"] = mirror_report
+
+    # Simple edits of the selection are answered by rules, without a model (see fast_path.py).
+    fast_plan: Optional[fast_path.Plan] = None
+    fast_report: Dict[str, Any] = {}
+    if fast_path.ENABLED and options["fastPath"] and response_mode in ("agentToUi-jsonl", "agentToUi-json"):
+        fast_plan, fast_report = fast_path.match(content, context_pack)
+        if fast_plan is not None:
+            prompt_report.update(intent=fast_plan.intent, scope="fastPath")
+            planner = False
+        elif fast_report["rule"] is not None:
+            prompt_report["fastPath"] = fast_report
+
+    # Classified once; the similar cache, the prompt and routing all key on it.
+    request_scope: Optional[RequestScope] = classify_request(content, context_pack) if fast_plan is None else None
+
+    # Near-duplicate insert requests replay an earlier turn (see similar_cache.py).
+    cache_partition: Optional[Tuple[Any, ...]] = None
+    cache_hit: Optional[similar_cache.Match] = None
+    cache_report: Dict[str, Any] = {}
+    use_cache = similar_cache.ENABLED and options["similarCache"] and fast_plan is None
+    if use_cache and response_mode == "agentToUi-jsonl" and not planner and request_scope is not None:
+        intent = request_scope.intent
+        if intent == "insert":
+            cache_scope = similar_cache.resolve_scope(conversation_id=conversation_id, tenant=body.get("tenantId"))
+            cache_partition = similar_cache.partition_key(
+                scope=cache_scope, response_mode=response_mode, intent=intent, model=model, context_pack=context_pack
+            )
+            cache_hit, cache_report = similar_cache.get_similar_cache().lookup(content, partition=cache_partition)
+
+    stage_tools: Optional["StageTools"] = None
+    if fast_plan is not None:
+        msgs: List[Dict[str, str]] = []
+    elif cache_hit is not None:
+        prompt_report.update(intent="insert", scope="cached", similarCache=cache_report)
+        msgs = []
     else:
-        payload = json.dumps(data, ensure_ascii=False)
-    # One event with one data block
-    return f"event: {event}\n" + "\n".join([f"data: {line}" for line in payload.splitlines()]) + "\n\n"
+        if cache_report:
+            prompt_report["similarCache"] = cache_report
+        layer = context_pack.get("activeLayer") if isinstance(context_pack, dict) else None
+        if (
+            use_stage_tools
+            and response_mode == "agentToUi-jsonl"
+            and not planner
+            and isinstance(layer, dict)
+            and isinstance(layer.get("nodeTree"), list)
+        ):
+            from .stage.tools import StageTools
+
+            stage_tools = StageTools(layer["nodeTree"])
+        msgs = _build_messages(
+            content,
+            context_pack,
+            response_mode,
+            default_intent="insert",
+            viewport=viewport_dict,
+            report=prompt_report,
+            prompt_scope=prompt_scope,
+            stage_tools=stage_tools,
+            output_dialect=output_dialect,
+            auto_layout=auto_layout,
+            request_scope=request_scope,
+        )
+        metrics.observe(
+            "chat.input_tokens",
+            prompt_report.get("inputTokens", 0),
+            intent=prompt_report.get("intent", response_mode),
+            scope=prompt_report.get("scope", "full"),
+        )
 
+    # Planner mode only pays off for multi-module inserts; edits stay single-stream.
+    planner = planner and response_mode == "agentToUi-jsonl" and prompt_report.get("intent") == "insert"
+
+    # Tiered model routing (see routing.py); an explicit model or a replayed cache hit skips it.
+    route_chain: List[routing.Route] = []
+    route_intent = prompt_report.get("intent") or "insert"
+    if request_scope is not None and cache_hit is None and not model_override and options["modelRouting"] and routing.enabled():
+        route_intent = request_scope.intent
+        tier, route_signals = routing.classify_tier(content, request_scope)
+        route_chain = routing.escalation_chain(tier, default_model=model)
+        if planner:
+            route_chain = route_chain[:1]  # planner modules cannot be rolled back; no provisional attempt
+        model = route_chain[0].model
+        prompt_report["route"] = dict(route_chain[0].to_dict(), signals=route_signals)
+    live = LiveStream(
+        conversation_id=conversation_id,
+        model=model,
+        response_mode=response_mode,
+        intent=prompt_report.get("intent"),
+        planner=planner,
+    )
+    recording: Optional[capture.Recording] = None
+    if fast_plan is not None:
+        events = fast_path.iter_events(fast_plan, fast_report, prompt_report=prompt_report, started_at=started_at)
+    elif cache_hit is not None:
+        events = similar_cache.iter_cached_events(
+            cache_hit,
+            cache_report,
+            viewport=viewport_dict,
+            model=model,
+            prompt_report=prompt_report,
+            started_at=started_at,
+        )
+    elif planner:
+        from .planner import iter_planned_events
 
-def _apply_sse_headers(resp: StreamingHttpResponse) -> None:
-    resp["Cache-Control"] = "no-cache"
-    resp["X-Accel-Buffering"] = "no"
+        events = iter_planned_events(
+            cfg=cfg,
+            provider=provider,
+            model=model,
+            content=content,
+            context_pack=context_pack,
+            viewport=viewport_dict,
+            msgs=msgs,
+            prompt_report=prompt_report,
+            started_at=started_at,
+            live=live,
+            probe=probe,
+        )
+    else:
+        # Sampled raw-stream capture (see capture.py); planner turns fan out and are not captured.
+        recording = capture.maybe_record(
+            conversation_id=conversation_id,
+            response_mode=response_mode,
+            output_dialect=output_dialect,
+            intent=prompt_report.get("intent"),
+        )
+        if recording is not None:
+            prompt_report["captureId"] = recording.id
+        stage_ids = _stage_node_ids(context_pack)
+
+        def run_turn(turn_model: str, max_tokens: Optional[int]) -> Generator[Tuple[str, Any], None, None]:
+            return _iter_stream_events(
+                cfg=cfg,
+                provider=provider,
+                model=turn_model,
+                response_mode=response_mode,
+                msgs=msgs,
+                prompt_report=prompt_report,
+                started_at=started_at,
+                live=live,
+                stage_tools=stage_tools,
+                probe=probe,
+                output_dialect=output_dialect,
+                max_tokens=max_tokens,
+                recording=recording,
+                stage_ids=stage_ids,
+            )
+
+        if route_chain:
+            events = routing.iter_routed_events(
+                route_chain,
+                lambda route: run_turn(route.model, route.max_tokens),
+                intent=route_intent,
+                status=lambda phase, message: _agent_to_ui_task_status(phase, message=message),
+            )
+        else:
+            events = run_turn(model, None)
+
+    # Only a fresh single-stream turn is worth remembering.
+    remember = cache_partition is not None and cache_hit is None and prompt_report.get("intent") == "insert"
+
+    def tracked() -> Generator[Tuple[str, Any], None, None]:
+        nonlocal mirror
+        # Registered on first iteration: an unstarted generator never runs its finally.
+        streams.register(live)
+        sent: List[Dict[str, Any]] = []
+        outcome = "error"
+        saw_error = False
+        mirror_base: Optional[Dict[str, Any]] = None
+        try:
+            for event, data in events:
+                # A provisional routed attempt may be rolled back (see routing.py); the mirror follows the client.
+                if mirror is not None and routing.is_provisional(data):
+                    mirror_base = mirror.to_dict()
+                elif routing.is_retry(data):
+                    sent.clear()
+                    if mirror is not None and mirror_base is not None:
+                        mirror = stage_mirror.StageMirror.from_dict(mirror_base)
+                if remember and event == "msg" and isinstance(data, dict):
+                    sent.append(data)
+                if recording is not None and event == "msg":
+                    recording.note_envelope(data)
+                    saw_error = saw_error or (isinstance(data, dict) and data.get("type") == "agentToUi/error")
+                yield event, data
+                # Applied once the write returned: the mirror follows what the client received.
+                if mirror is not None and event == "msg":
+                    mirror.apply(data, center=(viewport_dict or {}).get("centerWorld"))
+            last = sent[-1] if sent else {}
+            if remember and not live.canceled and (last.get("payload") or {}).get("phase") == "done":
+                similar_cache.get_similar_cache().remember(
+                    content, partition=cache_partition, viewport=viewport_dict, envelopes=sent
+                )
+            outcome = "canceled" if live.canceled else "error" if saw_error else "done"
+        except GeneratorExit:
+            outcome = "client_gone"
+            raise
+        finally:
+            events.close()  # client gone: stop upstream reads now, not at GC
+            streams.unregister(live)
+            if recording is not None:
+                recording.finish(outcome)
+            if mirror is not None:
+                stage_mirror.save(conversation_id, mirror)
+
+    return _Turn(events=tracked(), live=live)
 
+
+@csrf_exempt
+def stream_message(request: HttpRequest, conversation_id: str) -> HttpResponseBase:
+    # NOTE: This endpoint is intentionally a plain Django view.
+    # DRF's content negotiation may return 406 for `Accept: text/event-stream`.
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    started_at = time.monotonic()
+    try:
+        raw = request.body.decode("utf-8") if request.body else ""
+        data: Any = json.loads(raw) if raw else {}
+    except Exception:
+        data = {}
+    body = data if isinstance(data, dict) else {}
+    if profiling.requested(request.headers.get(profiling.PROFILE_HEADER)):
+        session = profiling.ProfileSession(endpoint="messages:stream", conversation_id=conversation_id)
+        with session.active():
+            turn = _open_turn(conversation_id, body, started_at=started_at, probe=session.probe)
+        turn.events = session.wrap(turn.events)
+    else:
+        turn = _open_turn(conversation_id, body, started_at=started_at)
+    live = turn.live
+
+    def gen() -> Generator[bytes, None, None]:
+        try:
+            for event, data in turn.events:
+                chunk = _sse(event, data).encode("utf-8")
+                if live is not None:
+                    live.before_write(chunk, envelope=event == "msg")
+                yield chunk
+                if live is not None:
+                    live.after_write()
+        except GeneratorExit:
+            if live is not None:
+                live.client_connected = False
+            raise
+        finally:
+            turn.events.close()
+
+    resp = StreamingHttpResponse(gen(), content_type="text/event-stream")
+    _apply_sse_headers(resp)
+    return resp
@@ -1,9 +1,48 @@
 from __future__ import annotations
 
 import json
-from typing import Any, Dict, List, Optional
+import os
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 
-from .prompts.agent_to_ui_jsonl import build_agent_to_ui_jsonl_system_parts
+from .prompts.agent_to_ui_jsonl import build_agent_to_ui_jsonl_system_parts, build_few_shot_part
+from .prompts.context import compact_context_pack, summarize_context_pack
+from .prompts.intent import INTENT_CLASSES, RequestScope, classify_request
+from .prompts.tokens import estimate_tokens
+
+# Upper bound for retrieved few-shot examples (estimated tokens).
+FEW_SHOT_TOKEN_BUDGET = int(os.environ.get("DWEB_FEW_SHOT_TOKEN_BUDGET", "900"))
+# "auto": only the rule fragments the classified intent needs; "full": every fragment.
+PROMPT_SCOPE = os.environ.get("DWEB_PROMPT_SCOPE", "auto")
+
+if TYPE_CHECKING:
+    from .stage.tools import StageTools
+
+_STAGE_TOOLS_RULE = (
+    "舞台查询工具：contextPack.activeLayer 只有摘要（节点数、类型统计、包围盒、顶层节点）。"
+    "需要某个节点的 transform/props、子节点或包围盒时，先调用工具 get_node / list_children / find_nodes / subtree_bbox，"
+    "拿到结果后再输出 JSONL；不要猜测 nodeId，也不要为了插入新模块而遍历整棵树。"
+)
+
+
+def precompute_prompts() -> Dict[str, Any]:
+    """Warm the per-process prompt caches: the template library index and the
+    JSONL rule text for every intent class (plus the full prompt).
+
+    Called from AppConfig.ready under DWEB_WARM_START so the first chat turn of
+    a fresh worker does not pay for them. Returns a small summary.
+    """
+
+    from .prompts.template_library import get_template_library
+
+    library = get_template_library()
+    scopes: List[Optional[frozenset]] = [None]
+    for intent in INTENT_CLASSES:
+        scopes.append(frozenset({intent}))
+    scopes.append(frozenset({"insert", "text"}))
+    scopes.append(frozenset({"insert", "text", "mount"}))
+    for scope in scopes:
+        build_agent_to_ui_jsonl_system_parts(default_intent="insert", scope=scope)
+    return {"templates": len(library.templates), "scopes": len(scopes)}
 
 
 def build_messages(
@@ -13,16 +52,63 @@ def build_messages(
     response_mode: str,
     default_intent: str = "insert",
     viewport: Optional[Dict[str, Any]] = None,
+    report: Optional[Dict[str, Any]] = None,
+    prompt_scope: Optional[str] = None,
+    stage_tools: Optional["StageTools"] = None,
+    output_dialect: str = "verbose",
+    auto_layout: bool = False,
+    request_scope: Optional[RequestScope] = None,
 ) -> List[Dict[str, str]]:
     """Build OpenAI-compatible messages.
 
     This centralizes prompt engineering so it can evolve without bloating the API view.
+    If `report` is given it is filled with prompt diagnostics (intent class, rule
+    fragments and few-shot templates used, estimated input tokens).
+    `prompt_scope` overrides DWEB_PROMPT_SCOPE ("auto" | "full").
+    With `stage_tools` the active layer is summarized instead of sent (the
+    model queries it through tool calls); the report then also carries the
+    token cost the full context would have had.
+    `output_dialect` "compact" asks for the short line format of
+    compact_dialect.py (JSONL mode only).
+    `auto_layout` teaches the layout intents of stage/layout.py in place of
+    the hand-computed container sizing rules (JSONL mode only).
+    `request_scope` is classify_request(content, context_pack) when the caller
+    already has it.
     """
 
     system_parts: List[str] = ["你是 dweb-video-studio 的 AI 助手。"]
 
     if response_mode == "agentToUi-jsonl":
-        system_parts.extend(build_agent_to_ui_jsonl_system_parts(default_intent=default_intent, viewport=viewport))
+        if request_scope is None:
+            request_scope = classify_request(content, context_pack)
+        scoped = (prompt_scope or PROMPT_SCOPE) != "full"
+        fragments: List[str] = []
+        system_parts.extend(
+            build_agent_to_ui_jsonl_system_parts(
+                default_intent=default_intent,
+                viewport=viewport,
+                scope=request_scope.tags if scoped else None,
+                used_fragments=fragments,
+                dialect=output_dialect,
+                auto_layout=auto_layout,
+            )
+        )
+        used: List[Dict[str, Any]] = []
+        if not scoped or "insert" in request_scope.tags:
+            few_shot, used = build_few_shot_part(
+                content, token_budget=FEW_SHOT_TOKEN_BUDGET, dialect=output_dialect
+            )
+            if few_shot:
+                system_parts.append(few_shot)
+        if report is not None:
+            report["intent"] = request_scope.intent
+            report["scope"] = "auto" if scoped else "full"
+            report["fragments"] = fragments
+            report["signals"] = request_scope.signals
+            report["fewShot"] = used
+            report["dialect"] = output_dialect
+            if auto_layout:
+                report["autoLayout"] = True
 
     # DeepSeek JSON Output mode: require a SINGLE valid JSON object.
     # Notes:
@@ -41,10 +127,33 @@ def build_messages(
             ]
         )
 
-    if context_pack is not None:
+    if context_pack is not None and stage_tools is not None and isinstance(context_pack, dict):
+        system_parts.append(_STAGE_TOOLS_RULE)
+        summary = "contextPack(JSON):\n" + json.dumps(summarize_context_pack(context_pack, stage_tools), ensure_ascii=False)
+        system_parts.append(summary)
+        if report is not None:
+            # What the same turn would have sent without tools (after compaction).
+            full_pack, _ = compact_context_pack(context_pack, viewport)
+            full = "contextPack(JSON):\n" + json.dumps(full_pack, ensure_ascii=False)
+            report["stageTools"] = {
+                "summaryTokens": estimate_tokens(summary),
+                "fullContextTokens": estimate_tokens(full),
+                "indexCache": "hit" if stage_tools.index_cache_hit else "miss",
+            }
+    elif context_pack is not None:
+        # Large canvases: only the viewport / selection neighbourhood goes verbatim.
+        context_pack, context_report = compact_context_pack(context_pack, viewport)
+        if report is not None and context_report is not None:
+            report["context"] = context_report
         system_parts.append("contextPack(JSON):\n" + json.dumps(context_pack, ensure_ascii=False))
 
-    return [
+    messages = [
         {"role": "system", "content": "\n".join(system_parts)},
         {"role": "user", "content": content},
     ]
+    if report is not None:
+        report["inputTokens"] = sum(estimate_tokens(m["content"]) for m in messages)
+        if "stageTools" in report:
+            st = report["stageTools"]
+            st["fullInputTokens"] = report["inputTokens"] - st["summaryTokens"] + st["fullContextTokens"]
+    return messages
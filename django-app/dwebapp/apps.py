@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class DwebappConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "dwebapp"
+
+    def ready(self) -> None:
+        from django.conf import settings
+
+        # Production profile: pay URLconf import and prompt assembly at boot,
+        # not on the first request a freshly scaled worker receives.
+        if getattr(settings, "DWEB_WARM_START", False):
+            from django.urls import get_resolver
+
+            from .ai_prompts import precompute_prompts
+
+            get_resolver().url_patterns
+            precompute_prompts()
@@ -0,0 +1 @@
+"""Microbenchmark suite for the backend hot paths (see suite.py; run via `manage.py microbench`)."""
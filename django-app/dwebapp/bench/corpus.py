@@ -0,0 +1,166 @@
+"""Deterministic benchmark corpus: model streams and scene snapshots.
+
+Streams are built from the template library's example replies (real
+envelope shapes and sizes) and cut into DeepSeek-like deltas of 3..20
+characters, in three flavours:
+
+- clean      strict JSONL / a single {"envelopes":[...]} object
+- prose      chatty prefix, Markdown fences and prose between envelopes
+- truncated  the reply stops in the middle of an envelope
+
+Scenes are editor nodeTrees (one project group, groups of rect + text
+children) spread over a 20k x 20k world so viewport trimming has work to do.
+Everything is seeded, so two runs see byte-identical inputs.
+"""
+
+from __future__ import annotations
+
+import json
+import random
+from typing import Any, Dict, List, Tuple
+
+STREAM_KINDS = ("clean", "prose", "truncated")
+SCENE_SIZES = (10, 100, 1000, 10_000)
+VIEWPORT: Dict[str, Any] = {"centerWorld": {"x": 0, "y": 0}, "zoom": 1, "screenW": 1920, "screenH": 1080}
+
+_PROSE = ("好的，我来帮你完成这个需求。", "接下来输出组件：", "以上是第一个模块。", "下面继续。")
+
+
+def _reply_lines(templates: int = 3) -> List[str]:
+    from ..prompts.template_library import get_template_library
+
+    lines: List[str] = []
+    library = sorted(get_template_library().templates, key=lambda t: t.template_id)
+    for n, t in enumerate(library[:templates]):
+        for i, line in enumerate(t.example.splitlines()):
+            env = json.loads(line)
+            env.update(id=f"00000000-0000-0000-0000-{n:06d}{i:06d}", createdAt="2026-01-01T00:00:00.000000Z")
+            lines.append(json.dumps(env, ensure_ascii=False, separators=(",", ":")))
+    return lines
+
+
+def _deltas(text: str, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    out: List[str] = []
+    i = 0
+    while i < len(text):
+        n = rng.randint(3, 20)
+        out.append(text[i : i + n])
+        i += n
+    return out
+
+
+def stream_text(mode: str, kind: str) -> str:
+    """Full upstream reply text for response mode "jsonl" | "json" and a STREAM_KINDS flavour."""
+
+    lines = _reply_lines()
+    if mode == "json":
+        text = '{"envelopes":[' + ",".join(lines) + "]}"
+        if kind == "prose":
+            text = _PROSE[0] + "\n```json\n" + text + "\n```\n" + _PROSE[2]
+    else:
+        if kind == "prose":
+            parts = [_PROSE[0], "```json"]
+            for i, line in enumerate(lines):
+                parts.append(line)
+                parts.append(_PROSE[1 + i % 3])
+            parts.append("```")
+            text = "\n".join(parts) + "\n"
+        else:
+            text = "\n".join(lines) + "\n"
+    if kind == "truncated":
+        text = text[: int(len(text) * 0.85)]
+    return text
+
+
+def stream_deltas(mode: str, kind: str) -> List[str]:
+    return _deltas(stream_text(mode, kind), seed=("jsonl", "json").index(mode) * 10 + STREAM_KINDS.index(kind))
+
+
+def sse_lines(mode: str, kind: str) -> List[bytes]:
+    """The same stream as raw upstream SSE body lines (what urllib yields)."""
+
+    out: List[bytes] = []
+    for d in stream_deltas(mode, kind):
+        obj = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": d}}]}
+        out.append(("data: " + json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8"))
+        out.append(b"\n")
+    out.append(b"data: [DONE]\n")
+    return out
+
+
+def _node(rng: random.Random, node_id: str, kind: str, x: float, y: float) -> Dict[str, Any]:
+    if kind == "text":
+        return {
+            "id": node_id,
+            "name": f"文本 {node_id}",
+            "category": "user",
+            "userType": "text",
+            "transform": {"x": x, "y": y, "rotation": 0, "opacity": 1},
+            "props": {"textContent": "指标说明文字", "fontSize": rng.choice((14, 16, 24)), "fontColor": "#ffffff"},
+            "children": [],
+        }
+    return {
+        "id": node_id,
+        "name": f"矩形 {node_id}",
+        "category": "user",
+        "userType": "rect",
+        "transform": {"x": x, "y": y, "width": rng.randint(40, 240), "height": rng.randint(30, 160), "rotation": 0, "opacity": 1},
+        "props": {"fillColor": "#1e1e1e", "fillOpacity": 1, "borderColor": "#3c3c3c", "borderOpacity": 1, "borderWidth": 1, "cornerRadius": 8},
+        "children": [],
+    }
+
+
+def scene(size: int) -> Dict[str, Any]:
+    """contextPack with a nodeTree of about `size` nodes."""
+
+    rng = random.Random(size)
+    groups: List[Dict[str, Any]] = []
+    count = 1  # the project group
+    g = 0
+    while count < size:
+        card = _node(rng, f"g{g}", "rect", rng.uniform(-10_000, 10_000), rng.uniform(-10_000, 10_000))
+        card["transform"].update(width=320, height=200)
+        count += 1
+        for k in range(min(9, size - count)):
+            card["children"].append(_node(rng, f"g{g}_{k}", "text" if k % 2 else "rect", rng.uniform(-120, 120), rng.uniform(-80, 80)))
+            count += 1
+        groups.append(card)
+        g += 1
+    root = {"id": "project", "name": "project", "category": "base", "userType": "base", "props": {}, "children": groups}
+    first = groups[0]["id"] if groups else "project"
+    return {
+        "activeLayerId": "layer-1",
+        "layers": [{"id": "layer-1", "name": "图层 1"}],
+        "selectedNodeIds": [first],
+        "selectedNodes": [groups[0]] if groups else [],
+        "activeLayer": {"id": "layer-1", "name": "图层 1", "nodeTree": [root]},
+        "lastStageOps": [],
+    }
+
+
+def text_props(count: int) -> List[Dict[str, Any]]:
+    """Text node props as a template / scene has them: mixed CJK and Latin, repeats, some multi-line."""
+
+    rng = random.Random(count)
+    words = ("登录", "用户名", "密码", "Sign in", "Dashboard", "本月销售额", "Revenue ¥12,480", "查看详情 →")
+    out: List[Dict[str, Any]] = []
+    for i in range(count):
+        text = rng.choice(words) if i % 3 else f"{rng.choice(words)} {i}"
+        if i % 7 == 0:
+            text += "\n" + rng.choice(words)
+        out.append({"textContent": text, "fontSize": rng.choice((14, 16, 24, 32)), "fontStyle": rng.choice(("normal", "bold"))})
+    return out
+
+
+def short_envelopes() -> List[Tuple[str, Dict[str, Any]]]:
+    """(label, object) pairs for the envelope helpers: full envelopes and short forms."""
+
+    lines = [json.loads(line) for line in _reply_lines(templates=1)]
+    chat, template = lines[0], lines[1]
+    return [
+        ("chat", chat),
+        ("template", template),
+        ("short_chat", {"type": "agentToUi/chat", "payload": {"content": "我将插入一个卡片。"}}),
+        ("short_template", {"type": template["type"], "payload": template["payload"]}),
+    ]
@@ -0,0 +1,109 @@
+"""Operation latency of the shared-state backends (see shared_state/base.py).
+
+Per backend, each operation runs `ops` times from one thread and reports
+per-call latency percentiles in microseconds:
+
+- set / get          1 KiB blob (an envelope-sized value), with a TTL
+- incr / incr_ttl    counter without / with a window TTL
+- publish            fire-and-forget, nobody listening
+- pubsub_roundtrip   publish, then receive it on a subscription (fan-out latency)
+
+plus a contention check: `threads` threads incr one counter concurrently;
+"atomic" is whether the final value is exactly threads * per-thread incrs.
+"""
+
+from __future__ import annotations
+
+import statistics
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List
+
+from ..shared_state.base import SharedState
+
+_BLOB = b"x" * 1024
+_ROUNDTRIPS_MAX = 200  # the SQLite backend polls, so round trips are slow by design
+
+
+def _summary(samples: List[float]) -> Dict[str, Any]:
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 1)
+
+    total = sum(samples)
+    return {
+        "count": len(samples),
+        "meanUs": round(statistics.mean(samples), 1),
+        "p50Us": pct(0.5),
+        "p95Us": pct(0.95),
+        "p99Us": pct(0.99),
+        "opsPerS": round(len(samples) / (total / 1e6)) if total else None,
+    }
+
+
+def _time_each(fn: Callable[[int], Any], n: int) -> List[float]:
+    samples = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - t0) * 1e6)
+    return samples
+
+
+def _contention(state: SharedState, prefix: str, *, threads: int, per_thread: int) -> Dict[str, Any]:
+    key = f"{prefix}:contended"
+    errors: List[str] = []
+
+    def worker() -> None:
+        try:
+            for _ in range(per_thread):
+                state.incr(key, ttl=60)
+        except Exception as e:  # reported, not raised: the other threads keep going
+            errors.append(repr(e))
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    t0 = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    final = int(state.get(key) or 0)
+    expected = threads * per_thread
+    return {
+        "threads": threads,
+        "expected": expected,
+        "final": final,
+        "atomic": final == expected and not errors,
+        "opsPerS": round(expected / elapsed) if elapsed else None,
+        "errors": errors[:5],
+    }
+
+
+def bench_backend(state: SharedState, *, ops: int = 2000, threads: int = 4) -> Dict[str, Any]:
+    prefix = f"bench:{uuid.uuid4().hex[:8]}"
+    state.incr(f"{prefix}:warm")  # connection / schema setup outside the timings
+    result: Dict[str, Any] = {"backend": state.scheme, "ops": {}}
+    timings = result["ops"]
+    timings["set"] = _summary(_time_each(lambda i: state.set(f"{prefix}:k{i % 100}", _BLOB, ttl=60), ops))
+    timings["get"] = _summary(_time_each(lambda i: state.get(f"{prefix}:k{i % 100}"), ops))
+    timings["incr"] = _summary(_time_each(lambda i: state.incr(f"{prefix}:c"), ops))
+    timings["incr_ttl"] = _summary(_time_each(lambda i: state.incr(f"{prefix}:w", ttl=60), ops))
+    timings["publish"] = _summary(_time_each(lambda i: state.publish(f"{prefix}:nobody", _BLOB), ops))
+
+    roundtrips = min(ops, _ROUNDTRIPS_MAX)
+    lost = 0
+    with state.subscribe(f"{prefix}:ch") as sub:
+
+        def roundtrip(i: int) -> None:
+            nonlocal lost
+            state.publish(f"{prefix}:ch", b"%d" % i)
+            if sub.get(timeout=2.0) != b"%d" % i:
+                lost += 1
+
+        timings["pubsub_roundtrip"] = _summary(_time_each(roundtrip, roundtrips))
+    timings["pubsub_roundtrip"]["lost"] = lost
+    result["contention"] = _contention(state, prefix, threads=threads, per_thread=max(1, ops // threads // 4))
+    return result
@@ -0,0 +1,257 @@
+"""Microbenchmarks for the per-delta / per-request hot paths, with baselines.
+
+Each benchmark is a zero-argument callable built over the corpus (corpus.py);
+run() times it timeit-style (auto-ranged loop count, several rounds) and
+reports per-call microseconds. Baselines are JSON:
+
+    {"schema": 1, "createdAt": ..., "python": ..., "platform": ...,
+     "benchmarks": {"<name>": {"medianUs": .., "minUs": .., "loops": .., "rounds": .., "extra": {...}}}}
+
+compare() flags benchmarks whose median got slower than the baseline by more
+than a threshold (a ratio, 0.2 = 20 %).
+
+try_emit_from_buffer is a closure of _iter_stream_events, so the stream
+benchmarks drive the whole pipeline with the upstream replaced by the
+recorded deltas; a profiling.Probe counts the try_emit_from_buffer calls so
+the per-call cost can be read off as well.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from . import corpus
+
+BASELINE_SCHEMA = 1
+
+Bench = Tuple[str, Callable[[], Any], Dict[str, Any]]
+
+
+@contextlib.contextmanager
+def _replayed_upstream(deltas: List[str]) -> Iterator[None]:
+    """Serve `deltas` for the first upstream call of each turn and nothing for repair re-prompts."""
+
+    from .. import ai_chat_api
+
+    original = ai_chat_api._openai_stream_chat
+    state = {"calls": 0}
+
+    def replay(**_kwargs: Any) -> Iterator[str]:
+        state["calls"] += 1
+        return iter(deltas if state["calls"] == 1 else ())
+
+    ai_chat_api._openai_stream_chat = replay  # type: ignore[assignment]
+    try:
+        yield
+    finally:
+        ai_chat_api._openai_stream_chat = original  # type: ignore[assignment]
+        state["calls"] = 0
+
+
+def _stream_bench(mode: str, kind: str) -> Bench:
+    from .. import ai_chat_api
+    from ..profiling import Probe
+
+    deltas = corpus.stream_deltas(mode, kind)
+    response_mode = "agentToUi-jsonl" if mode == "jsonl" else "agentToUi-json"
+    cfg = {"base_url": "http://bench.invalid", "api_key": "bench", "model": "bench"}
+    extra: Dict[str, Any] = {"deltas": len(deltas), "chars": sum(len(d) for d in deltas)}
+
+    def run_once(probe: Optional[Probe] = None) -> int:
+        n = 0
+        with _replayed_upstream(deltas):
+            for _event, _data in ai_chat_api._iter_stream_events(
+                cfg=cfg,
+                provider="deepseek",
+                model="bench",
+                response_mode=response_mode,
+                msgs=[],
+                prompt_report={"intent": "insert", "scope": "auto"},
+                started_at=time.monotonic(),
+                probe=probe,
+            ):
+                n += 1
+        return n
+
+    probe = Probe()
+    extra["events"] = run_once(probe)
+    extra["tryEmitCalls"] = sum(probe.emit_calls.values())
+    extra["bufferHighWaterChars"] = probe.buffer_high_water
+    return f"try_emit_from_buffer.{mode}.{kind}", run_once, extra
+
+
+def _sse_parser_bench(kind: str) -> Bench:
+    from ..ai_chat_api import _iter_sse_deltas
+
+    lines = corpus.sse_lines("jsonl", kind)
+
+    def run_once() -> int:
+        return sum(1 for _ in _iter_sse_deltas(lines))
+
+    return f"sse_parser.{kind}", run_once, {"lines": len(lines)}
+
+
+def _build_messages_bench(size: int) -> Bench:
+    from ..ai_prompts import build_messages
+
+    pack = corpus.scene(size)
+    report: Dict[str, Any] = {}
+    build_messages(
+        content="在右上角插入一个数据指标卡片",
+        context_pack=pack,
+        response_mode="agentToUi-jsonl",
+        viewport=corpus.VIEWPORT,
+        report=report,
+    )
+
+    def run_once() -> Any:
+        return build_messages(
+            content="在右上角插入一个数据指标卡片",
+            context_pack=pack,
+            response_mode="agentToUi-jsonl",
+            viewport=corpus.VIEWPORT,
+        )
+
+    return f"build_messages.nodes_{size}", run_once, {"inputTokens": report.get("inputTokens")}
+
+
+def _text_metrics_benches(size: int) -> List[Bench]:
+    from ..stage import text_metrics
+
+    props = corpus.text_props(size)
+    extra = {"distinct": len({json.dumps(p, sort_keys=True, ensure_ascii=False) for p in props})}
+
+    def warm() -> Any:
+        return text_metrics.measure_many(props)
+
+    def cold() -> Any:
+        text_metrics._CACHE.clear()
+        return text_metrics.measure_many(props)
+
+    return [(f"text_metrics.measure_many.warm_{size}", warm, extra), (f"text_metrics.measure_many.cold_{size}", cold, extra)]
+
+
+def _instantiate_benches(rows: int) -> List[Bench]:
+    from ..stage import instantiate
+
+    template = instantiate.resolve_template(None, "tmpl_mind_node")
+    params = [{"title": f"主题 {i}", "$x": (i % 25) * 260, "$y": (i // 25) * 80} for i in range(rows)]
+    extra = {"rows": rows}
+
+    def warm() -> Any:
+        return instantiate.instantiate(template, params)
+
+    def cold() -> Any:
+        instantiate._PLANS.clear()
+        instantiate._BY_IDENTITY.clear()
+        return instantiate.instantiate(template, params)
+
+    return [(f"instantiate.mind_node.warm_{rows}", warm, extra), (f"instantiate.mind_node.cold_{rows}", cold, extra)]
+
+
+def benchmarks() -> List[Bench]:
+    from ..ai_chat_api import _is_agent_to_ui_envelope, _wrap_short_agent_to_ui
+    from ..sse import sse_event
+
+    out: List[Bench] = []
+    for mode in ("jsonl", "json"):
+        for kind in corpus.STREAM_KINDS:
+            out.append(_stream_bench(mode, kind))
+    for kind in corpus.STREAM_KINDS:
+        out.append(_sse_parser_bench(kind))
+    for label, env in corpus.short_envelopes():
+        if label.startswith("short_"):
+            out.append((f"wrap_short_agent_to_ui.{label[6:]}", lambda env=env: _wrap_short_agent_to_ui(env, source_model="bench"), {}))
+        else:
+            out.append((f"sse_event.{label}", lambda env=env: sse_event("msg", env), {}))
+            out.append((f"is_agent_to_ui_envelope.{label}", lambda env=env: _is_agent_to_ui_envelope(env), {}))
+    out.append(("is_agent_to_ui_envelope.not_envelope", lambda: _is_agent_to_ui_envelope({"type": "x"}), {}))
+    for size in corpus.SCENE_SIZES:
+        out.append(_build_messages_bench(size))
+    for size in (100, 1000):
+        out.extend(_text_metrics_benches(size))
+    for rows in (1, 500):
+        out.extend(_instantiate_benches(rows))
+    return out
+
+
+def _time(fn: Callable[[], Any], loops: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        fn()
+    return time.perf_counter() - t0
+
+
+def measure(fn: Callable[[], Any], *, min_time: float = 0.05, rounds: int = 5) -> Dict[str, Any]:
+    fn()  # warm caches the hot path relies on in production too
+    loops = 1
+    while True:
+        elapsed = _time(fn, loops)
+        if elapsed >= min_time or loops >= 1_000_000:
+            break
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9) * 1.1))
+    samples = [_time(fn, loops) / loops * 1e6 for _ in range(max(1, rounds))]
+    return {
+        "medianUs": round(statistics.median(samples), 3),
+        "minUs": round(min(samples), 3),
+        "loops": loops,
+        "rounds": len(samples),
+    }
+
+
+def run(*, only: Optional[str] = None, min_time: float = 0.05, rounds: int = 5) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for name, fn, extra in benchmarks():
+        if only and only not in name:
+            continue
+        row = measure(fn, min_time=min_time, rounds=rounds)
+        if extra:
+            row["extra"] = extra
+        calls = extra.get("tryEmitCalls")
+        if calls:
+            row["extra"]["usPerTryEmitCall"] = round(row["medianUs"] / calls, 3)
+        results[name] = row
+    return {
+        "schema": BASELINE_SCHEMA,
+        "createdAt": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "benchmarks": results,
+    }
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as fp:
+        data = json.load(fp)
+    if not isinstance(data, dict) or data.get("schema") != BASELINE_SCHEMA or not isinstance(data.get("benchmarks"), dict):
+        raise ValueError(f"not a microbench baseline (schema {BASELINE_SCHEMA}): {path}")
+    return data
+
+
+def save(path: str, result: Dict[str, Any]) -> None:
+    with open(path, "w", encoding="utf-8") as fp:
+        json.dump(result, fp, ensure_ascii=False, indent=2, sort_keys=True)
+        fp.write("\n")
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], *, threshold: float) -> List[Dict[str, Any]]:
+    """Per-benchmark rows {name, baseUs, currentUs, ratio, status}; status is ok | regression | faster | new | missing."""
+
+    base, cur = baseline["benchmarks"], current["benchmarks"]
+    rows: List[Dict[str, Any]] = []
+    for name in sorted(set(base) | set(cur)):
+        b, c = base.get(name), cur.get(name)
+        if b is None or c is None:
+            rows.append({"name": name, "baseUs": b and b["medianUs"], "currentUs": c and c["medianUs"], "ratio": None, "status": "new" if b is None else "missing"})
+            continue
+        ratio = c["medianUs"] / b["medianUs"] if b["medianUs"] else 1.0
+        status = "regression" if ratio > 1 + threshold else ("faster" if ratio < 1 / (1 + threshold) else "ok")
+        rows.append({"name": name, "baseUs": b["medianUs"], "currentUs": c["medianUs"], "ratio": round(ratio, 3), "status": status})
+    return rows
@@ -0,0 +1,343 @@
+"""Sampled capture of raw upstream streams into rotating gzip archives.
+
+A jsonl_parse_error only carries a truncated tailPreview; a capture keeps
+the whole turn so parser behaviour and timing can be reproduced offline.
+DWEB_CAPTURE_SAMPLE (0..1, default 0 = off) is the share of single-stream
+turns recorded. A recording collects, per upstream call, every raw SSE line
+with its arrival time (ms since the call was sent), and for the turn the
+envelope ids sent to the client and the outcome. One record per turn:
+
+    {"v": 1, "id": "cap_...", "capturedAt": ..., "conversationId": ...,
+     "responseMode": ..., "outputDialect": ..., "intent": ..., "outcome": "done" | "error" | "canceled" | "client_gone",
+     "totalMs": ..., "envelopeIds": [...],
+     "calls": [{"model": ..., "messagesHash": "sha256:...", "startMs": ..., "endMs": ...,
+                "lines": [[ms, "data: {...}"], ...]}]}
+
+The streaming thread only appends to lists and enqueues the finished record;
+a background writer thread hashes the request messages, serializes and
+appends to DWEB_CAPTURE_DIR (default DWEB_DATA_DIR/captures) as
+capture-<time>-<pid>-<n>.jsonl.gz. A file is closed once it reaches
+DWEB_CAPTURE_MAX_FILE_BYTES compressed and the oldest files beyond
+DWEB_CAPTURE_MAX_FILES are deleted. When the queue is full a record is
+dropped (chat.capture_dropped), never waited for.
+
+Replay: replay_lines() feeds a call back through ai_chat_api._iter_sse_deltas;
+mock_chunks() serves a record's calls from mock_upstream.MockUpstream at
+their original arrival times (see `manage.py capture_replay`).
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from . import metrics
+
+SAMPLE = float(os.environ.get("DWEB_CAPTURE_SAMPLE") or 0)
+MAX_FILE_BYTES = int(os.environ.get("DWEB_CAPTURE_MAX_FILE_BYTES") or 8 * 1024 * 1024)
+MAX_FILES = int(os.environ.get("DWEB_CAPTURE_MAX_FILES") or 20)
+_QUEUE_SIZE = int(os.environ.get("DWEB_CAPTURE_QUEUE") or 256)
+_SCHEMA = 1
+
+
+def capture_dir() -> Path:
+    configured = os.environ.get("DWEB_CAPTURE_DIR")
+    if configured:
+        return Path(configured)
+    from django.conf import settings
+
+    return Path(getattr(settings, "DWEB_DATA_DIR")) / "captures"
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def messages_hash(messages: Any) -> str:
+    data = json.dumps(messages, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return "sha256:" + hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("model", "messages", "t0", "start_ms", "end_ms", "lines")
+
+    def __init__(self, model: str, messages: List[Any], t0: float, start_ms: int) -> None:
+        self.model = model
+        self.messages = messages  # hashed by the writer thread
+        self.t0 = t0
+        self.start_ms = start_ms
+        self.end_ms: Optional[int] = None
+        self.lines: List[Tuple[int, str]] = []
+
+
+class Recording:
+    """One captured turn; filled by the streaming thread, serialized by the writer."""
+
+    def __init__(self, *, conversation_id: str, response_mode: str, output_dialect: str, intent: Optional[str]) -> None:
+        self.id = "cap_" + uuid.uuid4().hex[:16]
+        self.conversation_id = conversation_id
+        self.response_mode = response_mode
+        self.output_dialect = output_dialect
+        self.intent = intent
+        self.captured_at = _now_iso()
+        self.t0 = time.monotonic()
+        self.calls: List[_Call] = []
+        self.envelope_ids: List[str] = []
+        self.outcome: Optional[str] = None
+        self.total_ms: Optional[int] = None
+
+    def begin_call(self, *, model: str, messages: List[Any]) -> _Call:
+        now = time.monotonic()
+        call = _Call(model, list(messages), now, int((now - self.t0) * 1000))
+        self.calls.append(call)
+        return call
+
+    def tap(self, call: _Call, lines: Iterable[bytes]) -> Iterator[bytes]:
+        """Pass `lines` through unchanged, recording each non-blank one with its arrival time."""
+
+        t0 = call.t0
+        append = call.lines.append
+        try:
+            for raw in lines:
+                if raw.strip():
+                    append((int((time.monotonic() - t0) * 1000), raw.decode("utf-8", "replace").rstrip("\r\n")))
+                yield raw
+        finally:
+            call.end_ms = int((time.monotonic() - t0) * 1000)
+
+    def note_envelope(self, env: Any) -> None:
+        if isinstance(env, dict) and isinstance(env.get("id"), str):
+            self.envelope_ids.append(env["id"])
+
+    def finish(self, outcome: str) -> None:
+        """Close the recording and hand it to the writer (no-op when called twice)."""
+
+        if self.outcome is not None:
+            return
+        self.outcome = outcome
+        self.total_ms = int((time.monotonic() - self.t0) * 1000)
+        get_writer().submit(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "v": _SCHEMA,
+            "id": self.id,
+            "capturedAt": self.captured_at,
+            "conversationId": self.conversation_id,
+            "responseMode": self.response_mode,
+            "outputDialect": self.output_dialect,
+            "intent": self.intent,
+            "outcome": self.outcome,
+            "totalMs": self.total_ms,
+            "envelopeIds": self.envelope_ids,
+            "calls": [
+                {
+                    "model": c.model,
+                    "messagesHash": messages_hash(c.messages),
+                    "startMs": c.start_ms,
+                    "endMs": c.end_ms,
+                    "lines": c.lines,
+                }
+                for c in self.calls
+            ],
+        }
+
+
+def maybe_record(
+    *, conversation_id: str, response_mode: str, output_dialect: str, intent: Optional[str], sample: Optional[float] = None
+) -> Optional[Recording]:
+    """A Recording for this turn if it is sampled (DWEB_CAPTURE_SAMPLE), else None."""
+
+    rate = SAMPLE if sample is None else sample
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return None
+    return Recording(conversation_id=conversation_id, response_mode=response_mode, output_dialect=output_dialect, intent=intent)
+
+
+class CaptureWriter:
+    """Background thread appending records to size-capped, rotating gzip files."""
+
+    def __init__(self, directory: Optional[Path] = None, *, max_file_bytes: int = MAX_FILE_BYTES, max_files: int = MAX_FILES) -> None:
+        self.directory = directory
+        self.max_file_bytes = max(1024, max_file_bytes)
+        self.max_files = max(1, max_files)
+        self._queue: "queue.Queue[Optional[Recording]]" = queue.Queue(maxsize=_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._raw: Any = None
+        self._gz: Optional[gzip.GzipFile] = None
+        self._seq = 0
+        self.written = 0
+        self.dropped = 0
+
+    def submit(self, rec: Recording) -> bool:
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(rec)
+        except queue.Full:
+            self.dropped += 1
+            metrics.incr("chat.capture_dropped")
+            return False
+        return True
+
+    def _ensure_thread(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="capture-writer", daemon=True)
+                self._thread.start()
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Wait until every submitted record is on disk (tests, management commands)."""
+
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _run(self) -> None:
+        while True:
+            rec = self._queue.get()
+            try:
+                if rec is None:
+                    self._close_file()
+                    return
+                t0 = time.perf_counter()
+                line = (json.dumps(rec.to_dict(), ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+                self._write(line)
+                self.written += 1
+                metrics.incr("chat.capture_records", outcome=rec.outcome)
+                metrics.observe("chat.capture_write_ms", (time.perf_counter() - t0) * 1000)
+            except Exception:
+                metrics.incr("chat.capture_errors")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, line: bytes) -> None:
+        if self._gz is None:
+            self._open_file()
+        assert self._gz is not None
+        self._gz.write(line)
+        self._gz.flush()  # sync flush: the file stays readable up to the last whole record
+        if self._raw.tell() >= self.max_file_bytes:
+            self._close_file()
+
+    def _open_file(self) -> None:
+        directory = self.directory or capture_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        self._seq += 1
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        path = directory / f"capture-{stamp}-{os.getpid()}-{self._seq}.jsonl.gz"
+        self._raw = open(path, "ab")
+        self._gz = gzip.GzipFile(fileobj=self._raw, mode="ab")
+        self._prune(directory, keep=path)
+
+    def _close_file(self) -> None:
+        if self._gz is not None:
+            self._gz.close()
+            self._raw.close()
+            self._gz = self._raw = None
+
+    def _prune(self, directory: Path, *, keep: Path) -> None:
+        files = sorted(directory.glob("capture-*.jsonl.gz"), key=lambda p: (p.stat().st_mtime, p.name))
+        for old in files[: max(0, len(files) - self.max_files)]:
+            if old != keep:
+                try:
+                    old.unlink()
+                except OSError:
+                    pass
+
+    def close(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5.0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"written": self.written, "dropped": self.dropped, "queued": self._queue.qsize(), "sample": SAMPLE}
+
+
+_WRITER: Optional[CaptureWriter] = None
+_WRITER_LOCK = threading.Lock()
+
+
+def get_writer() -> CaptureWriter:
+    global _WRITER
+    with _WRITER_LOCK:
+        if _WRITER is None:
+            _WRITER = CaptureWriter()
+        return _WRITER
+
+
+# -- reading / replay ------------------------------------------------------
+
+
+def list_files(directory: Optional[Union[str, Path]] = None) -> List[Path]:
+    d = Path(directory) if directory is not None else capture_dir()
+    return sorted(d.glob("capture-*.jsonl.gz"), key=lambda p: (p.stat().st_mtime, p.name))
+
+
+def iter_records(paths: Iterable[Union[str, Path]]) -> Iterator[Dict[str, Any]]:
+    """Records of capture files, oldest first; a file cut off mid-write ends at its last whole record."""
+
+    for path in paths:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as fp:
+                for line in fp:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        break
+                    if isinstance(rec, dict) and rec.get("v") == _SCHEMA:
+                        yield rec
+        except (EOFError, OSError):
+            continue
+
+
+def find_record(capture_id: str, directory: Optional[Union[str, Path]] = None) -> Optional[Dict[str, Any]]:
+    for rec in iter_records(reversed(list_files(directory))):
+        if rec.get("id") == capture_id:
+            return rec
+    return None
+
+
+def replay_lines(record: Dict[str, Any], call: int = 0) -> List[bytes]:
+    """Raw SSE body lines of one call, as urllib yields them (feed to _iter_sse_deltas)."""
+
+    return [(text + "\n").encode("utf-8") for _ms, text in record["calls"][call]["lines"]]
+
+
+def mock_chunks(record: Dict[str, Any], *, timed: bool = True) -> Callable[[Dict[str, Any]], List[Any]]:
+    """`chunks` for MockUpstream serving the record's calls in order, one per request.
+
+    With `timed`, each chunk is (ms, data) and MockUpstream sends it that many
+    ms after the request arrived (use base_ms=0, prefill_ms_per_1k=0). Requests
+    beyond the recorded calls get an empty stream.
+    """
+
+    calls = list(record.get("calls") or [])
+    state = {"next": 0}
+    lock = threading.Lock()
+
+    def chunks(_body: Dict[str, Any]) -> List[Any]:
+        with lock:
+            i = state["next"]
+            state["next"] += 1
+        if i >= len(calls):
+            return ["[DONE]"]
+        out: List[Any] = []
+        for ms, text in calls[i]["lines"]:
+            if not text.startswith("data:"):
+                continue
+            data = text[len("data:") :].strip()
+            out.append((ms, data) if timed else data)
+        return out
+
+    return chunks
@@ -0,0 +1,281 @@
+"""Batch generation: N prompts, one shared system prompt, bounded worker pool.
+
+Every item runs through the same envelope pipeline as stream_message
+(_iter_stream_events); only the delivery differs: the envelopes of a finished
+item are appended as one line to a JSONL result file.
+
+Layout under DWEB_DATA_DIR/chat-batches/<batchId>/:
+    batch.json      manifest (items, shared system prompt, model, options)
+    results.jsonl   one line per finished attempt-set: {index, itemId, status, ...}
+
+A batch is resumable: on resume (or after a restart) items whose latest
+result line is "ok" are skipped and everything else is queued again.
+
+A running item is registered in streams.py like any live turn (conversation
+id "batch:<batchId>:<itemId>", its stream id in the item status), so ops can
+see and cancel it; a canceled item is recorded as "canceled", is not retried
+and is queued again on resume.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional
+
+from . import metrics, streams
+from .caching import LruCache
+from .ratelimit import upstream_limiter
+
+_WORKERS = int(os.environ.get("DWEB_BATCH_WORKERS", "4"))
+_MAX_ATTEMPTS = int(os.environ.get("DWEB_BATCH_MAX_ATTEMPTS", "3"))
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_POOL = ThreadPoolExecutor(max_workers=max(1, _WORKERS), thread_name_prefix="chat-batch")
+_BATCHES: LruCache["ChatBatch"] = LruCache(maxsize=int(os.environ.get("DWEB_BATCH_HISTORY", "32")))
+_BATCHES_LOCK = threading.Lock()
+
+
+def _batch_root() -> Path:
+    from django.conf import settings
+
+    return Path(getattr(settings, "DWEB_DATA_DIR")) / "chat-batches"
+
+
+def _retry_delay(attempt: int, retry_after: Any) -> float:
+    try:
+        return max(0.0, float(retry_after))
+    except (TypeError, ValueError):
+        return min(30.0, 1.5 * 2 ** (attempt - 1))
+
+
+class ChatBatch:
+    def __init__(self, manifest: Dict[str, Any], directory: Path) -> None:
+        self.id: str = manifest["batchId"]
+        self.manifest = manifest
+        self.dir = directory
+        self.items: List[Dict[str, Any]] = manifest["items"]
+        self.state: List[Dict[str, Any]] = [{"status": "pending"} for _ in self.items]
+        self.concurrency = max(1, min(int(manifest.get("concurrency") or _WORKERS), _WORKERS))
+        self._queue: Deque[int] = deque()
+        self._running = 0
+        self._lock = threading.Lock()
+        self._load_results()
+
+    @property
+    def results_path(self) -> Path:
+        return self.dir / "results.jsonl"
+
+    def _load_results(self) -> None:
+        if not self.results_path.exists():
+            return
+        with open(self.results_path, "r", encoding="utf-8") as fp:
+            for line in fp:
+                try:
+                    row = json.loads(line)
+                    idx = int(row["index"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if 0 <= idx < len(self.state):
+                    self.state[idx] = {k: row.get(k) for k in ("status", "attempts", "ms", "errors")}
+                    self.state[idx]["envelopes"] = len(row.get("envelopes") or [])
+
+    def status(self) -> str:
+        counts = self.counts()
+        if counts["running"] or counts["queued"]:
+            return "running"
+        if counts["pending"]:
+            return "stopped"
+        return "done"
+
+    def counts(self) -> Dict[str, int]:
+        out = {"pending": 0, "queued": 0, "running": 0, "ok": 0, "error": 0, "canceled": 0}
+        for st in self.state:
+            out[st["status"]] = out.get(st["status"], 0) + 1
+        return out
+
+    def to_dict(self, *, with_items: bool = True) -> Dict[str, Any]:
+        counts = self.counts()
+        out: Dict[str, Any] = {
+            "batchId": self.id,
+            "status": self.status(),
+            "total": len(self.items),
+            "done": counts["ok"] + counts["error"] + counts["canceled"],
+            **counts,
+            "model": self.manifest.get("model"),
+            "responseMode": self.manifest.get("responseMode"),
+            "createdAt": self.manifest.get("createdAt"),
+            "prompt": self.manifest.get("promptReport"),
+        }
+        if with_items:
+            out["items"] = [
+                {"index": i, "itemId": item["id"], **{k: v for k, v in st.items() if v is not None}}
+                for i, (item, st) in enumerate(zip(self.items, self.state))
+            ]
+        return out
+
+    def enqueue_unfinished(self) -> int:
+        with self._lock:
+            queued = 0
+            for i, st in enumerate(self.state):
+                if st["status"] in ("pending", "error", "canceled"):
+                    self.state[i] = {"status": "queued"}
+                    self._queue.append(i)
+                    queued += 1
+        self._pump()
+        return queued
+
+    def _pump(self) -> None:
+        with self._lock:
+            while self._queue and self._running < self.concurrency:
+                idx = self._queue.popleft()
+                self._running += 1
+                self.state[idx] = {"status": "running"}
+                _POOL.submit(self._run_item, idx)
+
+    def _run_item(self, idx: int) -> None:
+        try:
+            row = self._generate(idx)
+        except Exception as e:  # pipeline already turns upstream failures into envelopes
+            row = {"status": "error", "attempts": 0, "ms": 0, "envelopes": [], "errors": [{"code": "internal_error", "message": str(e)}]}
+        row = {"index": idx, "itemId": self.items[idx]["id"], **row}
+        with self._lock:
+            with open(self.results_path, "a", encoding="utf-8") as fp:
+                fp.write(json.dumps(row, ensure_ascii=False) + "\n")
+            self.state[idx] = {k: row.get(k) for k in ("status", "attempts", "ms", "errors")}
+            self.state[idx]["envelopes"] = len(row["envelopes"])
+            self._running -= 1
+        metrics.incr("chat.batch_items", status=row["status"])
+        self._pump()
+
+    def _generate(self, idx: int) -> Dict[str, Any]:
+        from .ai_chat_api import _deepseek_cfg
+
+        cfg = _deepseek_cfg()
+        msgs = [
+            {"role": "system", "content": self.manifest["systemPrompt"]},
+            {"role": "user", "content": self.items[idx]["content"]},
+        ]
+        live = streams.LiveStream(
+            conversation_id=f"batch:{self.id}:{self.items[idx]['id']}",
+            model=self.manifest["model"],
+            response_mode=self.manifest["responseMode"],
+            intent=(self.manifest.get("promptReport") or {}).get("intent"),
+        )
+        with self._lock:
+            self.state[idx]["streamId"] = live.id
+        streams.register(live)
+        try:
+            return self._attempts(live, cfg, msgs)
+        finally:
+            streams.unregister(live)
+
+    def _attempts(self, live: streams.LiveStream, cfg: Dict[str, str], msgs: List[Dict[str, str]]) -> Dict[str, Any]:
+        from .ai_chat_api import _iter_stream_events
+
+        t0 = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            upstream_limiter().acquire()
+            envelopes: List[Dict[str, Any]] = []
+            errors: List[Dict[str, Any]] = []
+            timing: Dict[str, Any] = {}
+            for event, data in _iter_stream_events(
+                cfg=cfg,
+                provider="deepseek",
+                model=self.manifest["model"],
+                response_mode=self.manifest["responseMode"],
+                msgs=msgs,
+                prompt_report=dict(self.manifest.get("promptReport") or {}),
+                started_at=time.monotonic(),
+                live=live,
+            ):
+                if event != "msg" or not isinstance(data, dict):
+                    continue
+                if data.get("type") == "agentToUi/taskStatus":
+                    meta = data.get("meta") if isinstance(data.get("meta"), dict) else {}
+                    if isinstance(meta.get("timing"), dict):
+                        timing = meta["timing"]
+                    continue
+                if data.get("type") == "agentToUi/error":
+                    errors.append(data.get("payload") or {})
+                else:
+                    envelopes.append(data)
+
+            if live.canceled:
+                errors.append({"code": "canceled", "message": "item was canceled", "details": {"reason": live.cancel_reason}})
+                status = "canceled"
+            else:
+                details = (errors[0].get("details") or {}) if errors else {}
+                retryable = not envelopes and isinstance(details, dict) and details.get("status") in _RETRY_STATUSES
+                if retryable and attempt < _MAX_ATTEMPTS:
+                    metrics.incr("chat.batch_retries", status=details.get("status"))
+                    time.sleep(_retry_delay(attempt, details.get("retryAfter")))
+                    continue
+                status = "error" if errors else "ok"
+            return {
+                "status": status,
+                "attempts": attempt,
+                "ms": int((time.monotonic() - t0) * 1000),
+                "timing": timing,
+                "envelopes": envelopes,
+                "errors": errors or None,
+            }
+
+
+def create_batch(
+    *,
+    items: List[Dict[str, str]],
+    system_prompt: str,
+    prompt_report: Dict[str, Any],
+    model: str,
+    response_mode: str,
+    concurrency: int,
+) -> ChatBatch:
+    batch_id = uuid.uuid4().hex
+    directory = _batch_root() / batch_id
+    directory.mkdir(parents=True, exist_ok=True)
+    manifest = {
+        "batchId": batch_id,
+        "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "model": model,
+        "responseMode": response_mode,
+        "concurrency": concurrency,
+        "systemPrompt": system_prompt,
+        "promptReport": prompt_report,
+        "items": items,
+    }
+    with open(directory / "batch.json", "w", encoding="utf-8") as fp:
+        json.dump(manifest, fp, ensure_ascii=False)
+    batch = ChatBatch(manifest, directory)
+    with _BATCHES_LOCK:
+        _BATCHES.put(batch_id, batch)
+    batch.enqueue_unfinished()
+    return batch
+
+
+def get_batch(batch_id: str) -> Optional[ChatBatch]:
+    """In-memory batch, or one reloaded from disk (e.g. after a restart)."""
+
+    with _BATCHES_LOCK:
+        batch = _BATCHES.get(batch_id)
+        if batch is not None:
+            return batch
+        if not batch_id.isalnum():
+            return None
+        directory = _batch_root() / batch_id
+        try:
+            with open(directory / "batch.json", "r", encoding="utf-8") as fp:
+                manifest = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        batch = ChatBatch(manifest, directory)
+        _BATCHES.put(batch_id, batch)
+        return batch
@@ -0,0 +1,147 @@
+"""Batch generation APIs.
+
+Endpoints (no trailing slashes; APPEND_SLASH=False):
+- POST /api/chat/batches                    (start a batch; returns batchId)
+- GET  /api/chat/batches/{id}               (progress, per-item status)
+- GET  /api/chat/batches/{id}/results       (JSONL result file; ?after=N skips the first N lines)
+- POST /api/chat/batches/{id}:resume        (re-queue items without an "ok" result)
+
+A running item reports its `streamId`; POST /api/ops/streams/{streamId}:cancel
+cancels it.
+"""
+
+from __future__ import annotations
+
+import os
+from itertools import islice
+from collections import Counter
+from typing import Any, Dict, List
+
+from django.http import FileResponse, HttpRequest, HttpResponse, HttpResponseNotAllowed
+from django.http.response import HttpResponseBase
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.decorators import api_view
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .ai_chat_api import _agent_to_ui_error, _build_messages, _deepseek_cfg
+from .chat_batch import create_batch, get_batch
+
+_MAX_ITEMS = int(os.environ.get("DWEB_BATCH_MAX_ITEMS", "500"))
+
+
+def _parse_items(raw: Any) -> List[Dict[str, str]]:
+    items: List[Dict[str, str]] = []
+    for i, it in enumerate(raw if isinstance(raw, list) else []):
+        if isinstance(it, str):
+            content, item_id = it, str(i)
+        elif isinstance(it, dict):
+            content, item_id = str(it.get("content") or ""), str(it.get("id") or i)
+        else:
+            continue
+        if content.strip():
+            items.append({"id": item_id, "content": content})
+    return items
+
+
+@csrf_exempt
+@api_view(["POST"])
+def create_chat_batch(request: Request) -> Response:
+    """Body: {items: [string | {id?, content}], brief?, contextPack?, viewport?, responseMode?, model?, concurrency?}
+
+    The system prompt is compiled once for the whole batch from `brief` (or the
+    first item) plus the shared contextPack/viewport, so every item reuses the
+    same prompt prefix.
+    """
+
+    data: Any = request.data
+    body = data if isinstance(data, dict) else {}
+    items = _parse_items(body.get("items"))
+    if not items:
+        return Response(_agent_to_ui_error("bad_request", "items is required"), status=400)
+    if len(items) > _MAX_ITEMS:
+        return Response(_agent_to_ui_error("bad_request", f"at most {_MAX_ITEMS} items per batch"), status=400)
+    # Results are keyed by item id; a repeated id would make two results indistinguishable.
+    duplicates = sorted(item_id for item_id, n in Counter(it["id"] for it in items).items() if n > 1)
+    if duplicates:
+        return Response(
+            _agent_to_ui_error("bad_request", "item ids must be unique", details={"duplicateIds": duplicates[:20]}),
+            status=400,
+        )
+
+    cfg = _deepseek_cfg()
+    if not cfg["base_url"] or not cfg["api_key"] or not cfg["model"]:
+        return Response(
+            _agent_to_ui_error(
+                "missing_config",
+                "DeepSeek config missing. Please fill dwebapp/deepseek_secrets.py or set env vars.",
+                details={"need": ["DEEPSEEK_BASE_URL", "DEEPSEEK_API_KEY", "DEEPSEEK_MODEL"]},
+            ),
+            status=500,
+        )
+
+    response_mode = str(body.get("responseMode") or "agentToUi-jsonl")
+    model_override = body.get("model")
+    model = str(model_override) if isinstance(model_override, str) and model_override else cfg["model"]
+    viewport = body.get("viewport") if isinstance(body.get("viewport"), dict) else None
+    brief = str(body.get("brief") or items[0]["content"])
+    report: Dict[str, Any] = {}
+    msgs = _build_messages(brief, body.get("contextPack"), response_mode, default_intent="insert", viewport=viewport, report=report)
+    try:
+        concurrency = int(body.get("concurrency") or 0)
+    except (TypeError, ValueError):
+        concurrency = 0
+
+    batch = create_batch(
+        items=items,
+        system_prompt=msgs[0]["content"],
+        prompt_report=report,
+        model=model,
+        response_mode=response_mode,
+        concurrency=concurrency,
+    )
+    out = batch.to_dict(with_items=False)
+    out["statusUrl"] = f"/api/chat/batches/{batch.id}"
+    out["resultsUrl"] = f"/api/chat/batches/{batch.id}/results"
+    return Response(out, status=202)
+
+
+@api_view(["GET"])
+def chat_batch_status(_: Request, batch_id: str) -> Response:
+    batch = get_batch(batch_id)
+    if batch is None:
+        return Response(_agent_to_ui_error("not_found", "batch not found"), status=404)
+    return Response(batch.to_dict())
+
+
+@csrf_exempt
+@api_view(["POST"])
+def resume_chat_batch(_: Request, batch_id: str) -> Response:
+    batch = get_batch(batch_id)
+    if batch is None:
+        return Response(_agent_to_ui_error("not_found", "batch not found"), status=404)
+    queued = batch.enqueue_unfinished()
+    out = batch.to_dict(with_items=False)
+    out["requeued"] = queued
+    return Response(out)
+
+
+def chat_batch_results(request: HttpRequest, batch_id: str) -> HttpResponseBase:
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    batch = get_batch(batch_id)
+    if batch is None or not batch.results_path.exists():
+        return HttpResponse(b"", content_type="application/x-ndjson", status=404 if batch is None else 200)
+
+    try:
+        after = max(0, int(request.GET.get("after") or 0))
+    except ValueError:
+        after = 0
+    if after == 0:
+        resp: HttpResponseBase = FileResponse(open(batch.results_path, "rb"), content_type="application/x-ndjson")
+    else:
+        with open(batch.results_path, "rb") as fp:
+            resp = HttpResponse(b"".join(islice(fp, after, None)), content_type="application/x-ndjson")
+    resp["Content-Disposition"] = f'attachment; filename="batch-{batch.id}.jsonl"'
+    resp["X-Dweb-Batch-Status"] = batch.status()
+    return resp
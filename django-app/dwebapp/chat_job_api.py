@@ -0,0 +1,131 @@
+"""Detached generation job APIs.
+
+Endpoints (no trailing slashes; APPEND_SLASH=False):
+- POST /api/chat/conversations/{id}/jobs   (same body as messages:stream; returns jobId)
+- GET  /api/chat/jobs/{jobId}              (job status)
+- GET  /api/chat/jobs/{jobId}/events       (SSE; ?offset=N or Last-Event-ID to catch up)
+
+The events stream carries exactly what messages:stream would have sent; each
+event has an `id:` equal to its 1-based position in the job log.
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Any, Generator
+
+from django.http import HttpRequest, HttpResponseNotAllowed, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.decorators import api_view
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .ai_chat_api import _agent_to_ui_error, _deepseek_cfg, _turn_options
+from .chat_jobs import enqueue_job, ensure_dispatcher, follow_events, get_job
+from .prompts.intent import classify_request
+from .shared_state.base import is_shared
+from .stage import mirror as stage_mirror
+from .sse import apply_sse_headers, sse_event
+
+_KEEPALIVE_SECONDS = 15.0
+
+
+@csrf_exempt
+@api_view(["POST"])
+def create_chat_job(request: Request, conversation_id: str) -> Response:
+    """Same body as messages:stream; the turn options are resolved now and stored with the job."""
+
+    data: Any = request.data
+    body = data if isinstance(data, dict) else {}
+    content = str(body.get("content") or "")
+    if not content.strip():
+        return Response(_agent_to_ui_error("bad_request", "content is required"), status=400)
+    provider = str(body.get("provider") or "deepseek")
+    model_override = body.get("model")
+    if provider != "deepseek":
+        return Response(_agent_to_ui_error("bad_request", f"unsupported provider: {provider}"), status=400)
+
+    cfg = _deepseek_cfg()
+    if not cfg["base_url"] or not cfg["api_key"] or not cfg["model"]:
+        return Response(
+            _agent_to_ui_error(
+                "missing_config",
+                "DeepSeek config missing. Please fill dwebapp/deepseek_secrets.py or set env vars.",
+                details={"need": ["DEEPSEEK_BASE_URL", "DEEPSEEK_API_KEY", "DEEPSEEK_MODEL"]},
+            ),
+            status=500,
+        )
+
+    # The worker runs the turn through _open_turn with the options resolved here.
+    options = _turn_options(body)
+    if stage_mirror.ENABLED and body.get("stageHash") is not None and not is_shared():
+        return Response(
+            _agent_to_ui_error(
+                "bad_request",
+                "stageHash needs a shared state backend (DWEB_SHARED_STATE_URL) for jobs: workers run in other processes",
+            ),
+            status=400,
+        )
+    model = str(model_override) if isinstance(model_override, str) and model_override else cfg["model"]
+    intent = classify_request(content, body.get("contextPack")).intent
+
+    job = enqueue_job(
+        conversation_id,
+        {
+            "provider": provider,
+            "model": model,
+            "responseMode": options["responseMode"],
+            "body": dict(body, **options),
+            "promptReport": {"intent": intent},
+        },
+    )
+    job["statusUrl"] = f"/api/chat/jobs/{job['jobId']}"
+    job["eventsUrl"] = f"/api/chat/jobs/{job['jobId']}/events"
+    return Response(job, status=202)
+
+
+@api_view(["GET"])
+def chat_job_status(_: Request, job_id: str) -> Response:
+    job = get_job(job_id)
+    if job is None:
+        return Response(_agent_to_ui_error("not_found", "job not found"), status=404)
+    return Response(job)
+
+
+def chat_job_events(request: HttpRequest, job_id: str) -> HttpResponseBase:
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+
+    job = get_job(job_id)
+    if job is None:
+        resp = StreamingHttpResponse(
+            iter([sse_event("msg", _agent_to_ui_error("not_found", "job not found")).encode("utf-8")]),
+            content_type="text/event-stream",
+            status=404,
+        )
+        apply_sse_headers(resp)
+        return resp
+    # A restarted server picks queued jobs up again once someone is watching.
+    ensure_dispatcher()
+
+    raw_offset = request.GET.get("offset") or request.headers.get("Last-Event-ID") or "0"
+    try:
+        offset = max(0, int(raw_offset))
+    except ValueError:
+        offset = 0
+
+    def gen() -> Generator[bytes, None, None]:
+        last_sent = time.monotonic()
+        for item in follow_events(job_id, offset):
+            if item is not None:
+                index, event, data = item
+                yield sse_event(event, data, event_id=str(index)).encode("utf-8")
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent > _KEEPALIVE_SECONDS:
+                yield b": keepalive\n\n"
+                last_sent = time.monotonic()
+
+    resp = StreamingHttpResponse(gen(), content_type="text/event-stream")
+    apply_sse_headers(resp)
+    return resp
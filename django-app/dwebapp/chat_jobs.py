@@ -0,0 +1,364 @@
+"""Detached chat generation jobs.
+
+A job is one messages:stream turn that no longer lives inside the HTTP
+response: the request body, with its turn options resolved at submit time,
+goes into a durable SQLite queue, a dispatcher thread claims queued jobs and
+hands them to a process pool, and the worker runs the turn through
+_open_turn (fast path, stage mirror, routing, planner, ...) and appends every
+(event, data) pair to a per-job log.
+Any number of clients attach over SSE and replay the log from an offset, so a
+page reload or a second tab simply re-attaches.
+
+Layout under DWEB_DATA_DIR/chat-jobs/:
+    queue.sqlite3    jobs table (WAL): status, request, timestamps, counters
+    <jobId>.jsonl    event log, one {"event", "data"} object per line
+
+A running job whose worker stops heartbeating (process killed, server
+restart) is closed with a worker_lost error instead of being re-run: clients
+may already have applied part of the turn. Finished jobs and their logs are
+purged DWEB_CHAT_JOB_RETENTION_S seconds after they finish.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+_WORKERS = int(os.environ.get("DWEB_CHAT_JOB_WORKERS", "2"))
+_RETENTION_S = float(os.environ.get("DWEB_CHAT_JOB_RETENTION_S", "86400"))
+_STALE_S = float(os.environ.get("DWEB_CHAT_JOB_STALE_S", "60"))
+_HEARTBEAT_S = 5.0
+_SWEEP_S = 30.0
+_POLL_S = 0.05
+_FINISHED = ("done", "error")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    conversation_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    request TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL,
+    worker TEXT,
+    events INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+_local = threading.local()
+
+
+def _jobs_dir() -> Path:
+    from django.conf import settings
+
+    return Path(getattr(settings, "DWEB_DATA_DIR")) / "chat-jobs"
+
+
+def log_path(job_id: str) -> Path:
+    return _jobs_dir() / f"{job_id}.jsonl"
+
+
+def _conn() -> sqlite3.Connection:
+    """One connection per thread (and per process: forked handles are not reused)."""
+
+    db = _jobs_dir() / "queue.sqlite3"
+    cached = getattr(_local, "conn", None)
+    if cached is not None and cached[0] == (os.getpid(), db):
+        return cached[1]
+    db.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db), timeout=10.0, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    _local.conn = ((os.getpid(), db), conn)
+    return conn
+
+
+def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    request = json.loads(row["request"])
+    now = time.time()
+    started, finished = row["started_at"], row["finished_at"]
+    return {
+        "jobId": row["id"],
+        "conversationId": row["conversation_id"],
+        "status": row["status"],
+        "model": request.get("model"),
+        "responseMode": request.get("responseMode"),
+        "intent": (request.get("promptReport") or {}).get("intent"),
+        "events": row["events"],
+        "errors": row["errors"],
+        "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(row["created_at"])),
+        "queuedMs": int(((started or now) - row["created_at"]) * 1000),
+        "elapsedMs": int(((finished or now) - started) * 1000) if started else 0,
+        "expiresAt": (
+            time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(finished + _RETENTION_S)) if finished else None
+        ),
+    }
+
+
+def enqueue_job(conversation_id: str, request: Dict[str, Any]) -> Dict[str, Any]:
+    """Queue one turn. `request`: {provider, model, responseMode, body, promptReport}."""
+
+    job_id = uuid.uuid4().hex
+    conn = _conn()
+    conn.execute(
+        "INSERT INTO jobs (id, conversation_id, status, request, created_at) VALUES (?, ?, 'queued', ?, ?)",
+        (job_id, conversation_id, json.dumps(request, ensure_ascii=False), time.time()),
+    )
+    log_path(job_id).touch()
+    ensure_dispatcher()
+    return get_job(job_id) or {"jobId": job_id, "status": "queued"}
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    row = _conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _row_to_dict(row) if row is not None else None
+
+
+def _job_status(job_id: str) -> Optional[str]:
+    row = _conn().execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return row["status"] if row is not None else None
+
+
+def follow_events(job_id: str, offset: int = 0) -> Iterator[Optional[Tuple[int, str, Any]]]:
+    """Replay the job log after `offset`, then tail it until the job finishes.
+
+    Yields (index, event, data) with 1-based indexes, or None on idle polls so
+    callers can interleave keepalives. Only complete lines are consumed; a
+    line the worker is still writing is picked up on the next poll.
+    """
+
+    path = log_path(job_id)
+    index = 0
+    pos = 0
+    finished = False
+    with open(path, "rb") as fp:
+        while True:
+            got = False
+            fp.seek(pos)
+            for line in fp:
+                if not line.endswith(b"\n"):
+                    break
+                pos += len(line)
+                index += 1
+                if index <= offset:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                got = True
+                yield index, rec.get("event") or "msg", rec.get("data")
+            if got:
+                continue
+            # One more drain after seeing the final status: the worker writes the
+            # last lines before it flips the row.
+            if finished:
+                return
+            finished = _job_status(job_id) in (*_FINISHED, None)
+            if not finished:
+                yield None
+                time.sleep(_POLL_S)
+
+
+def _append_events(job_id: str, events: Any) -> None:
+    with open(log_path(job_id), "a", encoding="utf-8") as fp:
+        for event, data in events:
+            fp.write(json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n")
+
+
+def _fail(job_id: str, code: str, message: str) -> None:
+    from .ai_chat_api import _agent_to_ui_error
+
+    _append_events(job_id, [("msg", _agent_to_ui_error(code, message)), ("done", "{}")])
+    _conn().execute(
+        "UPDATE jobs SET status = 'error', finished_at = ?, errors = errors + 1, events = events + 2 WHERE id = ?",
+        (time.time(), job_id),
+    )
+
+
+def _worker_init() -> None:
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "dwebsite.settings")
+        django.setup()
+
+
+def run_job(job_id: str) -> str:
+    """Process-pool entry point: run one claimed job and write its log."""
+
+    _worker_init()
+    from . import metrics
+    from .ai_chat_api import _open_turn
+    from .ratelimit import upstream_limiter
+    from .sse import sse_event
+
+    row = _conn().execute("SELECT conversation_id, request FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return "missing"
+    request = json.loads(row["request"])
+    body = request["body"]
+
+    stop = threading.Event()
+    counters = {"events": 0, "errors": 0}
+
+    def heartbeat() -> None:
+        while not stop.wait(_HEARTBEAT_S):
+            _conn().execute(
+                "UPDATE jobs SET heartbeat_at = ?, events = ? WHERE id = ?",
+                (time.time(), counters["events"], job_id),
+            )
+
+    beat = threading.Thread(target=heartbeat, name=f"chat-job-beat-{job_id[:8]}", daemon=True)
+    beat.start()
+    try:
+        if not body.get("planner"):
+            upstream_limiter().acquire()  # planner modules take their own tokens
+        turn = _open_turn(row["conversation_id"], body, started_at=time.monotonic())
+        live = turn.live
+        with open(log_path(job_id), "a", encoding="utf-8") as fp:
+            try:
+                for event, data in turn.events:
+                    line = json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n"
+                    if live is not None:
+                        live.before_write(sse_event(event, data).encode("utf-8"), envelope=event == "msg")
+                    fp.write(line)
+                    fp.flush()
+                    if live is not None:
+                        live.after_write()
+                    counters["events"] += 1
+                    if event == "msg" and isinstance(data, dict) and data.get("type") == "agentToUi/error":
+                        counters["errors"] += 1
+            finally:
+                turn.events.close()
+    except Exception as e:  # the pipeline reports upstream failures itself
+        stop.set()
+        _conn().execute("UPDATE jobs SET events = ? WHERE id = ?", (counters["events"], job_id))
+        _fail(job_id, "internal_error", f"{type(e).__name__}: {e}")
+        metrics.incr("chat.jobs", status="error")
+        return "error"
+    finally:
+        stop.set()
+
+    status = "error" if counters["errors"] else "done"
+    _conn().execute(
+        "UPDATE jobs SET status = ?, finished_at = ?, events = ?, errors = ? WHERE id = ?",
+        (status, time.time(), counters["events"], counters["errors"], job_id),
+    )
+    metrics.incr("chat.jobs", status=status)
+    return status
+
+
+def _claim(worker: str) -> Optional[str]:
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+        if row is not None:
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ?, worker = ? WHERE id = ?",
+                (now, now, worker, row["id"]),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return row["id"] if row is not None else None
+
+
+def sweep() -> Dict[str, int]:
+    """Close jobs whose worker died and purge logs past the retention window."""
+
+    conn = _conn()
+    now = time.time()
+    lost = [r["id"] for r in conn.execute(
+        "SELECT id FROM jobs WHERE status = 'running' AND heartbeat_at < ?", (now - _STALE_S,)
+    )]
+    for job_id in lost:
+        _fail(job_id, "worker_lost", "生成进程已中断，请重新发送")
+    expired = [r["id"] for r in conn.execute(
+        "SELECT id FROM jobs WHERE status IN ('done', 'error') AND finished_at < ?", (now - _RETENTION_S,)
+    )]
+    for job_id in expired:
+        log_path(job_id).unlink(missing_ok=True)
+        conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+    return {"lost": len(lost), "purged": len(expired)}
+
+
+class Dispatcher:
+    """Claims queued jobs and keeps up to `workers` of them running in a process pool."""
+
+    def __init__(self, workers: int = _WORKERS) -> None:
+        self.workers = max(1, workers)
+        self.name = f"{os.uname().nodename}:{os.getpid()}"
+        self._wake = threading.Event()
+        self._inflight: Dict[Future, str] = {}
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # spawn, not fork: the web process is multi-threaded and holds sqlite handles.
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=_worker_init
+        )
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def run_forever(self) -> None:
+        last_sweep = 0.0
+        while True:
+            try:
+                if time.monotonic() - last_sweep > _SWEEP_S:
+                    sweep()
+                    last_sweep = time.monotonic()
+                self._reap()
+                while len(self._inflight) < self.workers:
+                    job_id = _claim(self.name)
+                    if job_id is None:
+                        break
+                    fut = self._pool.submit(run_job, job_id)
+                    fut.add_done_callback(lambda _f: self._wake.set())
+                    self._inflight[fut] = job_id
+            except sqlite3.Error:
+                pass  # busy / locked by another dispatcher: retry on the next tick
+            self._wake.wait(1.0)
+            self._wake.clear()
+
+    def _reap(self) -> None:
+        for fut in [f for f in self._inflight if f.done()]:
+            job_id = self._inflight.pop(fut)
+            exc = fut.exception()
+            if exc is not None and _job_status(job_id) not in _FINISHED:
+                _fail(job_id, "internal_error", f"{type(exc).__name__}: {exc}")
+
+
+_DISPATCHER: Optional[Dispatcher] = None
+_DISPATCHER_LOCK = threading.Lock()
+
+
+def ensure_dispatcher() -> None:
+    """Start the in-process dispatcher (unless DWEB_CHAT_JOB_DISPATCH=0) and poke it."""
+
+    global _DISPATCHER
+    if os.environ.get("DWEB_CHAT_JOB_DISPATCH", "1") == "0":
+        return
+    with _DISPATCHER_LOCK:
+        if _DISPATCHER is None:
+            _DISPATCHER = Dispatcher()
+            threading.Thread(target=_DISPATCHER.run_forever, name="chat-job-dispatcher", daemon=True).start()
+        _DISPATCHER.wake()
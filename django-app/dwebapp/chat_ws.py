@@ -0,0 +1,392 @@
+"""WebSocket transport for chat turns (raw ASGI; mounted in dwebsite/asgi.py).
+
+    ws(s)://<host>/api/chat/ws
+
+One socket carries any number of concurrent turns ("streams"); each one runs
+the same pipeline as POST .../messages:stream and carries the same envelopes.
+Frames are JSON text messages:
+
+client -> server
+  {"op":"start","streamId":"s1","conversationId":"c1","body":{...messages:stream body...},"credit"?:64}
+  {"op":"credit","streamId":"s1","n":32}          allow 32 more event frames
+  {"op":"cancel","streamId":"s1"}                 stops the generation, closes the upstream
+  {"op":"ack","streamId":"s1","ids":["<envelope id>",...],"ok":true,"error"?:"..."}
+  {"op":"ping"}
+
+server -> client
+  {"op":"ready","protocol":1,"maxStreams":8,"defaultCredit":64}
+  {"op":"event","streamId":"s1","seq":1,"event":"msg","data":{envelope}}
+  {"op":"end","streamId":"s1","reason":"done"|"error"|"canceled"|"rejected","stats":{...}}
+  {"op":"error","streamId"?:"s1","code":"...","message":"..."}
+  {"op":"pong"}
+
+Flow control is credit based and per stream: every event frame spends one
+credit, and a stream without credit stops pulling from its upstream until the
+client grants more, so one slow tab cannot make the server buffer another
+tab's output. A stream waiting for credit holds a pump thread, so waiting is
+bounded: after DWEB_WS_CREDIT_TIMEOUT_S without credit the stream is canceled
+(error `credit_timeout`), and at most DWEB_WS_MAX_STARVED streams per process
+may wait at once (the next one is canceled right away, `credit_starved`).
+The SSE "done" event is replaced by the `end` frame.
+
+Browsers send an Origin header with the handshake and CORS does not apply to
+WebSockets, so the handshake is checked against the CORS settings
+(CORS_ALLOW_ALL_ORIGINS / CORS_ALLOWED_ORIGINS / CORS_ALLOWED_ORIGIN_REGEXES,
+plus same-origin); other origins are refused with close code 4403.
+
+Acks report stage ops the client applied (ok=true) or rejected (ok=false);
+they are counted on the stream (ops endpoint, `end` stats) and their latency
+from frame send to ack is recorded as chat.ws_ack_ms.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from . import metrics
+
+WS_PATH = "/api/chat/ws"
+MAX_STREAMS = int(os.environ.get("DWEB_WS_MAX_STREAMS", "8"))
+DEFAULT_CREDIT = int(os.environ.get("DWEB_WS_DEFAULT_CREDIT", "64"))
+CREDIT_TIMEOUT_S = float(os.environ.get("DWEB_WS_CREDIT_TIMEOUT_S", "30"))
+MAX_STARVED = int(os.environ.get("DWEB_WS_MAX_STARVED", "16"))
+_MAX_CREDIT = 100_000
+_SENT_AT_LIMIT = 4096
+_ENDED_KEEP = 32
+
+# Turns are blocking (urllib upstream, prompt assembly); each stream pumps on its own thread.
+_POOL = ThreadPoolExecutor(max_workers=int(os.environ.get("DWEB_WS_WORKERS", "64")), thread_name_prefix="chat-ws")
+
+# Streams currently blocked in take_credit (process-wide).
+_STARVED = 0
+_STARVED_LOCK = threading.Lock()
+
+
+class CreditStarved(Exception):
+    def __init__(self, code: str, message: str) -> None:
+        super().__init__(message)
+        self.code = code
+
+
+class _WsStream:
+    def __init__(self, stream_id: str, conversation_id: str, body: Dict[str, Any], credit: int) -> None:
+        self.id = stream_id
+        self.conversation_id = conversation_id
+        self.body = body
+        self.credit = credit
+        self.cond = threading.Condition()
+        self.canceled = False
+        self.ended = False
+        self.live: Any = None  # streams.LiveStream once the turn is open
+        self.started_at = time.monotonic()
+        self.seq = 0
+        self.last_phase: Optional[str] = None
+        self.rejected = False
+        self.sent_at: Dict[str, float] = {}
+        self.acked = 0
+        self.ack_failed = 0
+
+    def grant(self, n: int) -> None:
+        with self.cond:
+            self.credit = min(_MAX_CREDIT, self.credit + n)
+            self.cond.notify_all()
+
+    def take_credit(self, closed: threading.Event) -> None:
+        """Block until a frame may be sent; canceled / closed streams drain without credit.
+
+        Raises CreditStarved when the wait exceeds CREDIT_TIMEOUT_S or MAX_STARVED
+        streams are already waiting; the caller cancels the stream.
+        """
+
+        global _STARVED
+        with self.cond:
+            if self.credit > 0 or self.canceled or closed.is_set():
+                if self.credit > 0:
+                    self.credit -= 1
+                return
+            with _STARVED_LOCK:
+                if _STARVED >= MAX_STARVED:
+                    raise CreditStarved("credit_starved", f"too many streams waiting for credit (max {MAX_STARVED})")
+                _STARVED += 1
+            try:
+                deadline = time.monotonic() + CREDIT_TIMEOUT_S
+                while self.credit <= 0 and not self.canceled and not closed.is_set():
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        raise CreditStarved("credit_timeout", f"no credit granted for {CREDIT_TIMEOUT_S:g}s")
+                    self.cond.wait(timeout=min(1.0, left))
+            finally:
+                with _STARVED_LOCK:
+                    _STARVED -= 1
+            if self.credit > 0:
+                self.credit -= 1
+
+    def cancel(self, reason: str) -> None:
+        with self.cond:
+            self.canceled = True
+            self.cond.notify_all()
+        if self.live is not None:
+            self.live.cancel(reason)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "frames": self.seq,
+            "ms": int((time.monotonic() - self.started_at) * 1000),
+            "acked": self.acked,
+            "ackFailed": self.ack_failed,
+            "creditLeft": self.credit,
+        }
+
+
+class _Connection:
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self.out: "asyncio.Queue[Optional[Tuple[Optional[_WsStream], str, Optional[str]]]]" = asyncio.Queue()
+        self.closed = threading.Event()
+        self.streams: Dict[str, _WsStream] = {}
+
+    # -- outgoing ---------------------------------------------------------
+
+    def emit(self, frame: Dict[str, Any], stream: Optional[_WsStream] = None) -> None:
+        """Queue a frame from any thread."""
+
+        if self.closed.is_set():
+            return
+        text = json.dumps(frame, ensure_ascii=False)
+        envelope_id: Optional[str] = None
+        if stream is not None and frame.get("op") == "event":
+            data = frame.get("data")
+            envelope_id = data.get("id") if isinstance(data, dict) and isinstance(data.get("id"), str) else None
+            if stream.live is not None:
+                stream.live.before_write(text.encode("utf-8"), envelope=frame.get("event") == "msg")
+        try:
+            self.loop.call_soon_threadsafe(self.out.put_nowait, (stream, text, envelope_id))
+        except RuntimeError:  # loop already gone
+            pass
+
+    async def writer(self, send: Any) -> None:
+        while True:
+            item = await self.out.get()
+            if item is None:
+                return
+            stream, text, envelope_id = item
+            try:
+                await send({"type": "websocket.send", "text": text})
+            except Exception:
+                self.close()
+                return
+            if stream is not None:
+                if stream.live is not None:
+                    stream.live.after_write()
+                if envelope_id is not None and len(stream.sent_at) < _SENT_AT_LIMIT:
+                    stream.sent_at[envelope_id] = time.monotonic()
+
+    def error(self, code: str, message: str, stream_id: Optional[str] = None) -> None:
+        frame: Dict[str, Any] = {"op": "error", "code": code, "message": message}
+        if stream_id is not None:
+            frame["streamId"] = stream_id
+        self.emit(frame)
+
+    # -- incoming ---------------------------------------------------------
+
+    def handle(self, raw: str) -> None:
+        try:
+            msg: Any = json.loads(raw)
+        except ValueError:
+            self.error("bad_frame", "frame is not JSON")
+            return
+        if not isinstance(msg, dict):
+            self.error("bad_frame", "frame must be a JSON object")
+            return
+        op = msg.get("op")
+        if op == "ping":
+            self.emit({"op": "pong"})
+            return
+        stream_id = msg.get("streamId")
+        if not isinstance(stream_id, str) or not stream_id:
+            self.error("bad_frame", "streamId is required")
+            return
+        if op == "start":
+            self._start(stream_id, msg)
+            return
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            self.error("unknown_stream", "no such stream on this socket", stream_id)
+        elif op == "credit":
+            stream.grant(max(0, _int(msg.get("n"), 0)))
+        elif op == "cancel":
+            if not stream.ended:
+                stream.cancel("client")
+        elif op == "ack":
+            self._ack(stream, msg)
+        else:
+            self.error("bad_frame", f"unknown op: {op}", stream_id)
+
+    def _start(self, stream_id: str, msg: Dict[str, Any]) -> None:
+        if stream_id in self.streams:
+            self.error("duplicate_stream", "streamId already used on this socket", stream_id)
+            return
+        active = sum(1 for s in self.streams.values() if not s.ended)
+        if active >= MAX_STREAMS:
+            self.error("too_many_streams", f"at most {MAX_STREAMS} concurrent streams per socket", stream_id)
+            return
+        body = msg.get("body") if isinstance(msg.get("body"), dict) else {}
+        conversation_id = str(msg.get("conversationId") or "default")
+        credit = max(1, min(_MAX_CREDIT, _int(msg.get("credit"), DEFAULT_CREDIT)))
+        stream = _WsStream(stream_id, conversation_id, body, credit)
+        self.streams[stream_id] = stream
+        ended = [k for k, s in self.streams.items() if s.ended]
+        for k in ended[: max(0, len(ended) - _ENDED_KEEP)]:
+            del self.streams[k]
+        metrics.incr("chat.ws_streams")
+        _POOL.submit(self._pump, stream)
+
+    def _ack(self, stream: _WsStream, msg: Dict[str, Any]) -> None:
+        ids = [i for i in msg.get("ids") or [] if isinstance(i, str)] if isinstance(msg.get("ids"), list) else []
+        ok = msg.get("ok") is not False
+        now = time.monotonic()
+        for envelope_id in ids:
+            sent = stream.sent_at.pop(envelope_id, None)
+            if sent is not None:
+                metrics.observe("chat.ws_ack_ms", (now - sent) * 1000, ok=ok)
+        if ok:
+            stream.acked += len(ids)
+        else:
+            stream.ack_failed += len(ids)
+        if stream.live is not None:
+            stream.live.note_ack(len(ids), ok=ok)
+        metrics.incr("chat.ws_acks", len(ids), ok=ok)
+
+    # -- per-stream pump (worker thread) ----------------------------------
+
+    def _pump(self, stream: _WsStream) -> None:
+        from .ai_chat_api import _open_turn
+
+        turn = None
+        try:
+            turn = _open_turn(stream.conversation_id, stream.body, started_at=stream.started_at)
+            stream.live = turn.live
+            stream.rejected = turn.live is None
+            if stream.canceled and turn.live is not None:
+                turn.live.cancel("client")
+            for event, data in turn.events:
+                if self.closed.is_set():
+                    break
+                if event == "done":
+                    continue  # replaced by the end frame
+                if isinstance(data, dict) and data.get("type") == "agentToUi/taskStatus":
+                    stream.last_phase = (data.get("payload") or {}).get("phase")
+                try:
+                    stream.take_credit(self.closed)
+                except CreditStarved as e:
+                    # Canceled streams drain their last frames without credit, then end.
+                    metrics.incr("chat.ws_credit_starved", code=e.code)
+                    self.error(e.code, str(e), stream.id)
+                    stream.cancel(e.code)
+                if self.closed.is_set():
+                    break
+                stream.seq += 1
+                self.emit({"op": "event", "streamId": stream.id, "seq": stream.seq, "event": event, "data": data}, stream)
+        except Exception as e:
+            self.error("internal_error", str(e), stream.id)
+        finally:
+            if turn is not None:
+                if self.closed.is_set() and turn.live is not None:
+                    turn.live.client_connected = False
+                turn.events.close()
+            stream.ended = True
+            self.emit({"op": "end", "streamId": stream.id, "reason": _end_reason(stream), "stats": stream.stats()})
+
+    # -- teardown ---------------------------------------------------------
+
+    def close(self) -> None:
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        for stream in list(self.streams.values()):
+            if not stream.ended:
+                if stream.live is not None:
+                    stream.live.client_connected = False
+                stream.cancel("client_gone")
+        try:
+            self.loop.call_soon_threadsafe(self.out.put_nowait, None)
+        except RuntimeError:
+            pass
+
+
+def _int(v: Any, fallback: int) -> int:
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return fallback
+
+
+def _end_reason(stream: _WsStream) -> str:
+    if stream.rejected:
+        return "rejected"
+    if stream.canceled or stream.last_phase == "canceled":
+        return "canceled"
+    if stream.last_phase == "error":
+        return "error"
+    return "done"
+
+
+def _origin_allowed(scope: Dict[str, Any]) -> bool:
+    """The CORS allow-list (django-cors-headers settings) applied to the handshake Origin."""
+
+    from urllib.parse import urlsplit
+
+    from django.conf import settings
+
+    headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers") or []}
+    origin = headers.get("origin")
+    if not origin:
+        return True  # not a browser: CORS would not apply either
+    if getattr(settings, "CORS_ALLOW_ALL_ORIGINS", False):
+        return True
+    if urlsplit(origin).netloc == headers.get("host"):
+        return True
+    if origin in getattr(settings, "CORS_ALLOWED_ORIGINS", ()):
+        return True
+    return any(re.match(pattern, origin) for pattern in getattr(settings, "CORS_ALLOWED_ORIGIN_REGEXES", ()))
+
+
+async def websocket_app(scope: Dict[str, Any], receive: Any, send: Any) -> None:
+    first = await receive()
+    if first.get("type") != "websocket.connect":
+        return
+    if scope.get("path") != WS_PATH:
+        await send({"type": "websocket.close", "code": 4404})
+        return
+    if not _origin_allowed(scope):
+        metrics.incr("chat.ws_origin_rejected")
+        await send({"type": "websocket.close", "code": 4403})
+        return
+    await send({"type": "websocket.accept"})
+    metrics.incr("chat.ws_connections")
+
+    conn = _Connection(asyncio.get_running_loop())
+    writer = asyncio.create_task(conn.writer(send))
+    conn.emit({"op": "ready", "protocol": 1, "maxStreams": MAX_STREAMS, "defaultCredit": DEFAULT_CREDIT})
+    try:
+        while not conn.closed.is_set():
+            msg = await receive()
+            if msg.get("type") == "websocket.disconnect":
+                break
+            if msg.get("type") != "websocket.receive":
+                continue
+            raw = msg.get("text")
+            if raw is None and msg.get("bytes") is not None:
+                raw = msg["bytes"].decode("utf-8", errors="replace")
+            if raw is not None:
+                conn.handle(raw)
+    finally:
+        conn.close()
+        await writer
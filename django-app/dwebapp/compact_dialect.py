@@ -0,0 +1,362 @@
+"""Compact JSONL output dialect, expanded server-side into AgentToUI envelopes.
+
+Opt in per request with `outputDialect: "compact"` (or DWEB_OUTPUT_DIALECT).
+Instead of full envelopes the model writes one short object per line:
+
+    {"t":"m","c":"我将插入一个标题卡片。"}
+    {"t":"c","id":"tmpl_title","n":"标题卡片","ns":[
+        {"i":"root","k":"r","x":[0,0,480,160],"p":{"fc":"#1e1e1e","cr":12}},
+        {"i":"title","k":"t","pa":"root","x":[0,-40],"p":{"tx":"欢迎","fs":36}}]}
+
+`t` is the message kind (m chatMessage, s taskStatus, c componentTemplate,
+n insertNode, u patchNode, d deleteNode, f applyFilter), `k` the node type,
+`x` a positional [x,y,w,h,rotation,opacity] or short-key transform, `p`
+props under short names and `lo` a template node's layout intents (passed
+through as `layout`, see stage/layout.py). Props equal to the editor defaults (the
+defaultProps() of the node classes in src/core/scene/nodesType) may be left
+out; expand() fills in schemaVersion, id, createdAt, source and the defaults,
+so the client receives exactly what a verbose turn would have sent.
+Lines that already are envelopes pass through untouched.
+
+compress() is the inverse; it renders few-shot examples and the
+compact_dialect_report benchmark corpus.
+"""
+
+from __future__ import annotations
+
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+DIALECTS = ("verbose", "compact")
+DEFAULT_DIALECT = os.environ.get("DWEB_OUTPUT_DIALECT", "verbose")
+
+# short key -> (prop name, editor default or None when there is none)
+PROP_KEYS: Dict[str, Tuple[Tuple[str, str, Any], ...]] = {
+    "rect": (
+        ("fc", "fillColor", "#3aa1ff"),
+        ("fo", "fillOpacity", 1),
+        ("bc", "borderColor", "#9cdcfe"),
+        ("bo", "borderOpacity", 1),
+        ("bw", "borderWidth", 2),
+        ("cr", "cornerRadius", 0),
+    ),
+    "text": (
+        ("tx", "textContent", "Text"),
+        ("fs", "fontSize", 24),
+        ("co", "fontColor", "#ffffff"),
+        ("st", "fontStyle", "normal"),
+        ("al", "textAlign", "center"),
+    ),
+    "image": (
+        ("id", "imageId", ""),
+        ("ip", "imagePath", ""),
+        ("in", "imageName", None),
+        ("fit", "imageFit", "contain"),
+    ),
+    "line": (
+        ("sx", "startX", None),
+        ("sy", "startY", 0),
+        ("ex", "endX", None),
+        ("ey", "endY", 0),
+        ("ax", "anchorX", None),
+        ("ay", "anchorY", None),
+        ("lc", "lineColor", "#ffffff"),
+        ("lw", "lineWidth", 4),
+        ("ls", "lineStyle", "solid"),
+    ),
+}
+NODE_TYPES = {"r": "rect", "t": "text", "i": "image", "l": "line"}
+_TYPE_CODES = {v: k for k, v in NODE_TYPES.items()}
+_TRANSFORM_KEYS = ("x", "y", "width", "height", "rotation", "opacity")
+_TRANSFORM_SHORT = {"x": "x", "y": "y", "w": "width", "h": "height", "r": "rotation", "o": "opacity"}
+_KINDS = {
+    "m": "agentToUi/chatMessage",
+    "s": "agentToUi/taskStatus",
+    "c": "agentToUi/componentTemplate",
+    "n": "agentToUi/insertNode",
+    "u": "agentToUi/patchNode",
+    "d": "agentToUi/deleteNode",
+    "f": "agentToUi/applyFilter",
+}
+
+
+def resolve(value: Any) -> str:
+    return value if value in DIALECTS else (DEFAULT_DIALECT if DEFAULT_DIALECT in DIALECTS else "verbose")
+
+
+def is_compact_line(obj: Any) -> bool:
+    return isinstance(obj, dict) and obj.get("t") in _KINDS and "type" not in obj
+
+
+def prop_legend() -> str:
+    """Short-name table for the system prompt (defaults in parentheses)."""
+
+    lines = []
+    for node_type, keys in PROP_KEYS.items():
+        items = []
+        for short, name, default in keys:
+            items.append(f"{short}={name}" + (f"({default})" if default not in (None, "") else ""))
+        lines.append(f"- {node_type}（k={_TYPE_CODES[node_type]}）：" + " ".join(items))
+    return "\n".join(lines)
+
+
+# -- expansion -------------------------------------------------------------
+
+
+def _expand_transform(v: Any, *, fill: bool) -> Optional[Dict[str, Any]]:
+    if isinstance(v, list):
+        out = {k: n for k, n in zip(_TRANSFORM_KEYS, v) if isinstance(n, (int, float)) and not isinstance(n, bool)}
+    elif isinstance(v, dict):
+        out = {_TRANSFORM_SHORT.get(k, k): n for k, n in v.items() if n is not None}
+    else:
+        return None
+    if fill:
+        out.setdefault("rotation", 0)
+        out.setdefault("opacity", 1)
+    return out
+
+
+def _expand_props(node_type: str, v: Any, transform: Optional[Dict[str, Any]], *, fill: bool) -> Dict[str, Any]:
+    short = v if isinstance(v, dict) else {}
+    keys = PROP_KEYS.get(node_type, ())
+    names = {s: name for s, name, _ in keys}
+    out: Dict[str, Any] = {names.get(k, k): val for k, val in short.items()}
+    if not fill:
+        return out
+    for _, name, default in keys:
+        if default is not None:
+            out.setdefault(name, default)
+    if node_type == "line":
+        # LineNode.defaultProps: endpoints 12px inside the box; the anchor defaults to a straight line.
+        w = float((transform or {}).get("width") or 200)
+        out.setdefault("startX", -w / 2 + 12)
+        out.setdefault("endX", w / 2 - 12)
+        out.setdefault("anchorX", (out["startX"] + out["endX"]) / 2)
+        out.setdefault("anchorY", (out["startY"] + out["endY"]) / 2)
+    return out
+
+
+def _expand_node(v: Dict[str, Any], *, template: bool) -> Dict[str, Any]:
+    node_type = NODE_TYPES.get(v.get("k"), v.get("k") if v.get("k") in PROP_KEYS else "rect")
+    # insertNode nodes carry a complete transform (as in the verbose examples); template nodes only what was given.
+    transform = _expand_transform(v.get("x"), fill=not template)
+    out: Dict[str, Any] = {}
+    if template:
+        out["localId"] = str(v.get("i") or "")
+        out["type"] = node_type
+        if v.get("pa"):
+            out["parentLocalId"] = v["pa"]
+        if v.get("n"):
+            out["name"] = v["n"]
+        if isinstance(v.get("lo"), dict):
+            out["layout"] = v["lo"]  # solved later with the rest of the template (stage/layout.py)
+    else:
+        out = {"category": "user", "userType": node_type, "name": v.get("n") or node_type}
+    if transform is not None:
+        out["transform"] = transform
+    out["props"] = _expand_props(node_type, v.get("p"), transform, fill=True)
+    if not template and isinstance(v.get("ch"), list):
+        out["children"] = [_expand_node(c, template=False) for c in v["ch"] if isinstance(c, dict)]
+    return out
+
+
+def _expand_payload(kind: str, v: Dict[str, Any], *, default_intent: str) -> Optional[Dict[str, Any]]:
+    if kind == "m":
+        return {"content": str(v.get("c") or "")}
+    if kind == "s":
+        out: Dict[str, Any] = {"message": str(v.get("m") or "")}
+        if isinstance(v.get("p"), str):
+            out["phase"] = v["p"]
+        return out
+    if kind == "c":
+        nodes = [_expand_node(n, template=True) for n in v.get("ns") or [] if isinstance(n, dict)]
+        if not nodes:
+            return None
+        template = {
+            "schemaVersion": 1,
+            "templateId": str(v.get("id") or f"tmpl_{uuid.uuid4().hex[:8]}"),
+            "name": str(v.get("n") or "AI组件"),
+            "params": [],
+            "nodes": nodes,
+            "rootLocalId": str(v.get("r") or nodes[0]["localId"]),
+        }
+        out = {"intent": default_intent, "template": template}
+    elif kind == "n":
+        if not isinstance(v.get("nd"), dict):
+            return None
+        out = {"node": _expand_node(v["nd"], template=False)}
+    elif kind == "u":
+        patch: Dict[str, Any] = {}
+        if v.get("n"):
+            patch["name"] = v["n"]
+        if v.get("x") is not None:
+            if isinstance(v["x"], list):
+                # Positional patches use null for "keep": [null,null,320] only changes the width.
+                patch["transform"] = {k: n for k, n in zip(_TRANSFORM_KEYS, v["x"]) if n is not None}
+            else:
+                patch["transform"] = _expand_transform(v["x"], fill=False)
+        if isinstance(v.get("p"), dict):
+            names = {s: name for keys in PROP_KEYS.values() for s, name, _ in keys if s not in ("id",)}
+            patch["props"] = {names.get(k, k): val for k, val in v["p"].items()}
+        return {"nodeId": str(v.get("id") or ""), "patch": patch}
+    elif kind == "d":
+        if isinstance(v.get("ids"), list):
+            return {"nodeIds": [str(i) for i in v["ids"]]}
+        return {"nodeId": str(v.get("id") or "")}
+    elif kind == "f":
+        if not isinstance(v.get("f"), dict):
+            return None
+        out = {"target": "nodeId", "nodeId": v["id"]} if v.get("id") else {"target": "selection"}
+        out.update(mode=v.get("mode") or "append", filter=v["f"])
+        return out
+    else:
+        return None
+    if v.get("p"):
+        out["parentId"] = v["p"]
+    if v.get("l"):
+        out["layerId"] = v["l"]
+    return out
+
+
+def expand(obj: Dict[str, Any], *, model: Optional[str] = None, default_intent: str = "insert") -> Optional[Dict[str, Any]]:
+    """Full AgentToUI envelope for one compact line (None if it cannot be expanded)."""
+
+    kind = obj.get("t")
+    payload = _expand_payload(kind, obj, default_intent=default_intent) if kind in _KINDS else None
+    if payload is None:
+        return None
+    env: Dict[str, Any] = {
+        "schemaVersion": 1,
+        "type": _KINDS[kind],
+        "id": str(uuid.uuid4()),
+        "createdAt": datetime.utcnow().isoformat() + "Z",
+        "payload": payload,
+    }
+    env["source"] = {"agentName": "deepseek", "model": model} if model else {"agentName": "deepseek"}
+    return env
+
+
+# -- compression (inverse; few-shot examples and the benchmark) -------------
+
+
+def _compress_transform(t: Any, *, drop_defaults: bool = True) -> Optional[List[Any]]:
+    if not isinstance(t, dict):
+        return None
+    values = [t.get(k) for k in _TRANSFORM_KEYS]
+    if drop_defaults:
+        if values[5] == 1:
+            values[5] = None
+        if values[4] == 0 and values[5] is None:
+            values[4] = None
+    while values and values[-1] is None:
+        values.pop()
+    if any(v is None for v in values):
+        # Holes (e.g. a text without width but with rotation) need explicit zeros / the default.
+        values = [t.get(k, 0 if k != "opacity" else 1) for k in _TRANSFORM_KEYS[: len(values)]]
+    return values
+
+
+def _compress_props(node_type: str, props: Any, transform: Any) -> Dict[str, Any]:
+    props = dict(props) if isinstance(props, dict) else {}
+    out: Dict[str, Any] = {}
+    if node_type == "line":
+        w = float((transform or {}).get("width") or 200) if isinstance(transform, dict) else 200.0
+        sx, ex = props.get("startX", -w / 2 + 12), props.get("endX", w / 2 - 12)
+        sy, ey = props.get("startY", 0), props.get("endY", 0)
+        if props.get("startX") == -w / 2 + 12:
+            props.pop("startX")
+        if props.get("endX") == w / 2 - 12:
+            props.pop("endX")
+        if props.get("anchorX") == (sx + ex) / 2:
+            props.pop("anchorX")
+        if props.get("anchorY") == (sy + ey) / 2:
+            props.pop("anchorY")
+    for short, name, default in PROP_KEYS.get(node_type, ()):
+        if name in props:
+            val = props.pop(name)
+            if default is None or val != default:
+                out[short] = val
+    out.update(props)  # unknown props keep their long names
+    return out
+
+
+def _compress_node(n: Dict[str, Any], *, template: bool) -> Dict[str, Any]:
+    node_type = str(n.get("type") if template else n.get("userType") or "rect")
+    out: Dict[str, Any] = {}
+    if template:
+        out["i"] = n.get("localId")
+    out["k"] = _TYPE_CODES.get(node_type, node_type)
+    if template and n.get("parentLocalId"):
+        out["pa"] = n["parentLocalId"]
+    name = n.get("name")
+    if name and (template or name != node_type):
+        out["n"] = name
+    if template and isinstance(n.get("layout"), dict):
+        out["lo"] = n["layout"]
+    x = _compress_transform(n.get("transform"))
+    if x is not None:
+        out["x"] = x
+    p = _compress_props(node_type, n.get("props"), n.get("transform"))
+    if p:
+        out["p"] = p
+    if not template and isinstance(n.get("children"), list) and n["children"]:
+        out["ch"] = [_compress_node(c, template=False) for c in n["children"] if isinstance(c, dict)]
+    return out
+
+
+def compress(env: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Compact line for a verbose envelope (None for kinds the dialect does not cover)."""
+
+    kind = next((k for k, t in _KINDS.items() if t == env.get("type")), None)
+    payload = env.get("payload") if isinstance(env.get("payload"), dict) else {}
+    if kind is None:
+        return None
+    out: Dict[str, Any] = {"t": kind}
+    if kind == "m":
+        out["c"] = payload.get("content", "")
+    elif kind == "s":
+        out["m"] = payload.get("message", "")
+        if payload.get("phase"):
+            out["p"] = payload["phase"]
+        return out
+    elif kind == "c":
+        template = payload.get("template") if isinstance(payload.get("template"), dict) else {}
+        nodes = [n for n in template.get("nodes") or [] if isinstance(n, dict)]
+        root = template.get("rootLocalId")
+        # The root goes first so "r" can be left out.
+        nodes.sort(key=lambda n: n.get("localId") != root)
+        out.update(id=template.get("templateId"), n=template.get("name"))
+        out["ns"] = [_compress_node(n, template=True) for n in nodes]
+    elif kind == "n":
+        out["nd"] = _compress_node(payload.get("node") or {}, template=False)
+    elif kind == "u":
+        out["id"] = payload.get("nodeId")
+        patch = payload.get("patch") if isinstance(payload.get("patch"), dict) else {}
+        if patch.get("name"):
+            out["n"] = patch["name"]
+        if isinstance(patch.get("transform"), dict):
+            out["x"] = {next((s for s, k in _TRANSFORM_SHORT.items() if k == key), key): v for key, v in patch["transform"].items()}
+        if isinstance(patch.get("props"), dict):
+            shorts = {name: s for keys in PROP_KEYS.values() for s, name, _ in keys if s != "id"}
+            out["p"] = {shorts.get(k, k): v for k, v in patch["props"].items()}
+        return out
+    elif kind == "d":
+        if isinstance(payload.get("nodeIds"), list):
+            out["ids"] = payload["nodeIds"]
+        else:
+            out["id"] = payload.get("nodeId")
+        return out
+    elif kind == "f":
+        out["f"] = payload.get("filter")
+        if payload.get("target") == "nodeId":
+            out["id"] = payload.get("nodeId")
+        if payload.get("mode") not in (None, "append"):
+            out["mode"] = payload["mode"]
+        return out
+    if payload.get("parentId"):
+        out["p"] = payload["parentId"]
+    if payload.get("layerId"):
+        out["l"] = payload["layerId"]
+    return out
@@ -0,0 +1,5 @@
+# Copy to deepseek_secrets.py (git-ignored) for a quick local setup; the
+# DEEPSEEK_* environment variables take precedence. Never commit real keys.
+DEEPSEEK_BASE_URL = ""
+DEEPSEEK_API_KEY = ""
+DEEPSEEK_MODEL = ""
@@ -0,0 +1 @@
+"""Offline frame-sequence export (timeline bake -> CPU raster -> numbered files)."""
@@ -0,0 +1,112 @@
+"""Per-frame keys and the process-pool worker that renders frames.
+
+Everything in here runs in worker processes too, so it must not need Django.
+
+A frame key hashes the render-relevant base snapshot, output settings, the
+static channel table and that frame's row of animated tracks. Editing one
+keyframe only changes the tracks of the surrounding segments, so only those
+frames get new keys; identical held frames share a key and render once.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from ..caching import LruCache
+from ..stage.raster import encode_png, render_cache_key, render_snapshot
+from ..stage.snapshot import get_layers
+from ..timeline.apply import FrameApplier
+from ..timeline.bake import BakedTimeline, load_baked
+
+FORMATS = ("png", "rgba")
+
+# Per worker process: parsed job inputs, keyed by (snapshot path, bake path).
+_INPUTS: LruCache[Tuple[Any, BakedTimeline]] = LruCache(maxsize=2)
+
+
+def frame_filename(frame: int, fmt: str) -> str:
+    return f"frame_{int(frame):06d}.{fmt}"
+
+
+def cache_path(cache_dir: Path, key: str, fmt: str) -> Path:
+    return cache_dir / key[:2] / f"{key}.{fmt}"
+
+
+def frame_keys(snapshot: Any, baked: BakedTimeline, frames: Sequence[int], *, width: int, height: int, fmt: str) -> List[str]:
+    prefix = hashlib.sha256()
+    prefix.update(json.dumps([render_cache_key(snapshot, None), int(width), int(height), fmt]).encode("utf-8"))
+    prefix.update(np.ascontiguousarray(baked.static).tobytes())
+    prefix.update(np.ascontiguousarray(baked.track_index).tobytes())
+    out: List[str] = []
+    last = baked.frame_count - 1
+    for f in frames:
+        h = prefix.copy()
+        if baked.track_index.size:
+            h.update(np.ascontiguousarray(baked.tracks[min(max(0, int(f)), last)]).tobytes())
+        out.append(h.hexdigest())
+    return out
+
+
+def place_frame(src: Path, dst: Path) -> None:
+    """Expose a cached frame under its output name (hard link, copy across devices)."""
+
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def _load_inputs(snapshot_path: str, bake_path: str) -> Tuple[Any, BakedTimeline]:
+    key = f"{snapshot_path}|{bake_path}"
+    hit = _INPUTS.get(key)
+    if hit is not None:
+        return hit
+    with open(snapshot_path, "r", encoding="utf-8") as fp:
+        snapshot = json.load(fp)
+    loaded = (snapshot, load_baked(bake_path))
+    _INPUTS.put(key, loaded)
+    return loaded
+
+
+def render_chunk(task: Dict[str, Any]) -> List[Tuple[int, str]]:
+    """Render `task["frames"]` ([(frame, key), ...]) into the frame cache.
+
+    Returns the (frame, key) pairs it wrote; frames whose cache file already
+    exists (written by a concurrent job) are skipped.
+    """
+
+    snapshot, baked = _load_inputs(task["snapshotPath"], task["bakePath"])
+    fmt = task["format"]
+    width, height = int(task["width"]), int(task["height"])
+    cache_dir = Path(task["cacheDir"])
+    applier = FrameApplier(get_layers(snapshot), baked)
+    done: List[Tuple[int, str]] = []
+    for frame, key in task["frames"]:
+        path = cache_path(cache_dir, key, fmt)
+        if not path.exists():
+            rgba = render_snapshot(snapshot, width=width, height=height, layers=applier.apply(frame))
+            _write_atomic(path, encode_png(rgba) if fmt == "png" else rgba.tobytes())
+        done.append((frame, key))
+    return done
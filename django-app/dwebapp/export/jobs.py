@@ -0,0 +1,304 @@
+"""Frame-sequence export jobs.
+
+A job bakes the timeline once, computes a key per frame, links every frame
+that is already in the frame cache into its output directory and fans the
+remaining unique keys out to a shared process pool in contiguous chunks.
+Progress is recorded as an append-only event list that SSE clients replay
+from any offset.
+
+Layout under DWEB_DATA_DIR:
+    exports/<jobId>/input.json          the submitted snapshot/package
+    exports/<jobId>/frame_000123.png    output sequence (+ sequence.json)
+    export-cache/<k[:2]>/<key>.<fmt>    content-addressed rendered frames
+    timeline-bake/<key>.dvsbake         baked timelines (timeline/bake.py)
+
+Disk use is bounded by sweep(), run before each job starts (at most every
+DWEB_EXPORT_SWEEP_S): job directories are removed DWEB_EXPORT_RETENTION_S
+after they were last written, then oldest first while all of exports/ is
+above DWEB_EXPORT_MAX_BYTES; cache entries are evicted least recently used
+first (a cache hit touches the file) past the same retention and while
+export-cache/ is above DWEB_EXPORT_CACHE_MAX_BYTES; baked timelines the
+same way against DWEB_TIMELINE_BAKE_MAX_BYTES (POST /api/timeline/bake runs
+maybe_sweep() too). A sweep is skipped while another export runs in this
+process, so it never removes frames or a bake a job is about to use. Job
+status reports paths relative to DWEB_DATA_DIR.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..caching import LruCache
+from .frames import cache_path, frame_filename, frame_keys, place_frame, render_chunk
+
+_CHUNK_FRAMES = int(os.environ.get("DWEB_EXPORT_CHUNK_FRAMES", "16"))
+_RETENTION_S = float(os.environ.get("DWEB_EXPORT_RETENTION_S", "86400"))
+_MAX_BYTES = int(os.environ.get("DWEB_EXPORT_MAX_BYTES", str(4 << 30)))
+_CACHE_MAX_BYTES = int(os.environ.get("DWEB_EXPORT_CACHE_MAX_BYTES", str(2 << 30)))
+_BAKE_MAX_BYTES = int(os.environ.get("DWEB_TIMELINE_BAKE_MAX_BYTES", str(2 << 30)))
+_SWEEP_S = float(os.environ.get("DWEB_EXPORT_SWEEP_S", "300"))
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+_JOBS: LruCache["ExportJob"] = LruCache(maxsize=int(os.environ.get("DWEB_EXPORT_JOB_HISTORY", "64")))
+_RUNNING = 0
+_SWEEP_LOCK = threading.Lock()
+_LAST_SWEEP = 0.0
+
+
+def _data_dir() -> Path:
+    from django.conf import settings
+
+    return Path(getattr(settings, "DWEB_DATA_DIR"))
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            workers = int(os.environ.get("DWEB_EXPORT_WORKERS") or 0) or max(1, (os.cpu_count() or 2) - 1)
+            _POOL = ProcessPoolExecutor(max_workers=workers)
+        return _POOL
+
+
+class ExportJob:
+    def __init__(self, *, start: int, end: int, width: int, height: int, fmt: str) -> None:
+        self.id = uuid.uuid4().hex
+        self.start = start
+        self.end = end
+        self.width = width
+        self.height = height
+        self.format = fmt
+        self.status = "queued"
+        self.total = end - start + 1
+        self.done = 0
+        self.cached = 0
+        self.rendered = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.out_dir = _data_dir() / "exports" / self.id
+        self._events: List[Tuple[str, Dict[str, Any]]] = []
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "error")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "range": [self.start, self.end],
+            "width": self.width,
+            "height": self.height,
+            "format": self.format,
+            "total": self.total,
+            "done": self.done,
+            "cached": self.cached,
+            "rendered": self.rendered,
+            # Relative to DWEB_DATA_DIR; None once the directory was swept.
+            "outputDir": f"exports/{self.id}" if not self.finished or self.out_dir.exists() else None,
+            "error": self.error,
+            "elapsedMs": int(((self.finished_at or time.time()) - self.created_at) * 1000),
+            "expiresAt": (
+                time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.finished_at + _RETENTION_S))
+                if self.finished_at
+                else None
+            ),
+        }
+
+    def _emit(self, event: str, **extra: Any) -> None:
+        with self._cond:
+            data = self.to_dict()
+            data.update(extra)
+            self._events.append((event, data))
+            self._cond.notify_all()
+
+    def events_since(self, offset: int, timeout: float) -> List[Tuple[str, Dict[str, Any]]]:
+        """Events after `offset`; blocks up to `timeout` seconds when there are none yet."""
+
+        with self._cond:
+            if offset >= len(self._events) and not self.finished:
+                self._cond.wait(timeout)
+            return list(self._events[offset:])
+
+    def _run(self, snapshot: Any) -> None:
+        global _RUNNING
+        maybe_sweep()
+        with _SWEEP_LOCK:
+            _RUNNING += 1
+        try:
+            self._export(snapshot)
+        except Exception as e:
+            self.status = "error"
+            self.error = f"{type(e).__name__}: {e}"
+            self.finished_at = time.time()
+            self._emit("error")
+        finally:
+            with _SWEEP_LOCK:
+                _RUNNING -= 1
+
+    def _export(self, snapshot: Any) -> None:
+        from ..timeline.bake import get_baked_timeline
+
+        self.status = "running"
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        snapshot_path = self.out_dir / "input.json"
+        with open(snapshot_path, "w", encoding="utf-8") as fp:
+            json.dump(snapshot, fp, ensure_ascii=False)
+
+        baked, bake_path, _ = get_baked_timeline(snapshot)
+        frames = list(range(self.start, self.end + 1))
+        keys = frame_keys(snapshot, baked, frames, width=self.width, height=self.height, fmt=self.format)
+        cache_dir = _data_dir() / "export-cache"
+
+        # Frames sharing a key (held poses) are rendered once and linked for all.
+        frames_by_key: Dict[str, List[int]] = {}
+        for f, k in zip(frames, keys):
+            frames_by_key.setdefault(k, []).append(f)
+        missing: List[Tuple[int, str]] = []
+        for k, fs in frames_by_key.items():
+            src = cache_path(cache_dir, k, self.format)
+            if src.exists():
+                os.utime(src)  # LRU order for sweep()
+                for f in fs:
+                    place_frame(src, self.out_dir / frame_filename(f, self.format))
+                self.cached += len(fs)
+                self.done += len(fs)
+            else:
+                missing.append((fs[0], k))
+        missing.sort()
+        self._emit("started", uniqueFrames=len(frames_by_key), toRender=len(missing))
+
+        base_task = {
+            "snapshotPath": str(snapshot_path),
+            "bakePath": str(bake_path),
+            "width": self.width,
+            "height": self.height,
+            "format": self.format,
+            "cacheDir": str(cache_dir),
+        }
+        pending: List[Future] = [
+            _pool().submit(render_chunk, dict(base_task, frames=missing[i : i + _CHUNK_FRAMES]))
+            for i in range(0, len(missing), _CHUNK_FRAMES)
+        ]
+        while pending:
+            finished, rest = wait(pending, return_when=FIRST_COMPLETED)
+            pending = list(rest)
+            for fut in finished:
+                for _, k in fut.result():
+                    src = cache_path(cache_dir, k, self.format)
+                    fs = frames_by_key[k]
+                    for f in fs:
+                        place_frame(src, self.out_dir / frame_filename(f, self.format))
+                    self.rendered += 1
+                    self.done += len(fs)
+                self._emit("progress")
+
+        with open(self.out_dir / "sequence.json", "w", encoding="utf-8") as fp:
+            json.dump(
+                {
+                    "format": self.format,
+                    "width": self.width,
+                    "height": self.height,
+                    "frames": [frame_filename(f, self.format) for f in frames],
+                    "pixelFormat": "rgba8" if self.format == "rgba" else None,
+                    "timelineKey": baked.cache_key,
+                },
+                fp,
+            )
+        self.status = "done"
+        self.finished_at = time.time()
+        self._emit("done")
+
+
+def start_export(snapshot: Any, *, start: int, end: int, width: int, height: int, fmt: str) -> ExportJob:
+    job = ExportJob(start=start, end=end, width=width, height=height, fmt=fmt)
+    _JOBS.put(job.id, job)
+    threading.Thread(target=job._run, args=(snapshot,), name=f"export-{job.id[:8]}", daemon=True).start()
+    return job
+
+
+def get_job(job_id: str) -> Optional[ExportJob]:
+    return _JOBS.get(job_id)
+
+
+def _tree_size(path: Path) -> Tuple[int, float]:
+    """(bytes, newest mtime) of a job directory."""
+
+    size, newest = 0, path.stat().st_mtime
+    for f in path.iterdir():
+        st = f.stat()
+        size += st.st_size
+        newest = max(newest, st.st_mtime)
+    return size, newest
+
+
+def sweep(now: Optional[float] = None) -> Dict[str, int]:
+    """Apply the retention window and size caps to exports/, export-cache/ and timeline-bake/."""
+
+    now = time.time() if now is None else now
+    removed_jobs = 0
+
+    jobs: List[Tuple[float, int, Path]] = []
+    exports = _data_dir() / "exports"
+    for d in exports.iterdir() if exports.is_dir() else ():
+        try:
+            size, newest = _tree_size(d)
+        except OSError:
+            continue
+        jobs.append((newest, size, d))
+    jobs.sort()
+    total = sum(size for _, size, _ in jobs)
+    for newest, size, d in jobs:
+        if newest >= now - _RETENTION_S and total <= _MAX_BYTES:
+            break
+        shutil.rmtree(d, ignore_errors=True)
+        total -= size
+        removed_jobs += 1
+
+    removed_frames = _evict(_data_dir() / "export-cache", "*/*", max_bytes=_CACHE_MAX_BYTES, now=now)
+    removed_bakes = _evict(_data_dir() / "timeline-bake", "*.dvsbake", max_bytes=_BAKE_MAX_BYTES, now=now)
+    return {"jobs": removed_jobs, "frames": removed_frames, "bakes": removed_bakes}
+
+
+def _evict(root: Path, pattern: str, *, max_bytes: int, now: float) -> int:
+    """Remove files under `root` least recently used first (by mtime) past the retention window or size cap."""
+
+    files: List[Tuple[float, int, Path]] = []
+    for f in root.glob(pattern) if root.is_dir() else ():
+        try:
+            st = f.stat()
+        except OSError:
+            continue
+        files.append((st.st_mtime, st.st_size, f))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for mtime, size, f in files:
+        if mtime >= now - _RETENTION_S and total <= max_bytes:
+            break
+        f.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+    return removed
+
+
+def maybe_sweep() -> Optional[Dict[str, int]]:
+    """sweep() at most every DWEB_EXPORT_SWEEP_S, and only while no export runs in this process."""
+
+    global _LAST_SWEEP
+    with _SWEEP_LOCK:
+        if _RUNNING or time.monotonic() - _LAST_SWEEP < _SWEEP_S:
+            return None
+        _LAST_SWEEP = time.monotonic()
+        return sweep()
@@ -0,0 +1,103 @@
+"""Frame-sequence export APIs.
+
+Endpoints (no trailing slashes; APPEND_SLASH=False):
+- POST /api/export/frames                 (start a job; returns jobId)
+- GET  /api/export/jobs/{jobId}           (job status)
+- GET  /api/export/jobs/{jobId}/events    (SSE progress; ?offset=N to resume)
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Generator
+
+from django.http import HttpRequest, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+from django.views.decorators.csrf import csrf_exempt
+
+from .sse import apply_sse_headers, sse_event
+from .stage_api import _error, _int_param, _read_json_body
+
+_KEEPALIVE_SECONDS = 15.0
+
+
+@csrf_exempt
+def create_export(request: HttpRequest) -> HttpResponseBase:
+    """Start exporting a frame range to a numbered PNG / raw RGBA sequence.
+
+    Body: {project | snapshot, start?, end? (inclusive), width?, height?, format?: "png" | "rgba"}
+    """
+
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    body = _read_json_body(request)
+    snapshot = body.get("project") if isinstance(body.get("project"), dict) else body.get("snapshot")
+    if not isinstance(snapshot, dict):
+        return _error("bad_request", "project is required")
+
+    from .export.frames import FORMATS
+    from .export.jobs import start_export
+    from .stage.raster import MAX_RENDER_SIZE
+    from .timeline.bake import timeline_frame_count
+
+    fmt = str(body.get("format") or "png")
+    if fmt not in FORMATS:
+        return _error("bad_request", f"unsupported format: {fmt}")
+    width = _int_param(body.get("width"), 1280)
+    height = _int_param(body.get("height"), 720)
+    if not (0 < width <= MAX_RENDER_SIZE and 0 < height <= MAX_RENDER_SIZE):
+        return _error("bad_request", f"width/height must be within 1..{MAX_RENDER_SIZE}")
+    frame_count = timeline_frame_count(snapshot)
+    start = _int_param(body.get("start"), 0)
+    end = _int_param(body.get("end"), frame_count - 1)
+    if not (0 <= start <= end < frame_count):
+        return _error("bad_request", f"frame range must be within 0..{frame_count - 1}")
+
+    job = start_export(snapshot, start=start, end=end, width=width, height=height, fmt=fmt)
+    out = job.to_dict()
+    out["eventsUrl"] = f"/api/export/jobs/{job.id}/events"
+    return JsonResponse(out, status=202)
+
+
+def export_status(request: HttpRequest, job_id: str) -> HttpResponseBase:
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+
+    from .export.jobs import get_job
+
+    job = get_job(job_id)
+    if job is None:
+        return _error("not_found", "export job not found", status=404)
+    return JsonResponse(job.to_dict())
+
+
+def export_events(request: HttpRequest, job_id: str) -> HttpResponseBase:
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+
+    from .export.jobs import get_job
+
+    job = get_job(job_id)
+    if job is None:
+        return _error("not_found", "export job not found", status=404)
+    offset = max(0, _int_param(request.GET.get("offset"), 0))
+
+    def gen() -> Generator[bytes, None, None]:
+        nonlocal offset
+        last_sent = time.monotonic()
+        while True:
+            events = job.events_since(offset, timeout=1.0)
+            for event, data in events:
+                offset += 1
+                yield sse_event(event, dict(data, offset=offset)).encode("utf-8")
+                last_sent = time.monotonic()
+            if job.finished and not events:
+                return
+            if time.monotonic() - last_sent > _KEEPALIVE_SECONDS:
+                yield b": keepalive\n\n"
+                last_sent = time.monotonic()
+
+    resp = StreamingHttpResponse(gen(), content_type="text/event-stream")
+    apply_sse_headers(resp)
+    return resp
@@ -0,0 +1,293 @@
+"""Deterministic fast path for simple edits of the current selection.
+
+"加发光滤镜", "把选中节点变成红色", "删除选中", "字体改成 24" need no model:
+the request names one edit and contextPack.selectedNodeIds names its targets.
+Before a turn goes upstream, match() normalizes the request (NFKC, lower
+case, polite fillers / selection words / punctuation dropped) and tries each
+rule in RULES; a rule fires only when the whole normalized request is its
+pattern, so "删除选中并新建一个按钮" falls through to the model. A rule also
+declines (and the turn falls through) when it is not sure of the result:
+
+- glow       applyFilter(target=selection, mode=append); lines get the line
+             defaults (intensity 4, blur 5), everything else intensity 1, blur 18
+- recolor    patchNode per node: rect fillColor (borderColor when 边框/描边 is
+             named), text fontColor, line lineColor; images and groups decline
+- delete     one deleteNode with all selected ids
+- fontSize   patchNode props.fontSize; every selected node must be text
+
+Node types come from contextPack.selectedNodes, else from the active layer's
+nodeTree. A hit is served as a normal envelope stream (started status,
+chatMessage, the edits, done status with meta.fastPath). Per rule the
+metrics registry gets chat.fast_path_checks{rule, hit, reason} (hit rate)
+and chat.fast_path_ms{rule} (request received to done). A request opts out
+with `"fastPath": false`; DWEB_FAST_PATH=0 disables it.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import time
+import unicodedata
+from typing import Any, Callable, Dict, Generator, List, NamedTuple, Optional, Tuple
+
+from . import metrics
+
+ENABLED = os.environ.get("DWEB_FAST_PATH", "1") != "0"
+
+RULES = ("glow", "recolor", "delete", "fontSize")
+
+_COLORS = {
+    "红": "#ff4d4f",
+    "橙": "#fa8c16",
+    "黄": "#fadb14",
+    "绿": "#52c41a",
+    "青": "#13c2c2",
+    "蓝": "#1677ff",
+    "紫": "#722ed1",
+    "粉": "#eb2f96",
+    "金": "#faad14",
+    "白": "#ffffff",
+    "黑": "#000000",
+    "灰": "#8c8c8c",
+    "red": "#ff4d4f",
+    "orange": "#fa8c16",
+    "yellow": "#fadb14",
+    "green": "#52c41a",
+    "cyan": "#13c2c2",
+    "blue": "#1677ff",
+    "purple": "#722ed1",
+    "pink": "#eb2f96",
+    "gold": "#faad14",
+    "white": "#ffffff",
+    "black": "#000000",
+    "gray": "#8c8c8c",
+    "grey": "#8c8c8c",
+}
+_COLOR = r"(#[0-9a-f]{6}|#[0-9a-f]{3}|" + "|".join(sorted(_COLORS, key=len, reverse=True)) + r")色?"
+
+_FILLER_RE = re.compile(
+    r"请|帮我|帮忙|麻烦|给我|一下|吧|呢|啊|哦|谢谢|please|"
+    r"选中的?|所选的?|选择的?|当前的?|这些|这个|那些|那个|这|该|"
+    r"节点|元素|对象|图形|组件|全部|所有|都|"
+    r"[\s，。！？、,.!?~…：:；;]+"
+)
+# Leading "把 / 将 / 给 / 对 / 为 / 让"; dropped after the fillers so "把选中节点变红" -> "变红".
+_LEAD_RE = re.compile(r"^(把|将|给|对|为|让)")
+# Kind words a request may name its targets by; kept apart so recolor can read 文字 / 边框.
+_KIND_RE = re.compile(r"^(线条|线段|直线|连线|线|矩形|方块|文字|文本|标题|图片)(的)?")
+
+_GLOW_RE = re.compile(r"^(添加|增加|加上|加个|加|来个|开启|打开|做)?(个|一个)?(" + _COLOR + r")?的?(发光|辉光|光晕|glow)(滤镜|效果|特效)?$")
+_RECOLOR_RE = re.compile(
+    r"^((?:填充|背景|边框|描边|文字|字体|线条)?(?:颜色|色)|填充|背景|边框|描边)?"
+    r"(改成|改为|变成|换成|设为|设置为|设成|调成|改|变|染成|涂成)" + _COLOR + r"$"
+)
+_DELETE_RE = re.compile(r"^(删除|删掉|删了|删|移除|去掉|清除|delete|remove)(掉|了)?$")
+_FONT_SIZE_RE = re.compile(
+    r"^(字体大小|文字大小|字体|字号|字体字号|文字字号|字)?(大小)?"
+    r"(改成|改为|变成|换成|设为|设置为|设成|调成|调到|调整为|调整到|改到|改|=)?"
+    r"(\d{1,3}(?:\.\d+)?)(号|px|像素|pt)?$"
+)
+_MIN_FONT_SIZE = 1.0
+_MAX_FONT_SIZE = 500.0
+
+
+class Plan(NamedTuple):
+    rule: str
+    intent: str
+    chat: str
+    envelopes: List[Dict[str, Any]]  # short-form {type, payload}
+
+
+class _Selection(NamedTuple):
+    ids: List[str]
+    types: Dict[str, Optional[str]]  # id -> userType (None: unknown)
+
+
+def normalize(content: str) -> Tuple[str, str]:
+    """(kind word the request names its targets by, normalized request)."""
+
+    text = unicodedata.normalize("NFKC", content or "").lower()
+    text = _FILLER_RE.sub("", text)
+    text = _LEAD_RE.sub("", text)
+    m = _KIND_RE.match(text)
+    if m is None:
+        return "", text
+    return m.group(1), text[m.end() :]
+
+
+def _color(token: str) -> str:
+    token = token[:-1] if token.endswith("色") else token
+    if token.startswith("#"):
+        if len(token) == 4:
+            token = "#" + "".join(c * 2 for c in token[1:])
+        return token
+    return _COLORS[token]
+
+
+def _selection(context_pack: Any) -> _Selection:
+    pack = context_pack if isinstance(context_pack, dict) else {}
+    raw = pack.get("selectedNodeIds")
+    ids = [i for i in raw if isinstance(i, str) and i] if isinstance(raw, list) else []
+    types: Dict[str, Optional[str]] = {i: None for i in ids}
+    for node in pack.get("selectedNodes") or []:
+        if isinstance(node, dict) and node.get("id") in types:
+            types[node["id"]] = node.get("userType")
+    missing = [i for i in ids if types[i] is None]
+    layer = pack.get("activeLayer")
+    if missing and isinstance(layer, dict) and isinstance(layer.get("nodeTree"), list):
+        from .stage.spatial import get_spatial_index
+
+        index, _ = get_spatial_index(layer["nodeTree"])
+        for i in missing:
+            pos = index.index_of.get(i)
+            if pos is not None:
+                types[i] = index.nodes[pos].get("userType")
+    return _Selection(ids=ids, types=types)
+
+
+def _count(sel: _Selection) -> str:
+    return "选中的节点" if len(sel.ids) == 1 else f"选中的 {len(sel.ids)} 个节点"
+
+
+def _glow(kind: str, text: str, sel: _Selection) -> Tuple[Optional[Plan], str]:
+    m = _GLOW_RE.match(text)
+    if m is None:
+        return None, "not_exact"
+    color = _color(m.group(4)) if m.group(4) else "#00ffff"
+    kinds = {sel.types[i] for i in sel.ids}
+    lines = kinds == {"line"} or (kind in ("线条", "线段", "直线", "连线", "线") and kinds <= {"line", None})
+    glow = {
+        "type": "glow",
+        "color": color,
+        "intensity": 4 if lines else 1,
+        "blurX": 5 if lines else 18,
+        "blurY": 5 if lines else 18,
+        "inner": False,
+        "knockout": False,
+    }
+    if "line" in kinds and not lines:
+        # Mixed selection: per-node filters so lines still get the line defaults.
+        envelopes = []
+        for i in sel.ids:
+            f = dict(glow, intensity=4, blurX=5, blurY=5) if sel.types[i] == "line" else glow
+            envelopes.append({"type": "agentToUi/applyFilter", "payload": {"target": "nodeId", "nodeId": i, "mode": "append", "filter": f}})
+    else:
+        envelopes = [{"type": "agentToUi/applyFilter", "payload": {"target": "selection", "mode": "append", "filter": glow}}]
+    return Plan("glow", "filter", f"我将给{_count(sel)}添加发光滤镜（{color}）。", envelopes), ""
+
+
+def _recolor(kind: str, text: str, sel: _Selection) -> Tuple[Optional[Plan], str]:
+    m = _RECOLOR_RE.match(text)
+    if m is None:
+        return None, "not_exact"
+    color = _color(m.group(3))
+    part = m.group(1) or ""
+    border = "边框" in part or "描边" in part
+    text_part = kind in ("文字", "文本", "标题") or "字" in part
+    line_part = "线条" in part
+    envelopes: List[Dict[str, Any]] = []
+    for i in sel.ids:
+        t = sel.types[i]
+        if t == "rect" and not (text_part or line_part):
+            prop = "borderColor" if border else "fillColor"
+        elif t == "text" and not (border or line_part):
+            prop = "fontColor"
+        elif t == "line" and not (border or text_part):
+            prop = "lineColor"
+        else:
+            return None, "unsupported_type"
+        envelopes.append({"type": "agentToUi/patchNode", "payload": {"nodeId": i, "patch": {"props": {prop: color}}}})
+    return Plan("recolor", "modify", f"我将把{_count(sel)}改为 {color}。", envelopes), ""
+
+
+def _delete(kind: str, text: str, sel: _Selection) -> Tuple[Optional[Plan], str]:
+    if _DELETE_RE.match(text) is None:
+        return None, "not_exact"
+    envelopes = [{"type": "agentToUi/deleteNode", "payload": {"nodeIds": list(sel.ids)}}]
+    return Plan("delete", "delete", f"我将删除{_count(sel)}。", envelopes), ""
+
+
+def _font_size(kind: str, text: str, sel: _Selection) -> Tuple[Optional[Plan], str]:
+    m = _FONT_SIZE_RE.match(text)
+    # A bare number is only a font size when the request says so ("字体" / "字号" / a text kind word).
+    if m is None or not (m.group(1) or m.group(2) or kind in ("文字", "文本", "标题")):
+        return None, "not_exact"
+    size = float(m.group(4))
+    if not _MIN_FONT_SIZE <= size <= _MAX_FONT_SIZE:
+        return None, "out_of_range"
+    if any(sel.types[i] != "text" for i in sel.ids):
+        return None, "unsupported_type"
+    value: Any = int(size) if size == int(size) else size
+    envelopes = [{"type": "agentToUi/patchNode", "payload": {"nodeId": i, "patch": {"props": {"fontSize": value}}}} for i in sel.ids]
+    return Plan("fontSize", "modify", f"我将把{_count(sel)}的字号改为 {value}。", envelopes), ""
+
+
+_MATCHERS: Dict[str, Callable[[str, str, _Selection], Tuple[Optional[Plan], str]]] = {
+    "glow": _glow,
+    "recolor": _recolor,
+    "delete": _delete,
+    "fontSize": _font_size,
+}
+
+
+def match(content: str, context_pack: Any) -> Tuple[Optional[Plan], Dict[str, Any]]:
+    """(plan, report) for one request; plan is None when the turn should go to the model.
+
+    report: {rule, hit, reason, normalized, matchUs}; rule is the rule that
+    claimed the request (None when none did).
+    """
+
+    t0 = time.perf_counter()
+    kind, text = normalize(content)
+    sel = _selection(context_pack)
+    plan: Optional[Plan] = None
+    rule: Optional[str] = None
+    reason = "no_rule"
+    for name in RULES:
+        plan, why = _MATCHERS[name](kind, text, sel)
+        if plan is not None or why != "not_exact":
+            rule, reason = name, why
+            break
+    if plan is not None and not sel.ids:
+        plan, reason = None, "no_selection"
+    report: Dict[str, Any] = {
+        "rule": rule,
+        "hit": plan is not None,
+        "reason": reason or None,
+        "normalized": text,
+        "matchUs": round((time.perf_counter() - t0) * 1e6, 1),
+    }
+    if rule is not None:
+        metrics.incr("chat.fast_path_checks", rule=rule, hit=plan is not None, reason=reason or "hit")
+    return plan, report
+
+
+def iter_events(
+    plan: Plan,
+    report: Dict[str, Any],
+    *,
+    prompt_report: Dict[str, Any],
+    started_at: float,
+) -> Generator[Tuple[str, Any], None, None]:
+    """Serve a plan with the same event shape as ai_chat_api._iter_stream_events."""
+
+    from .ai_chat_api import _agent_to_ui_task_status, _wrap_short_agent_to_ui
+
+    yield ("msg", _agent_to_ui_task_status("started", message="已开始", meta={"prompt": prompt_report, "fastPath": report}))
+    ttft_ms = int((time.monotonic() - started_at) * 1000)
+    envelopes = [{"type": "agentToUi/chatMessage", "payload": {"content": plan.chat}}] + plan.envelopes
+    for env in envelopes:
+        out = _wrap_short_agent_to_ui(env)
+        out["source"] = {"agentName": "backend"}  # no model was involved
+        out["meta"] = {"fastPath": {"rule": plan.rule}}
+        yield ("msg", out)
+    total = (time.monotonic() - started_at) * 1000
+    metrics.observe("chat.fast_path_ms", total, rule=plan.rule)
+    meta = {
+        "timing": {"ttftMs": ttft_ms, "totalMs": int(total)},
+        "intent": plan.intent,
+        "fastPath": dict(report, ms=round(total, 3)),
+    }
+    yield ("msg", _agent_to_ui_task_status("done", message="完成", meta=meta))
+    yield ("done", "{}")
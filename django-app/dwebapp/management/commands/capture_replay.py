@@ -0,0 +1,149 @@
+"""List and replay sampled upstream captures (capture.py).
+
+    python manage.py capture_replay --list
+    python manage.py capture_replay                      # latest capture
+    python manage.py capture_replay --id cap_0123abcd... --fast
+    python manage.py capture_replay --dir /tmp/captures --json
+
+A replay runs the record twice: every call's raw lines through the SSE
+parser (_iter_sse_deltas), timed in-process, then the whole turn through
+the envelope pipeline (_iter_stream_events) against the mock upstream,
+which serves the recorded lines at their original arrival times (--fast
+sends them back to back). The report compares envelope count and turn time
+with the captured turn. Request messages are not stored (only their hash),
+so stage-tool rounds are not re-answered: the replay serves the recorded
+calls in order.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+from typing import Any, Dict, List
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "List sampled upstream captures or replay one through the parser and the mock upstream."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument("--dir", default=None, help="capture directory (default: DWEB_CAPTURE_DIR)")
+        parser.add_argument("--list", action="store_true", help="list captures instead of replaying")
+        parser.add_argument("--id", default=None, help="capture id (default: the latest)")
+        parser.add_argument("--fast", action="store_true", help="ignore recorded timing")
+        parser.add_argument("--json", action="store_true", help="print machine-readable JSON")
+
+    def handle(self, *args: Any, **opts: Any) -> None:
+        from dwebapp import capture
+
+        if opts["list"]:
+            rows = [
+                {
+                    "id": r["id"],
+                    "capturedAt": r.get("capturedAt"),
+                    "responseMode": r.get("responseMode"),
+                    "outcome": r.get("outcome"),
+                    "calls": len(r.get("calls") or []),
+                    "lines": sum(len(c.get("lines") or []) for c in r.get("calls") or []),
+                    "envelopes": len(r.get("envelopeIds") or []),
+                    "totalMs": r.get("totalMs"),
+                }
+                for r in capture.iter_records(capture.list_files(opts["dir"]))
+            ]
+            if opts["json"]:
+                self.stdout.write(json.dumps(rows, ensure_ascii=False, indent=2))
+                return
+            self.stdout.write(f"{'id':<22} {'captured at':<28} {'outcome':<12} {'calls':>5} {'lines':>6} {'envs':>5} {'ms':>7}")
+            for r in rows:
+                self.stdout.write(
+                    f"{r['id']:<22} {r['capturedAt'] or '-':<28} {r['outcome'] or '-':<12} "
+                    f"{r['calls']:>5} {r['lines']:>6} {r['envelopes']:>5} {r['totalMs'] or 0:>7}"
+                )
+            return
+
+        if opts["id"]:
+            record = capture.find_record(opts["id"], opts["dir"])
+        else:
+            records = list(capture.iter_records(capture.list_files(opts["dir"])))
+            record = records[-1] if records else None
+        if record is None:
+            raise CommandError("capture not found" if opts["id"] else "no captures")
+
+        report = {
+            "id": record["id"],
+            "outcome": record.get("outcome"),
+            "parser": self._parse(record),
+            "replay": self._replay(record, timed=not opts["fast"]),
+        }
+        if opts["json"]:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+        self.stdout.write(f"capture {report['id']} ({report['outcome']})")
+        for i, p in enumerate(report["parser"]):
+            self.stdout.write(
+                f"  call {i}: {p['lines']} lines -> {p['deltas']} deltas ({p['chars']} chars), parse {p['parseUs']} us"
+            )
+        r = report["replay"]
+        self.stdout.write(
+            f"  replay: {r['envelopes']} envelopes (captured {r['capturedEnvelopes']}), "
+            f"{r['totalMs']} ms (captured {r['capturedMs']}), errors {r['errors'] or '-'}"
+        )
+
+    def _parse(self, record: Dict[str, Any]) -> List[Dict[str, Any]]:
+        from dwebapp.ai_chat_api import _iter_sse_deltas
+        from dwebapp.capture import replay_lines
+
+        out = []
+        for i in range(len(record.get("calls") or [])):
+            lines = replay_lines(record, i)
+            t0 = time.perf_counter()
+            deltas = list(_iter_sse_deltas(lines, tool_calls=[]))
+            out.append(
+                {
+                    "lines": len(lines),
+                    "deltas": len(deltas),
+                    "chars": sum(len(d) for d in deltas),
+                    "parseUs": round((time.perf_counter() - t0) * 1e6, 1),
+                }
+            )
+        return out
+
+    def _replay(self, record: Dict[str, Any], *, timed: bool) -> Dict[str, Any]:
+        from dwebapp.ai_chat_api import _iter_stream_events
+        from dwebapp.capture import mock_chunks
+        from dwebapp.mock_upstream import MockUpstream
+
+        calls = record.get("calls") or []
+        model = calls[0]["model"] if calls else "mock"
+        envelopes = 0
+        errors: List[str] = []
+        with MockUpstream(chunks=mock_chunks(record, timed=timed), base_ms=0, prefill_ms_per_1k=0) as up:
+            started_at = time.monotonic()
+            for event, data in _iter_stream_events(
+                cfg={"base_url": up.base_url, "api_key": "mock", "model": model},
+                provider="deepseek",
+                model=model,
+                response_mode=record.get("responseMode") or "agentToUi-jsonl",
+                msgs=[{"role": "user", "content": "capture replay"}],
+                prompt_report={},
+                started_at=started_at,
+                output_dialect=record.get("outputDialect") or "verbose",
+            ):
+                if event != "msg" or not isinstance(data, dict):
+                    continue
+                envelopes += 1
+                if data.get("type") == "agentToUi/error":
+                    errors.append(str((data.get("payload") or {}).get("code")))
+            total_ms = int((time.monotonic() - started_at) * 1000)
+            served = len(up.requests)
+        return {
+            "timed": timed,
+            "calls": served,
+            "capturedCalls": len(calls),
+            "envelopes": envelopes,
+            "capturedEnvelopes": len(record.get("envelopeIds") or []),
+            "totalMs": total_ms,
+            "capturedMs": record.get("totalMs"),
+            "errors": errors,
+        }
@@ -0,0 +1,34 @@
+"""Run the detached chat job dispatcher outside the web process.
+
+    DWEB_CHAT_JOB_DISPATCH=0 python manage.py runserver   # web only enqueues
+    python manage.py chat_job_worker --workers 4          # dedicated worker pool
+    python manage.py chat_job_worker --sweep              # purge expired logs once and exit
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Claim queued chat jobs from the SQLite queue and run them in a process pool."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument("--workers", type=int, default=0, help="pool size (default DWEB_CHAT_JOB_WORKERS)")
+        parser.add_argument("--sweep", action="store_true", help="close lost jobs, purge expired logs, then exit")
+
+    def handle(self, *args: Any, **opts: Any) -> None:
+        from dwebapp import chat_jobs
+
+        if opts["sweep"]:
+            self.stdout.write(json.dumps(chat_jobs.sweep()))
+            return
+        dispatcher = chat_jobs.Dispatcher(opts["workers"] or chat_jobs._WORKERS)
+        self.stdout.write(f"chat job worker {dispatcher.name}: {dispatcher.workers} processes")
+        try:
+            dispatcher.run_forever()
+        except KeyboardInterrupt:
+            pass
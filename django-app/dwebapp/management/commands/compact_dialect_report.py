@@ -0,0 +1,178 @@
+"""Compare verbose vs compact JSONL output: output tokens and generation time per template.
+
+    python manage.py compact_dialect_report
+    python manage.py compact_dialect_report --ms-per-token 25 --json
+
+Every template of the library is replayed by the mock upstream as a model
+reply (chatMessage + componentTemplate), once as verbose envelopes and once
+in the compact dialect (compact_dialect.compress), through real
+/messages:stream requests. The mock emits about one estimated token per
+`--ms-per-token`, so generation time follows output tokens the way a real
+decoder's does. Each compact run is also checked against the verbose run:
+the expanded template must keep every verbose transform and prop value.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import statistics
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.core.management.base import BaseCommand
+
+
+def _verbose_reply(example: str) -> str:
+    # Library examples carry "..." placeholders; a model writes real ids and timestamps.
+    lines = []
+    for line in example.splitlines():
+        env = json.loads(line)
+        env.update(id=str(uuid.uuid4()), createdAt="2026-01-01T00:00:00.000000Z")
+        lines.append(json.dumps(env, ensure_ascii=False, separators=(",", ":")))
+    return "\n".join(lines) + "\n"
+
+
+def _compact_reply(example: str) -> str:
+    from dwebapp.compact_dialect import compress
+
+    lines = []
+    for line in example.splitlines():
+        env = json.loads(line)
+        short = compress(env)
+        lines.append(json.dumps(short if short is not None else env, ensure_ascii=False, separators=(",", ":")))
+    return "\n".join(lines) + "\n"
+
+
+def _token_chunks(text: str, tokens_per_chunk: int) -> List[str]:
+    from dwebapp.prompts.tokens import estimate_tokens
+
+    out: List[str] = []
+    start = 0
+    for end in range(1, len(text) + 1):
+        if estimate_tokens(text[start:end]) >= tokens_per_chunk or end == len(text):
+            out.append(text[start:end])
+            start = end
+    return out
+
+
+def _preserved(verbose: Dict[str, Any], compact: Dict[str, Any]) -> bool:
+    """Every transform / prop value of the verbose template survives the compact round trip."""
+
+    defaults = {"rotation": 0, "opacity": 1}
+    by_id = {n.get("localId"): n for n in compact.get("nodes") or []}
+    for node in verbose.get("nodes") or []:
+        other = by_id.get(node.get("localId"))
+        if other is None or other.get("type") != node.get("type") or other.get("parentLocalId") != node.get("parentLocalId"):
+            return False
+        for k, v in (node.get("transform") or {}).items():
+            if (other.get("transform") or {}).get(k, defaults.get(k)) != v:
+                return False
+        for k, v in (node.get("props") or {}).items():
+            if (other.get("props") or {}).get(k) != v:
+                return False
+    return compact.get("rootLocalId") == verbose.get("rootLocalId")
+
+
+class Command(BaseCommand):
+    help = "Report output tokens and generation time per template for the verbose vs compact output dialect."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument("--ms-per-token", type=float, default=20.0, help="simulated decode time per output token")
+        parser.add_argument("--tokens-per-chunk", type=int, default=4, help="estimated tokens per streamed delta")
+        parser.add_argument("--json", action="store_true", help="print machine-readable JSON")
+
+    def handle(self, *args: Any, **opts: Any) -> None:
+        from dwebapp.mock_upstream import MockUpstream
+        from dwebapp.prompts.template_library import get_template_library
+        from dwebapp.prompts.tokens import estimate_tokens
+
+        tokens_per_chunk = max(1, opts["tokens_per_chunk"])
+        current: Dict[str, str] = {"reply": ""}
+
+        def chunks(_body: Dict[str, Any]) -> List[str]:
+            datas = [
+                json.dumps({"choices": [{"index": 0, "delta": {"content": c}}]}, ensure_ascii=False)
+                for c in _token_chunks(current["reply"], tokens_per_chunk)
+            ]
+            return datas + ["[DONE]"]
+
+        rows: List[Dict[str, Any]] = []
+        saved = {k: os.environ.get(k) for k in ("DEEPSEEK_BASE_URL", "DEEPSEEK_API_KEY", "DEEPSEEK_MODEL")}
+        with MockUpstream(chunks=chunks, chunk_delay_ms=opts["ms_per_token"] * tokens_per_chunk) as up:
+            os.environ.update({"DEEPSEEK_BASE_URL": up.base_url, "DEEPSEEK_API_KEY": "mock", "DEEPSEEK_MODEL": "mock"})
+            try:
+                for t in get_template_library().templates:
+                    row: Dict[str, Any] = {"templateId": t.template_id}
+                    templates: Dict[str, Optional[Dict[str, Any]]] = {}
+                    for dialect, reply in (("verbose", _verbose_reply(t.example)), ("compact", _compact_reply(t.example))):
+                        current["reply"] = reply
+                        meta, template = self._run(t.name, dialect)
+                        timing = meta.get("timing") or {}
+                        row[dialect] = {
+                            "outputTokens": estimate_tokens(reply),
+                            "outputChars": len(reply),
+                            "ttftMs": timing.get("ttftMs"),
+                            "totalMs": timing.get("totalMs"),
+                            "generationMs": (timing.get("totalMs") or 0) - (timing.get("ttftMs") or 0),
+                        }
+                        templates[dialect] = template
+                    verbose_t, compact_t = templates["verbose"], templates["compact"]
+                    row["preserved"] = bool(verbose_t and compact_t and _preserved(verbose_t, compact_t))
+                    rows.append(row)
+            finally:
+                for k, v in saved.items():
+                    if v is None:
+                        os.environ.pop(k, None)
+                    else:
+                        os.environ[k] = v
+
+        def ratio(key: str) -> Optional[float]:
+            values = [r["compact"][key] / r["verbose"][key] for r in rows if r["verbose"][key]]
+            return round(statistics.median(values), 3) if values else None
+
+        report = {
+            "msPerToken": opts["ms_per_token"],
+            "templates": rows,
+            "medianRatio": {"outputTokens": ratio("outputTokens"), "generationMs": ratio("generationMs")},
+            "allPreserved": all(r["preserved"] for r in rows),
+        }
+        if opts["json"]:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write(f"ms/token={report['msPerToken']} (before=verbose, after=compact)")
+        self.stdout.write(f"{'template':<22} {'tokens before':>14} {'after':>7} {'gen ms before':>14} {'after':>7} {'ok':>4}")
+        for r in rows:
+            v, c = r["verbose"], r["compact"]
+            self.stdout.write(
+                f"{r['templateId']:<22} {v['outputTokens']:>14} {c['outputTokens']:>7} "
+                f"{v['generationMs']:>14} {c['generationMs']:>7} {'yes' if r['preserved'] else 'NO':>4}"
+            )
+        m = report["medianRatio"]
+        self.stdout.write(f"median compact/verbose: tokens {m['outputTokens']}, generation time {m['generationMs']}")
+
+    def _run(self, content: str, dialect: str) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        from django.test import Client
+
+        resp = Client().post(
+            "/api/chat/conversations/bench/messages:stream",
+            data=json.dumps({"content": f"插入{content}", "outputDialect": dialect, "similarCache": False}),
+            content_type="application/json",
+        )
+        meta: Dict[str, Any] = {}
+        template: Optional[Dict[str, Any]] = None
+        for line in b"".join(resp.streaming_content).decode("utf-8").splitlines():
+            if not line.startswith("data: "):
+                continue
+            try:
+                env = json.loads(line[len("data: ") :])
+            except ValueError:
+                continue
+            if not isinstance(env, dict):
+                continue
+            if env.get("type") == "agentToUi/componentTemplate":
+                template = (env.get("payload") or {}).get("template")
+            elif env.get("type") == "agentToUi/taskStatus" and (env.get("payload") or {}).get("phase") == "done":
+                meta = env.get("meta") or {}
+        return meta, template
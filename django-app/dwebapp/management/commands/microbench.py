@@ -0,0 +1,74 @@
+"""Microbenchmarks for the streaming / prompt hot paths, with stored baselines.
+
+    python manage.py microbench                          # run and print
+    python manage.py microbench --save                   # write dwebapp/bench/baseline.json
+    python manage.py microbench --compare                # compare against it (exit 1 on regressions)
+    python manage.py microbench --compare other.json --threshold 0.3 --filter build_messages
+    python manage.py microbench --json
+
+Covers try_emit_from_buffer (JSON and JSONL; clean / prose-polluted /
+truncated streams), the upstream SSE line parser, sse_event,
+_wrap_short_agent_to_ui, _is_agent_to_ui_envelope and build_messages over
+scenes of 10 to 10 000 nodes. Timings are machine dependent: compare against
+a baseline recorded on the same machine.
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_BASELINE = str(Path(__file__).resolve().parents[2] / "bench" / "baseline.json")
+
+
+class Command(BaseCommand):
+    help = "Run the backend microbenchmarks; save a baseline or compare against one."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument("--save", nargs="?", const=DEFAULT_BASELINE, default=None, help="write the results as a baseline")
+        parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE, default=None, help="compare against a baseline")
+        parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before a regression (0.2 = 20%%)")
+        parser.add_argument("--filter", default=None, help="only benchmarks whose name contains this")
+        parser.add_argument("--min-time", type=float, default=0.05, help="seconds per timing round")
+        parser.add_argument("--rounds", type=int, default=5)
+        parser.add_argument("--json", action="store_true", help="print machine-readable JSON")
+
+    def handle(self, *args: Any, **opts: Any) -> None:
+        from dwebapp.bench import suite
+
+        baseline = None
+        if opts["compare"]:
+            try:
+                baseline = suite.load(opts["compare"])
+            except (OSError, ValueError) as e:
+                raise CommandError(str(e))
+
+        result = suite.run(only=opts["filter"], min_time=opts["min_time"], rounds=opts["rounds"])
+        if opts["save"]:
+            suite.save(opts["save"], result)
+
+        rows = suite.compare(baseline, result, threshold=opts["threshold"]) if baseline is not None else None
+        if rows is not None and opts["filter"]:
+            rows = [r for r in rows if opts["filter"] in r["name"]]
+        regressions = [r for r in rows or [] if r["status"] == "regression"]
+
+        if opts["json"]:
+            self.stdout.write(json.dumps({"result": result, "comparison": rows}, ensure_ascii=False, indent=2))
+        elif rows is None:
+            self.stdout.write(f"{'benchmark':<46} {'median us':>12} {'min us':>12} {'loops':>8}  extra")
+            for name, r in result["benchmarks"].items():
+                extra = json.dumps(r.get("extra") or {}, ensure_ascii=False) if r.get("extra") else ""
+                self.stdout.write(f"{name:<46} {r['medianUs']:>12} {r['minUs']:>12} {r['loops']:>8}  {extra}")
+        else:
+            self.stdout.write(f"baseline {opts['compare']} (threshold {opts['threshold']:.0%})")
+            self.stdout.write(f"{'benchmark':<46} {'base us':>12} {'now us':>12} {'ratio':>7}  status")
+            for r in rows:
+                ratio = f"{r['ratio']:.3f}" if r["ratio"] is not None else "-"
+                self.stdout.write(f"{r['name']:<46} {r['baseUs'] or '-':>12} {r['currentUs'] or '-':>12} {ratio:>7}  {r['status']}")
+        if opts["save"]:
+            self.stdout.write(f"saved {len(result['benchmarks'])} benchmarks to {opts['save']}")
+        if regressions:
+            raise CommandError(f"{len(regressions)} benchmark(s) slower than baseline by more than {opts['threshold']:.0%}")
@@ -0,0 +1,165 @@
+"""Compare full vs intent-scoped JSONL prompts: input tokens and TTFT per intent class.
+
+    python manage.py prompt_scope_report                 # mock upstream (simulated prefill latency)
+    python manage.py prompt_scope_report --upstream live # configured DeepSeek endpoint
+    python manage.py prompt_scope_report --json
+
+TTFT is taken from the final taskStatus (meta.timing.ttftMs) of real
+/messages:stream requests, so it includes prompt assembly and SSE framing.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import statistics
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.core.management.base import BaseCommand
+
+_SELECTION_PACK: Dict[str, Any] = {
+    "activeLayerId": "layer-1",
+    "selectedNodeIds": ["card:root"],
+    "selectedNodes": [{"id": "card:root", "userType": "rect", "name": "Card"}],
+    "activeLayer": {
+        "id": "layer-1",
+        "name": "Layer 1",
+        "nodeTree": [
+            {
+                "id": "card:root",
+                "category": "user",
+                "userType": "rect",
+                "name": "Card",
+                "transform": {"x": 0, "y": 0, "width": 480, "height": 200, "rotation": 0, "opacity": 1},
+                "props": {"fillColor": "#1e1e1e"},
+                "children": [
+                    {
+                        "id": "card:title",
+                        "category": "user",
+                        "userType": "text",
+                        "name": "Title",
+                        "transform": {"x": 0, "y": -50, "rotation": 0, "opacity": 1},
+                        "props": {"textContent": "标题", "fontSize": 32},
+                    }
+                ],
+            }
+        ],
+    },
+}
+
+# (request text, use the selection contextPack)
+CORPUS: List[Tuple[str, bool]] = [
+    ("帮我做一个登录页面，有账号和密码输入框", False),
+    ("生成一个展示季度销售额的柱状图", False),
+    ("画一个三步的流程图", False),
+    ("在卡片里加一个按钮", True),
+    ("把选中的卡片改成红色", True),
+    ("把标题字号调大一点", True),
+    ("把选中节点往右移动 100", True),
+    ("给选中的节点加一个青色发光", True),
+    ("给选中节点加模糊滤镜", True),
+    ("删除选中的节点", True),
+]
+
+
+def _median(values: List[float]) -> Optional[float]:
+    return round(statistics.median(values), 1) if values else None
+
+
+class Command(BaseCommand):
+    help = "Report input tokens and time-to-first-token per intent class for full vs scoped prompts."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument("--upstream", choices=["mock", "live", "none"], default="mock")
+        parser.add_argument("--repeat", type=int, default=3, help="TTFT samples per request and scope")
+        parser.add_argument("--json", action="store_true", help="print machine-readable JSON")
+
+    def handle(self, *args: Any, **opts: Any) -> None:
+        from dwebapp.ai_prompts import build_messages
+
+        rows: Dict[str, Dict[str, Any]] = {}
+        for content, with_selection in CORPUS:
+            pack = _SELECTION_PACK if with_selection else None
+            full: Dict[str, Any] = {}
+            auto: Dict[str, Any] = {}
+            build_messages(content=content, context_pack=pack, response_mode="agentToUi-jsonl", report=full, prompt_scope="full")
+            build_messages(content=content, context_pack=pack, response_mode="agentToUi-jsonl", report=auto, prompt_scope="auto")
+            row = rows.setdefault(auto["intent"], {"requests": 0, "tokens": {"full": [], "auto": []}, "ttftMs": {"full": [], "auto": []}})
+            row["requests"] += 1
+            row["tokens"]["full"].append(full["inputTokens"])
+            row["tokens"]["auto"].append(auto["inputTokens"])
+            if opts["upstream"] != "none":
+                for scope in ("full", "auto"):
+                    row["ttftMs"][scope].extend(self._ttft(content, pack, scope, opts["upstream"], opts["repeat"]))
+
+        report = {
+            "upstream": opts["upstream"],
+            "byIntent": {
+                intent: {
+                    "requests": r["requests"],
+                    "inputTokens": {s: _median(r["tokens"][s]) for s in ("full", "auto")},
+                    "ttftMsP50": {s: _median(r["ttftMs"][s]) for s in ("full", "auto")},
+                }
+                for intent, r in sorted(rows.items())
+            },
+        }
+        if opts["json"]:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write(f"upstream={report['upstream']} (median per intent class; before=full, after=auto)")
+        self.stdout.write(f"{'intent':<8} {'n':>3} {'tokens before':>14} {'after':>8} {'saved':>7} {'ttft before':>12} {'after':>8}")
+        for intent, r in report["byIntent"].items():
+            tb, ta = r["inputTokens"]["full"], r["inputTokens"]["auto"]
+            fb, fa = r["ttftMsP50"]["full"], r["ttftMsP50"]["auto"]
+            saved = f"{(1 - ta / tb) * 100:.0f}%" if tb else "-"
+            self.stdout.write(
+                f"{intent:<8} {r['requests']:>3} {tb:>14} {ta:>8} {saved:>7} {fb if fb is not None else '-':>12} {fa if fa is not None else '-':>8}"
+            )
+
+    def _ttft(self, content: str, pack: Any, scope: str, upstream: str, repeat: int) -> List[float]:
+        from django.test import Client
+
+        def run() -> List[float]:
+            client = Client()
+            out: List[float] = []
+            for _ in range(max(1, repeat)):
+                resp = client.post(
+                    "/api/chat/conversations/bench/messages:stream",
+                    # Every turn must reach the upstream, not the near-duplicate cache or the rule fast path.
+                    data=json.dumps(
+                        {"content": content, "contextPack": pack, "promptScope": scope, "similarCache": False, "fastPath": False}
+                    ),
+                    content_type="application/json",
+                )
+                ttft = None
+                for line in b"".join(resp.streaming_content).decode("utf-8").splitlines():
+                    if not line.startswith("data: "):
+                        continue
+                    try:
+                        env = json.loads(line[len("data: ") :])
+                    except ValueError:
+                        continue
+                    timing = (env.get("meta") or {}).get("timing") if isinstance(env, dict) else None
+                    if isinstance(timing, dict) and "ttftMs" in timing:
+                        ttft = float(timing["ttftMs"])
+                if ttft is not None:
+                    out.append(ttft)
+            return out
+
+        if upstream == "live":
+            return run()
+
+        from dwebapp.mock_upstream import MockUpstream
+
+        saved = {k: os.environ.get(k) for k in ("DEEPSEEK_BASE_URL", "DEEPSEEK_API_KEY", "DEEPSEEK_MODEL")}
+        with MockUpstream() as up:
+            os.environ.update({"DEEPSEEK_BASE_URL": up.base_url, "DEEPSEEK_API_KEY": "mock", "DEEPSEEK_MODEL": "mock"})
+            try:
+                return run()
+            finally:
+                for k, v in saved.items():
+                    if v is None:
+                        os.environ.pop(k, None)
+                    else:
+                        os.environ[k] = v
@@ -0,0 +1,70 @@
+"""Latency of the shared-state backends (memory, SQLite-WAL, Redis protocol).
+
+    python manage.py shared_state_bench                          # all three; Redis = local stand-in server
+    python manage.py shared_state_bench --redis-url redis://127.0.0.1:6379/0
+    python manage.py shared_state_bench --backend sqlite --ops 5000
+    python manage.py shared_state_bench --json
+
+The SQLite backend uses a throw-away database in a temp directory; the
+stand-in RESP server (shared_state/resp_server.py) runs in this process,
+so its numbers include loopback TCP but not a real Redis.
+"""
+
+from __future__ import annotations
+
+import json
+import tempfile
+from pathlib import Path
+from typing import Any, Dict
+
+from django.core.management.base import BaseCommand
+
+_BACKENDS = ("memory", "sqlite", "redis")
+
+
+class Command(BaseCommand):
+    help = "Benchmark shared-state operation latency per backend."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument("--backend", action="append", choices=_BACKENDS, help="repeatable; default: all")
+        parser.add_argument("--redis-url", default=None, help="real server to use instead of the stand-in")
+        parser.add_argument("--ops", type=int, default=2000, help="calls per operation")
+        parser.add_argument("--threads", type=int, default=4, help="threads for the contention check")
+        parser.add_argument("--json", action="store_true", help="print machine-readable JSON")
+
+    def handle(self, *args: Any, **opts: Any) -> None:
+        from dwebapp.bench.shared_state import bench_backend
+        from dwebapp.shared_state.base import from_url
+        from dwebapp.shared_state.resp_server import RespServer
+
+        results: Dict[str, Any] = {}
+        for name in opts["backend"] or _BACKENDS:
+            server = None
+            with tempfile.TemporaryDirectory() as tmp:
+                if name == "memory":
+                    url = "memory://"
+                elif name == "sqlite":
+                    url = "sqlite:///" + str(Path(tmp) / "bench.sqlite3")
+                elif opts["redis_url"]:
+                    url = opts["redis_url"]
+                else:
+                    server = RespServer(port=0).start()
+                    url = server.url
+                state = from_url(url)
+                try:
+                    results[name] = dict(bench_backend(state, ops=opts["ops"], threads=opts["threads"]), url=url)
+                finally:
+                    state.close()
+                    if server is not None:
+                        server.stop()
+
+        if opts["json"]:
+            self.stdout.write(json.dumps(results, ensure_ascii=False, indent=2))
+            return
+        self.stdout.write(f"{'backend':<8} {'operation':<18} {'p50 us':>10} {'p95 us':>10} {'p99 us':>10} {'ops/s':>10}")
+        for name, r in results.items():
+            for op, t in r["ops"].items():
+                self.stdout.write(f"{name:<8} {op:<18} {t['p50Us']:>10} {t['p95Us']:>10} {t['p99Us']:>10} {t['opsPerS'] or '-':>10}")
+            c = r["contention"]
+            verdict = "atomic" if c["atomic"] else f"NOT atomic ({c['final']}/{c['expected']}) {c['errors']}"
+            self.stdout.write(f"{name:<8} {'contended incr':<18} {c['threads']} threads, {c['opsPerS']} ops/s, {verdict}")
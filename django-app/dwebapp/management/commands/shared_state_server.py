@@ -0,0 +1,33 @@
+"""Run the stand-in RESP server (shared_state/resp_server.py) in the foreground.
+
+    python manage.py shared_state_server --port 6390
+    DWEB_SHARED_STATE_URL=redis://127.0.0.1:6390/0 gunicorn ...
+
+For trying multi-worker setups without a Redis install; not for production.
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Serve the in-memory stand-in for a Redis server (shared-state backend)."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=6379)
+
+    def handle(self, *args: Any, **opts: Any) -> None:
+        from dwebapp.shared_state.resp_server import RespServer
+
+        server = RespServer(opts["host"], opts["port"])
+        self.stdout.write(f"shared state stand-in listening on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
@@ -0,0 +1,132 @@
+"""Cold-start benchmark: dev settings vs the lean production profile.
+
+    python manage.py startup_bench                       # dwebsite.settings vs dwebsite.settings_prod
+    python manage.py startup_bench --runs 5 --requests 300
+    python manage.py startup_bench --json
+
+Every run is a fresh interpreter (like a newly scaled worker) that reports:
+- setupMs        python + django.setup() (includes DWEB_WARM_START work)
+- wsgiMs         building the WSGI handler (middleware chain)
+- firstRequestMs first GET /api/health/
+- firstChatMs    first POST .../messages:stream up to its first SSE byte
+                 (prompt assembly + middleware; the upstream is never called)
+- steady p50 per request for GET /api/health/ and POST /api/chat/conversations
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+_CHILD = r"""
+import json, os, sys, time
+t0 = time.perf_counter()
+import django
+django.setup()
+t_setup = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+t_wsgi = time.perf_counter()
+from django.test import Client
+c = Client()
+t = time.perf_counter()
+c.get("/api/health/")
+first_request = time.perf_counter() - t
+t = time.perf_counter()
+resp = c.post(
+    "/api/chat/conversations/bench/messages:stream",
+    data=json.dumps({"content": "把选中的卡片改成红色", "contextPack": {"selectedNodeIds": ["a"]}}),
+    content_type="application/json",
+)
+next(iter(resp.streaming_content))
+first_chat = time.perf_counter() - t
+resp.close()
+
+def p50(fn, n):
+    out = []
+    for _ in range(n):
+        t = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t)
+    return sorted(out)[len(out) // 2]
+
+n = int(os.environ["BENCH_REQUESTS"])
+health = p50(lambda: c.get("/api/health/"), n)
+conv = p50(lambda: c.post("/api/chat/conversations", data="{}", content_type="application/json"), n)
+print(json.dumps({
+    "setupMs": (t_setup - t0) * 1000,
+    "wsgiMs": (t_wsgi - t_setup) * 1000,
+    "firstRequestMs": first_request * 1000,
+    "firstChatMs": first_chat * 1000,
+    "healthP50Ms": health * 1000,
+    "conversationP50Ms": conv * 1000,
+}))
+"""
+
+_FIELDS = ("processMs", "setupMs", "wsgiMs", "firstRequestMs", "firstChatMs", "healthP50Ms", "conversationP50Ms")
+
+
+class Command(BaseCommand):
+    help = "Measure interpreter start, django.setup, first request and steady per-request cost per settings profile."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument(
+            "--settings-modules",
+            nargs="+",
+            default=["dwebsite.settings", "dwebsite.settings_prod"],
+            help="settings modules to compare",
+        )
+        parser.add_argument("--runs", type=int, default=3, help="fresh processes per profile (median reported)")
+        parser.add_argument("--requests", type=int, default=200, help="requests for the steady-state p50")
+        parser.add_argument("--json", action="store_true", help="print machine-readable JSON")
+
+    def handle(self, *args: Any, **opts: Any) -> None:
+        report: Dict[str, Dict[str, float]] = {}
+        for module in opts["settings_modules"]:
+            runs = [self._run(module, opts["requests"]) for _ in range(max(1, opts["runs"]))]
+            report[module] = {k: round(statistics.median(r[k] for r in runs), 2) for k in _FIELDS}
+
+        if opts["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        width = max(len(m) for m in report)
+        self.stdout.write(f"{'profile':<{width}} " + " ".join(f"{k:>17}" for k in _FIELDS))
+        for module, row in report.items():
+            self.stdout.write(f"{module:<{width}} " + " ".join(f"{row[k]:>17.2f}" for k in _FIELDS))
+
+    def _run(self, module: str, requests: int) -> Dict[str, float]:
+        env = dict(os.environ)
+        env.update(
+            {
+                "DJANGO_SETTINGS_MODULE": module,
+                "BENCH_REQUESTS": str(max(1, requests)),
+                # Prompt assembly runs before the upstream call; the stream is
+                # closed after its first byte, so this address is never dialed.
+                "DEEPSEEK_BASE_URL": "http://127.0.0.1:9",
+                "DEEPSEEK_API_KEY": "bench",
+                "DEEPSEEK_MODEL": "bench",
+            }
+        )
+        # settings_prod refuses to start without these; the bench only talks to the test client.
+        env.setdefault("DJANGO_SECRET_KEY", "startup-bench")
+        env.setdefault("DJANGO_ALLOWED_HOSTS", "testserver,localhost,127.0.0.1")
+        t0 = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, "-c", _CHILD],
+            cwd=str(settings.BASE_DIR),
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        row: Dict[str, Any] = json.loads(out.stdout.strip().splitlines()[-1])
+        row["processMs"] = (time.perf_counter() - t0) * 1000
+        return row
@@ -0,0 +1,86 @@
+"""In-process metrics registry (per worker process; no external exporter).
+
+Series are keyed by name + sorted labels and keep count/sum/min/max plus a
+bounded window of recent values for percentiles.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+_WINDOW = 1024
+
+_LOCK = threading.Lock()
+_SERIES: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], "_Series"] = {}
+_COUNTERS: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], int] = {}
+
+
+class _Series:
+    __slots__ = ("count", "total", "min", "max", "recent")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.recent: Deque[float] = deque(maxlen=_WINDOW)
+
+    def add(self, v: float) -> None:
+        self.count += 1
+        self.total += v
+        self.min = min(self.min, v)
+        self.max = max(self.max, v)
+        self.recent.append(v)
+
+    def summary(self) -> Dict[str, Any]:
+        ordered = sorted(self.recent)
+
+        def pct(p: float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 3)
+
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3),
+            "min": round(self.min, 3),
+            "max": round(self.max, 3),
+            "p50": pct(0.5),
+            "p95": pct(0.95),
+        }
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    key = _key(name, labels)
+    with _LOCK:
+        series = _SERIES.get(key)
+        if series is None:
+            series = _SERIES[key] = _Series()
+        series.add(float(value))
+
+
+def incr(name: str, amount: int = 1, **labels: Any) -> None:
+    key = _key(name, labels)
+    with _LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + amount
+
+
+def snapshot() -> Dict[str, Any]:
+    """{"series": [{name, labels, count, mean, ...}], "counters": [{name, labels, value}]}"""
+
+    with _LOCK:
+        series = [dict(name=k[0], labels=dict(k[1]), **s.summary()) for k, s in _SERIES.items()]
+        counters = [dict(name=k[0], labels=dict(k[1]), value=v) for k, v in _COUNTERS.items()]
+    series.sort(key=lambda x: (x["name"], sorted(x["labels"].items())))
+    counters.sort(key=lambda x: (x["name"], sorted(x["labels"].items())))
+    return {"series": series, "counters": counters}
+
+
+def reset() -> None:
+    with _LOCK:
+        _SERIES.clear()
+        _COUNTERS.clear()
@@ -0,0 +1,193 @@
+"""Local OpenAI-compatible mock upstream for benchmarks and offline runs.
+
+Serves POST /chat/completions (streaming SSE or plain JSON) from a canned
+reply. Latency is simulated, not measured: time-to-first-token is
+`base_ms + prefill_ms_per_1k * input_tokens / 1000` (tokens estimated the same
+way as the prompt report), then chunks are sent `chunk_delay_ms` apart. Use it
+to compare prompt variants relative to each other, not to predict absolute
+DeepSeek latency.
+
+    with MockUpstream() as up:
+        os.environ["DEEPSEEK_BASE_URL"] = up.base_url
+        ...
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from .prompts.tokens import estimate_tokens
+
+DEFAULT_REPLY = "\n".join(
+    json.dumps(x, ensure_ascii=False, separators=(",", ":"))
+    for x in [
+        {
+            "schemaVersion": 1,
+            "type": "agentToUi/chatMessage",
+            "id": "00000000-0000-0000-0000-000000000001",
+            "createdAt": "2026-01-01T00:00:00Z",
+            "payload": {"content": "我将在舞台中央插入一个卡片组件。"},
+        },
+        {
+            "schemaVersion": 1,
+            "type": "agentToUi/componentTemplate",
+            "id": "00000000-0000-0000-0000-000000000002",
+            "createdAt": "2026-01-01T00:00:00Z",
+            "payload": {
+                "intent": "insert",
+                "template": {
+                    "schemaVersion": 1,
+                    "templateId": "tmpl_mock_card",
+                    "name": "卡片",
+                    "params": [],
+                    "rootLocalId": "root",
+                    "nodes": [
+                        {
+                            "localId": "root",
+                            "type": "rect",
+                            "transform": {"x": 0, "y": 0, "width": 480, "height": 200},
+                            "props": {"fillColor": "#1e1e1e", "fillOpacity": 1, "borderColor": "#3c3c3c", "borderOpacity": 1, "borderWidth": 2, "cornerRadius": 12},
+                        },
+                        {
+                            "localId": "title",
+                            "type": "text",
+                            "parentLocalId": "root",
+                            "transform": {"x": 0, "y": -50},
+                            "props": {"textContent": "标题", "fontSize": 32, "fontColor": "#ffffff"},
+                        },
+                    ],
+                },
+            },
+        },
+    ]
+) + "\n"
+
+
+class MockUpstream:
+    def __init__(
+        self,
+        *,
+        reply: Optional[Callable[[Dict[str, Any]], str]] = None,
+        chunks: Optional[Callable[[Dict[str, Any]], List[Union[str, Tuple[float, str]]]]] = None,
+        base_ms: float = 120.0,
+        prefill_ms_per_1k: float = 60.0,
+        chunk_chars: int = 12,
+        chunk_delay_ms: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        """`reply(request_body) -> text` is split into `chunk_chars` deltas;
+        `chunks(request_body) -> [raw SSE data strings]` replaces the whole stream
+        (for replaying captured upstream traffic verbatim); a `(ms, data)` item
+        is sent `ms` after the request arrived, so with base_ms=0 and
+        prefill_ms_per_1k=0 a capture replays at its recorded timing
+        (see capture.mock_chunks)."""
+
+        self.reply = reply or (lambda _body: DEFAULT_REPLY)
+        self.chunks = chunks
+        self.base_ms = base_ms
+        self.prefill_ms_per_1k = prefill_ms_per_1k
+        self.chunk_chars = max(1, chunk_chars)
+        self.chunk_delay_ms = chunk_delay_ms
+        self.requests: List[Dict[str, Any]] = []
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockUpstream":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-upstream", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockUpstream":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    def prefill_delay(self, body: Dict[str, Any]) -> float:
+        messages = body.get("messages") if isinstance(body.get("messages"), list) else []
+        tokens = sum(estimate_tokens(str(m.get("content") or "")) for m in messages if isinstance(m, dict))
+        return (self.base_ms + self.prefill_ms_per_1k * tokens / 1000.0) / 1000.0
+
+    def _handler_class(self) -> type:
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *_args: Any) -> None:
+                pass
+
+            def do_POST(self) -> None:  # noqa: N802 - http.server naming
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    body = {}
+                received = time.monotonic()
+                upstream.requests.append(body)
+                time.sleep(upstream.prefill_delay(body))
+                if body.get("stream"):
+                    self._stream(body, received)
+                else:
+                    self._complete(body)
+
+            def _complete(self, body: Dict[str, Any]) -> None:
+                text = upstream.reply(body)
+                data = json.dumps(
+                    {"choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]},
+                    ensure_ascii=False,
+                ).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, body: Dict[str, Any], received: float) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                if upstream.chunks is not None:
+                    datas = upstream.chunks(body)
+                else:
+                    text = upstream.reply(body)
+                    datas = [
+                        json.dumps({"choices": [{"index": 0, "delta": {"content": text[i : i + upstream.chunk_chars]}}]}, ensure_ascii=False)
+                        for i in range(0, len(text), upstream.chunk_chars)
+                    ]
+                    datas.append("[DONE]")
+                try:
+                    for d in datas:
+                        if isinstance(d, tuple):
+                            at_ms, d = d
+                            wait = received + at_ms / 1000.0 - time.monotonic()
+                            if wait > 0:
+                                time.sleep(wait)
+                        self.wfile.write(f"data: {d}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                        if upstream.chunk_delay_ms:
+                            time.sleep(upstream.chunk_delay_ms / 1000.0)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                self.close_connection = True
+
+        return Handler
@@ -0,0 +1,120 @@
+"""Operator endpoints (per worker process; see streams.py).
+
+Endpoints (no trailing slashes; APPEND_SLASH=False):
+- GET  /api/ops/streams               (live messages:stream generations)
+- GET  /api/ops/streams/{id}
+- POST /api/ops/streams/{id}:cancel   (closes the upstream connection; 202 when
+                                      forwarded to other workers over shared state)
+- GET  /api/ops/metrics               (metrics registry + cache / shared-state / capture stats)
+- GET  /api/ops/profiles              (profiled requests; see profiling.py)
+- GET  /api/ops/profiles/{id}
+
+Every request must carry DWEB_OPS_TOKEN as `Authorization: Bearer <token>` or
+`X-Dweb-Ops-Token: <token>`. With DWEB_OPS_TOKEN unset the endpoints answer 404.
+"""
+
+from __future__ import annotations
+
+import functools
+import hmac
+import os
+from typing import Any, Callable
+
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.decorators import api_view
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from . import capture, metrics, profiling, streams
+from .shared_state.base import SharedStateError, get_shared_state
+from .similar_cache import get_similar_cache
+from .stage import instantiate, text_metrics
+from .stage import mirror as stage_mirror
+
+
+def _ops_error(code: str, message: str, status: int) -> Response:
+    return Response({"error": {"code": code, "message": message}}, status=status)
+
+
+def _ops_only(view: Callable[..., Response]) -> Callable[..., Response]:
+    @functools.wraps(view)
+    def wrapper(request: Request, *args: Any, **kwargs: Any) -> Response:
+        token = os.environ.get("DWEB_OPS_TOKEN", "")
+        if not token:
+            return _ops_error("not_found", "ops endpoints disabled (DWEB_OPS_TOKEN unset)", 404)
+        auth = request.headers.get("Authorization", "")
+        given = auth[len("Bearer ") :] if auth.startswith("Bearer ") else request.headers.get("X-Dweb-Ops-Token", "")
+        if not hmac.compare_digest(given.encode("utf-8"), token.encode("utf-8")):
+            return _ops_error("unauthorized", "invalid ops token", 401)
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+@api_view(["GET"])
+@_ops_only
+def list_streams(_: Request) -> Response:
+    items = streams.list_streams()
+    return Response({"pid": os.getpid(), "count": len(items), "streams": items})
+
+
+@api_view(["GET"])
+@_ops_only
+def stream_detail(_: Request, stream_id: str) -> Response:
+    live = streams.get_stream(stream_id)
+    if live is None:
+        return _ops_error("not_found", "stream not found (finished, or served by another worker)", 404)
+    return Response(live.to_dict())
+
+
+@csrf_exempt
+@api_view(["POST"])
+@_ops_only
+def cancel_stream(request: Request, stream_id: str) -> Response:
+    data: Any = request.data
+    reason = data.get("reason") if isinstance(data, dict) and isinstance(data.get("reason"), str) else "ops"
+    live = streams.cancel_stream(stream_id, reason=reason[:200])
+    if live is None:
+        try:
+            receivers = streams.broadcast_cancel(stream_id, reason=reason[:200])
+        except SharedStateError as e:
+            return _ops_error("shared_state_error", str(e), 503)
+        if receivers is None or receivers == 0:
+            return _ops_error("not_found", "stream not found (finished, or served by another worker)", 404)
+        # Published to the other workers; the one holding the stream (if any) cancels it.
+        return Response({"id": stream_id, "forwarded": True, "receivers": receivers}, status=202)
+    return Response(live.to_dict())
+
+
+@api_view(["GET"])
+@_ops_only
+def metrics_snapshot(_: Request) -> Response:
+    caches = {
+        "similarCache": get_similar_cache().stats(),
+        "textMetrics": text_metrics.cache_stats(),
+        "templatePlans": instantiate.cache_stats(),
+        "stageMirrors": stage_mirror.cache_stats(),
+    }
+    try:
+        shared = get_shared_state().stats()
+    except SharedStateError as e:
+        shared = {"error": str(e)}
+    return Response(
+        {"pid": os.getpid(), "caches": caches, "sharedState": shared, "capture": capture.get_writer().stats(), **metrics.snapshot()}
+    )
+
+
+@api_view(["GET"])
+@_ops_only
+def list_profiles(_: Request) -> Response:
+    items = profiling.list_reports()
+    return Response({"pid": os.getpid(), "count": len(items), "profiles": items})
+
+
+@api_view(["GET"])
+@_ops_only
+def profile_detail(_: Request, profile_id: str) -> Response:
+    report = profiling.get_report(profile_id)
+    if report is None:
+        return _ops_error("not_found", "profile not found (evicted, or served by another worker)", 404)
+    return Response(report)
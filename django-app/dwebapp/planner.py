@@ -0,0 +1,355 @@
+"""Planner mode: plan modules first, generate them concurrently, merge in order.
+
+The JSONL prompt asks the model to 拆分模块 and then 逐步落地 every module in
+one long generation. In planner mode a turn runs in three stages instead:
+
+1. plan     one short JSON call (DWEB_PLANNER_MODEL, default: the turn's model)
+            returns a container size and 2..N modules with a slot each
+            (x/y relative to the container center, width/height budget);
+2. fan out  the backend emits the container as a componentTemplate and starts
+            one upstream generation per module, each told to mount under the
+            container (payload.parentId) inside its slot;
+3. merge    envelopes are forwarded in module order: module 0 streams live,
+            later modules are buffered until every earlier one finished.
+
+Wall-clock time becomes plan + the slowest module instead of the sum. When the
+plan is unusable (error, fewer than two modules) the turn falls back to the
+regular single-stream pipeline.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, Generator, List, Optional, Tuple
+
+from . import metrics
+from .ratelimit import upstream_limiter
+from .streams import LiveStream
+
+if TYPE_CHECKING:
+    from .profiling import Probe
+
+PLANNER_MODEL = os.environ.get("DWEB_PLANNER_MODEL", "")
+MAX_MODULES = int(os.environ.get("DWEB_PLANNER_MAX_MODULES", "6"))
+_POOL = ThreadPoolExecutor(max_workers=int(os.environ.get("DWEB_PLANNER_WORKERS", "12")), thread_name_prefix="planner")
+_END = object()
+
+_PLAN_SYSTEM = (
+    "你是 dweb-video-studio 的界面规划器。根据用户需求把界面拆成 2~{max_modules} 个可以独立生成的模块，并给出布局。\n"
+    "只输出 json（单个 JSON object），格式：\n"
+    '{{"title":"界面名","container":{{"width":1200,"height":800,"fillColor":"#1e1e1e"}},'
+    '"modules":[{{"name":"模块名","brief":"该模块包含什么（一句话）","x":0,"y":-300,"width":1100,"height":120}}]}}\n'
+    "规则：x/y 是模块中心相对容器中心的偏移（像素，y 向下为正）；模块矩形必须完全位于容器内且互不重叠；"
+    "模块按从上到下、从左到右排序；brief 不要包含 JSON。"
+)
+
+
+def _num(v: Any, fallback: float) -> float:
+    return float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) and v == v else fallback
+
+
+def parse_plan(text: str) -> Optional[Dict[str, Any]]:
+    """Normalize the planner reply; None when it has fewer than two usable modules."""
+
+    try:
+        obj = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(obj, dict) or not isinstance(obj.get("modules"), list):
+        return None
+    box = obj.get("container") if isinstance(obj.get("container"), dict) else {}
+    cw = max(200.0, _num(box.get("width"), 1200.0))
+    ch = max(200.0, _num(box.get("height"), 800.0))
+    modules: List[Dict[str, Any]] = []
+    for m in obj["modules"][:MAX_MODULES]:
+        if not isinstance(m, dict) or not str(m.get("name") or "").strip():
+            continue
+        w = min(cw, max(40.0, _num(m.get("width"), cw * 0.8)))
+        h = min(ch, max(40.0, _num(m.get("height"), ch / 4)))
+        # keep the slot inside the container
+        x = min(cw / 2 - w / 2, max(-cw / 2 + w / 2, _num(m.get("x"), 0.0)))
+        y = min(ch / 2 - h / 2, max(-ch / 2 + h / 2, _num(m.get("y"), 0.0)))
+        modules.append({"name": str(m["name"]).strip(), "brief": str(m.get("brief") or "").strip(), "x": x, "y": y, "width": w, "height": h})
+    if len(modules) < 2:
+        return None
+    fill = box.get("fillColor") if isinstance(box.get("fillColor"), str) else "#1e1e1e"
+    return {"title": str(obj.get("title") or "界面"), "container": {"width": cw, "height": ch, "fillColor": fill}, "modules": modules}
+
+
+def _container_envelope(plan: Dict[str, Any], template_id: str, viewport: Any) -> Dict[str, Any]:
+    from .ai_chat_api import _iso_now
+
+    center = viewport.get("centerWorld") if isinstance(viewport, dict) else None
+    cx = _num(center.get("x"), 0.0) if isinstance(center, dict) else 0.0
+    cy = _num(center.get("y"), 0.0) if isinstance(center, dict) else 0.0
+    c = plan["container"]
+    return {
+        "schemaVersion": 1,
+        "type": "agentToUi/componentTemplate",
+        "id": str(uuid.uuid4()),
+        "createdAt": _iso_now(),
+        "source": {"agentName": "backend"},
+        "payload": {
+            "intent": "insert",
+            "template": {
+                "schemaVersion": 1,
+                "templateId": template_id,
+                "name": plan["title"],
+                "params": [],
+                "rootLocalId": "root",
+                "nodes": [
+                    {
+                        "localId": "root",
+                        "type": "rect",
+                        "name": plan["title"],
+                        "transform": {"x": cx, "y": cy, "width": c["width"], "height": c["height"], "rotation": 0, "opacity": 1},
+                        "props": {
+                            "fillColor": c["fillColor"],
+                            "fillOpacity": 1,
+                            "borderColor": "#3c3c3c",
+                            "borderOpacity": 1,
+                            "borderWidth": 2,
+                            "cornerRadius": 16,
+                        },
+                    }
+                ],
+            },
+        },
+    }
+
+
+def _module_request(content: str, module: Dict[str, Any], index: int, total: int, parent_id: str) -> str:
+    return (
+        f"用户原始需求：{content}\n"
+        f"本次只落地第 {index + 1}/{total} 个模块「{module['name']}」：{module['brief'] or module['name']}。\n"
+        f"- 只输出这一个模块：一条简短 chatMessage + 一条 componentTemplate，不要输出其他模块，不要自检回合。\n"
+        f"- componentTemplate 的 payload.parentId 必须是 \"{parent_id}\"（已存在的容器节点）。\n"
+        f"- 模块 root 节点 transform 必须为 x={module['x']:.0f}, y={module['y']:.0f}（相对容器中心），"
+        f"width<={module['width']:.0f}, height<={module['height']:.0f}；所有子节点都在该范围内。"
+    )
+
+
+def _fit_to_slot(env: Dict[str, Any], module: Dict[str, Any], parent_id: str) -> None:
+    """Enforce the module's mount point and placement budget on its componentTemplate."""
+
+    payload = env.get("payload")
+    if env.get("type") != "agentToUi/componentTemplate" or not isinstance(payload, dict):
+        return
+    payload["parentId"] = parent_id
+    template = payload.get("template")
+    if not isinstance(template, dict) or not isinstance(template.get("nodes"), list):
+        return
+    root_id = template.get("rootLocalId")
+    for node in template["nodes"]:
+        if isinstance(node, dict) and node.get("localId") == root_id:
+            t = node.get("transform") if isinstance(node.get("transform"), dict) else {}
+            t["x"], t["y"] = module["x"], module["y"]
+            if isinstance(t.get("width"), (int, float)):
+                t["width"] = min(t["width"], module["width"])
+            if isinstance(t.get("height"), (int, float)):
+                t["height"] = min(t["height"], module["height"])
+            node["transform"] = t
+
+
+def iter_planned_events(
+    *,
+    cfg: Dict[str, str],
+    provider: str,
+    model: str,
+    content: str,
+    context_pack: Any,
+    viewport: Any,
+    msgs: List[Dict[str, str]],
+    prompt_report: Dict[str, Any],
+    started_at: float,
+    live: Optional[LiveStream] = None,
+    probe: Optional["Probe"] = None,
+) -> Generator[Tuple[str, Any], None, None]:
+    """Planner-mode counterpart of ai_chat_api._iter_stream_events (same event shape)."""
+
+    from .ai_chat_api import (
+        _agent_to_ui_task_status,
+        _build_messages,
+        _iter_stream_events,
+        _openai_chat,
+    )
+
+    def status(phase: str, message: str, meta: Optional[Dict[str, Any]] = None) -> Tuple[str, Any]:
+        if live is not None:
+            live.set_phase(phase)
+        return ("msg", _agent_to_ui_task_status(phase, message=message, meta=meta))
+
+    def canceled() -> Generator[Tuple[str, Any], None, None]:
+        meta = {
+            "timing": {"totalMs": int((time.monotonic() - started_at) * 1000)},
+            "reason": live.cancel_reason if live is not None else None,
+        }
+        yield status("canceled", "已被取消", meta)
+        yield ("done", "{}")
+
+    yield status("started", "已开始", {"prompt": prompt_report, "planner": True})
+    yield status("streaming", "拆分模块…")
+
+    t_plan = time.monotonic()
+    plan: Optional[Dict[str, Any]] = None
+    try:
+        upstream_limiter().acquire()
+        plan = parse_plan(
+            _openai_chat(
+                base_url=cfg["base_url"],
+                api_key=cfg["api_key"],
+                model=PLANNER_MODEL or model,
+                messages=[
+                    {"role": "system", "content": _PLAN_SYSTEM.format(max_modules=MAX_MODULES)},
+                    {"role": "user", "content": content},
+                ],
+                response_format={"type": "json_object"},
+                timeout_s=30,
+            )
+        )
+    except Exception:
+        plan = None
+    plan_ms = int((time.monotonic() - t_plan) * 1000)
+    metrics.observe("chat.planner_plan_ms", plan_ms, ok=plan is not None)
+    if live is not None and live.canceled:
+        yield from canceled()
+        return
+
+    if plan is None:
+        # Unusable plan: run the ordinary single-stream turn, minus its own "started".
+        for event, data in _iter_stream_events(
+            cfg=cfg,
+            provider=provider,
+            model=model,
+            response_mode="agentToUi-jsonl",
+            msgs=msgs,
+            prompt_report=prompt_report,
+            started_at=started_at,
+            live=live,
+            probe=probe,
+        ):
+            if isinstance(data, dict) and data.get("type") == "agentToUi/taskStatus":
+                if (data.get("payload") or {}).get("phase") == "started":
+                    continue
+            yield event, data
+        return
+
+    modules = plan["modules"]
+    template_id = f"plan_{uuid.uuid4().hex[:8]}"
+    parent_id = f"{template_id}:root"
+    names = "、".join(m["name"] for m in modules)
+    yield ("msg", _agent_to_ui_chat(f"我将把界面拆成 {len(modules)} 个模块并行生成：{names}。", model))
+    yield ("msg", _container_envelope(plan, template_id, viewport))
+
+    stop = threading.Event()
+    queues: List["queue.Queue[Any]"] = [queue.Queue() for _ in modules]
+    stats: List[Dict[str, Any]] = [{"name": m["name"], "envelopes": 0} for m in modules]
+    module_live = [live.module(m["name"]) if live is not None else None for m in modules]
+
+    def stopped() -> bool:
+        return stop.is_set() or (live is not None and live.canceled)
+
+    def run(i: int) -> None:
+        t0 = time.monotonic()
+        q = queues[i]
+        try:
+            # Tasks still queued in _POOL when the client left must not build prompts,
+            # take rate-limit tokens or open a generation.
+            if stopped():
+                return
+            module_msgs = _build_messages(
+                _module_request(content, modules[i], i, len(modules), parent_id),
+                context_pack,
+                "agentToUi-jsonl",
+                default_intent="insert",
+                viewport=viewport if isinstance(viewport, dict) else None,
+                prompt_scope="auto",
+            )
+            if stopped():
+                return
+            upstream_limiter().acquire()
+            if stopped():
+                return
+            events = _iter_stream_events(
+                cfg=cfg,
+                provider=provider,
+                model=model,
+                response_mode="agentToUi-jsonl",
+                msgs=module_msgs,
+                prompt_report={},
+                started_at=t0,
+                live=module_live[i],
+                probe=probe,
+            )
+            for event, data in events:
+                if stop.is_set():
+                    events.close()  # closes the upstream connection
+                    break
+                q.put((event, data))
+        except Exception as e:  # _iter_stream_events reports upstream failures itself
+            from .ai_chat_api import _agent_to_ui_error
+
+            q.put(("msg", _agent_to_ui_error("internal_error", f"{modules[i]['name']}: {e}")))
+        finally:
+            stats[i]["ms"] = int((time.monotonic() - t0) * 1000)
+            q.put(_END)
+
+    for i in range(len(modules)):
+        _POOL.submit(run, i)
+
+    ttft_ms: Optional[int] = None
+    try:
+        for i, module in enumerate(modules):
+            if live is not None and live.canceled:
+                break
+            yield status("writing", f"落地：{module['name']}")
+            while True:
+                item = queues[i].get()
+                if item is _END:
+                    break
+                event, data = item
+                if event != "msg" or not isinstance(data, dict):
+                    continue  # per-module "done" markers
+                if data.get("type") == "agentToUi/taskStatus":
+                    continue  # module phases are folded into the planner's own
+                if ttft_ms is None:
+                    ttft_ms = int((time.monotonic() - started_at) * 1000)
+                    if live is not None:
+                        live.note_first_token(ttft_ms)
+                _fit_to_slot(data, module, parent_id)
+                stats[i]["envelopes"] += 1
+                yield ("msg", data)
+    finally:
+        stop.set()
+    if live is not None and live.canceled:
+        yield from canceled()
+        return
+
+    total_ms = int((time.monotonic() - started_at) * 1000)
+    slowest = max(s.get("ms", 0) for s in stats)
+    metrics.observe("chat.planner_total_ms", total_ms, modules=len(modules))
+    meta = {
+        "timing": {
+            "ttftMs": ttft_ms,
+            "planMs": plan_ms,
+            "slowestModuleMs": slowest,
+            "sumModuleMs": sum(s.get("ms", 0) for s in stats),
+            "totalMs": total_ms,
+        },
+        "intent": prompt_report.get("intent", "insert"),
+        "planner": {"containerId": parent_id, "modules": stats},
+    }
+    yield status("done", "完成", meta)
+    yield ("done", "{}")
+
+
+def _agent_to_ui_chat(content: str, model: str) -> Dict[str, Any]:
+    from .ai_chat_api import _wrap_short_agent_to_ui
+
+    return _wrap_short_agent_to_ui({"type": "agentToUi/chatMessage", "payload": {"content": content}}, source_model=model)
@@ -0,0 +1,252 @@
+"""Operator-only per-request profiling of chat turns (per worker process).
+
+A messages / messages:stream request carrying `X-Dweb-Profile: <DWEB_OPS_TOKEN>`
+runs under cProfile plus a tracemalloc snapshot diff, and the pipeline counts
+try_emit_from_buffer calls and the buffer high-water mark into a Probe. The
+report id is put into the final taskStatus (`meta.profileId`; plain `profileId`
+on the non-streaming endpoint) and the report is kept here, fetchable through
+
+- GET /api/ops/profiles
+- GET /api/ops/profiles/{id}
+
+Reports are capped in size (DWEB_PROFILE_MAX_BYTES) and count
+(DWEB_PROFILE_KEEP, oldest dropped first). cProfile only sees the thread that
+drives the turn (planner module threads show up as waits); tracemalloc is
+process-wide, so allocations of concurrent requests land in the diff too.
+"""
+
+from __future__ import annotations
+
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Generator, List, Optional, Tuple
+
+from . import metrics
+
+PROFILE_HEADER = "X-Dweb-Profile"
+KEEP = int(os.environ.get("DWEB_PROFILE_KEEP", "16"))
+MAX_BYTES = int(os.environ.get("DWEB_PROFILE_MAX_BYTES", str(128 * 1024)))
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+_TERMINAL_PHASES = ("done", "canceled", "error")
+
+
+def requested(header_value: Optional[str]) -> bool:
+    """True when the profile header carries the ops token (never true with DWEB_OPS_TOKEN unset)."""
+
+    token = os.environ.get("DWEB_OPS_TOKEN", "")
+    if not token or not header_value:
+        return False
+    return hmac.compare_digest(header_value.encode("utf-8"), token.encode("utf-8"))
+
+
+class Probe:
+    """Pipeline counters (thread-safe: planner modules report from worker threads)."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.emit_calls: Dict[str, int] = {}
+        self.buffer_high_water = 0
+
+    def note_emit_call(self, mode: str, buffer_chars: int) -> None:
+        with self._lock:
+            self.emit_calls[mode] = self.emit_calls.get(mode, 0) + 1
+            if buffer_chars > self.buffer_high_water:
+                self.buffer_high_water = buffer_chars
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"tryEmitFromBufferCalls": dict(self.emit_calls), "bufferHighWaterChars": self.buffer_high_water}
+
+
+_TRACE_LOCK = threading.Lock()
+_TRACE_USERS = 0
+_TRACE_OWNED = False
+
+
+def _trace_acquire() -> None:
+    global _TRACE_USERS, _TRACE_OWNED
+    with _TRACE_LOCK:
+        if _TRACE_USERS == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(1)
+            _TRACE_OWNED = True
+        _TRACE_USERS += 1
+
+
+def _trace_release() -> None:
+    global _TRACE_USERS, _TRACE_OWNED
+    with _TRACE_LOCK:
+        _TRACE_USERS -= 1
+        if _TRACE_USERS == 0 and _TRACE_OWNED:
+            tracemalloc.stop()
+            _TRACE_OWNED = False
+
+
+class ProfileSession:
+    """cProfile + tracemalloc around one turn; `active()` brackets each slice of work."""
+
+    def __init__(self, *, endpoint: str, conversation_id: str) -> None:
+        self.id = uuid.uuid4().hex[:12]
+        self.endpoint = endpoint
+        self.conversation_id = conversation_id
+        self.created_at = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        self.probe = Probe()
+        self._profiler = cProfile.Profile()
+        self._started = time.monotonic()
+        self._cpu_ms = 0.0
+        self._slices = 0
+        self.finished = False
+        _trace_acquire()
+        self._snapshot = tracemalloc.take_snapshot()
+
+    def active(self) -> "_Slice":
+        return _Slice(self)
+
+    def wrap(self, events: Generator[Tuple[str, Any], None, None]) -> Generator[Tuple[str, Any], None, None]:
+        """Profile every step of `events`; stamp the report id on the terminal taskStatus."""
+
+        try:
+            while True:
+                with self.active():
+                    try:
+                        event, data = next(events)
+                    except StopIteration:
+                        return
+                if isinstance(data, dict) and data.get("type") == "agentToUi/taskStatus":
+                    payload = data.get("payload") or {}
+                    if payload.get("phase") in _TERMINAL_PHASES:
+                        # Finish first, so a client reacting to this status can fetch the report.
+                        self.finish()
+                        data = dict(data, meta=dict(data.get("meta") or {}, profileId=self.id))
+                yield event, data
+        finally:
+            events.close()
+            self.finish()
+
+    def finish(self) -> Optional[Dict[str, Any]]:
+        if self.finished:
+            return None
+        self.finished = True
+        try:
+            after = tracemalloc.take_snapshot()
+            peak_kb = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        finally:
+            _trace_release()
+        report = {
+            "id": self.id,
+            "endpoint": self.endpoint,
+            "conversationId": self.conversation_id,
+            "createdAt": self.created_at,
+            "wallMs": int((time.monotonic() - self._started) * 1000),
+            "profiledCpuMs": round(self._cpu_ms, 1),
+            "slices": self._slices,
+            "pipeline": self.probe.to_dict(),
+            "functions": _top_functions(self._profiler),
+            "memory": {"tracedPeakKB": peak_kb, "topDiff": _top_allocations(self._snapshot, after)},
+        }
+        self._snapshot = None  # type: ignore[assignment]
+        _store(_cap(report))
+        metrics.observe("ops.profile_wall_ms", report["wallMs"], endpoint=self.endpoint)
+        return report
+
+
+class _Slice:
+    def __init__(self, session: ProfileSession) -> None:
+        self.session = session
+        self.cpu0 = 0.0
+
+    def __enter__(self) -> None:
+        self.cpu0 = time.thread_time()
+        self.session._profiler.enable()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.session._profiler.disable()
+        self.session._cpu_ms += (time.thread_time() - self.cpu0) * 1000
+        self.session._slices += 1
+
+
+def _top_functions(profiler: cProfile.Profile) -> List[Dict[str, Any]]:
+    try:
+        stats = pstats.Stats(profiler)
+    except TypeError:  # nothing was recorded
+        return []
+    rows = []
+    for (filename, line, name), (_cc, ncalls, tottime, cumtime, _callers) in stats.stats.items():  # type: ignore[attr-defined]
+        rows.append(
+            {
+                "function": f"{_short_path(filename)}:{line}({name})",
+                "calls": ncalls,
+                "ownMs": round(tottime * 1000, 3),
+                "cumMs": round(cumtime * 1000, 3),
+            }
+        )
+    rows.sort(key=lambda r: r["cumMs"], reverse=True)
+    return rows[:TOP_FUNCTIONS]
+
+
+def _top_allocations(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot) -> List[Dict[str, Any]]:
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+    diff = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+    out = []
+    for stat in diff[:TOP_ALLOCATIONS]:
+        frame = stat.traceback[0]
+        out.append(
+            {
+                "where": f"{_short_path(frame.filename)}:{frame.lineno}",
+                "sizeDiffKB": round(stat.size_diff / 1024, 1),
+                "countDiff": stat.count_diff,
+            }
+        )
+    return out
+
+
+def _short_path(filename: str) -> str:
+    for marker in ("/dwebapp/", "/site-packages/", "/lib/python"):
+        i = filename.rfind(marker)
+        if i >= 0:
+            return filename[i + 1 :]
+    return filename
+
+
+def _cap(report: Dict[str, Any]) -> Dict[str, Any]:
+    """Trim the function / allocation tables until the report fits MAX_BYTES."""
+
+    functions, top_diff = report["functions"], report["memory"]["topDiff"]
+    while len(json.dumps(report, ensure_ascii=False).encode("utf-8")) > MAX_BYTES and (functions or top_diff):
+        if len(functions) >= len(top_diff):
+            functions.pop()
+        else:
+            top_diff.pop()
+        report["truncated"] = True
+    return report
+
+
+_LOCK = threading.Lock()
+_REPORTS: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+def _store(report: Dict[str, Any]) -> None:
+    with _LOCK:
+        _REPORTS[report["id"]] = report
+        while len(_REPORTS) > max(1, KEEP):
+            _REPORTS.popitem(last=False)
+
+
+def get_report(report_id: str) -> Optional[Dict[str, Any]]:
+    with _LOCK:
+        return _REPORTS.get(report_id)
+
+
+def list_reports() -> List[Dict[str, Any]]:
+    keys = ("id", "endpoint", "conversationId", "createdAt", "wallMs", "profiledCpuMs")
+    with _LOCK:
+        return [{k: r.get(k) for k in keys} for r in reversed(_REPORTS.values())]
@@ -1,15 +1,25 @@
 from __future__ import annotations
 
 import json
-from typing import Any, Dict, List, Optional
+from functools import lru_cache
+from typing import AbstractSet, Any, Dict, FrozenSet, List, Optional, Tuple
 
 
-def build_agent_to_ui_jsonl_system_parts(
-    *,
-    default_intent: str,
-    viewport: Optional[Dict[str, Any]] = None,
-) -> List[str]:
-    """System prompt parts for AgentToUI JSONL mode.
+# Fragment tags. "core" fragments are sent on every turn and always come first
+# (in declaration order), so the system prompt keeps a stable, cacheable prefix;
+# the other fragments are only included when the request scope asks for a tag.
+_CORE = ("core",)
+_INSERT = ("insert",)
+# Dialect tags (see compact_dialect.py): a fragment tagged with one dialect is left out of the other's prompt.
+_DIALECT_TAGS = ("verbose", "compact")
+# Layout tags (see stage/layout.py): with auto layout the hand-computed container sizing rules are left out.
+_LAYOUT_TAGS = ("manual_layout", "auto_layout")
+ALL_SCOPE_TAGS = frozenset({"insert", "modify", "delete", "filter", "text", "layout", "mount", "login"})
+
+
+@lru_cache(maxsize=8)
+def _rule_fragments(default_intent: str) -> Tuple[Tuple[str, Tuple[str, ...], str], ...]:
+    """Every (fragment_id, tags, text) rule fragment, in declaration order.
 
     Goals:
     - Maximum format stability (strict JSONL, no extra text)
@@ -17,19 +27,24 @@ def build_agent_to_ui_jsonl_system_parts(
     - Ensure templates pass validation (props must be object)
     """
 
-    parts: List[str] = []
+    fragments: List[Tuple[str, Tuple[str, ...], str]] = []
+
+    def add(fragment_id: str, tags: Tuple[str, ...], text: str) -> None:
+        fragments.append((fragment_id, tags, text))
 
     # Hard formatting constraints
-    parts.append("你必须只输出 JSONL（每行一个 JSON 对象），禁止输出任何非 JSON 内容。")
-    parts.append("重要：你输出的每一个字符都必须属于某一行 JSON 对象；不得输出中文说明/前缀/后缀/空行。")
-    parts.append("如果你想‘说一句话’，也必须用 agentToUi/chatMessage 的 payload.content 来说，仍然要用 JSONL 输出。")
-    parts.append("禁止输出 Markdown/代码块（例如 ```json ... ```）。")
-    parts.append("不要输出多行美化 JSON；每个 envelope 必须独立占一行。")
-    parts.append("每一行必须是完整的 AgentToUI envelope：必须包含 schemaVersion=1,type,id,createdAt,payload。")
-    parts.append("不要把 JSON 再包进字符串里（禁止输出带转义的 JSON 字符串）。必须输出原生 JSON 对象行。")
-    parts.append("每行行尾必须换行（\\n）。允许多行（多个 envelope），但不允许空行。")
-
-    parts.append(
+    add("format", _CORE, "你必须只输出 JSONL（每行一个 JSON 对象），禁止输出任何非 JSON 内容。")
+    add("format", _CORE, "重要：你输出的每一个字符都必须属于某一行 JSON 对象；不得输出中文说明/前缀/后缀/空行。")
+    add("format", _CORE, "如果你想‘说一句话’，也必须用 agentToUi/chatMessage 的 payload.content 来说，仍然要用 JSONL 输出。")
+    add("format", _CORE, "禁止输出 Markdown/代码块（例如 ```json ... ```）。")
+    add("format", _CORE, "不要输出多行美化 JSON；每个 envelope 必须独立占一行。")
+    add("format", _CORE + ("verbose",), "每一行必须是完整的 AgentToUI envelope：必须包含 schemaVersion=1,type,id,createdAt,payload。")
+    add("format", _CORE, "不要把 JSON 再包进字符串里（禁止输出带转义的 JSON 字符串）。必须输出原生 JSON 对象行。")
+    add("format", _CORE, "每行行尾必须换行（\\n）。允许多行（多个 envelope），但不允许空行。")
+
+    add(
+        "text_fields",
+        _CORE,
         "文本字段禁止夹带 JSON（强制规则）：\n"
         "- 对于任何‘用户可见文本’字段（包括但不限于 agentToUi/chatMessage.payload.content、agentToUi/text.payload.text、任何 error/message 字段）：\n"
         "  - 禁止出现 '{' '}' '[' ']' 或类似 JSON 的片段。\n"
@@ -39,7 +54,9 @@ def build_agent_to_ui_jsonl_system_parts(
     )
 
     # Message ordering conventions
-    parts.append(
+    add(
+        "ordering",
+        _INSERT,
         "当你要输出可插入舞台的图形产物时：\n"
         "1) 必须先输出一条对话描述：type=agentToUi/chatMessage，payload.content 用中文说明你将插入什么、插入到哪里（简短即可）。\n"
         f"2) 然后输出一条图形产物：type=agentToUi/componentTemplate，payload.intent=\"{default_intent}\"，并提供 payload.template。\n"
@@ -48,7 +65,9 @@ def build_agent_to_ui_jsonl_system_parts(
         "4) 不要在 chatMessage 里粘贴模板 JSON（也不要输出任何带花括号的片段）。"
     )
 
-    parts.append(
+    add(
+        "envelope_kinds",
+        _CORE,
         "插入方式（两种都允许，推荐按复杂度选择）：\n"
         "A) agentToUi/componentTemplate：用于插入一个‘模块/组件’，支持模板内部 parentLocalId 组装树；也支持 payload.parentId/layerId 增量挂载到舞台已有父节点。\n"
         "B) agentToUi/insertNode：用于快速追加一个节点或一小棵节点树（单步落地），不要求 ComponentTemplate 结构；也支持 payload.parentId/layerId 增量挂载。\n"
@@ -57,7 +76,9 @@ def build_agent_to_ui_jsonl_system_parts(
         "D) agentToUi/deleteNode：用于按 nodeId 精确删除已存在节点（避免自检时通过新增覆盖导致错乱）。"
     )
 
-    parts.append(
+    add(
+        "patch_delete",
+        ("insert", "modify", "delete"),
         "节点精确修改/删除（用于自检修正；强制优先）：\n"
         "- 当你在自检阶段发现问题（尺寸、位置、样式、文案等），你必须优先使用以下消息按 id 修正，而不是新建节点：\n"
         "  - agentToUi/patchNode：payload.nodeId 指向已存在舞台节点；payload.patch 支持 name/userType/transform/props 的局部 patch（只改提供字段）。\n"
@@ -68,7 +89,9 @@ def build_agent_to_ui_jsonl_system_parts(
     )
 
     # Schema / validation rules aligned with frontend validate.ts
-    parts.append(
+    add(
+        "schema",
+        _CORE,
         "你只能使用编辑器已支持的节点类型与字段命名（大小写必须一致）：\n"
         "- ComponentTemplate: schemaVersion=1, templateId, name, params, nodes, rootLocalId。\n"
         "- TemplateNode: localId(字符串)、type、parentLocalId(可选)、transform(可选)、props(必须)。\n"
@@ -84,7 +107,9 @@ def build_agent_to_ui_jsonl_system_parts(
         "注意：不要使用不存在的字段名，否则模板会校验失败。"
     )
 
-    parts.append(
+    add(
+        "root_style",
+        _INSERT,
         "根节点与样式（强制规则，避免生成‘空父节点+一个子节点就结束’）：\n"
         "- 任何插入舞台的 componentTemplate，都必须包含一个‘可作为容器’的根节点（强制使用 rect）。\n"
         "- rootLocalId 必须指向一个 rect（背景/卡片/画布容器）。\n"
@@ -95,7 +120,9 @@ def build_agent_to_ui_jsonl_system_parts(
         "- 除 text/image/line 等自身可视节点外：任何 rect 都必须有明确样式；不要依赖 CSS/HTML，这里只靠 props+transform 形成视觉。"
     )
 
-    parts.append(
+    add(
+        "parent_local_id",
+        _INSERT,
         "父子关系（parentLocalId）硬规则（非常重要，避免前端报 parentLocalId not found）：\n"
         "- parentLocalId 只能引用同一个 ComponentTemplate 内已声明的 TemplateNode.localId。\n"
         "- 禁止在 parentLocalId 里写舞台 nodeId（例如 login_card:root、tmpl_xxx:root 这种带冒号的实例化 id）。\n"
@@ -103,7 +130,9 @@ def build_agent_to_ui_jsonl_system_parts(
         "- 重要：parentLocalId 只用于模板内部组装树结构；如果你要把‘新模块’挂到舞台中已存在的父节点，请使用 componentTemplate 的 payload.parentId（见下）。"
     )
 
-    parts.append(
+    add(
+        "mount",
+        ("mount",),
         "增量挂载（允许分模块分步追加，替代‘必须整棵树’规则）：\n"
         "- 你可以分多次输出 agentToUi/componentTemplate 来逐步完善界面（每次落地一个模块）。\n"
         "- 当你需要把新模块挂到舞台上已存在的父节点下：\n"
@@ -112,14 +141,18 @@ def build_agent_to_ui_jsonl_system_parts(
         "- 如果 parentId 指向的舞台节点不存在，本次插入会回退到默认 root/顶层；因此在使用 parentId 前，应先在 chatMessage 里说明你要挂到哪个节点，并确保该节点已在 contextPack.stage 中存在。"
     )
 
-    parts.append(
+    add(
+        "modules",
+        _INSERT,
         "模块化分步落地（强制完成所有模块）：\n"
         "- 当你在 chatMessage 里列出模块（例如 4~6 个区域），你必须逐个模块输出对应的 componentTemplate/applyFilter，直到全部完成。\n"
         "- 不允许只落地第一个模块就进入‘完成’或只输出 taskStatus。\n"
         "- 若你必须缩减：也必须一次性输出‘完整但更简单’的版本（至少包含：背景容器 + 主标题 + 2 个内容区域）。"
     )
 
-    parts.append(
+    add(
+        "text_nodes",
+        ("text",),
         "文本节点（text）的关键规则（非常重要）：\n"
         "- textContent 支持换行：使用 \\n（反斜杠+n）表示多行。\n"
         "- 编辑器会根据 textContent/fontSize/fontStyle/textAlign 自动计算文本节点的宽高；因此：\n"
@@ -128,11 +161,17 @@ def build_agent_to_ui_jsonl_system_parts(
         "- textAlign 只允许 left/center/right 三个值；缺省时会被视为 center。"
     )
 
-    parts.append(
+    add(
+        "workflow",
+        _INSERT,
         "模块化分步落地 + 自检回合（强制工作流）：\n"
         "- 对于任何需要生成/修改舞台节点的任务，你必须按‘拆分 → 逐步落地 → 自检’执行。\n"
         "- 第一步（拆分模块）：先输出一条 agentToUi/taskStatus，payload.message=\"拆分模块…\"；再输出一条 agentToUi/chatMessage，用中文列出 2~5 个步骤（不要贴 JSON）。\n"
-        "- 第二步（逐步落地）：每落地一个模块，都先输出 taskStatus（message=\"落地：<模块名>\"），再输出必要的 componentTemplate/applyFilter。\n"
+        "- 第二步（逐步落地）：每落地一个模块，都先输出 taskStatus（message=\"落地：<模块名>\"），再输出必要的 componentTemplate/applyFilter。"
+    )
+    add(
+        "workflow",
+        ("insert", "manual_layout"),
         "- 第三步（自检）：输出 taskStatus（message=\"自检…\"），你必须重新阅读你本次输出/插入的所有节点（逐个 localId / nodeId 检查），至少包含以下强制检查项：\n"
         "  1) parentLocalId 合法性：每个 parentLocalId 都必须引用同模板内已声明的 localId；rootLocalId 的节点不得有 parentLocalId。\n"
         "  2) props 完整性：每个节点必须有 props:{}（对象），不能缺失/为 null。\n"
@@ -144,21 +183,35 @@ def build_agent_to_ui_jsonl_system_parts(
         "    - 容器 B：minWidth=..., minHeight=...（含 padding）\n"
         "  - 注意：这里只能写中文说明 + 数字结论，禁止粘贴任何 JSON/节点对象。\n"
         "  - 若发现任何一项不满足：你必须继续输出对应的 componentTemplate/insertNode 修正，修正后再次自检，直到满足为止；禁止在未满足时输出‘完成/自检通过’。\n"
-        "  - 若全部满足：再输出 chatMessage 说明‘自检通过’。\n"
-        "- 注意：仍然必须遵守 JSONL 约束；每行一个完整 envelope；禁止输出 Markdown/代码块。"
+        "  - 若全部满足：再输出 chatMessage 说明‘自检通过’。"
     )
+    add(
+        "workflow",
+        ("insert", "auto_layout"),
+        "- 第三步（自检）：输出 taskStatus（message=\"自检…\"），只检查 parentLocalId 合法性与 props 完整性（每个节点都有 props:{}）；"
+        "用 layout 排版的容器尺寸与子节点坐标由后端求解，不需要核算 minWidth/minHeight。通过后输出 chatMessage 说明‘自检通过’。",
+    )
+    add("workflow", _INSERT, "- 注意：仍然必须遵守 JSONL 约束；每行一个完整 envelope；禁止输出 Markdown/代码块。")
 
-    parts.append(
+    add(
+        "layout",
+        ("insert", "layout"),
         "布局与坐标（非常重要）：\n"
         "- 这不是 CSS/HTML：你必须通过 transform.x/y/width/height 等数值来排版与美化。\n"
         "- 父子关系下：子节点 transform.x/y 的 (0,0) 原点是父节点的中心点。\n"
         "  例：把某个子矩形居中放在父容器里：transform:{x:0,y:0,width:...,height:...}。\n"
         "  例：把子节点放到父容器左上角（带 padding）：设父容器宽W高H，则左上角约为 (-W/2, -H/2)，再加 padding。\n"
-        "- 为了输出更稳定、更可控：生成可视节点时，建议显式给出完整 props 字段（rect/text/image/line 的所有可配置项），即使使用默认值。\n"
         "- 注意边框：rect 的 borderWidth 会影响视觉占用，请给出合理的 borderWidth 与 cornerRadius。"
     )
+    add(
+        "layout",
+        ("insert", "layout", "verbose"),
+        "- 为了输出更稳定、更可控：生成可视节点时，建议显式给出完整 props 字段（rect/text/image/line 的所有可配置项），即使使用默认值。",
+    )
 
-    parts.append(
+    add(
+        "container_size",
+        ("insert", "manual_layout"),
         "容器尺寸硬规则（用于避免‘父节点小于子节点’导致组合错位；强制执行）：\n"
         "- 只要一个节点‘有子节点’，该节点就必须显式给出 transform.width/height，并且能完全包裹其子节点的内容。\n"
         "  - 判定‘有子节点’：在 template.nodes 中，存在任意节点的 parentLocalId 指向它；或在 insertNode 的 node.children 中它拥有 children。\n"
@@ -176,7 +229,24 @@ def build_agent_to_ui_jsonl_system_parts(
         "- 即使父容器只是为了层级组织（不需要可视样式），仍然必须满足上述最小宽高要求。"
     )
 
-    parts.append(
+    add(
+        "auto_layout",
+        ("insert", "layout", "auto_layout"),
+        "自动布局（本轮启用；推荐用于卡片、表单、列表等规则排版，代替手算坐标与容器尺寸）：\n"
+        "- 在容器 rect 的模板节点上写 layout 字段（与 transform/props 同级），后端会在下发前算出它和子节点的 transform.x/y/width/height：\n"
+        '  {"localId":"card","type":"rect","layout":{"type":"vstack","gap":16,"padding":[24,32],"align":"stretch"},"transform":{"x":0,"y":0,"width":520},"props":{...}}\n'
+        "- type：vstack（子节点按 nodes 顺序从上到下）| hstack（从左到右）；gap：相邻子节点间距；padding：数字 | [上下,左右] | [上,右,下,左]。\n"
+        "- align（交叉轴）：start | center | end | stretch（rect/image/子容器拉满宽度或高度；text 按 textAlign 对齐）。\n"
+        "- justify（主轴，容器比内容大时）：start | center | end | space-between。\n"
+        "- 容器省略 transform.width/height 时按内容自动撑开（也可写 fit:\"content\"）；写了宽高则按给定值排版。\n"
+        "- 布局容器的子节点不要写 transform.x/y（写了也会被覆盖）；需要自由定位的子节点写 layout:{\"position\":\"absolute\"} 并给出 x/y。\n"
+        "- 布局容器可以嵌套（例如 vstack 卡片里放一个 hstack 按钮行）；根节点仍要给出 transform.x/y（放在目标位置）。\n"
+        "- 紧凑格式下把同一个 layout 对象写在模板节点的 lo 字段里。",
+    )
+
+    add(
+        "login_tips",
+        ("login",),
         "登录框组件美化建议（用于生成更合理美观的节点组合）：\n"
         "- 建议结构：root(rect) → title(text) + input1(rect+text) + input2(rect+text) + button(rect+text)。\n"
         "- 推荐尺寸（可按 viewport 调整）：card 宽 520~680，高 520~620，圆角 12~18，边框 1~2。\n"
@@ -186,69 +256,159 @@ def build_agent_to_ui_jsonl_system_parts(
         "- 输入框：用 rect 表示输入区域（浅色边框或更深底色），再用 text 表示 placeholder/label。"
     )
 
-    parts.append(
+    add(
+        "node_ids",
+        _CORE,
         "节点 id 约定（用于后续精确编辑）：\n"
         "- 前端会将每个模板节点实例化为舞台节点，并使用 nodeId = `${templateId}:${localId}`（如冲突会自动加后缀）。\n"
         "- 因此，当你需要在后续消息里引用某个已插入节点时：请优先使用这个约定生成 nodeId，并在 agentToUi/applyFilter 中使用 target=\"nodeId\" + nodeId 字段。"
     )
 
     # Examples
-    parts.append(
+    add(
+        "example_template",
+        ("insert", "verbose"),
         "示例（仅示意）：\n"
         '{"schemaVersion":1,"type":"agentToUi/chatMessage","id":"...","createdAt":"...","payload":{"content":"我将插入一个标题文本到舞台左上角。"}}\n'
         '{"schemaVersion":1,"type":"agentToUi/componentTemplate","id":"...","createdAt":"...","payload":{"intent":"insert","template":{"schemaVersion":1,"templateId":"tmpl_1","name":"AI标题","params":[],"nodes":[{"localId":"root","type":"text","props":{"textContent":"Hello","fontSize":48,"fontColor":"#ffffff"},"transform":{"x":40,"y":40}}],"rootLocalId":"root"}}}\n'
     )
 
-    parts.append(
+    add(
+        "example_insert_node",
+        ("insert", "verbose"),
         "insertNode 示例（单节点追加到舞台；适合分步骤落地）：\n"
         '{"schemaVersion":1,"type":"agentToUi/chatMessage","id":"...","createdAt":"...","payload":{"content":"我将追加一个按钮矩形到舞台中央。"}}\n'
         '{"schemaVersion":1,"type":"agentToUi/insertNode","id":"...","createdAt":"...","payload":{"node":{"category":"user","userType":"rect","name":"Button","transform":{"x":0,"y":0,"width":240,"height":56,"rotation":0,"opacity":1},"props":{"fillColor":"#3aa1ff","fillOpacity":1,"borderColor":"#3aa1ff","borderOpacity":1,"borderWidth":1,"cornerRadius":12}}}}\n'
     )
 
-    parts.append(
+    add(
+        "example_mount",
+        ("mount", "verbose"),
         "insertNode 增量挂载示例（把单节点挂到舞台已存在父节点下）：\n"
         '{"schemaVersion":1,"type":"agentToUi/chatMessage","id":"...","createdAt":"...","payload":{"content":"我将把一个标题文本挂到已存在的 login_card:root 下面。"}}\n'
         '{"schemaVersion":1,"type":"agentToUi/insertNode","id":"...","createdAt":"...","payload":{"parentId":"login_card:root","node":{"category":"user","userType":"text","name":"Title","transform":{"x":0,"y":-220,"rotation":0,"opacity":1},"props":{"textContent":"欢迎登录","fontSize":36,"fontColor":"#ffffff","fontStyle":"normal","textAlign":"center"}}}}\n'
         "说明：insertNode 的 parentId 是舞台 nodeId；如果要插入多节点形成树，可以在 node.children 里提供子节点。"
     )
 
-    parts.append(
-        "增量挂载示例（把新模块挂到已存在的舞台父节点下）：\n"
-        '{"schemaVersion":1,"type":"agentToUi/chatMessage","id":"...","createdAt":"...","payload":{"content":"我将把‘登录按钮’模块挂到已存在的 login_card:root 节点下面。"}}\n'
-        '{"schemaVersion":1,"type":"agentToUi/componentTemplate","id":"...","createdAt":"...","payload":{"intent":"insert","parentId":"login_card:root","template":{"schemaVersion":1,"templateId":"tmpl_login_btn","name":"登录按钮模块","params":[],"nodes":['
-        '{"localId":"root","type":"rect","props":{"fillColor":"#000000","fillOpacity":0,"borderColor":"#000000","borderOpacity":0,"borderWidth":0,"cornerRadius":0},"transform":{"x":0,"y":180,"width":400,"height":80}},'
-        '{"localId":"btn","type":"rect","parentLocalId":"root","transform":{"x":0,"y":0,"width":360,"height":56},"props":{"fillColor":"#3aa1ff","fillOpacity":1,"borderColor":"#3aa1ff","borderOpacity":1,"borderWidth":1,"cornerRadius":12}},'
-        '{"localId":"btn_text","type":"text","parentLocalId":"root","transform":{"x":0,"y":0},"props":{"textContent":"登录","fontSize":18,"fontColor":"#ffffff","fontStyle":"normal","textAlign":"center"}}'
-        '],"rootLocalId":"root"}}}\n'
-        "说明：payload.parentId 是舞台 nodeId（来自已插入节点的 templateId:localId），而 parentLocalId 仍然只引用模板内部 localId。"
+    add(
+        "instantiate_template",
+        ("insert",),
+        "批量实例化（同一个模板重复插入多份，例如 500 个思维导图节点、一排卡片）：不要把模板重复输出 N 次。\n"
+        "- 先输出一次 componentTemplate（用 params 声明可变参数，节点里写 {{key}} 占位符，例如 textContent:\"{{title}}\"、transform.x:\"{{x}}\"）；"
+        "或直接引用模板库里的 templateId。\n"
+        "- 再输出一条 agentToUi/instantiateTemplate：payload.templateId 为模板 id，payload.rows 为参数行数组（每行一个实例；行里的 $x/$y 指定该实例根节点的位置），可选 parentId/layerId。\n"
+        "- 后端会把每一行展开成一条 insertNode，节点 id 为 `${templateId}:${localId}`，重复时加 __1、__2 …（第 1 行无后缀，第 2 行 __1，依此类推）。",
     )
-
-    parts.append(
-        "高级组件示例（推荐：rect 作为根容器，多个子节点组合）：\n"
-        '{"schemaVersion":1,"type":"agentToUi/chatMessage","id":"...","createdAt":"...","payload":{"content":"我将插入一个带背景卡片和标题的组件到舞台中央。"}}\n'
-        '{"schemaVersion":1,"type":"agentToUi/componentTemplate","id":"...","createdAt":"...","payload":{"intent":"insert","template":{"schemaVersion":1,"templateId":"tmpl_card","name":"卡片标题组件","params":[],"nodes":['
-        '{"localId":"root","type":"rect","props":{"fillColor":"#1e1e1e","fillOpacity":1,"borderColor":"#3c3c3c","borderOpacity":1,"borderWidth":2,"cornerRadius":12},"transform":{"x":0,"y":0,"width":520,"height":160}},'
-        '{"localId":"title","type":"text","parentLocalId":"root","transform":{"x":-236,"y":-52},"props":{"textContent":"标题","fontSize":40,"fontColor":"#ffffff","fontStyle":"normal"}}'
-        '],"rootLocalId":"root"}}}}\n'
-        "说明：root(rect) 的 x/y 应该放在目标位置（如 viewport.centerWorld）；子节点的 (0,0) 是父节点中心。"
+    add(
+        "instantiate_template",
+        ("insert", "verbose"),
+        '示例：{"schemaVersion":1,"type":"agentToUi/instantiateTemplate","id":"...","createdAt":"...","payload":{"templateId":"tmpl_mind_node","rows":[{"title":"目标","$x":0,"$y":0},{"title":"计划","$x":300,"$y":0}]}}',
+    )
+    add(
+        "instantiate_template",
+        ("insert", "compact"),
+        '紧凑格式下这条消息照常写 type/payload（可省略 schemaVersion/id/createdAt）：{"type":"agentToUi/instantiateTemplate","payload":{"templateId":"tmpl_mind_node","rows":[{"title":"目标","$x":0,"$y":0}]}}',
     )
 
     # Editor command: applyFilter
-    parts.append(
+    add(
+        "apply_filter",
+        ("filter",),
         "当用户要求修改已选中节点（例如：添加发光/模糊滤镜）时，不要输出 componentTemplate。改为输出编辑器动作：\n"
         "1) 先输出 chatMessage 简短说明你将做什么。\n"
         "2) 再输出 type=agentToUi/applyFilter，payload.target=\"selection\"，payload.mode=\"append\"，payload.filter 为滤镜对象。\n"
         "滤镜对象示例（发光）：{\"type\":\"glow\",\"color\":\"#00ffff\",\"intensity\":1,\"blurX\":18,\"blurY\":18,\"inner\":false,\"knockout\":false}"
     )
 
-    parts.append(
+    add(
+        "glow_line",
+        ("filter",),
         "发光滤镜的可视强度规则（针对 line 线条；强制建议）：\n"
         "- 如果你给线条（type=line）添加 glow，并且 blurX=5 且 blurY=5（默认值）：则 intensity 应从 1.5 开始（>=1.5），否则发光几乎不可见。\n"
         "- 当用户未明确要求 intensity 时：对线条的 glow 请默认使用 intensity=4（blurX/blurY 若未指定则默认 5）。"
     )
 
+    # Compact output dialect: replaces the full-envelope line format and the verbose examples.
+    from ..compact_dialect import prop_legend
+
+    add(
+        "compact_dialect",
+        _CORE + ("compact",),
+        "紧凑输出格式（本轮启用；每行一个 JSON 对象，后端会补全 schemaVersion/id/createdAt/source 与默认属性，展开成完整 AgentToUI envelope）：\n"
+        "- 不要输出 schemaVersion/type/id/createdAt/payload；用 t 表示消息类型：\n"
+        '  - t=m 对话：{"t":"m","c":"说明文字"}\n'
+        '  - t=s 进度：{"t":"s","m":"落地：标题"}\n'
+        '  - t=c 组件模板：{"t":"c","id":"templateId","n":"名称","ns":[节点...]}，ns[0] 为根节点；可选 p=舞台 parentId，l=layerId。\n'
+        '  - t=n 追加节点（insertNode）：{"t":"n","p":"舞台 parentId(可选)","nd":{"k":"r","n":"名称","x":[...],"p":{...},"ch":[子节点...]}}\n'
+        '  - t=u 修改节点（patchNode）：{"t":"u","id":"nodeId","x":{"x":0,"w":320}（只写要改的 x/y/w/h/r/o）,"p":{只写要改的属性},"n":"新名称"}\n'
+        '  - t=d 删除节点：{"t":"d","id":"nodeId"} 或 {"t":"d","ids":["a","b"]}\n'
+        '  - t=f 滤镜（applyFilter）：{"t":"f","f":{滤镜对象}}（作用于选中节点；加 "id":"nodeId" 则作用于指定节点）\n'
+        '- 模板节点：{"i":"localId","k":"r|t|i|l","pa":"父 localId","x":[x,y,w,h],"p":{属性}}；根节点不写 pa；text 可只写 [x,y]；需要旋转/透明度时写 [x,y,w,h,rotation,opacity]。\n'
+        "- 属性用短名；与默认值（括号内）相同的属性省略不写，后端会补全：\n"
+        + prop_legend()
+        + "\n- line 的 ax/ay 省略时为起止点中点（直线）；sx/ex 省略时按宽度留 12 像素边距。\n"
+        "示例：\n"
+        '{"t":"m","c":"我将在舞台中央插入一个标题卡片。"}\n'
+        '{"t":"c","id":"tmpl_title","n":"标题卡片","ns":[{"i":"root","k":"r","x":[0,0,480,160],"p":{"fc":"#1e1e1e","bc":"#3c3c3c","bw":1,"cr":12}},{"i":"title","k":"t","pa":"root","x":[0,0],"p":{"tx":"欢迎","fs":36}}]}',
+    )
+
+    return tuple(fragments)
+
+
+@lru_cache(maxsize=256)
+def _scoped_rule_parts(
+    default_intent: str, scope: Optional[FrozenSet[str]], dialect: str = "verbose", auto_layout: bool = False
+) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """(rule texts, fragment ids) for one scope, output dialect and layout mode; core fragments first."""
+
+    parts: List[str] = []
+    ids: List[str] = []
+    fragments = _rule_fragments(default_intent)
+    layout_tag = "auto_layout" if auto_layout else "manual_layout"
+    for want_core in (True, False):
+        for fragment_id, tags, text in fragments:
+            if ("core" in tags) != want_core:
+                continue
+            if any(t in tags and t != dialect for t in _DIALECT_TAGS):
+                continue
+            if any(t in tags and t != layout_tag for t in _LAYOUT_TAGS):
+                continue
+            if not want_core and scope is not None and not scope.intersection(tags):
+                continue
+            parts.append(text)
+            if fragment_id not in ids:
+                ids.append(fragment_id)
+    return tuple(parts), tuple(ids)
+
+
+def build_agent_to_ui_jsonl_system_parts(
+    *,
+    default_intent: str,
+    viewport: Optional[Dict[str, Any]] = None,
+    scope: Optional[AbstractSet[str]] = None,
+    used_fragments: Optional[List[str]] = None,
+    dialect: str = "verbose",
+    auto_layout: bool = False,
+) -> List[str]:
+    """System prompt parts for AgentToUI JSONL mode.
+
+    `scope` selects the tagged rule fragments for this turn (None = all of them);
+    ids of the included fragments are appended to `used_fragments`. With
+    `auto_layout` the model is taught layout intents (stage/layout.py) instead
+    of hand-computing container sizes. The rule text per (default_intent,
+    scope, dialect, auto_layout) is assembled once and cached; only the
+    viewport part is built per request.
+    """
+
+    rule_parts, ids = _scoped_rule_parts(
+        default_intent, frozenset(scope) if scope is not None else None, dialect, auto_layout
+    )
+    parts = list(rule_parts)
+    if used_fragments is not None:
+        used_fragments.extend(i for i in ids if i not in used_fragments)
+
     # Viewport context
-    if isinstance(viewport, dict) and viewport: 
+    if isinstance(viewport, dict) and viewport:
         parts.append(
             "舞台坐标系说明：\n"
             "- world 坐标单位为像素（zoom=1 时）。\n"
@@ -259,3 +419,42 @@ def build_agent_to_ui_jsonl_system_parts(
         parts.append("viewport(JSON):\n" + json.dumps(viewport, ensure_ascii=False))
 
     return parts
+
+
+def build_few_shot_part(
+    content: str, *, token_budget: int, max_examples: int = 3, dialect: str = "verbose"
+) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+    """Few-shot componentTemplate examples retrieved from the template library for this request.
+
+    Returns (prompt_part or None, report entries of the templates used).
+    In the compact dialect the examples are rewritten into compact lines.
+    """
+
+    from .template_library import get_template_library
+
+    picked = get_template_library().select_few_shot(content, max_examples=max_examples, token_budget=token_budget)
+    if not picked:
+        return None, []
+    report = [
+        {"templateId": t.template_id, "name": t.name, "score": round(score, 3), "tokens": t.example_tokens}
+        for t, score in picked
+    ]
+    part = (
+        "组件示例（按本次需求从模板库检索，仅示意结构与排版思路；文案/尺寸/颜色按用户需求调整，不要照抄）：\n"
+        + "\n".join(_compact_example(t.example) if dialect == "compact" else t.example for t, _ in picked)
+        + "\n说明：root(rect) 的 x/y 应该放在目标位置（如 viewport.centerWorld）；子节点的 (0,0) 是父节点中心；"
+        "payload.parentId 是舞台 nodeId，而 parentLocalId 只引用模板内部 localId。"
+    )
+    return part, report
+
+
+@lru_cache(maxsize=64)
+def _compact_example(example: str) -> str:
+    from ..compact_dialect import compress
+
+    lines = []
+    for line in example.splitlines():
+        env = json.loads(line)
+        short = compress(env)
+        lines.append(json.dumps(short if short is not None else env, ensure_ascii=False, separators=(",", ":")))
+    return "\n".join(lines)
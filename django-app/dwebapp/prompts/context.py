@@ -0,0 +1,83 @@
+"""Viewport- and selection-aware trimming of the contextPack for large canvases.
+
+Up to DWEB_CONTEXT_NODE_BUDGET nodes the active layer is sent as-is. Above
+that, its nodeTree is replaced by the nodes inside / near the viewport and the
+selection plus their ancestor chains, and the rest is summarized as counts per
+compass region around the viewport (see stage/spatial.py). 0 disables it.
+
+In stage-tools mode (see stage/tools.py) the nodeTree is not sent at all:
+summarize_context_pack replaces it with counts, bounds and the top-level
+nodes, and the model looks up the rest through tool calls.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+from ..stage.spatial import get_spatial_index, prune_node_tree, select_context, viewport_world_box
+
+if TYPE_CHECKING:
+    from ..stage.tools import StageTools
+
+CONTEXT_NODE_BUDGET = int(os.environ.get("DWEB_CONTEXT_NODE_BUDGET", "400"))
+
+
+def compact_context_pack(
+    context_pack: Any, viewport: Any, *, budget: Optional[int] = None
+) -> Tuple[Any, Optional[Dict[str, Any]]]:
+    """Return (context pack to send, report or None when left untouched)."""
+
+    budget = CONTEXT_NODE_BUDGET if budget is None else budget
+    if budget <= 0 or not isinstance(context_pack, dict):
+        return context_pack, None
+    layer = context_pack.get("activeLayer")
+    if not isinstance(layer, dict) or not isinstance(layer.get("nodeTree"), list):
+        return context_pack, None
+
+    t0 = time.perf_counter()
+    index, hit = get_spatial_index(layer["nodeTree"])
+    if len(index) <= budget:
+        return context_pack, None
+
+    ids = context_pack.get("selectedNodeIds")
+    selected = [s for s in ids if isinstance(s, str)] if isinstance(ids, list) else []
+    picked = select_context(index, view=viewport_world_box(viewport), selected_ids=selected, budget=budget)
+    omitted = {
+        "note": "画布节点过多：nodeTree 只保留视口/选中节点附近的节点及其祖先链；其余节点按区域计数，如需操作请先让用户选中或移动视口。",
+        "totalNodes": len(index),
+        "keptNodes": len(picked.keep),
+        "focusBox": [round(v, 1) for v in picked.focus] if picked.focus else None,
+        "regions": picked.regions,
+    }
+    pack = dict(context_pack)
+    pack["activeLayer"] = dict(layer, nodeTree=prune_node_tree(layer["nodeTree"], index, picked.keep), omitted=omitted)
+    report = {
+        "totalNodes": len(index),
+        "keptNodes": len(picked.keep),
+        "regions": len(picked.regions),
+        "indexCache": "hit" if hit else "miss",
+        "ms": round((time.perf_counter() - t0) * 1000, 2),
+    }
+    return pack, report
+
+
+def summarize_context_pack(context_pack: Dict[str, Any], tools: "StageTools") -> Dict[str, Any]:
+    """contextPack with the active layer's nodeTree replaced by a tool-mode summary."""
+
+    pack = dict(context_pack)
+    layer = pack.get("activeLayer") if isinstance(pack.get("activeLayer"), dict) else {}
+    pack["activeLayer"] = {
+        "id": layer.get("id"),
+        "name": layer.get("name"),
+        "summary": tools.summary(),
+        "note": "nodeTree 未随请求发送；需要节点详情时调用工具 get_node / list_children / find_nodes / subtree_bbox 查询。",
+    }
+    ids = pack.get("selectedNodeIds")
+    if isinstance(ids, list):
+        # The client ships full subtrees here; the tools can expand them on demand.
+        pack["selectedNodes"] = [
+            tools.describe(tools.index.index_of[i]) for i in ids if isinstance(i, str) and i in tools.index.index_of
+        ]
+    return pack
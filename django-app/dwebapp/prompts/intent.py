@@ -0,0 +1,103 @@
+"""Lightweight request classifier that scopes the JSONL rule fragments per turn.
+
+Signals: selection present, filter / delete / modify / insert keywords, text
+and login keywords, and the size of the active layer. No model call; a miss
+falls back to the "insert" scope, which carries the full generation rules.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet
+
+from ..stage.snapshot import count_nodes
+
+INTENT_CLASSES = ("insert", "modify", "delete", "filter")
+
+_FILTER_RE = re.compile(r"发光|辉光|光晕|glow|模糊|blur|滤镜|filter|阴影|shadow|描边光", re.I)
+_DELETE_RE = re.compile(r"删除|删掉|移除|去掉|清除|delete|remove", re.I)
+_MODIFY_RE = re.compile(
+    r"修改|改成|改为|改一下|调整|换成|变成|改色|颜色|字号|字体|大小|放大|缩小|加粗|移动|移到|挪|对齐|旋转|透明|圆角|边框|文案|重命名"
+    r"|recolor|colou?r|resize|move|rotate|rename|opacity|font",
+    re.I,
+)
+_INSERT_RE = re.compile(
+    r"插入|添加|新增|新建|生成|创建|做一个|做个|画|设计|加一个|加个|来一个|布局|页面|界面|模块|组件|卡片|图表"
+    r"|insert|add|create|make|draw|design|build|generate",
+    re.I,
+)
+_TEXT_RE = re.compile(r"文字|文本|标题|字号|字体|文案|段落|text|font|title|label", re.I)
+_LAYOUT_RE = re.compile(r"位置|移动|移到|挪|对齐|居中|间距|排版|布局|align|center|move|position|spacing", re.I)
+_LOGIN_RE = re.compile(r"登录|注册|登入|表单|login|sign ?in|sign ?up|form", re.I)
+
+
+@dataclass
+class RequestScope:
+    intent: str
+    tags: FrozenSet[str]
+    signals: Dict[str, Any] = field(default_factory=dict)
+
+
+def _selection_count(context_pack: Any) -> int:
+    if not isinstance(context_pack, dict):
+        return 0
+    ids = context_pack.get("selectedNodeIds")
+    return len(ids) if isinstance(ids, list) else 0
+
+
+def _active_layer_size(context_pack: Any) -> int:
+    if not isinstance(context_pack, dict):
+        return 0
+    layer = context_pack.get("activeLayer")
+    if not isinstance(layer, dict):
+        return 0
+    return count_nodes(layer.get("nodeTree"))
+
+
+def classify_request(content: str, context_pack: Any) -> RequestScope:
+    text = content or ""
+    selected = _selection_count(context_pack)
+    layer_size = _active_layer_size(context_pack)
+    has = {
+        "filter": bool(_FILTER_RE.search(text)),
+        "delete": bool(_DELETE_RE.search(text)),
+        "modify": bool(_MODIFY_RE.search(text)),
+        "insert": bool(_INSERT_RE.search(text)),
+        "text": bool(_TEXT_RE.search(text)),
+        "layout": bool(_LAYOUT_RE.search(text)),
+        "login": bool(_LOGIN_RE.search(text)),
+    }
+
+    # Edits only make sense against something that exists: a selection, or a
+    # non-empty layer the model can address by nodeId.
+    can_edit = selected > 0 or layer_size > 0
+    # "给选中节点加一个发光" reads as insert by keywords; a selection disambiguates.
+    if has["filter"] and can_edit and (selected > 0 or not has["insert"]):
+        intent = "filter"
+    elif has["delete"] and not has["insert"] and can_edit:
+        intent = "delete"
+    elif not has["insert"] and can_edit and (has["modify"] or selected > 0):
+        intent = "modify"
+    else:
+        intent = "insert"
+
+    tags = {intent}
+    if intent == "insert":
+        tags.add("text")
+        if layer_size > 0 or selected > 0:
+            tags.add("mount")
+        if has["filter"]:
+            tags.add("filter")
+    elif intent == "modify":
+        if has["text"]:
+            tags.add("text")
+        if has["layout"]:
+            tags.add("layout")
+        if has["filter"]:
+            tags.add("filter")
+    if has["login"]:
+        tags.add("login")
+
+    signals = {"selected": selected, "layerSize": layer_size, **{k: v for k, v in has.items() if v}}
+    return RequestScope(intent=intent, tags=frozenset(tags), signals=signals)
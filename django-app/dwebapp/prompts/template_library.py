@@ -0,0 +1,196 @@
+"""Server-side ComponentTemplate library used for few-shot retrieval.
+
+Templates are `*.template.json` files (same format as
+samples/components/mindnode_v1.template.json) with two optional extras that
+are stripped before a template is shown to the model:
+- tags: retrieval keywords (Chinese and English)
+- fewShot: {content, parentId?} used to render the example envelopes
+
+The bundled library lives next to this module; extra directories can be
+added with DWEB_TEMPLATE_LIBRARY_DIRS (os.pathsep separated).
+
+Retrieval is a small BM25-style inverted index over name, tags, description
+and node types. Chinese text is indexed as character unigrams + bigrams, so
+no segmenter is needed.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .tokens import estimate_tokens
+
+_BUNDLED_DIR = Path(__file__).resolve().parent / "templates"
+
+_FIELD_WEIGHTS = {"name": 3.0, "tags": 3.0, "description": 1.5, "types": 1.0}
+# Node types also match the words users actually type.
+_NODE_TYPE_TERMS = {
+    "rect": "rect 矩形 方框 卡片 背景 容器",
+    "text": "text 文字 文本 标题",
+    "image": "image 图片 图像 照片",
+    "line": "line 线 线条 连线 箭头",
+}
+_STOP = set("的了和与及在把将请帮我你个一是给让要用中上下里这那并再")
+_WORD_RE = re.compile(r"[a-z0-9]+|[一-鿿]+")
+_BM25_K1 = 1.2
+_LIBRARY_ONLY_KEYS = ("tags", "fewShot")
+
+
+def _terms(text: str) -> List[str]:
+    out: List[str] = []
+    for m in _WORD_RE.finditer(text.lower()):
+        w = m.group(0)
+        if w.isascii():
+            out.append(w)
+            continue
+        chars = list(w)
+        out.extend(c for c in chars if c not in _STOP)
+        out.extend(a + b for a, b in zip(chars, chars[1:]))
+    return out
+
+
+@dataclass
+class LibraryTemplate:
+    template_id: str
+    name: str
+    description: str
+    tags: List[str]
+    node_types: List[str]
+    template: Dict[str, Any]
+    example: str
+    example_tokens: int
+
+
+def _render_example(template: Dict[str, Any], few_shot: Dict[str, Any]) -> str:
+    content = str(few_shot.get("content") or f"我将插入「{template.get('name')}」。")
+    payload: Dict[str, Any] = {"intent": "insert"}
+    if isinstance(few_shot.get("parentId"), str):
+        payload["parentId"] = few_shot["parentId"]
+    payload["template"] = {k: v for k, v in template.items() if k not in _LIBRARY_ONLY_KEYS}
+    lines = [
+        {"schemaVersion": 1, "type": "agentToUi/chatMessage", "id": "...", "createdAt": "...", "payload": {"content": content}},
+        {"schemaVersion": 1, "type": "agentToUi/componentTemplate", "id": "...", "createdAt": "...", "payload": payload},
+    ]
+    return "\n".join(json.dumps(x, ensure_ascii=False, separators=(",", ":")) for x in lines)
+
+
+def _load_template(path: Path) -> Optional[LibraryTemplate]:
+    try:
+        with open(path, "r", encoding="utf-8") as fp:
+            raw = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(raw, dict) or not isinstance(raw.get("nodes"), list) or not raw.get("templateId"):
+        return None
+    node_types = sorted({str(n.get("type")) for n in raw["nodes"] if isinstance(n, dict) and n.get("type")})
+    few_shot = raw.get("fewShot") if isinstance(raw.get("fewShot"), dict) else {}
+    example = _render_example(raw, few_shot)
+    return LibraryTemplate(
+        template_id=str(raw["templateId"]),
+        name=str(raw.get("name") or raw["templateId"]),
+        description=str(raw.get("description") or ""),
+        tags=[str(t) for t in raw.get("tags") or [] if isinstance(t, (str, int))],
+        node_types=node_types,
+        template=raw,
+        example=example,
+        example_tokens=estimate_tokens(example),
+    )
+
+
+class TemplateLibrary:
+    def __init__(self, templates: Iterable[LibraryTemplate]) -> None:
+        self.templates: List[LibraryTemplate] = list(templates)
+        self._postings: Dict[str, Dict[int, float]] = {}
+        for i, t in enumerate(self.templates):
+            fields = {
+                "name": t.name + " " + t.template_id.replace("_", " "),
+                "tags": " ".join(t.tags),
+                "description": t.description,
+                "types": " ".join(_NODE_TYPE_TERMS.get(nt, nt) for nt in t.node_types),
+            }
+            for field_name, text in fields.items():
+                for term in _terms(text):
+                    posting = self._postings.setdefault(term, {})
+                    posting[i] = posting.get(i, 0.0) + _FIELD_WEIGHTS[field_name]
+        n = max(1, len(self.templates))
+        self._idf = {term: math.log(1.0 + (n - len(p) + 0.5) / (len(p) + 0.5)) for term, p in self._postings.items()}
+
+    def get(self, template_id: str) -> Optional[LibraryTemplate]:
+        for t in self.templates:
+            if t.template_id == template_id:
+                return t
+        return None
+
+    def search(self, query: str) -> List[Tuple[LibraryTemplate, float]]:
+        """All templates matching `query`, best first."""
+
+        scores: Dict[int, float] = {}
+        for term in set(_terms(query)):
+            posting = self._postings.get(term)
+            if not posting:
+                continue
+            idf = self._idf[term]
+            for i, w in posting.items():
+                scores[i] = scores.get(i, 0.0) + idf * (w * (_BM25_K1 + 1)) / (w + _BM25_K1)
+        ranked = sorted(scores.items(), key=lambda kv: (-kv[1], self.templates[kv[0]].template_id))
+        return [(self.templates[i], s) for i, s in ranked]
+
+    def select_few_shot(
+        self,
+        query: str,
+        *,
+        max_examples: int = 3,
+        token_budget: int = 900,
+        min_score: float = 8.0,
+        min_relative_score: float = 0.35,
+        fallback_id: Optional[str] = "tmpl_card",
+    ) -> List[Tuple[LibraryTemplate, float]]:
+        """Pick 1..max_examples templates whose examples fit in `token_budget`.
+
+        Weak matches (below `min_score`, or below `min_relative_score` of the best
+        hit, i.e. a single generic character in common) are dropped;
+        with no match at all the fallback template keeps one example in the prompt.
+        """
+
+        picked: List[Tuple[LibraryTemplate, float]] = []
+        used = 0
+        ranked = self.search(query)
+        best = ranked[0][1] if ranked else 0.0
+        for t, score in ranked:
+            if len(picked) >= max_examples or score < max(min_score, best * min_relative_score):
+                break
+            if used + t.example_tokens > token_budget:
+                continue
+            picked.append((t, score))
+            used += t.example_tokens
+        if not picked and fallback_id:
+            fb = self.get(fallback_id)
+            if fb is not None and fb.example_tokens <= token_budget:
+                picked.append((fb, 0.0))
+        return picked
+
+
+def _library_dirs() -> List[Path]:
+    dirs = [_BUNDLED_DIR]
+    extra = os.environ.get("DWEB_TEMPLATE_LIBRARY_DIRS", "")
+    dirs.extend(Path(p) for p in extra.split(os.pathsep) if p.strip())
+    return dirs
+
+
+@lru_cache(maxsize=1)
+def get_template_library() -> TemplateLibrary:
+    templates: Dict[str, LibraryTemplate] = {}
+    for d in _library_dirs():
+        for path in sorted(d.glob("*.template.json")) if d.is_dir() else []:
+            t = _load_template(path)
+            if t is not None:
+                # Later directories override bundled templates with the same id.
+                templates[t.template_id] = t
+    return TemplateLibrary(templates.values())
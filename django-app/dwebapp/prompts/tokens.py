@@ -0,0 +1,18 @@
+from __future__ import annotations
+
+import re
+
+_CJK_RE = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate for prompt budgeting (no tokenizer dependency).
+
+    DeepSeek's BPE spends roughly one token per CJK character and one per
+    ~3.5 characters of ASCII/JSON; good enough to compare prompt variants.
+    """
+
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + int((len(text) - cjk) / 3.5 + 0.5)
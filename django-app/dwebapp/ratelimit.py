@@ -0,0 +1,99 @@
+"""Client-side upstream rate limiting.
+
+A TokenBucket limits one process. With a shared-state backend configured
+(DWEB_SHARED_STATE_URL, see shared_state/base.py) the upstream limit is a
+SharedWindowLimiter instead: a fixed one-minute window counted by every
+worker on the backend, so DWEB_UPSTREAM_RPM caps the whole deployment.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Optional, Union
+
+
+class TokenBucket:
+    """`rate` tokens per second, up to `burst` banked. rate <= 0 disables limiting."""
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Block until a token is available; False if `timeout` expires first."""
+
+        if self.rate <= 0:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return True
+                wait = (1.0 - self._tokens) / self.rate
+            if deadline is not None:
+                if time.monotonic() + wait > deadline:
+                    return False
+            time.sleep(wait)
+
+
+class SharedWindowLimiter:
+    """At most `limit` acquisitions per `window` seconds across all processes sharing `key`.
+
+    Counted with the shared-state backend's atomic incr; if the backend fails,
+    acquire() falls back to `fallback` (a per-process bucket).
+    """
+
+    def __init__(self, key: str, limit: int, *, window: float = 60.0, fallback: Optional[TokenBucket] = None) -> None:
+        self.key = key
+        self.limit = max(1, int(limit))
+        self.window = float(window)
+        self.fallback = fallback or TokenBucket(self.limit / self.window, burst=1)
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        from .shared_state.base import SharedStateError, get_shared_state
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            now = time.time()
+            slot = int(now // self.window)
+            try:
+                used = get_shared_state().incr(f"{self.key}:{slot}", ttl=self.window * 2)
+            except SharedStateError:
+                left = None if deadline is None else max(0.0, deadline - time.monotonic())
+                return self.fallback.acquire(left)
+            if used <= self.limit:
+                return True
+            wait = (slot + 1) * self.window - now
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+_UPSTREAM: Optional[Union[TokenBucket, SharedWindowLimiter]] = None
+_UPSTREAM_LOCK = threading.Lock()
+
+
+def upstream_limiter() -> Union[TokenBucket, SharedWindowLimiter]:
+    """Shared limiter for upstream chat requests (DWEB_UPSTREAM_RPM / DWEB_UPSTREAM_BURST; 0 = unlimited)."""
+
+    global _UPSTREAM
+    with _UPSTREAM_LOCK:
+        if _UPSTREAM is None:
+            from .shared_state.base import is_shared
+
+            rpm = float(os.environ.get("DWEB_UPSTREAM_RPM") or 0)
+            bucket = TokenBucket(rpm / 60.0, burst=int(os.environ.get("DWEB_UPSTREAM_BURST") or 4))
+            if rpm > 0 and is_shared():
+                _UPSTREAM = SharedWindowLimiter("dweb:ratelimit:upstream", int(rpm), fallback=bucket)
+            else:
+                _UPSTREAM = bucket
+        return _UPSTREAM
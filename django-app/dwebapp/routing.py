@@ -0,0 +1,278 @@
+"""Complexity-tiered model routing for chat turns, with escalation on bad output.
+
+Each turn is put in a tier from the request classifier (prompts/intent.py)
+plus a few size signals:
+
+- light     filter / delete, or a short modify of a small selection
+- standard  a plain insert, or an edit of a larger selection / layout
+- heavy     multi-module inserts (pages, dashboards, forms, lists), long requests
+
+Tiers map to a model and a max_tokens budget through DWEB_MODEL_ROUTES (JSON):
+
+    {"light": {"model": "deepseek-chat", "maxTokens": 1024},
+     "heavy": {"model": "deepseek-reasoner", "maxTokens": 8192}}
+
+Tiers missing from the map use DEEPSEEK_MODEL without a budget; with the
+variable unset routing is off. A request opts out with `"modelRouting": false`
+and an explicit `model` always wins.
+
+Every tier streams live. A light-tier attempt is provisional: it opens with a
+taskStatus whose meta.route has `provisional: true` (the client snapshots its
+stage), and each envelope is validated as it arrives (envelope_problems; the
+finished turn must also contain an action). The first failure is not
+forwarded: the attempt is closed, a taskStatus with phase "retry" tells the
+client to roll back what it received, and the turn re-runs on the next tier
+up. Per tier the metrics registry gets chat.route_turns, chat.route_turn_ms
+and chat.route_escalations.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple
+
+from . import metrics
+from .prompts.intent import RequestScope
+
+TIERS = ("light", "standard", "heavy")
+# Tiers whose output is validated as it streams; a failure escalates one tier up.
+ESCALATING_TIERS = ("light",)
+
+_HEAVY_RE = re.compile(
+    r"页面|界面|仪表盘|看板|大屏|首页|落地页|整套|完整|多个|一组|列表|表格|表单|导航|侧边栏|模块|布局"
+    r"|dashboard|landing|page|screen|layout|table|list|form|navbar|sidebar",
+    re.I,
+)
+_ITEM_SEP_RE = re.compile(r"[、，,；;]")
+_LONG_REQUEST_CHARS = 80
+_SMALL_SELECTION = 3
+_ACTION_TYPES = ("agentToUi/componentTemplate", "agentToUi/insertNode", "agentToUi/patchNode", "agentToUi/deleteNode", "agentToUi/applyFilter")
+_BAD_ERROR_CODES = ("unexpected_json_shape", "compact_expand_error", "jsonl_parse_error", "empty_content", "bad_json")
+_NODE_TYPES = ("rect", "text", "image", "line")
+
+
+@dataclass(frozen=True)
+class Route:
+    tier: str
+    model: str
+    max_tokens: Optional[int]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"tier": self.tier, "model": self.model, "maxTokens": self.max_tokens}
+
+
+def load_routes(raw: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """Parsed DWEB_MODEL_ROUTES ({} when unset or invalid)."""
+
+    raw = os.environ.get("DWEB_MODEL_ROUTES", "") if raw is None else raw
+    if not raw.strip():
+        return {}
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {k: v for k, v in data.items() if k in TIERS and isinstance(v, dict)}
+
+
+def enabled() -> bool:
+    return bool(load_routes())
+
+
+def classify_tier(content: str, scope: RequestScope) -> Tuple[str, Dict[str, Any]]:
+    """(tier, signals) for one request."""
+
+    text = content or ""
+    selected = int(scope.signals.get("selected") or 0)
+    items = len(_ITEM_SEP_RE.findall(text)) + 1
+    signals: Dict[str, Any] = {"intent": scope.intent, "chars": len(text), "selected": selected, "items": items}
+    if scope.intent in ("filter", "delete"):
+        return "light", signals
+    if scope.intent == "modify":
+        small = selected <= _SMALL_SELECTION and len(text) <= _LONG_REQUEST_CHARS and "layout" not in scope.tags
+        return ("light" if small else "standard"), signals
+    heavy_hit = bool(_HEAVY_RE.search(text)) or "login" in scope.tags
+    if heavy_hit:
+        signals["heavyKeyword"] = True
+    if heavy_hit or len(text) > _LONG_REQUEST_CHARS or items >= 3:
+        return "heavy", signals
+    return "standard", signals
+
+
+def route_for(tier: str, *, default_model: str, routes: Optional[Dict[str, Dict[str, Any]]] = None) -> Route:
+    cfg = (load_routes() if routes is None else routes).get(tier) or {}
+    model = cfg.get("model") if isinstance(cfg.get("model"), str) and cfg.get("model") else default_model
+    max_tokens = cfg.get("maxTokens")
+    return Route(tier=tier, model=model, max_tokens=max_tokens if isinstance(max_tokens, int) and max_tokens > 0 else None)
+
+
+def escalation_chain(tier: str, *, default_model: str, routes: Optional[Dict[str, Dict[str, Any]]] = None) -> List[Route]:
+    """Routes to try in order: the tier itself, then (for escalating tiers) the next one up."""
+
+    routes = load_routes() if routes is None else routes
+    chain = [route_for(tier, default_model=default_model, routes=routes)]
+    if tier in ESCALATING_TIERS:
+        chain.append(route_for(TIERS[TIERS.index(tier) + 1], default_model=default_model, routes=routes))
+    return chain
+
+
+def _template_problems(template: Any) -> List[str]:
+    if not isinstance(template, dict):
+        return ["template_not_object"]
+    nodes = template.get("nodes")
+    if not isinstance(nodes, list):
+        # Single-node / node-tree shorthand; the client wraps it.
+        return [] if isinstance(template.get("userType") or template.get("type"), str) else ["template_without_nodes"]
+    if not nodes:
+        return ["template_empty"]
+    ids = {n.get("localId") for n in nodes if isinstance(n, dict)}
+    problems: List[str] = []
+    if template.get("rootLocalId") not in ids:
+        problems.append("root_not_found")
+    for n in nodes:
+        if not isinstance(n, dict) or not isinstance(n.get("localId"), str):
+            problems.append("node_without_local_id")
+        elif n.get("type") not in _NODE_TYPES:
+            problems.append("node_type")
+        elif not isinstance(n.get("props"), dict):
+            problems.append("node_props")
+        elif n.get("parentLocalId") is not None and n["parentLocalId"] not in ids:
+            problems.append("parent_not_found")
+    return sorted(set(problems))
+
+
+def envelope_problems(env: Dict[str, Any]) -> List[str]:
+    """Problems with one envelope of a turn (empty list: acceptable)."""
+
+    t = env.get("type")
+    payload = env.get("payload") if isinstance(env.get("payload"), dict) else {}
+    if t == "agentToUi/error" and payload.get("code") in _BAD_ERROR_CODES:
+        return [f"error:{payload.get('code')}"]
+    if t == "agentToUi/text":
+        return ["raw_text"]
+    if t == "agentToUi/componentTemplate":
+        return _template_problems(payload.get("template"))
+    if t == "agentToUi/patchNode" and not (isinstance(payload.get("nodeId"), str) and isinstance(payload.get("patch"), dict)):
+        return ["patch_shape"]
+    if t == "agentToUi/deleteNode" and not (isinstance(payload.get("nodeId"), str) or isinstance(payload.get("nodeIds"), list)):
+        return ["delete_shape"]
+    if t == "agentToUi/applyFilter" and not isinstance(payload.get("filter"), dict):
+        return ["filter_shape"]
+    return []
+
+
+def _missing_action(intent: str) -> str:
+    return "no_action" if intent != "insert" else "no_template"
+
+
+def validate_output(envelopes: List[Dict[str, Any]], *, intent: str) -> List[str]:
+    """Problems with a finished turn's envelopes (empty list: acceptable)."""
+
+    problems: List[str] = []
+    actions = 0
+    for env in envelopes:
+        problems.extend(envelope_problems(env))
+        if env.get("type") in _ACTION_TYPES:
+            actions += 1
+    if not actions:
+        problems.append(_missing_action(intent))
+    return sorted(set(problems))
+
+
+def _terminal(data: Any) -> Optional[str]:
+    if isinstance(data, dict) and data.get("type") == "agentToUi/taskStatus":
+        phase = (data.get("payload") or {}).get("phase")
+        if phase in ("done", "canceled", "error"):
+            return phase
+    return None
+
+
+def is_provisional(data: Any) -> bool:
+    """The taskStatus opening a provisional attempt (the client snapshots its stage)."""
+
+    return isinstance(data, dict) and bool(((data.get("meta") or {}).get("route") or {}).get("provisional"))
+
+
+def is_retry(data: Any) -> bool:
+    """The taskStatus abandoning a provisional attempt (the client rolls back to its snapshot)."""
+
+    return (
+        isinstance(data, dict)
+        and data.get("type") == "agentToUi/taskStatus"
+        and (data.get("payload") or {}).get("phase") == "retry"
+    )
+
+
+def _stamp(data: Dict[str, Any], route_meta: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(data, meta=dict(data.get("meta") or {}, route=route_meta))
+
+
+def iter_routed_events(
+    chain: List[Route],
+    run: Callable[[Route], Generator[Tuple[str, Any], None, None]],
+    *,
+    intent: str,
+    status: Callable[[str, str], Dict[str, Any]],
+) -> Generator[Tuple[str, Any], None, None]:
+    """Run `run(route)` for each route of `chain` until one passes validation.
+
+    Every attempt streams live; all but the last are provisional and checked
+    envelope by envelope. `status(phase, message)` builds the taskStatus that
+    opens a provisional attempt ("streaming") and the one that abandons it
+    ("retry"). The terminal taskStatus of the accepted attempt gets
+    `meta.route`.
+    """
+
+    escalated: List[Dict[str, Any]] = []
+    for i, route in enumerate(chain):
+        last = i == len(chain) - 1
+        started = time.monotonic()
+        route_meta: Dict[str, Any] = dict(route.to_dict(), attempt=i + 1)
+        if escalated:
+            route_meta["escalatedFrom"] = escalated
+        metrics.incr("chat.route_turns", tier=route.tier)
+        events = run(route)
+        if last:
+            try:
+                for event, data in events:
+                    if _terminal(data) is not None:
+                        metrics.observe("chat.route_turn_ms", (time.monotonic() - started) * 1000, tier=route.tier)
+                        data = _stamp(data, route_meta)
+                    yield event, data
+            finally:
+                events.close()
+            return
+
+        yield "msg", _stamp(status("streaming", f"{route.tier} 档模型生成中"), dict(route_meta, provisional=True))
+        problems: List[str] = []
+        actions = 0
+        try:
+            for event, data in events:
+                if event == "msg" and isinstance(data, dict):
+                    phase = _terminal(data)
+                    if phase is None:
+                        problems = envelope_problems(data)
+                        actions += data.get("type") in _ACTION_TYPES
+                    elif phase == "done" and not actions:
+                        problems = [_missing_action(intent)]
+                    if problems:
+                        break
+                    if phase is not None:
+                        metrics.observe("chat.route_turn_ms", (time.monotonic() - started) * 1000, tier=route.tier)
+                        data = _stamp(data, route_meta)
+                yield event, data
+        finally:
+            events.close()
+        if not problems:
+            return
+        ms = (time.monotonic() - started) * 1000
+        metrics.observe("chat.route_turn_ms", ms, tier=route.tier)
+        nxt = chain[i + 1]
+        metrics.incr("chat.route_escalations", tier=route.tier, to=nxt.tier)
+        escalated.append({"tier": route.tier, "model": route.model, "problems": problems[:8], "ms": int(ms)})
+        yield "msg", status("retry", f"输出校验未通过，改用 {nxt.tier} 档模型重试")
@@ -0,0 +1 @@
+"""Cross-process shared state (blobs with TTL, counters, pub/sub) behind one interface (see base.py)."""
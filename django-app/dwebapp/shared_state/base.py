@@ -0,0 +1,159 @@
+"""Shared-state interface and backend selection.
+
+Several gunicorn / uvicorn workers, possibly on several hosts, serve the
+same clients; what one worker keeps in memory the others cannot see. A
+SharedState backend gives them three primitives:
+
+- blobs     get / set / delete of bytes under a key, optionally with a TTL
+- counters  atomic incr (quotas, rate windows); the TTL is set when the
+            counter is created, so a fixed window expires on its own
+- pub/sub   publish bytes on a channel; every live Subscription to it
+            receives them in order (envelope fan-out, cross-worker cancel)
+
+Backends, chosen by DWEB_SHARED_STATE_URL:
+
+    memory://                       per process (the default; single worker)
+    sqlite:///shared.sqlite3        one host, any number of processes (WAL)
+    redis://127.0.0.1:6379/0        any number of hosts (RESP protocol)
+
+A relative SQLite path is under DWEB_DATA_DIR (`sqlite://` alone:
+shared-state.sqlite3), an absolute one takes four slashes. The
+Redis client speaks RESP directly (no client library); resp_server.py is a
+stand-in server for tests and benchmarks. Pub/sub is at-most-once: a
+subscriber that is not listening when a message is published misses it.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from typing import Any, Dict, Iterator, Optional, Union
+from urllib.parse import parse_qs, urlsplit
+
+Data = Union[str, bytes]
+
+DEFAULT_URL = "memory://"
+
+
+def _bytes(value: Data) -> bytes:
+    return value.encode("utf-8") if isinstance(value, str) else bytes(value)
+
+
+class SharedStateError(Exception):
+    """The backend failed (connection lost, protocol error, locked database)."""
+
+
+class Subscription:
+    """Messages published on one channel after subscribe(); close() when done."""
+
+    channel: str
+
+    def get(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        """Next message, or None when `timeout` seconds pass (or the subscription is closed)."""
+
+        raise NotImplementedError
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            msg = self.get()
+            if msg is None:
+                return
+            yield msg
+
+    def __enter__(self) -> "Subscription":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class SharedState:
+    """Backend interface; keys and channels are plain strings, values bytes (str is UTF-8 encoded)."""
+
+    scheme = ""
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Data, *, ttl: Optional[float] = None) -> None:
+        """Store `value`; `ttl` in seconds (None: no expiry)."""
+
+        raise NotImplementedError
+
+    def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def incr(self, key: str, amount: int = 1, *, ttl: Optional[float] = None) -> int:
+        """Atomically add `amount` and return the new value; a new counter expires after `ttl`."""
+
+        raise NotImplementedError
+
+    def publish(self, channel: str, message: Data) -> int:
+        """Send `message` to the channel's subscribers; returns how many got it (-1: unknown)."""
+
+        raise NotImplementedError
+
+    def subscribe(self, channel: str) -> Subscription:
+        raise NotImplementedError
+
+    def ping(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.scheme}
+
+
+def from_url(url: str) -> SharedState:
+    """Backend for a DWEB_SHARED_STATE_URL value."""
+
+    parts = urlsplit(url or DEFAULT_URL)
+    scheme = parts.scheme.lower()
+    if scheme == "memory":
+        from .memory import MemoryState
+
+        return MemoryState()
+    if scheme == "sqlite":
+        from .sqlite import SqliteState
+
+        # sqlite:///name (relative to DWEB_DATA_DIR) | sqlite:////absolute/path
+        return SqliteState(parts.path[1:] or None)
+    if scheme == "redis":
+        from .resp import RespState
+
+        db = parts.path.strip("/") or "0"
+        query = parse_qs(parts.query)
+        timeout = float(query.get("timeout", ["5"])[0])
+        return RespState(
+            host=parts.hostname or "127.0.0.1",
+            port=parts.port or 6379,
+            db=int(db) if db.isdigit() else 0,
+            password=parts.password,
+            timeout=timeout,
+        )
+    raise ValueError(f"unsupported shared state url: {url}")
+
+
+_STATE: Optional[SharedState] = None
+_STATE_LOCK = threading.Lock()
+
+
+def get_shared_state() -> SharedState:
+    """The process-wide backend for DWEB_SHARED_STATE_URL (created on first use)."""
+
+    global _STATE
+    with _STATE_LOCK:
+        if _STATE is None:
+            _STATE = from_url(os.environ.get("DWEB_SHARED_STATE_URL") or DEFAULT_URL)
+        return _STATE
+
+
+def is_shared() -> bool:
+    """True when the configured backend is visible to other processes."""
+
+    return get_shared_state().scheme != "memory"
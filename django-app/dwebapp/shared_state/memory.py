@@ -0,0 +1,154 @@
+"""In-process backend: the default, and the store behind the RESP stand-in server."""
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .base import Data, SharedState, SharedStateError, Subscription, _bytes
+
+_CLOSED = object()
+_SWEEP_S = 1.0
+
+
+class MemorySubscription(Subscription):
+    def __init__(self, owner: "MemoryState", channel: str) -> None:
+        self.channel = channel
+        self._owner = owner
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self.closed = False
+
+    def deliver(self, message: bytes) -> None:
+        self._queue.put(message)
+
+    def get(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        if self.closed and self._queue.empty():
+            return None
+        try:
+            msg = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        return None if msg is _CLOSED else msg
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self._owner._unsubscribe(self)
+            self._queue.put(_CLOSED)
+
+
+class MemoryState(SharedState):
+    scheme = "memory"
+
+    def __init__(self) -> None:
+        self._data: Dict[str, Tuple[Any, Optional[float]]] = {}  # key -> (bytes | int, expires_at monotonic)
+        self._subs: Dict[str, List[MemorySubscription]] = {}
+        self._lock = threading.Lock()
+        self._next_sweep = 0.0
+
+    def _sweep(self, now: float) -> None:
+        if now >= self._next_sweep:
+            self._next_sweep = now + _SWEEP_S
+            for key in [k for k, (_, exp) in self._data.items() if exp is not None and exp <= now]:
+                del self._data[key]
+
+    def _live(self, key: str, now: float) -> Optional[Tuple[Any, Optional[float]]]:
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        return item
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._live(key, time.monotonic())
+        if item is None:
+            return None
+        return str(item[0]).encode("ascii") if isinstance(item[0], int) else item[0]
+
+    def set(self, key: str, value: Data, *, ttl: Optional[float] = None) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            self._data[key] = (_bytes(value), now + ttl if ttl is not None else None)
+
+    def set_if(self, key: str, value: Data, *, ttl: Optional[float] = None, exists: bool = False) -> bool:
+        """set() only when the key is missing (exists=False) or present (exists=True); SET NX / XX."""
+
+        now = time.monotonic()
+        with self._lock:
+            if (self._live(key, now) is not None) != exists:
+                return False
+            self._data[key] = (_bytes(value), now + ttl if ttl is not None else None)
+            return True
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            if self._live(key, time.monotonic()) is None:
+                return False
+            del self._data[key]
+            return True
+
+    def incr(self, key: str, amount: int = 1, *, ttl: Optional[float] = None) -> int:
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            item = self._live(key, now)
+            if item is None:
+                value, expires = int(amount), (now + ttl if ttl is not None else None)
+            else:
+                try:
+                    value, expires = int(item[0]) + int(amount), item[1]
+                except ValueError:
+                    raise SharedStateError(f"value of {key!r} is not an integer") from None
+            self._data[key] = (value, expires)
+            return value
+
+    def ttl(self, key: str) -> Optional[float]:
+        """Seconds until `key` expires (None: missing or no expiry)."""
+
+        now = time.monotonic()
+        with self._lock:
+            item = self._live(key, now)
+        return None if item is None or item[1] is None else item[1] - now
+
+    def expire(self, key: str, ttl: float) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            item = self._live(key, now)
+            if item is None:
+                return False
+            self._data[key] = (item[0], now + ttl)
+            return True
+
+    def flush(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def publish(self, channel: str, message: Data) -> int:
+        payload = _bytes(message)
+        with self._lock:
+            subs = list(self._subs.get(channel, ()))
+        for sub in subs:
+            sub.deliver(payload)
+        return len(subs)
+
+    def subscribe(self, channel: str) -> MemorySubscription:
+        sub = MemorySubscription(self, channel)
+        with self._lock:
+            self._subs.setdefault(channel, []).append(sub)
+        return sub
+
+    def _unsubscribe(self, sub: MemorySubscription) -> None:
+        with self._lock:
+            subs = self._subs.get(sub.channel, [])
+            if sub in subs:
+                subs.remove(sub)
+            if not subs:
+                self._subs.pop(sub.channel, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": self.scheme, "keys": len(self._data), "channels": len(self._subs)}
@@ -0,0 +1,292 @@
+"""Redis-protocol (RESP2) backend, with no client library.
+
+Commands used: AUTH, SELECT, PING, GET, SET .. PX / NX, DEL, INCRBY, PUBLISH,
+SUBSCRIBE. Each thread keeps one connection; a connection the server closed
+is dropped and the command retried once on a fresh one (a timeout is not
+retried: the command may have been applied). incr with a TTL
+pipelines `SET key 0 NX PX ttl` and `INCRBY` in one round trip, so a new
+counter is created with its expiry. Every subscription has its own
+connection, as the protocol requires.
+
+Works against Redis, Valkey, KeyDB, ... and resp_server.RespServer.
+"""
+
+from __future__ import annotations
+
+import os
+import socket
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .base import Data, SharedState, SharedStateError, Subscription, _bytes
+
+_INCOMPLETE = object()
+_RECV = 65536
+_COMPACT_AT = 1 << 16
+
+
+class RespError(SharedStateError):
+    """An error reply (-ERR ...) from the server."""
+
+
+class _Incomplete(Exception):
+    pass
+
+
+def encode_command(args: Sequence[Any]) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for a in args:
+        b = a if isinstance(a, bytes) else str(a).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(b), b))
+    return b"".join(parts)
+
+
+def encode_reply(value: Any) -> bytes:
+    """RESP2 encoding of a reply (the stand-in server's side)."""
+
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, RespError):
+        return b"-%s\r\n" % str(value).encode("utf-8")
+    if isinstance(value, bool):
+        return b":%d\r\n" % int(value)
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        return b"+%s\r\n" % value.encode("utf-8")
+    if isinstance(value, (list, tuple)):
+        return b"*%d\r\n" % len(value) + b"".join(encode_reply(v) for v in value)
+    b = bytes(value)
+    return b"$%d\r\n%s\r\n" % (len(b), b)
+
+
+class Reader:
+    """Incremental RESP2 parser: feed() bytes, gets() one complete reply (or _INCOMPLETE).
+
+    Simple strings decode to str, bulk strings stay bytes, error replies
+    become RespError values (returned, not raised).
+    """
+
+    def __init__(self) -> None:
+        self._buf = bytearray()
+        self._pos = 0
+
+    def feed(self, data: bytes) -> None:
+        self._buf += data
+
+    def gets(self) -> Any:
+        try:
+            value, pos = self._parse(self._pos)
+        except _Incomplete:
+            return _INCOMPLETE
+        self._pos = pos
+        if pos >= _COMPACT_AT:
+            del self._buf[:pos]
+            self._pos = 0
+        return value
+
+    def _line(self, pos: int) -> Tuple[bytes, int]:
+        end = self._buf.find(b"\r\n", pos)
+        if end < 0:
+            raise _Incomplete
+        return bytes(self._buf[pos:end]), end + 2
+
+    def _parse(self, pos: int) -> Tuple[Any, int]:
+        line, pos = self._line(pos)
+        kind, rest = line[:1], line[1:]
+        if kind == b"+":
+            return rest.decode("utf-8", "replace"), pos
+        if kind == b"-":
+            return RespError(rest.decode("utf-8", "replace")), pos
+        if kind == b":":
+            return int(rest), pos
+        if kind == b"$":
+            n = int(rest)
+            if n < 0:
+                return None, pos
+            if len(self._buf) < pos + n + 2:
+                raise _Incomplete
+            return bytes(self._buf[pos : pos + n]), pos + n + 2
+        if kind == b"*":
+            n = int(rest)
+            if n < 0:
+                return None, pos
+            items = []
+            for _ in range(n):
+                item, pos = self._parse(pos)
+                items.append(item)
+            return items, pos
+        raise SharedStateError(f"RESP protocol error: unexpected {line[:20]!r}")
+
+
+class RespConnection:
+    def __init__(self, host: str, port: int, *, timeout: float, password: Optional[str] = None, db: int = 0) -> None:
+        self.timeout = timeout
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = Reader()
+        if password:
+            self.call("AUTH", password)
+        if db:
+            self.call("SELECT", db)
+
+    def send(self, commands: Sequence[Sequence[Any]]) -> None:
+        self.sock.sendall(b"".join(encode_command(c) for c in commands))
+
+    def read(self) -> Any:
+        while True:
+            value = self.reader.gets()
+            if value is not _INCOMPLETE:
+                return value
+            data = self.sock.recv(_RECV)
+            if not data:
+                raise ConnectionError("connection closed by the server")
+            self.reader.feed(data)
+
+    def call(self, *args: Any) -> Any:
+        self.send([args])
+        reply = self.read()
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    def pipeline(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        """Replies in order; error replies are returned as RespError values."""
+
+        self.send(commands)
+        return [self.read() for _ in commands]
+
+    def close(self) -> None:
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class RespSubscription(Subscription):
+    def __init__(self, conn: RespConnection, channel: str) -> None:
+        self.channel = channel
+        self._conn = conn
+        self.closed = False
+        conn.send([("SUBSCRIBE", channel)])
+        reply = conn.read()
+        if not (isinstance(reply, list) and reply and reply[0] == b"subscribe"):
+            conn.close()
+            raise SharedStateError(f"unexpected SUBSCRIBE reply: {reply!r}")
+
+    def get(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        while not self.closed:
+            self._conn.sock.settimeout(timeout)
+            try:
+                reply = self._conn.read()
+            except socket.timeout:
+                return None
+            except OSError as e:
+                if self.closed:
+                    return None
+                raise SharedStateError(f"subscription lost: {e}") from e
+            if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                return reply[2]
+        return None
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self._conn.close()  # shutdown also wakes a get() blocked on another thread
+
+
+class RespState(SharedState):
+    scheme = "redis"
+
+    def __init__(
+        self,
+        *,
+        host: str = "127.0.0.1",
+        port: int = 6379,
+        db: int = 0,
+        password: Optional[str] = None,
+        timeout: float = 5.0,
+    ) -> None:
+        self.host, self.port, self.db, self.timeout = host, port, db, timeout
+        self._password = password
+        self._local = threading.local()
+
+    def _connect(self) -> RespConnection:
+        try:
+            return RespConnection(self.host, self.port, timeout=self.timeout, password=self._password, db=self.db)
+        except OSError as e:
+            raise SharedStateError(f"cannot connect to {self.host}:{self.port}: {e}") from e
+
+    def _conn(self) -> RespConnection:
+        cached = getattr(self._local, "conn", None)
+        if cached is not None and cached[0] == os.getpid():
+            return cached[1]
+        conn = self._connect()
+        self._local.conn = (os.getpid(), conn)
+        return conn
+
+    def _drop(self) -> None:
+        cached = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if cached is not None:
+            cached[1].close()
+
+    def _pipeline(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        for attempt in (1, 2):
+            try:
+                replies = self._conn().pipeline(commands)
+                break
+            except socket.timeout as e:
+                # The server may have applied the commands; a retry could apply them twice.
+                self._drop()
+                raise SharedStateError(f"{self.host}:{self.port}: timed out") from e
+            except OSError as e:  # ConnectionError included: the server closed an idle connection
+                self._drop()
+                if attempt == 2:
+                    raise SharedStateError(f"{self.host}:{self.port}: {e}") from e
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def _call(self, *args: Any) -> Any:
+        return self._pipeline([args])[0]
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._call("GET", key)
+
+    def set(self, key: str, value: Data, *, ttl: Optional[float] = None) -> None:
+        if ttl is None:
+            self._call("SET", key, _bytes(value))
+        else:
+            self._call("SET", key, _bytes(value), "PX", max(1, int(ttl * 1000)))
+
+    def delete(self, key: str) -> bool:
+        return int(self._call("DEL", key)) > 0
+
+    def incr(self, key: str, amount: int = 1, *, ttl: Optional[float] = None) -> int:
+        if ttl is None:
+            return int(self._call("INCRBY", key, int(amount)))
+        replies = self._pipeline([("SET", key, 0, "PX", max(1, int(ttl * 1000)), "NX"), ("INCRBY", key, int(amount))])
+        return int(replies[1])
+
+    def publish(self, channel: str, message: Data) -> int:
+        return int(self._call("PUBLISH", channel, _bytes(message)))
+
+    def subscribe(self, channel: str) -> RespSubscription:
+        conn = self._connect()
+        conn.sock.settimeout(None)
+        return RespSubscription(conn, channel)
+
+    def ping(self) -> bool:
+        try:
+            return self._call("PING") == "PONG"
+        except SharedStateError:
+            return False
+
+    def close(self) -> None:
+        self._drop()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.scheme, "server": f"{self.host}:{self.port}", "db": self.db}
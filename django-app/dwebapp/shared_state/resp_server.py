@@ -0,0 +1,244 @@
+"""Stand-in RESP server for tests, benchmarks and single-host trials.
+
+Speaks enough of the Redis protocol for resp.RespState (and redis-cli):
+PING, ECHO, AUTH, SELECT, GET, SET (EX / PX / NX / XX), DEL, EXISTS, INCR,
+INCRBY, DECR, DECRBY, EXPIRE, PEXPIRE, TTL, PTTL, DBSIZE, FLUSHDB, FLUSHALL,
+PUBLISH, SUBSCRIBE, UNSUBSCRIBE, QUIT. The store is a memory.MemoryState; all
+databases share it, and AUTH accepts any password. Not for production.
+
+    server = RespServer(port=0).start()   # free port; server.url -> redis://127.0.0.1:<port>/0
+    ...
+    server.stop()
+"""
+
+from __future__ import annotations
+
+import socket
+import socketserver
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .base import SharedStateError
+from .memory import MemoryState, MemorySubscription
+from .resp import _INCOMPLETE, Reader, RespError, encode_reply
+
+_RECV = 65536
+_OK = "OK"
+
+
+def _key(a: bytes) -> str:
+    return a.decode("utf-8", "surrogateescape")
+
+
+def _int(v: bytes) -> int:
+    try:
+        return int(v)
+    except ValueError:
+        raise RespError("ERR value is not an integer or out of range") from None
+
+
+class _Session:
+    """One client connection: command dispatch plus its subscriptions."""
+
+    def __init__(self, server: "RespServer", sock: socket.socket) -> None:
+        self.server = server
+        self.store = server.store
+        self.sock = sock
+        self.write_lock = threading.Lock()
+        self.subs: Dict[bytes, MemorySubscription] = {}
+
+    def write(self, data: bytes) -> None:
+        with self.write_lock:
+            self.sock.sendall(data)
+
+    def run(self) -> None:
+        reader = Reader()
+        try:
+            while True:
+                data = self.sock.recv(_RECV)
+                if not data:
+                    return
+                reader.feed(data)
+                out: List[bytes] = []
+                while True:
+                    cmd = reader.gets()
+                    if cmd is _INCOMPLETE:
+                        break
+                    if not isinstance(cmd, list) or not cmd:
+                        out.append(encode_reply(RespError("ERR protocol error: expected an array of bulk strings")))
+                        continue
+                    name = bytes(cmd[0]).upper()
+                    if name == b"QUIT":
+                        self.write(b"".join(out) + encode_reply(_OK))
+                        return
+                    try:
+                        out.append(self.dispatch(name, [bytes(a) for a in cmd[1:]]))
+                    except RespError as e:
+                        out.append(encode_reply(e))
+                if out:
+                    self.write(b"".join(out))
+        except (OSError, SharedStateError):
+            return  # client gone, or not speaking RESP
+        finally:
+            for sub in list(self.subs.values()):
+                sub.close()
+
+    def dispatch(self, name: bytes, args: List[bytes]) -> bytes:
+        handler = _COMMANDS.get(name)
+        if handler is None:
+            raise RespError(f"ERR unknown command '{name.decode('utf-8', 'replace')}'")
+        arity, fn = handler
+        if len(args) < arity:
+            raise RespError(f"ERR wrong number of arguments for '{name.decode().lower()}' command")
+        return fn(self, args)
+
+    # -- pub/sub ----------------------------------------------------------
+
+    def subscribe(self, channels: List[bytes]) -> bytes:
+        out = []
+        for ch in channels:
+            if ch not in self.subs:
+                sub = self.store.subscribe(_key(ch))
+                self.subs[ch] = sub
+                threading.Thread(target=self._forward, args=(ch, sub), daemon=True).start()
+            out.append(encode_reply([b"subscribe", ch, len(self.subs)]))
+        return b"".join(out)
+
+    def unsubscribe(self, channels: List[bytes]) -> bytes:
+        out = []
+        for ch in channels or list(self.subs):
+            sub = self.subs.pop(ch, None)
+            if sub is not None:
+                sub.close()
+            out.append(encode_reply([b"unsubscribe", ch, len(self.subs)]))
+        return b"".join(out)
+
+    def _forward(self, ch: bytes, sub: MemorySubscription) -> None:
+        for message in sub:
+            try:
+                self.write(encode_reply([b"message", ch, message]))
+            except OSError:
+                sub.close()
+                return
+
+
+def _set(s: _Session, args: List[bytes]) -> bytes:
+    key, value = _key(args[0]), args[1]
+    ttl: Optional[float] = None
+    nx = xx = False
+    opts = [a.upper() for a in args[2:]]
+    i = 0
+    while i < len(opts):
+        if opts[i] in (b"EX", b"PX") and i + 1 < len(opts):
+            n = _int(args[2 + i + 1])
+            ttl = n if opts[i] == b"EX" else n / 1000
+            i += 2
+            continue
+        if opts[i] == b"NX":
+            nx = True
+        elif opts[i] == b"XX":
+            xx = True
+        else:
+            raise RespError("ERR syntax error")
+        i += 1
+    if nx or xx:
+        if not s.store.set_if(key, value, ttl=ttl, exists=xx):
+            return encode_reply(None)
+    else:
+        s.store.set(key, value, ttl=ttl)
+    return encode_reply(_OK)
+
+
+def _incrby(s: _Session, key: bytes, amount: int) -> bytes:
+    try:
+        return encode_reply(s.store.incr(_key(key), amount))
+    except SharedStateError:
+        raise RespError("ERR value is not an integer or out of range") from None
+
+
+def _expire(s: _Session, key: bytes, seconds: float) -> bytes:
+    return encode_reply(int(s.store.expire(_key(key), seconds)))
+
+
+def _ttl(s: _Session, key: bytes, scale: int) -> bytes:
+    k = _key(key)
+    if s.store.get(k) is None:
+        return encode_reply(-2)
+    left = s.store.ttl(k)
+    return encode_reply(-1 if left is None else max(0, int(left * scale)))
+
+
+_COMMANDS: Dict[bytes, Tuple[int, Callable[[_Session, List[bytes]], bytes]]] = {
+    b"PING": (0, lambda s, a: encode_reply(a[0] if a else "PONG")),
+    b"ECHO": (1, lambda s, a: encode_reply(a[0])),
+    b"AUTH": (1, lambda s, a: encode_reply(_OK)),
+    b"SELECT": (1, lambda s, a: encode_reply(_OK)),
+    b"GET": (1, lambda s, a: encode_reply(s.store.get(_key(a[0])))),
+    b"SET": (2, _set),
+    b"DEL": (1, lambda s, a: encode_reply(sum(s.store.delete(_key(k)) for k in a))),
+    b"EXISTS": (1, lambda s, a: encode_reply(sum(s.store.get(_key(k)) is not None for k in a))),
+    b"INCR": (1, lambda s, a: _incrby(s, a[0], 1)),
+    b"INCRBY": (2, lambda s, a: _incrby(s, a[0], _int(a[1]))),
+    b"DECR": (1, lambda s, a: _incrby(s, a[0], -1)),
+    b"DECRBY": (2, lambda s, a: _incrby(s, a[0], -_int(a[1]))),
+    b"EXPIRE": (2, lambda s, a: _expire(s, a[0], _int(a[1]))),
+    b"PEXPIRE": (2, lambda s, a: _expire(s, a[0], _int(a[1]) / 1000)),
+    b"TTL": (1, lambda s, a: _ttl(s, a[0], 1)),
+    b"PTTL": (1, lambda s, a: _ttl(s, a[0], 1000)),
+    b"DBSIZE": (0, lambda s, a: encode_reply(s.store.stats()["keys"])),
+    b"FLUSHDB": (0, lambda s, a: (s.store.flush(), encode_reply(_OK))[1]),
+    b"FLUSHALL": (0, lambda s, a: (s.store.flush(), encode_reply(_OK))[1]),
+    b"PUBLISH": (2, lambda s, a: encode_reply(s.store.publish(_key(a[0]), a[1]))),
+    b"SUBSCRIBE": (1, lambda s, a: s.subscribe(a)),
+    b"UNSUBSCRIBE": (0, lambda s, a: s.unsubscribe(a)),
+}
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    server: "_TcpServer"
+
+    def handle(self) -> None:
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        _Session(self.server.owner, self.request).run()
+
+
+class _TcpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    owner: "RespServer"
+
+
+class RespServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, *, store: Optional[MemoryState] = None) -> None:
+        self.store = store or MemoryState()
+        self._tcp = _TcpServer((host, port), _Handler)
+        self._tcp.owner = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        host, port = self._tcp.server_address[:2]
+        return str(host), int(port)
+
+    @property
+    def url(self) -> str:
+        host, port = self.address
+        return f"redis://{host}:{port}/0"
+
+    def start(self) -> "RespServer":
+        self._thread = threading.Thread(target=self._tcp.serve_forever, name="resp-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._tcp.serve_forever()
+
+    def stop(self) -> None:
+        self._tcp.shutdown()
+        self._tcp.server_close()
+
+    def __enter__(self) -> "RespServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
@@ -0,0 +1,212 @@
+"""SQLite backend in WAL mode: shared by every process on one host.
+
+Blobs and counters live in one `kv` table with a wall-clock expiry; incr
+runs in a BEGIN IMMEDIATE transaction, so concurrent workers never lose an
+update. Pub/sub is a `messages` log: publish appends a row, a subscription
+remembers the last id it has seen and polls for newer rows on its channel
+every DWEB_SHARED_STATE_POLL_S seconds. Messages older than
+DWEB_SHARED_STATE_RETENTION_S are pruned, expired keys are swept
+periodically, both by whichever process writes.
+"""
+
+from __future__ import annotations
+
+import collections
+import functools
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Optional, TypeVar
+
+from .base import Data, SharedState, SharedStateError, Subscription, _bytes
+
+_POLL_S = float(os.environ.get("DWEB_SHARED_STATE_POLL_S", "0.01"))
+_RETENTION_S = float(os.environ.get("DWEB_SHARED_STATE_RETENTION_S", "60"))
+_SWEEP_S = 5.0
+_BATCH = 256
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires_at REAL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_channel_id ON messages (channel, id);
+"""
+
+
+def _wrap_errors(fn: F) -> F:
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        try:
+            return fn(*args, **kwargs)
+        except sqlite3.Error as e:
+            raise SharedStateError(f"sqlite: {e}") from e
+
+    return wrapper  # type: ignore[return-value]
+
+
+def _default_dir() -> Path:
+    from django.conf import settings
+
+    return Path(getattr(settings, "DWEB_DATA_DIR"))
+
+
+class SqliteSubscription(Subscription):
+    def __init__(self, owner: "SqliteState", channel: str) -> None:
+        self.channel = channel
+        self._owner = owner
+        self._pending: Deque[bytes] = collections.deque()
+        row = owner._conn().execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()
+        self._last_id = int(row[0])
+        self.closed = False
+
+    @_wrap_errors
+    def _poll(self) -> None:
+        rows = self._owner._conn().execute(
+            "SELECT id, payload FROM messages WHERE channel = ? AND id > ? ORDER BY id LIMIT ?",
+            (self.channel, self._last_id, _BATCH),
+        ).fetchall()
+        for row_id, payload in rows:
+            self._pending.append(bytes(payload))
+            self._last_id = row_id
+
+    @_wrap_errors
+    def get(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.closed:
+            if not self._pending:
+                self._poll()
+            if self._pending:
+                return self._pending.popleft()
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(_POLL_S)
+        return None
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class SqliteState(SharedState):
+    scheme = "sqlite"
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        p = Path(path or "shared-state.sqlite3")
+        self.path = p if p.is_absolute() else _default_dir() / p
+        self._local = threading.local()
+        self._next_sweep = 0.0
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread (and per process: forked handles are not reused)."""
+
+        cached = getattr(self._local, "conn", None)
+        if cached is not None and cached[0] == os.getpid():
+            return cached[1]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), timeout=10.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        self._local.conn = (os.getpid(), conn)
+        return conn
+
+    def _maybe_sweep(self, conn: sqlite3.Connection, now: float) -> None:
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + _SWEEP_S
+        conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        conn.execute("DELETE FROM messages WHERE created_at < ?", (now - _RETENTION_S,))
+
+    @_wrap_errors
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._conn().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        value = row[0]
+        return str(value).encode("ascii") if isinstance(value, int) else bytes(value)
+
+    @_wrap_errors
+    def set(self, key: str, value: Data, *, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, _bytes(value), now + ttl if ttl is not None else None),
+        )
+        self._maybe_sweep(conn, now)
+
+    @_wrap_errors
+    def delete(self, key: str) -> bool:
+        cur = self._conn().execute(
+            "DELETE FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        )
+        return cur.rowcount > 0
+
+    @_wrap_errors
+    def incr(self, key: str, amount: int = 1, *, ttl: Optional[float] = None) -> int:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value, expires_at FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, now)
+            ).fetchone()
+            if row is None:
+                value, expires = int(amount), (now + ttl if ttl is not None else None)
+            else:
+                try:
+                    value, expires = int(row[0]) + int(amount), row[1]
+                except ValueError:
+                    raise SharedStateError(f"value of {key!r} is not an integer") from None
+            conn.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)", (key, value, expires))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._maybe_sweep(conn, now)
+        return value
+
+    @_wrap_errors
+    def publish(self, channel: str, message: Data) -> int:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("INSERT INTO messages (channel, payload, created_at) VALUES (?, ?, ?)", (channel, _bytes(message), now))
+        self._maybe_sweep(conn, now)
+        return -1
+
+    @_wrap_errors
+    def subscribe(self, channel: str) -> SqliteSubscription:
+        return SqliteSubscription(self, channel)
+
+    def ping(self) -> bool:
+        try:
+            self._conn().execute("SELECT 1").fetchone()
+        except sqlite3.Error:
+            return False
+        return True
+
+    def close(self) -> None:
+        cached = getattr(self._local, "conn", None)
+        if cached is not None:
+            cached[1].close()
+            self._local.conn = None
+
+    @_wrap_errors
+    def stats(self) -> Dict[str, Any]:
+        conn = self._conn()
+        keys = conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+        messages = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        return {"backend": self.scheme, "path": str(self.path), "keys": keys, "messages": messages}
@@ -0,0 +1,418 @@
+"""Near-duplicate cache of successful insert turns (per worker process).
+
+"生成一个登录框" and "帮我做一个登录框吧" produce the same componentTemplate, but
+an exact-hash cache misses every rewording. Here a finished messages:stream
+turn that only inserted new modules (chatMessage + componentTemplate, no
+parentId, no edits of existing nodes) is remembered under a normalized form
+of its request:
+
+- normalization: NFKC, lower case, quoted literals (「…」 “…” "…") replaced by
+  a slot marker, filler words / verbs / punctuation dropped; the partition
+  key (scope, responseMode, intent, model, selection present) must match
+  exactly, so entries are never served outside their scope;
+- signature: MinHash over character trigrams, LSH banding for candidates, then
+  the exact trigram Jaccard of the best candidate as the confidence score;
+- hard features must be identical, in order: numbers, colour words, style
+  words and negations ("3 个卡片" is not "5 个卡片", "深色" is not "浅色",
+  "不要注册按钮" is not "要注册按钮"), and so must the count of quoted literals.
+  A one-character difference keeps trigram Jaccard high, so these words are
+  compared exactly instead of through the score.
+
+A hit at or above DWEB_SIMILAR_CACHE_THRESHOLD is replayed as a normal
+envelope stream: fresh envelope ids and templateIds, root nodes moved by the
+same offset from the new viewport.centerWorld as the original had from its
+own, and the original request's quoted literals replaced by the new ones in
+text nodes and the chat message. The cache is opt-in (DWEB_SIMILAR_CACHE=1);
+a request then opts out with `"similarCache": false`.
+
+DWEB_SIMILAR_CACHE_SCOPE decides who shares entries: "conversation" (the
+default), "tenant" (requests with the same `tenantId` in the body; requests
+without one fall back to their conversation) or "global" (every conversation
+served by the process). stats() reports lookups, hits and the hit rate per
+scope.
+"""
+
+from __future__ import annotations
+
+import copy
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
+import uuid
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Generator, List, Optional, Set, Tuple
+
+from . import metrics
+
+ENABLED = os.environ.get("DWEB_SIMILAR_CACHE", "0") == "1"
+THRESHOLD = float(os.environ.get("DWEB_SIMILAR_CACHE_THRESHOLD", "0.85"))
+MAX_ENTRIES = int(os.environ.get("DWEB_SIMILAR_CACHE_SIZE", "512"))
+SCOPES = ("conversation", "tenant", "global")
+SCOPE = os.environ.get("DWEB_SIMILAR_CACHE_SCOPE", "conversation")
+
+_BANDS = 8
+_ROWS = 4
+_PRIME = (1 << 61) - 1
+_rng = random.Random(0x5EED)
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(_BANDS * _ROWS)]
+
+_QUOTE_RE = re.compile(r"「([^」]{1,80})」|『([^』]{1,80})』|“([^”]{1,80})”|\"([^\"]{1,80})\"|‘([^’]{1,80})’")
+_FILLER_RE = re.compile(
+    r"请|帮我|帮忙|给我|麻烦|一下|一个|一份|一张|个|吧|呢|啊|哦|"
+    r"生成|创建|新建|插入|添加|新增|做|画|设计|来|加|"
+    r"please|make|create|generate|insert|add|build|draw|design|\ban?\b|\bthe\b"
+)
+# Words whose change flips the result while barely moving the trigram score.
+_FEATURE_RE = re.compile(
+    r"#[0-9a-f]{3,8}\b|\d+(?:\.\d+)?|"
+    # colours and tones
+    r"[红橙黄绿青蓝紫粉黑白灰金银棕褐]|深|浅|亮|暗|透明|"
+    r"\b(?:red|orange|yellow|green|cyan|teal|blue|purple|violet|pink|black|white|gr[ae]y|gold|silver|brown|"
+    r"dark|light|bright|transparent)\b|"
+    # styles
+    r"圆角|直角|扁平|立体|阴影|渐变|描边|边框|虚线|实线|粗|细|斜体|大|小|宽|窄|极简|简约|复古|科技|卡通|玻璃|霓虹|发光|"
+    r"\b(?:rounded|square|flat|shadow|gradient|outline|border|dashed|bold|italic|large|small|big|wide|narrow|"
+    r"minimal|retro|neon|glass|glow)\b|"
+    # negations
+    r"[不没无别非勿]|去掉|除了|\b(?:no|not|without|never|except|don't|dont)\b"
+)
+_NEGATIONS = set("不没无别非勿") | {"去掉", "除了", "no", "not", "without", "never", "except", "don't", "dont"}
+_DROP_RE = re.compile(r"[^\w\x00]+|_+")
+_SLOT = "§"
+_CACHEABLE_TYPES = {"agentToUi/chatMessage", "agentToUi/componentTemplate", "agentToUi/taskStatus"}
+
+
+def _literals(content: str) -> List[str]:
+    return [next(g for g in m.groups() if g is not None) for m in _QUOTE_RE.finditer(content)]
+
+
+def normalize(content: str) -> str:
+    text = _QUOTE_RE.sub("\x00", unicodedata.normalize("NFKC", content or "")).lower()
+    text = _DROP_RE.sub("", _FILLER_RE.sub("", text))
+    return text.replace("\x00", _SLOT)
+
+
+def features(content: str) -> Tuple[str, ...]:
+    """Hard-match features of a request, in order: numbers, colours, styles, negations ("¬").
+
+    Quoted literals are left out: they are substituted on replay.
+    """
+
+    text = _QUOTE_RE.sub(" ", unicodedata.normalize("NFKC", content or "")).lower()
+    return tuple("¬" if m in _NEGATIONS else m for m in _FEATURE_RE.findall(text))
+
+
+def _shingles(norm: str) -> Set[str]:
+    if len(norm) < 3:
+        return {norm} if norm else set()
+    return {norm[i : i + 3] for i in range(len(norm) - 2)}
+
+
+def _minhash(shingles: Set[str]) -> Tuple[int, ...]:
+    hashed = [zlib.crc32(s.encode("utf-8")) for s in shingles]
+    return tuple(min((a * h + b) % _PRIME for h in hashed) for a, b in _PERMS)
+
+
+def _bands(sig: Tuple[int, ...]) -> List[Tuple[int, int]]:
+    return [(i, hash(sig[i * _ROWS : (i + 1) * _ROWS])) for i in range(_BANDS)]
+
+
+def _center(viewport: Any) -> Optional[Tuple[float, float]]:
+    c = viewport.get("centerWorld") if isinstance(viewport, dict) else None
+    if not isinstance(c, dict):
+        return None
+    try:
+        return float(c["x"]), float(c["y"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+@dataclass
+class Entry:
+    key: str
+    partition: Tuple[Any, ...]
+    shingles: Set[str]
+    features: Tuple[str, ...]
+    literals: List[str]
+    center: Optional[Tuple[float, float]]
+    envelopes: List[Dict[str, Any]]
+    bands: List[Tuple[int, int]] = field(default_factory=list)
+    hits: int = 0
+
+
+@dataclass
+class Match:
+    entry: Entry
+    score: float
+    literals: List[str]
+
+
+def resolve_scope(*, conversation_id: str, tenant: Any = None, scope: Optional[str] = None) -> Tuple[str, str]:
+    """(scope, scope id) whose requests share entries, for DWEB_SIMILAR_CACHE_SCOPE or `scope`."""
+
+    kind = scope if scope is not None else SCOPE
+    if kind == "global":
+        return "global", ""
+    if kind == "tenant" and isinstance(tenant, str) and tenant:
+        return "tenant", tenant
+    return "conversation", conversation_id
+
+
+def partition_key(
+    *, scope: Tuple[str, str], response_mode: str, intent: Optional[str], model: str, context_pack: Any
+) -> Tuple[Any, ...]:
+    """`scope` comes from resolve_scope(): generated content is only replayed inside it."""
+
+    ids = context_pack.get("selectedNodeIds") if isinstance(context_pack, dict) else None
+    return (scope, response_mode, intent, model, bool(ids))
+
+
+def _scope_of(partition: Tuple[Any, ...]) -> str:
+    head = partition[0] if partition else None
+    return str(head[0]) if isinstance(head, tuple) and head else "conversation"
+
+
+class SimilarCache:
+    def __init__(self, *, maxsize: int = MAX_ENTRIES, threshold: float = THRESHOLD) -> None:
+        self.maxsize = max(1, maxsize)
+        self.threshold = threshold
+        self._entries: "OrderedDict[str, Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[int, int], Set[str]] = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self._by_scope: Dict[str, List[int]] = {}  # scope -> [lookups, hits]
+
+    def lookup(self, content: str, *, partition: Tuple[Any, ...]) -> Tuple[Optional[Match], Dict[str, Any]]:
+        """(match or None, report). The report says why a lookup missed."""
+
+        t0 = time.perf_counter()
+        norm = normalize(content)
+        shingles = _shingles(norm)
+        literals = _literals(content)
+        feats = features(content)
+        best: Optional[Entry] = None
+        best_score = 0.0
+        candidates = 0
+        if shingles:
+            bands = _bands(_minhash(shingles))
+            with self._lock:
+                keys: Set[str] = set()
+                for b in bands:
+                    keys |= self._buckets.get(b, set())
+                pool = [self._entries[k] for k in keys if k in self._entries]
+            for e in pool:
+                if e.partition != partition or e.features != feats or len(e.literals) != len(literals):
+                    continue
+                candidates += 1
+                score = len(shingles & e.shingles) / len(shingles | e.shingles)
+                if score > best_score:
+                    best, best_score = e, score
+
+        hit = best is not None and best_score >= self.threshold
+        scope = _scope_of(partition)
+        with self._lock:
+            self.lookups += 1
+            counts = self._by_scope.setdefault(scope, [0, 0])
+            counts[0] += 1
+            if hit and best is not None:
+                self.hits += 1
+                counts[1] += 1
+                best.hits += 1
+                self._entries.move_to_end(best.key)
+        outcome = "hit" if hit else ("below_threshold" if best is not None else "miss")
+        metrics.incr("chat.similar_cache", outcome=outcome, scope=scope)
+        if best is not None:
+            metrics.observe("chat.similar_cache_score", best_score)
+        report = {
+            "outcome": outcome,
+            "scope": scope,
+            "score": round(best_score, 3),
+            "threshold": self.threshold,
+            "candidates": candidates,
+            "ms": round((time.perf_counter() - t0) * 1000, 3),
+        }
+        if hit and best is not None:
+            report["entry"] = best.key
+            return Match(entry=best, score=best_score, literals=literals), report
+        return None, report
+
+    def remember(
+        self,
+        content: str,
+        *,
+        partition: Tuple[Any, ...],
+        viewport: Any,
+        envelopes: List[Dict[str, Any]],
+    ) -> Optional[str]:
+        """Index a finished turn if it is a pure insert; returns the entry key."""
+
+        kept: List[Dict[str, Any]] = []
+        for env in envelopes:
+            t = env.get("type")
+            if t not in _CACHEABLE_TYPES:
+                return None
+            if t == "agentToUi/taskStatus":
+                continue
+            payload = env.get("payload")
+            if not isinstance(payload, dict):
+                return None
+            if t == "agentToUi/componentTemplate":
+                tpl = payload.get("template")
+                if payload.get("parentId") or not isinstance(tpl, dict) or not isinstance(tpl.get("nodes"), list):
+                    return None
+            kept.append({"type": t, "payload": copy.deepcopy(payload)})
+        if not any(e["type"] == "agentToUi/componentTemplate" for e in kept):
+            return None
+
+        norm = normalize(content)
+        shingles = _shingles(norm)
+        if not shingles:
+            return None
+        entry = Entry(
+            key=uuid.uuid4().hex[:12],
+            partition=partition,
+            shingles=shingles,
+            features=features(content),
+            literals=_literals(content),
+            center=_center(viewport),
+            envelopes=kept,
+            bands=_bands(_minhash(shingles)),
+        )
+        with self._lock:
+            self._entries[entry.key] = entry
+            for b in entry.bands:
+                self._buckets.setdefault(b, set()).add(entry.key)
+            while len(self._entries) > self.maxsize:
+                _, old = self._entries.popitem(last=False)
+                for b in old.bands:
+                    bucket = self._buckets.get(b)
+                    if bucket is not None:
+                        bucket.discard(old.key)
+                        if not bucket:
+                            del self._buckets[b]
+        metrics.incr("chat.similar_cache_stored")
+        return entry.key
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "maxsize": self.maxsize,
+                "threshold": self.threshold,
+                "scope": SCOPE,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hitRate": _rate(self.hits, self.lookups),
+                "byScope": {
+                    scope: {"lookups": lookups, "hits": hits, "hitRate": _rate(hits, lookups)}
+                    for scope, (lookups, hits) in sorted(self._by_scope.items())
+                },
+            }
+
+
+def _rate(hits: int, lookups: int) -> Optional[float]:
+    return round(hits / lookups, 4) if lookups else None
+
+
+_CACHE: Optional[SimilarCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_similar_cache() -> SimilarCache:
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = SimilarCache()
+        return _CACHE
+
+
+def adapt_envelopes(match: Match, viewport: Any) -> List[Dict[str, Any]]:
+    """Short-form {type, payload} envelopes of the cached turn, fitted to the new request."""
+
+    replace = [(old, new) for old, new in zip(match.entry.literals, match.literals) if old != new]
+    old_center = match.entry.center
+    new_center = _center(viewport)
+    out: List[Dict[str, Any]] = []
+    for env in match.entry.envelopes:
+        payload = copy.deepcopy(env["payload"])
+        if env["type"] == "agentToUi/chatMessage" and isinstance(payload.get("content"), str):
+            payload["content"] = _substitute(payload["content"], replace)
+        elif env["type"] == "agentToUi/componentTemplate":
+            tpl = payload["template"]
+            tpl["templateId"] = f"{tpl.get('templateId') or 'tmpl'}_{uuid.uuid4().hex[:6]}"
+            root_id = tpl.get("rootLocalId")
+            for node in tpl["nodes"]:
+                if not isinstance(node, dict):
+                    continue
+                props = node.get("props")
+                if replace and isinstance(props, dict) and isinstance(props.get("textContent"), str):
+                    props["textContent"] = _substitute(props["textContent"], replace)
+                is_root = node.get("localId") == root_id if root_id else not node.get("parentLocalId")
+                if is_root and new_center is not None:
+                    _move_root(node, old_center, new_center)
+        out.append({"type": env["type"], "payload": payload})
+    return out
+
+
+def _substitute(text: str, replace: List[Tuple[str, str]]) -> str:
+    for old, new in replace:
+        text = text.replace(old, new)
+    return text
+
+
+def _move_root(node: Dict[str, Any], old: Optional[Tuple[float, float]], new: Tuple[float, float]) -> None:
+    tr = node.get("transform")
+    if not isinstance(tr, dict):
+        tr = node["transform"] = {}
+    try:
+        x, y = float(tr.get("x", 0)), float(tr.get("y", 0))
+    except (TypeError, ValueError):
+        x, y = 0.0, 0.0
+    dx, dy = (x - old[0], y - old[1]) if old is not None else (0.0, 0.0)
+    tr["x"] = round(new[0] + dx, 2)
+    tr["y"] = round(new[1] + dy, 2)
+
+
+def iter_cached_events(
+    match: Match,
+    report: Dict[str, Any],
+    *,
+    viewport: Any,
+    model: str,
+    prompt_report: Dict[str, Any],
+    started_at: float,
+) -> Generator[Tuple[str, Any], None, None]:
+    """Replay a cache hit with the same event shape as ai_chat_api._iter_stream_events."""
+
+    from .ai_chat_api import _agent_to_ui_task_status, _wrap_short_agent_to_ui
+
+    yield ("msg", _agent_to_ui_task_status("started", message="已开始", meta={"prompt": prompt_report, "similarCache": report}))
+    first = True
+    ttft_ms = 0
+    for env in adapt_envelopes(match, viewport):
+        out = _wrap_short_agent_to_ui(env, source_model=model)
+        out["meta"] = {"similarCache": {"entry": match.entry.key, "score": round(match.score, 3)}}
+        if first:
+            first = False
+            ttft_ms = int((time.monotonic() - started_at) * 1000)
+        yield ("msg", out)
+    total_ms = int((time.monotonic() - started_at) * 1000)
+    metrics.observe("chat.similar_cache_serve_ms", total_ms)
+    meta = {
+        "timing": {"ttftMs": ttft_ms, "totalMs": total_ms},
+        "intent": prompt_report.get("intent"),
+        "similarCache": report,
+    }
+    yield ("msg", _agent_to_ui_task_status("done", message="完成", meta=meta))
+    yield ("done", "{}")
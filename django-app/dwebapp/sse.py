@@ -0,0 +1,23 @@
+"""Server-Sent Events helpers shared by the streaming endpoints."""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Optional
+
+from django.http import StreamingHttpResponse
+
+
+def sse_event(event: str, data: Any, *, event_id: Optional[str] = None) -> str:
+    if isinstance(data, str):
+        payload = data
+    else:
+        payload = json.dumps(data, ensure_ascii=False)
+    # One event with one data block; `id:` lets EventSource resume via Last-Event-ID.
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return head + f"event: {event}\n" + "\n".join([f"data: {line}" for line in payload.splitlines()]) + "\n\n"
+
+
+def apply_sse_headers(resp: StreamingHttpResponse) -> None:
+    resp["Cache-Control"] = "no-cache"
+    resp["X-Accel-Buffering"] = "no"
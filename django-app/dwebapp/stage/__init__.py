@@ -0,0 +1 @@
+"""Server-side helpers for EditorSnapshot / nodeTree data (mirrors src/core/scene)."""
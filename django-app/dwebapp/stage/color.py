@@ -0,0 +1,96 @@
+"""Color parsing (port of src/ui/VideoScene/anim/color.ts)."""
+
+from __future__ import annotations
+
+import re
+from functools import lru_cache
+from typing import Any, Optional, Tuple
+
+RGBA = Tuple[float, float, float, float]  # r,g,b in 0..255, a in 0..1
+
+_HEX_RE = re.compile(r"^[0-9a-fA-F]+$")
+_RGB_RE = re.compile(r"^rgba?\((.*)\)$", re.IGNORECASE)
+
+
+def _clamp(v: float, lo: float, hi: float) -> float:
+    return max(lo, min(hi, v))
+
+
+def _parse_hex(s: str) -> Optional[RGBA]:
+    if not s.startswith("#"):
+        return None
+    h = s[1:]
+    if not _HEX_RE.match(h):
+        return None
+    if len(h) in (3, 4):
+        r, g, b = (int(c * 2, 16) for c in h[:3])
+        a = int(h[3] * 2, 16) / 255 if len(h) == 4 else 1.0
+        return float(r), float(g), float(b), a
+    if len(h) in (6, 8):
+        r, g, b = int(h[0:2], 16), int(h[2:4], 16), int(h[4:6], 16)
+        a = int(h[6:8], 16) / 255 if len(h) == 8 else 1.0
+        return float(r), float(g), float(b), a
+    return None
+
+
+def _parse_channel(raw: str) -> Optional[float]:
+    s = raw.strip()
+    if not s:
+        return None
+    try:
+        if s.endswith("%"):
+            return _clamp(float(s[:-1]) / 100 * 255, 0, 255)
+        return _clamp(float(s), 0, 255)
+    except ValueError:
+        return None
+
+
+def _parse_alpha(raw: str) -> Optional[float]:
+    s = raw.strip()
+    if not s:
+        return None
+    try:
+        if s.endswith("%"):
+            return _clamp(float(s[:-1]) / 100, 0, 1)
+        return _clamp(float(s), 0, 1)
+    except ValueError:
+        return None
+
+
+def _parse_rgb(s: str) -> Optional[RGBA]:
+    m = _RGB_RE.match(s)
+    if not m:
+        return None
+    body = m.group(1).strip()
+    if not body:
+        return None
+    alpha_part: Optional[str] = None
+    if "/" in body:
+        body, alpha_part = (p.strip() for p in body.split("/", 1))
+    parts = body.split(",") if "," in body else body.split()
+    chans = [_parse_channel(p) for p in (parts + ["", "", ""])[:3]]
+    if any(c is None for c in chans):
+        return None
+    a = 1.0
+    alpha_raw = alpha_part if alpha_part is not None else (parts[3] if len(parts) > 3 else None)
+    if alpha_raw is not None and alpha_raw.strip():
+        aa = _parse_alpha(alpha_raw)
+        if aa is None:
+            return None
+        a = aa
+    return chans[0], chans[1], chans[2], a  # type: ignore[return-value]
+
+
+@lru_cache(maxsize=4096)
+def _parse_cached(s: str) -> Optional[RGBA]:
+    return _parse_hex(s) or _parse_rgb(s)
+
+
+def parse_color(raw: Any) -> Optional[RGBA]:
+    if not isinstance(raw, str):
+        return None
+    return _parse_cached(raw.strip())
+
+
+def parse_color_or(raw: Any, fallback: str) -> RGBA:
+    return parse_color(raw) or parse_color(fallback) or (255.0, 255.0, 255.0, 1.0)
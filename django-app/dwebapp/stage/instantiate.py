@@ -0,0 +1,498 @@
+"""Server-side ComponentTemplate instantiation (mirrors src/core/components/instantiate.ts).
+
+A template is compiled once into a substitution plan and cached by its
+content hash: per node, the static props / transform are resolved up front
+and only the values holding `{{key}}` placeholders are kept as slots. An
+instance then costs one copy-on-write per slot path instead of a deep walk
+of the whole template, so N parameter rows are cheap:
+
+    plan = compile_template(template)
+    instances = plan.instantiate([{"title": "A", "x": 0}, {"title": "B", "x": 300}], taken=stage_ids)
+
+Substitution follows the client: a value that is exactly one placeholder
+takes the parameter's JSON type, placeholders inside longer strings are
+formatted with str(), unknown keys stay as written. Transform values are
+coerced to numbers (width/height >= 1, opacity 0..1) and laid over the
+NodeBase defaults; `group` nodes become `base` nodes.
+A row may also carry `$x` / `$y`, which place the instance root (for
+templates whose position is not a parameter).
+
+Stage ids follow the client's getNodeId: `templateId:localId`, with `__<n>`
+appended when the id is taken (by `taken` or an earlier row), so row 0 gets
+`mindnode_v1:g0`, row 1 `mindnode_v1:g0__1`, and so on. Unchanged nested
+values are shared between instances; treat results as read-only.
+Layout intents (stage/layout.py) are not resolved here.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import re
+import time
+import uuid
+from datetime import datetime
+from typing import AbstractSet, Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from ..caching import LruCache
+
+_PLACEHOLDER_RE = re.compile(r"\{\{\s*([a-zA-Z0-9_.-]+)\s*\}\}")
+_PURE_RE = re.compile(r"^\{\{\s*([a-zA-Z0-9_.-]+)\s*\}\}$")
+_UNSAFE_ID_RE = re.compile(r"[^a-zA-Z0-9:_\-]")
+_PARAM_TYPES = ("string", "number", "boolean", "color", "asset:image")
+_TRANSFORM_KEYS = ("x", "y", "width", "height", "rotation", "opacity")
+# NodeBase.create (src/core/scene/nodesType/NodeBase.ts).
+_BASE_TRANSFORM: Dict[str, float] = {"x": 0, "y": 0, "width": 200, "height": 120, "rotation": 0, "opacity": 1}
+_USER_TYPES = {"group": "base", "base": "base", "rect": "rect", "text": "text", "image": "image", "line": "line"}
+_DEFAULT_NAMES = {"rect": "Rect", "text": "Text", "image": "Image", "line": "Line"}
+MAX_ROWS = int(os.environ.get("DWEB_INSTANTIATE_MAX_ROWS", "2000"))
+
+_PLANS: LruCache["TemplatePlan"] = LruCache(maxsize=int(os.environ.get("DWEB_INSTANTIATE_CACHE_SIZE", "256")))
+_BY_IDENTITY: LruCache[Tuple[Tuple[Any, Any, Any], "TemplatePlan"]] = LruCache(maxsize=_PLANS.maxsize)
+
+
+class InvalidTemplate(ValueError):
+    def __init__(self, errors: List[str]) -> None:
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def validate_template(template: Any) -> List[str]:
+    """The checks of validateComponentTemplate (src/core/components/validate.ts); [] when valid."""
+
+    if not isinstance(template, dict):
+        return ["template: not an object"]
+    errors: List[str] = []
+    if template.get("schemaVersion") != 1:
+        errors.append("schemaVersion must be 1")
+    for key in ("templateId", "name", "rootLocalId"):
+        if not isinstance(template.get(key), str) or not template[key].strip():
+            errors.append(f"{key} must be non-empty string")
+    params = template.get("params") if template.get("params") is not None else []
+    nodes = template.get("nodes") if template.get("nodes") is not None else []
+    if not isinstance(params, list):
+        errors.append("params must be an array")
+        params = []
+    if not isinstance(nodes, list):
+        errors.append("nodes must be an array")
+        nodes = []
+    keys: Set[str] = set()
+    for p in params:
+        if not isinstance(p, dict):
+            errors.append("params[] must be objects")
+            continue
+        if not isinstance(p.get("key"), str) or not p["key"].strip():
+            errors.append("param.key must be non-empty string")
+            continue
+        if p["key"] in keys:
+            errors.append(f"param.key duplicated: {p['key']}")
+        keys.add(p["key"])
+        if p.get("type") not in _PARAM_TYPES:
+            errors.append(f"param.type invalid: {p.get('type')}")
+    by_id: Dict[str, Dict[str, Any]] = {}
+    for n in nodes:
+        if not isinstance(n, dict):
+            errors.append("nodes[] must be objects")
+            continue
+        local_id = n.get("localId")
+        if not isinstance(local_id, str) or not local_id.strip():
+            errors.append("nodes[].localId must be non-empty string")
+            continue
+        if local_id in by_id:
+            errors.append(f"nodes[].localId duplicated: {local_id}")
+        if not isinstance(n.get("type"), str) or not n["type"].strip():
+            errors.append(f"nodes[{local_id}].type must be non-empty string")
+        if not isinstance(n.get("props"), dict):
+            errors.append(f"nodes[{local_id}].props must be object")
+        transform = n.get("transform")
+        if transform is not None:
+            if not isinstance(transform, dict):
+                errors.append(f"nodes[{local_id}].transform must be object when provided")
+            else:
+                for key in _TRANSFORM_KEYS:
+                    v = transform.get(key)
+                    if v is not None and (isinstance(v, bool) or not isinstance(v, (int, float, str))):
+                        errors.append(f"nodes[{local_id}].transform.{key} must be number|string when provided")
+        by_id[local_id] = n
+    root = template.get("rootLocalId")
+    if isinstance(root, str) and root.strip() and root not in by_id:
+        errors.append("rootLocalId must exist in nodes[].localId")
+    for local_id, n in by_id.items():
+        parent = n.get("parentLocalId")
+        if parent is None:
+            continue
+        if not isinstance(parent, str) or not parent.strip():
+            errors.append(f"nodes[{local_id}].parentLocalId must be string when provided")
+            continue
+        if parent == local_id:
+            errors.append(f"nodes[{local_id}].parentLocalId cannot reference itself")
+        if parent not in by_id:
+            errors.append(f"nodes[{local_id}].parentLocalId not found: {parent}")
+    return errors
+
+
+def template_hash(template: Dict[str, Any]) -> str:
+    data = json.dumps(template, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+# -- compilation -------------------------------------------------------------
+
+Render = Callable[[Dict[str, Any]], Any]
+Path = Tuple[Any, ...]
+
+
+def _renderer(s: str) -> Optional[Render]:
+    """A params -> value function for a string with placeholders; None for a plain string."""
+
+    pure = _PURE_RE.match(s)
+    if pure:
+        key = pure.group(1)
+        return lambda params: params.get(key, s)
+    if "{{" not in s or not _PLACEHOLDER_RE.search(s):
+        return None
+    pieces: List[Tuple[bool, str]] = []  # (is_key, text)
+    pos = 0
+    for m in _PLACEHOLDER_RE.finditer(s):
+        if m.start() > pos:
+            pieces.append((False, s[pos : m.start()]))
+        pieces.append((True, m.group(1)))
+        pos = m.end()
+    if pos < len(s):
+        pieces.append((False, s[pos:]))
+
+    def render(params: Dict[str, Any]) -> str:
+        out = []
+        for is_key, text in pieces:
+            if not is_key:
+                out.append(text)
+            elif text in params:
+                out.append(_js_string(params[text]))
+            else:
+                out.append("{{" + text + "}}")
+        return "".join(out)
+
+    return render
+
+
+def _js_string(v: Any) -> str:
+    # String(v) in the client.
+    if v is None:
+        return "null"
+    if isinstance(v, bool):
+        return "true" if v else "false"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    if isinstance(v, (dict, list)):
+        return "[object Object]" if isinstance(v, dict) else ",".join(_js_string(x) for x in v)
+    return str(v)
+
+
+def _collect_slots(v: Any, path: Path, out: List[Tuple[Path, Render]]) -> None:
+    if isinstance(v, str):
+        render = _renderer(v)
+        if render is not None:
+            out.append((path, render))
+    elif isinstance(v, dict):
+        for k, vv in v.items():
+            _collect_slots(vv, path + (k,), out)
+    elif isinstance(v, list):
+        for i, vv in enumerate(v):
+            _collect_slots(vv, path + (i,), out)
+
+
+def _coerce_number(v: Any) -> Optional[float]:
+    if isinstance(v, bool):
+        return None
+    if isinstance(v, (int, float)):
+        return v if math.isfinite(v) else None
+    if isinstance(v, str):
+        try:
+            n = float(v.strip()) if v.strip() else 0.0  # Number("") is 0
+        except ValueError:
+            return None
+        if not math.isfinite(n):
+            return None
+        return int(n) if n.is_integer() else n
+    return None
+
+
+def _apply_transform(out: Dict[str, Any], key: str, v: Any) -> None:
+    n = _coerce_number(v)
+    if n is None:
+        return
+    if key in ("width", "height"):
+        n = max(1, n)
+    elif key == "opacity":
+        n = max(0, min(1, n))
+    out[key] = n
+
+
+def _set_path(root: Dict[str, Any], path: Path, value: Any) -> None:
+    """Assign root[path] = value, copying each container on the way (shared with the plan)."""
+
+    cur: Any = root
+    for key in path[:-1]:
+        child = cur[key]
+        child = dict(child) if isinstance(child, dict) else list(child)
+        cur[key] = child
+        cur = child
+    cur[path[-1]] = value
+
+
+class PlanNode(NamedTuple):
+    local_id: str
+    parent_local_id: Optional[str]
+    user_type: str
+    name: str
+    props: Dict[str, Any]
+    prop_slots: Tuple[Tuple[Path, Render], ...]
+    transform: Dict[str, Any]  # base + static patch, already coerced
+    transform_slots: Tuple[Tuple[str, Render], ...]
+
+
+class TemplatePlan:
+    """A compiled template: build with compile_template(), reuse for every instance."""
+
+    def __init__(self, template: Dict[str, Any], digest: str) -> None:
+        self.template_id = str(template["templateId"])
+        self.hash = digest
+        self.root_local_id = str(template["rootLocalId"])
+        self.defaults: Dict[str, Any] = {
+            p["key"]: p["default"] for p in template.get("params") or [] if isinstance(p, dict) and "default" in p
+        }
+        nodes: List[PlanNode] = []
+        for n in template.get("nodes") or []:
+            user_type = _USER_TYPES.get(str(n.get("type")), "base")
+            prop_slots: List[Tuple[Path, Render]] = []
+            _collect_slots(n["props"], (), prop_slots)
+            transform = dict(_BASE_TRANSFORM)
+            transform_slots: List[Tuple[str, Render]] = []
+            for key in _TRANSFORM_KEYS:
+                v = (n.get("transform") or {}).get(key)
+                render = _renderer(v) if isinstance(v, str) else None
+                if render is not None:
+                    transform_slots.append((key, render))
+                elif v is not None:
+                    _apply_transform(transform, key, v)
+            nodes.append(
+                PlanNode(
+                    local_id=n["localId"],
+                    parent_local_id=n.get("parentLocalId"),
+                    user_type=user_type,
+                    name=str(n["name"]) if n.get("name") is not None else _DEFAULT_NAMES.get(user_type, "Node"),
+                    props=n["props"],
+                    prop_slots=tuple(prop_slots),
+                    transform=transform,
+                    transform_slots=tuple(transform_slots),
+                )
+            )
+        self.nodes: Tuple[PlanNode, ...] = tuple(nodes)
+        self._links = tuple((n.parent_local_id, n.local_id) for n in self.nodes if n.parent_local_id)
+        base = _UNSAFE_ID_RE.sub("_", f"{self.template_id}:")
+        self._base_ids = {node.local_id: base + _UNSAFE_ID_RE.sub("_", node.local_id) for node in self.nodes}
+
+    @property
+    def slots(self) -> int:
+        return sum(len(n.prop_slots) + len(n.transform_slots) for n in self.nodes)
+
+    def instantiate(
+        self, rows: List[Dict[str, Any]], *, taken: Optional[AbstractSet[str]] = None, created_at: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """One {rootNodeId, localIdToNodeId, root} per parameter row (InstantiateTemplateResult)."""
+
+        used: Set[str] = set(taken or ())
+        next_suffix: Dict[str, int] = {}
+        created = created_at if created_at is not None else int(time.time() * 1000)
+        out = []
+        root_local_id = self.root_local_id
+        for row in rows:
+            params = dict(self.defaults, **row) if row else self.defaults
+            by_local: Dict[str, Dict[str, Any]] = {}
+            ids: Dict[str, str] = {}
+            for local_id, _parent, user_type, name, props0, prop_slots, transform0, transform_slots in self.nodes:
+                props = dict(props0)
+                for path, render in prop_slots:
+                    _set_path(props, path, render(params))
+                transform = dict(transform0)
+                for key, render in transform_slots:
+                    _apply_transform(transform, key, render(params))
+                if local_id == root_local_id and row:
+                    for key in ("x", "y"):
+                        if "$" + key in row:
+                            _apply_transform(transform, key, row["$" + key])
+                node_id = self._free_id(local_id, used, next_suffix)
+                ids[local_id] = node_id
+                by_local[local_id] = {
+                    "id": node_id,
+                    "createdAt": created,
+                    "name": name,
+                    "category": "user",
+                    "userType": user_type,
+                    "transform": transform,
+                    "props": props,
+                }
+            for parent_local_id, local_id in self._links:
+                parent = by_local[parent_local_id]
+                if "children" in parent:
+                    parent["children"].append(by_local[local_id])
+                else:
+                    parent["children"] = [by_local[local_id]]
+            root = by_local[root_local_id]
+            out.append({"rootNodeId": root["id"], "localIdToNodeId": ids, "root": root})
+        return out
+
+    def _free_id(self, local_id: str, used: Set[str], next_suffix: Dict[str, int]) -> str:
+        # next_suffix resumes the probe where the previous row stopped (N rows stay linear).
+        base = self._base_ids[local_id]
+        i = next_suffix.get(base, 0)
+        node_id = base if i == 0 else f"{base}__{i}"
+        while node_id in used:
+            i += 1
+            node_id = f"{base}__{i}"
+        next_suffix[base] = i + 1
+        used.add(node_id)
+        return node_id
+
+
+def _identity_key(template: Dict[str, Any]) -> Tuple[str, int, int]:
+    return (str(template.get("templateId")), id(template.get("nodes")), id(template.get("params")))
+
+
+def _source(template: Dict[str, Any]) -> Tuple[Any, Any, Any]:
+    return (template.get("nodes"), template.get("params"), template.get("rootLocalId"))
+
+
+def compile_template(template: Any) -> Tuple[TemplatePlan, bool]:
+    """(plan, cached) for a template; raises InvalidTemplate.
+
+    Plans are cached by template_hash. Library templates and the templates
+    seen in a turn share their nodes/params lists, so those are first looked
+    up by identity, which skips validate_template + template_hash (together
+    costlier than compiling). Re-parsed JSON misses that check and falls back
+    to the hash. Templates are treated as immutable once compiled.
+    """
+
+    key = _identity_key(template) if isinstance(template, dict) else None
+    if key is not None:
+        seen = _BY_IDENTITY.get(key)
+        # The entry holds the source lists, so their ids cannot be reused while it is cached.
+        if seen is not None and seen[0] == _source(template):
+            return seen[1], True
+    errors = validate_template(template)
+    if errors:
+        raise InvalidTemplate(errors)
+    digest = template_hash(template)
+    plan = _PLANS.get(digest)
+    cached = plan is not None
+    if plan is None:
+        plan = TemplatePlan(template, digest)
+        _PLANS.put(digest, plan)
+    _BY_IDENTITY.put(key, (_source(template), plan))
+    return plan, cached
+
+
+def cache_stats() -> Dict[str, Any]:
+    return dict(_PLANS.stats(), identity=_BY_IDENTITY.stats())
+
+
+def resolve_template(template: Any, template_id: Any, known: Optional[Dict[str, Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+    """The inline template, else `known[template_id]` (templates seen this turn), else the library's."""
+
+    if isinstance(template, dict):
+        return template
+    if not isinstance(template_id, str) or not template_id:
+        return None
+    if known and template_id in known:
+        return known[template_id]
+    from ..prompts.template_library import _LIBRARY_ONLY_KEYS, get_template_library
+
+    found = get_template_library().get(template_id)
+    if found is None:
+        return None
+    return {k: v for k, v in found.template.items() if k not in _LIBRARY_ONLY_KEYS}
+
+
+def instantiate(
+    template: Dict[str, Any], rows: List[Dict[str, Any]], *, taken: Optional[AbstractSet[str]] = None
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Compile (or reuse) `template` and instantiate every row; (instances, info)."""
+
+    t0 = time.perf_counter()
+    plan, cached = compile_template(template)
+    instances = plan.instantiate(rows, taken=taken)
+    info = {
+        "templateId": plan.template_id,
+        "templateHash": plan.hash,
+        "cached": cached,
+        "rows": len(rows),
+        "nodes": len(plan.nodes) * len(rows),
+        "slots": plan.slots,
+        "ms": round((time.perf_counter() - t0) * 1000, 3),
+    }
+    return instances, info
+
+
+def parse_rows(body: Dict[str, Any]) -> Tuple[Optional[List[Dict[str, Any]]], Optional[str]]:
+    """(rows, None) from `rows` (a list of param objects) or a single `params` object; (None, reason) when malformed."""
+
+    rows = body.get("rows")
+    if rows is None:
+        params = body.get("params")
+        if params is not None and not isinstance(params, dict):
+            return None, "params must be an object"
+        return [params or {}], None
+    if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+        return None, "rows must be an array of objects"
+    if not rows:
+        return None, "rows must not be empty"
+    if len(rows) > MAX_ROWS:
+        return None, f"at most {MAX_ROWS} rows"
+    return rows, None
+
+
+def insert_node_envelopes(
+    instances: List[Dict[str, Any]],
+    *,
+    template_id: str,
+    parent_id: Any = None,
+    layer_id: Any = None,
+    source: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """One agentToUi/insertNode envelope per instance (the client needs no template support)."""
+
+    created_at = datetime.utcnow().isoformat() + "Z"
+    out = []
+    for i, inst in enumerate(instances):
+        payload: Dict[str, Any] = {"node": inst["root"]}
+        if isinstance(parent_id, str) and parent_id.strip():
+            payload["parentId"] = parent_id
+        if isinstance(layer_id, str) and layer_id.strip():
+            payload["layerId"] = layer_id
+        env: Dict[str, Any] = {
+            "schemaVersion": 1,
+            "type": "agentToUi/insertNode",
+            "id": str(uuid.uuid4()),
+            "createdAt": created_at,
+            "payload": payload,
+            "meta": {"instantiate": {"templateId": template_id, "row": i}},
+        }
+        if source is not None:
+            env["source"] = source
+        out.append(env)
+    return out
+
+
+def template_node_ids(template: Any) -> List[str]:
+    """Stage ids the client gives a componentTemplate's nodes when nothing collides."""
+
+    if not isinstance(template, dict) or not isinstance(template.get("nodes"), list):
+        return []
+    tid = str(template.get("templateId") or "")
+    return [
+        _UNSAFE_ID_RE.sub("_", f"{tid}:{n['localId']}")
+        for n in template["nodes"]
+        if isinstance(n, dict) and isinstance(n.get("localId"), str)
+    ]
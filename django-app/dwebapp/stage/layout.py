@@ -0,0 +1,300 @@
+"""Auto-layout solver for componentTemplate nodes with declarative layout intents.
+
+A container (rect) node may carry a `layout` object instead of hand-computed
+child coordinates:
+
+    {"localId":"card","type":"rect","layout":{"type":"vstack","gap":16,"padding":[24,32],"align":"stretch"},...}
+
+- type     "vstack" (children top to bottom) | "hstack" (left to right)
+- gap      space between consecutive children (default 0)
+- padding  number | [vertical, horizontal] | [top, right, bottom, left]
+- align    cross axis: "start" | "center" | "end" | "stretch" (default "start");
+           stretch sets rect/image/stack children to the inner cross size and
+           places text by its textAlign
+- justify  main axis, when the container is larger than its content:
+           "start" | "center" | "end" | "space-between" (default "start")
+- fit      "content" | "width" | "height" | "none": axes sized to the
+           content; an axis without transform.width/height is always fitted
+
+A child with `"layout":{"position":"absolute"}` keeps its own x/y and stays
+out of the flow. solve_template() sizes every node bottom-up and then places
+children top-down under the parent-center convention (a child's (0,0) is its
+parent's center), one pass each over the whole template; the `layout` keys
+are removed, so the client receives a plain ComponentTemplate. Rotation is
+ignored when measuring. The root keeps its own x/y.
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from .snapshot import _num
+from .text_metrics import TextBox, measure_many
+
+LAYOUT_TYPES = ("vstack", "hstack")
+_ALIGN = ("start", "center", "end", "stretch")
+_JUSTIFY = ("start", "center", "end", "space-between")
+_FIT = ("content", "width", "height", "none")
+# NodeBase / ImageNode defaults (src/core/scene/nodesType) for nodes without a size.
+_DEFAULT_SIZE = {"image": (240.0, 180.0)}
+_FALLBACK_SIZE = (200.0, 120.0)
+_MAX_WARNINGS = 20
+
+
+class StackSpec(NamedTuple):
+    vertical: bool
+    gap: float
+    padding: Tuple[float, float, float, float]  # top, right, bottom, left
+    align: str
+    justify: str
+    fit_width: Optional[bool]  # None: fit only when the transform has no width
+    fit_height: Optional[bool]
+
+
+class Measure(NamedTuple):
+    width: float
+    height: float
+    # Visual box center relative to the node origin (non-zero for off-center lines).
+    dx: float = 0.0
+    dy: float = 0.0
+
+
+def has_layout(template: Any) -> bool:
+    nodes = template.get("nodes") if isinstance(template, dict) else None
+    return isinstance(nodes, list) and any(isinstance(n, dict) and isinstance(n.get("layout"), dict) for n in nodes)
+
+
+def _padding(v: Any) -> Tuple[float, float, float, float]:
+    if isinstance(v, list) and v:
+        p = [max(0.0, _num(x, 0.0)) for x in v[:4]]
+        if len(p) == 1:
+            return p[0], p[0], p[0], p[0]
+        if len(p) == 2:
+            return p[0], p[1], p[0], p[1]
+        if len(p) == 3:
+            return p[0], p[1], p[2], p[1]
+        return p[0], p[1], p[2], p[3]
+    n = max(0.0, _num(v, 0.0))
+    return n, n, n, n
+
+
+def parse_spec(layout: Any) -> Optional[StackSpec]:
+    """StackSpec for a node's `layout` object, or None when it does not ask for a stack."""
+
+    if not isinstance(layout, dict) or layout.get("type") not in LAYOUT_TYPES:
+        return None
+    align = layout.get("align") if layout.get("align") in _ALIGN else "start"
+    justify = layout.get("justify") if layout.get("justify") in _JUSTIFY else "start"
+    fit = layout.get("fit") if layout.get("fit") in _FIT else None
+    return StackSpec(
+        vertical=layout["type"] == "vstack",
+        gap=max(0.0, _num(layout.get("gap"), 0.0)),
+        padding=_padding(layout.get("padding")),
+        align=align,
+        justify=justify,
+        fit_width=None if fit is None else fit in ("content", "width"),
+        fit_height=None if fit is None else fit in ("content", "height"),
+    )
+
+
+def _is_absolute(layout: Any) -> bool:
+    return isinstance(layout, dict) and layout.get("position") == "absolute"
+
+
+def _out(v: float) -> Any:
+    r = round(v, 2)
+    return int(r) if r == int(r) else r
+
+
+def _leaf_measure(node: Dict[str, Any], text_box: Optional[TextBox]) -> Measure:
+    t = node.get("transform") if isinstance(node.get("transform"), dict) else {}
+    props = node.get("props") if isinstance(node.get("props"), dict) else {}
+    kind = node.get("type")
+    if text_box is not None:
+        return Measure(_num(t.get("width"), text_box.width), _num(t.get("height"), text_box.height))
+    default_w, default_h = _DEFAULT_SIZE.get(str(kind), _FALLBACK_SIZE)
+    w, h = _num(t.get("width"), default_w), _num(t.get("height"), default_h)
+    if kind == "line":
+        xs = [_num(props.get("startX"), -w / 2 + 12), _num(props.get("anchorX"), 0.0), _num(props.get("endX"), w / 2 - 12)]
+        ys = [_num(props.get("startY"), 0.0), _num(props.get("anchorY"), 0.0), _num(props.get("endY"), 0.0)]
+        half = max(1.0, _num(props.get("lineWidth"), 4.0)) / 2
+        x0, x1, y0, y1 = min(xs) - half, max(xs) + half, min(ys) - half, max(ys) + half
+        return Measure(x1 - x0, y1 - y0, (x0 + x1) / 2, (y0 + y1) / 2)
+    return Measure(w, h)
+
+
+def solve_template(template: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """(template with layout intents resolved into transforms, stats).
+
+    The input is not modified. stats: {nodes, containers, ms, overflow:[...]}
+    where overflow lists fixed-size containers smaller than their content.
+    """
+
+    t0 = time.perf_counter()
+    nodes: List[Dict[str, Any]] = []
+    layouts: Dict[str, Any] = {}
+    no_transform: List[Dict[str, Any]] = []
+    for n in template.get("nodes") or []:
+        if not isinstance(n, dict):
+            nodes.append(n)
+            continue
+        copy = {k: v for k, v in n.items() if k != "layout"}
+        copy["transform"] = dict(n["transform"]) if isinstance(n.get("transform"), dict) else {}
+        if "transform" not in n:
+            no_transform.append(copy)
+        nodes.append(copy)
+        if "layout" in n and isinstance(n.get("localId"), str):
+            layouts[n["localId"]] = n["layout"]
+
+    by_id = {n["localId"]: n for n in nodes if isinstance(n, dict) and isinstance(n.get("localId"), str)}
+    children: Dict[str, List[Dict[str, Any]]] = {}
+    roots: List[Dict[str, Any]] = []
+    for n in nodes:
+        if not isinstance(n, dict):
+            continue
+        parent = n.get("parentLocalId")
+        if isinstance(parent, str) and parent in by_id and parent != n.get("localId"):
+            children.setdefault(parent, []).append(n)
+        else:
+            roots.append(n)
+    specs = {lid: s for lid, s in ((lid, parse_spec(v)) for lid, v in layouts.items()) if s is not None}
+    texts = [n for n in nodes if isinstance(n, dict) and n.get("type") == "text"]
+    text_boxes = {id(n): box for n, box in zip(texts, measure_many(n.get("props") for n in texts))}
+
+    sizes: Dict[str, Measure] = {}
+    overflow: List[Dict[str, Any]] = []
+    visiting: set = set()
+
+    def measure(node: Dict[str, Any]) -> Measure:
+        lid = node.get("localId")
+        if lid in sizes:
+            return sizes[lid]
+        visiting.add(lid)
+        kids = [c for c in children.get(lid, ()) if c.get("localId") not in visiting]
+        kid_sizes = [measure(c) for c in kids]
+        spec = specs.get(lid)
+        if spec is None:
+            m = _leaf_measure(node, text_boxes.get(id(node)))
+        else:
+            flow = [m for c, m in zip(kids, kid_sizes) if not _is_absolute(layouts.get(c.get("localId")))]
+            main = sum(m.height if spec.vertical else m.width for m in flow) + spec.gap * max(0, len(flow) - 1)
+            cross = max((m.width if spec.vertical else m.height for m in flow), default=0.0)
+            top, right, bottom, left = spec.padding
+            need_w = (cross if spec.vertical else main) + left + right
+            need_h = (main if spec.vertical else cross) + top + bottom
+            t = node["transform"]
+            m = Measure(
+                _fit(lid, "width", t, spec.fit_width, need_w, overflow),
+                _fit(lid, "height", t, spec.fit_height, need_h, overflow),
+            )
+            t["width"], t["height"] = _out(m.width), _out(m.height)
+        visiting.discard(lid)
+        sizes[lid] = m
+        return m
+
+    placed: set = set()
+
+    def place(node: Dict[str, Any]) -> None:
+        lid = node.get("localId")
+        if lid in placed:
+            return
+        placed.add(lid)
+        spec = specs.get(lid)
+        kids = children.get(lid, ())
+        if spec is not None:
+            flow = [c for c in kids if c.get("localId") in sizes and not _is_absolute(layouts.get(c.get("localId")))]
+            _place_stack(spec, sizes[lid], flow, sizes, specs)
+        for c in kids:
+            if c.get("localId") in sizes:
+                place(c)
+
+    for root in roots:
+        measure(root)
+        place(root)
+
+    for n in no_transform:
+        if not n["transform"]:
+            del n["transform"]
+    solved = dict(template, nodes=nodes)
+    stats = {
+        "nodes": len(sizes),
+        "containers": len(specs),
+        "ms": round((time.perf_counter() - t0) * 1000, 3),
+        "overflow": overflow[:_MAX_WARNINGS],
+    }
+    return solved, stats
+
+
+def _fit(
+    lid: Any, axis: str, t: Dict[str, Any], fit: Optional[bool], need: float, overflow: List[Dict[str, Any]]
+) -> float:
+    given = t.get(axis)
+    if fit or (fit is None and _num(given, -1.0) < 0):
+        return need
+    value = _num(given, need)
+    if value + 0.5 < need:
+        overflow.append({"localId": lid, "axis": axis, "need": _out(need), "given": _out(value)})
+    return value
+
+
+def _place_stack(
+    spec: StackSpec,
+    box: Measure,
+    flow: List[Dict[str, Any]],
+    sizes: Dict[str, Measure],
+    specs: Dict[str, StackSpec],
+) -> None:
+    top, right, bottom, left = spec.padding
+    if spec.vertical:
+        main_start, main_end, cross_start, cross_end = -box.height / 2 + top, box.height / 2 - bottom, -box.width / 2 + left, box.width / 2 - right
+    else:
+        main_start, main_end, cross_start, cross_end = -box.width / 2 + left, box.width / 2 - right, -box.height / 2 + top, box.height / 2 - bottom
+
+    mains = [sizes[c["localId"]].height if spec.vertical else sizes[c["localId"]].width for c in flow]
+    free = (main_end - main_start) - sum(mains) - spec.gap * max(0, len(flow) - 1)
+    gap = spec.gap
+    cursor = main_start
+    if free > 0:
+        if spec.justify == "center":
+            cursor += free / 2
+        elif spec.justify == "end":
+            cursor += free
+        elif spec.justify == "space-between" and len(flow) > 1:
+            gap += free / (len(flow) - 1)
+
+    inner_cross = max(0.0, cross_end - cross_start)
+    for c, main in zip(flow, mains):
+        lid = c["localId"]
+        m = sizes[lid]
+        align = spec.align
+        if align == "stretch":
+            if c.get("type") in ("rect", "image") or lid in specs:
+                t = c["transform"]
+                if spec.vertical:
+                    m = m._replace(width=inner_cross)
+                    t["width"] = _out(inner_cross)
+                else:
+                    m = m._replace(height=inner_cross)
+                    t["height"] = _out(inner_cross)
+                sizes[lid] = m
+                align = "center"
+            elif c.get("type") == "text" and spec.vertical:
+                text_align = (c.get("props") or {}).get("textAlign")
+                align = {"left": "start", "right": "end"}.get(text_align, "center")
+            else:
+                align = "center"
+        cross = m.width if spec.vertical else m.height
+        if align == "start":
+            cross_center = cross_start + cross / 2
+        elif align == "end":
+            cross_center = cross_end - cross / 2
+        else:
+            cross_center = (cross_start + cross_end) / 2
+        main_center = cursor + main / 2
+        cursor += main + gap
+        t = c["transform"]
+        if spec.vertical:
+            t["x"], t["y"] = _out(cross_center - m.dx), _out(main_center - m.dy)
+        else:
+            t["x"], t["y"] = _out(main_center - m.dx), _out(cross_center - m.dy)
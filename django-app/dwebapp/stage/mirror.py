@@ -0,0 +1,500 @@
+"""Per-conversation server-side mirror of the active layer's nodeTree.
+
+The backend already knows every stage mutation it streams, so the next turn
+(typically the client's self-check round) does not have to upload the freshly
+mutated stage again:
+
+- a turn that sends `stageHash` opts in; if its contextPack carries
+  activeLayer.nodeTree that hashes to `stageHash`, the tree seeds the mirror
+  (turns without `stageHash` pay nothing: no copy, no index);
+- each insertNode / componentTemplate / patchNode / deleteNode envelope the
+  client received is applied to the mirror through an id -> node index,
+  following the client (addNodeTreeToLayer, patchNodeById, deleteNodeById);
+- a later turn may omit the nodeTree and send `stageHash` instead: when it
+  matches the mirror, the mirror's tree goes into the contextPack; when it
+  does not, the turn is rejected and the client uploads the stage again.
+
+The stage hash has two parts:
+
+    s2-<node count>-<sum of CRC-32 over "id\\tparentId\\tuserType\\n" (UTF-8) per node, mod 2^32, 8 hex>-<edits>
+
+The structural part is order-independent, which keeps it incremental on both
+sides, and leaves out transform / props / name, so the client's own
+normalizations of applied envelopes (viewport centering, text auto-size,
+unique names) do not count as divergence. Edits the user makes in the editor
+(move, resize, recolor, text, undo / redo) are caught by `edits`: a counter
+the client bumps on every stage change that did not come from an applied
+agentToUi envelope. The mirror keeps the value it was seeded with, so any
+local edit since then makes the hash differ and the client re-uploads.
+
+Root nodes have an empty parentId, a missing userType is "". Only the active
+layer is mirrored: envelopes addressed to another known layer are ignored,
+applyFilter has no stage effect. Nodes the client gives a generated id (no
+`id` in insertNode) cannot match, so the next hash check asks for a
+re-upload. Mirrors live in a per-worker LRU; with a shared-state backend
+(shared_state/) they are also written through so any worker can serve the
+next turn.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import threading
+import time
+import uuid
+import zlib
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Tuple
+
+from ..caching import LruCache
+from .instantiate import _BASE_TRANSFORM, InvalidTemplate, compile_template, resolve_template
+from .snapshot import text_auto_size
+
+ENABLED = os.environ.get("DWEB_STAGE_MIRROR", "1") not in ("0", "false", "no")
+TTL_S = float(os.environ.get("DWEB_STAGE_MIRROR_TTL_S", "3600"))
+HASH_VERSION = "s2"
+
+_KEY_PREFIX = "dweb:stage-mirror:"
+
+_MIRRORS: LruCache["StageMirror"] = LruCache(maxsize=int(os.environ.get("DWEB_STAGE_MIRROR_CACHE_SIZE", "256")))
+
+
+def _node_digest(node: Dict[str, Any], parent_id: Optional[str]) -> int:
+    user_type = node.get("userType")
+    line = f"{node.get('id')}\t{parent_id or ''}\t{user_type if isinstance(user_type, str) else ''}\n"
+    return zlib.crc32(line.encode("utf-8"))
+
+
+def _walk(nodes: Any, parent_id: Optional[str]) -> Iterator[Tuple[Dict[str, Any], Optional[str]]]:
+    """(node, parent id) for every dict node under `nodes`, pre-order."""
+
+    stack: List[Tuple[Any, Optional[str]]] = [(n, parent_id) for n in reversed(nodes)] if isinstance(nodes, list) else []
+    while stack:
+        node, pid = stack.pop()
+        if not isinstance(node, dict):
+            continue
+        yield node, pid
+        children = node.get("children")
+        if isinstance(children, list):
+            nid = str(node.get("id"))
+            stack.extend((c, nid) for c in reversed(children))
+
+
+def format_hash(count: int, total: int, edits: int) -> str:
+    return f"{HASH_VERSION}-{count}-{total & 0xFFFFFFFF:08x}-{edits}"
+
+
+def parse_edits(stage_hash: str) -> Optional[int]:
+    """The client's edit counter from a stage hash; None when the hash is malformed."""
+
+    parts = stage_hash.split("-")
+    if len(parts) != 4 or parts[0] != HASH_VERSION or not parts[3].isdigit():
+        return None
+    return int(parts[3])
+
+
+def hash_tree(node_tree: Any, edits: int = 0) -> str:
+    """Stage hash of an uploaded nodeTree (same value the client reports)."""
+
+    count = total = 0
+    for node, parent_id in _walk(node_tree, None):
+        count += 1
+        total += _node_digest(node, parent_id)
+    return format_hash(count, total, edits)
+
+
+def _finite(v: Any) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v)
+
+
+def _normalize_transform(prev: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+    """normalizeTransformPatch: finite numbers win, width/height >= 1, opacity 0..1."""
+
+    out = {}
+    for key in ("x", "y", "width", "height", "rotation", "opacity"):
+        v = patch.get(key)
+        if not _finite(v):
+            out[key] = prev.get(key, _BASE_TRANSFORM[key])
+        elif key in ("width", "height"):
+            out[key] = max(1, v)
+        elif key == "opacity":
+            out[key] = max(0, min(1, v))
+        else:
+            out[key] = v
+    return out
+
+
+def _normalize_inserted(node: Dict[str, Any], created_at: int) -> None:
+    """addNodeTreeToLayer's normalizeNodeTreeInPlace (unique names are not mirrored)."""
+
+    for n, _ in _walk([node], None):
+        if not isinstance(n.get("id"), str) or not n["id"].strip():
+            n["id"] = f"node_{uuid.uuid4().hex[:12]}"
+        if not _finite(n.get("createdAt")):
+            n["createdAt"] = created_at
+        if not isinstance(n.get("name"), str) or not n["name"].strip():
+            n["name"] = "Node"
+        if n.get("category") not in ("user", "project"):
+            n["category"] = "user"
+        if n["category"] == "user":
+            t = n.get("transform")
+            n["transform"] = _normalize_transform(_BASE_TRANSFORM, t if isinstance(t, dict) else {})
+            if not isinstance(n.get("props"), dict):
+                n["props"] = {}
+            if str(n.get("userType") or n.get("type") or "") == "text":
+                n["transform"]["width"], n["transform"]["height"] = text_auto_size(n["props"])
+        if "children" in n and not isinstance(n["children"], list):
+            del n["children"]
+
+
+def _copy(v: Any) -> Any:
+    return json.loads(json.dumps(v, ensure_ascii=False))
+
+
+class StageMirror:
+    """The active layer of one conversation, kept in step with the envelopes sent to it."""
+
+    def __init__(
+        self,
+        layer_id: str,
+        node_tree: List[Any],
+        *,
+        layer_name: Optional[str] = None,
+        other_layers: FrozenSet[str] = frozenset(),
+        version: int = 0,
+        edits: int = 0,
+    ) -> None:
+        self.layer_id = layer_id
+        self.layer_name = layer_name
+        self.other_layers = other_layers
+        self.version = version  # envelopes applied since the mirror was seeded
+        self.edits = edits  # the client's local-edit counter at seeding; envelopes do not move it
+        self.skipped = 0
+        self.roots: List[Any] = _copy(node_tree)  # never share dicts with cached contextPack trees
+        self._index: Dict[str, Dict[str, Any]] = {}
+        self._parent: Dict[str, Optional[str]] = {}
+        self._count = 0
+        self._sum = 0
+        self._lock = threading.Lock()
+        for node, parent_id in _walk(self.roots, None):
+            self._track(node, parent_id)
+
+    @classmethod
+    def from_context_pack(cls, context_pack: Any, *, edits: int = 0) -> Optional["StageMirror"]:
+        """Seed from contextPack.activeLayer; None when it carries no nodeTree."""
+
+        if not isinstance(context_pack, dict):
+            return None
+        layer = context_pack.get("activeLayer")
+        if not isinstance(layer, dict) or not isinstance(layer.get("nodeTree"), list):
+            return None
+        layer_id = str(layer.get("id") or context_pack.get("activeLayerId") or "")
+        layers = context_pack.get("layers") if isinstance(context_pack.get("layers"), list) else []
+        others = frozenset(str(l["id"]) for l in layers if isinstance(l, dict) and l.get("id") and str(l["id"]) != layer_id)
+        name = layer.get("name")
+        return cls(
+            layer_id,
+            layer["nodeTree"],
+            layer_name=name if isinstance(name, str) else None,
+            other_layers=others,
+            edits=edits,
+        )
+
+    # --- index -------------------------------------------------------------
+
+    def _track(self, node: Dict[str, Any], parent_id: Optional[str]) -> None:
+        self._count += 1
+        self._sum = (self._sum + _node_digest(node, parent_id)) & 0xFFFFFFFF
+        node_id = str(node.get("id"))
+        if node_id not in self._index:  # duplicate ids: the first one wins, like findNode
+            self._index[node_id] = node
+            self._parent[node_id] = parent_id
+
+    def _untrack(self, node: Dict[str, Any], parent_id: Optional[str]) -> None:
+        self._count -= 1
+        self._sum = (self._sum - _node_digest(node, parent_id)) & 0xFFFFFFFF
+        node_id = str(node.get("id"))
+        if self._index.get(node_id) is node:
+            del self._index[node_id]
+            del self._parent[node_id]
+
+    @property
+    def stage_hash(self) -> str:
+        return format_hash(self._count, self._sum, self.edits)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, node_id: object) -> bool:
+        return node_id in self._index
+
+    def get(self, node_id: str) -> Optional[Dict[str, Any]]:
+        return self._index.get(node_id)
+
+    def node_ids(self) -> FrozenSet[str]:
+        with self._lock:
+            return frozenset(self._index)
+
+    def node_tree(self) -> List[Any]:
+        """A private copy of the mirrored nodeTree."""
+
+        with self._lock:
+            return _copy(self.roots)
+
+    # --- envelopes ---------------------------------------------------------
+
+    def apply(self, env: Any, *, center: Optional[Dict[str, Any]] = None) -> bool:
+        """Apply one agentToUi envelope; False when it has no effect on the mirror.
+
+        `center` is the turn's viewport centerWorld, used like the client for
+        componentTemplate roots without a position.
+        """
+
+        if not isinstance(env, dict) or not isinstance(env.get("payload"), dict):
+            return False
+        kind = env.get("type")
+        if kind not in _APPLIERS:
+            return False
+        payload = env["payload"]
+        layer_id = payload.get("layerId")
+        if isinstance(layer_id, str) and layer_id.strip() in self.other_layers:
+            return False
+        with self._lock:
+            ok = _APPLIERS[kind](self, payload, center)
+            if ok:
+                self.version += 1
+            else:
+                self.skipped += 1
+        return ok
+
+    def _attach(self, node: Dict[str, Any], parent_id: Any) -> None:
+        # Unknown parents fall back to the layer root, then findNode(nodeTree, parentId ?? 'root').
+        key = parent_id.strip() if isinstance(parent_id, str) and parent_id.strip() else "root"
+        parent = self._index.get(key)
+        if parent is not None:
+            children = parent.get("children")
+            if not isinstance(children, list):
+                children = parent["children"] = []
+            children.append(node)
+            pid: Optional[str] = key
+        else:
+            self.roots.append(node)
+            pid = None
+        for n, p in _walk([node], pid):
+            self._track(n, p)
+
+    def _insert_node(self, payload: Dict[str, Any], _center: Optional[Dict[str, Any]]) -> bool:
+        node = payload.get("node")
+        if not isinstance(node, dict):
+            return False
+        node = _copy(node)
+        if not isinstance(node.get("props"), dict):
+            node["props"] = {}
+        if not isinstance(node.get("category"), str):
+            node["category"] = "user"
+        if node["category"] == "user" and not isinstance(node.get("userType"), str) and isinstance(node.get("type"), str):
+            node["userType"] = node["type"]
+        _normalize_inserted(node, int(time.time() * 1000))
+        self._attach(node, payload.get("parentId"))
+        return True
+
+    def _component_template(self, payload: Dict[str, Any], center: Optional[Dict[str, Any]]) -> bool:
+        template = resolve_template(payload.get("template"), payload.get("templateId"))
+        if template is None:
+            return False
+        if isinstance(center, dict) and _finite(center.get("x")) and _finite(center.get("y")):
+            template = _center_root(template, center)
+        try:
+            plan, _ = compile_template(template)
+        except InvalidTemplate:
+            return False
+        # The client instantiates with no params (template defaults) and ids unique across the stage.
+        root = plan.instantiate([{}], taken=self._index.keys())[0]["root"]
+        self._attach(_copy(root), payload.get("parentId"))
+        return True
+
+    def _patch_node(self, payload: Dict[str, Any], _center: Optional[Dict[str, Any]]) -> bool:
+        node_id = payload.get("nodeId")
+        patch = payload.get("patch")
+        node = self._index.get(node_id.strip()) if isinstance(node_id, str) else None
+        if node is None or not isinstance(patch, dict):
+            return False
+        if isinstance(patch.get("userType"), str) and patch["userType"] != node.get("userType"):
+            parent_id = self._parent[node["id"]]
+            self._sum = (self._sum - _node_digest(node, parent_id)) & 0xFFFFFFFF
+            node["userType"] = patch["userType"]
+            self._sum = (self._sum + _node_digest(node, parent_id)) & 0xFFFFFFFF
+        if isinstance(patch.get("name"), str) and patch["name"].strip():
+            node["name"] = patch["name"]
+        if isinstance(patch.get("transform"), dict) and node.get("category") == "user":
+            prev = node.get("transform") if isinstance(node.get("transform"), dict) else {}
+            node["transform"] = _normalize_transform(prev, patch["transform"])
+        if isinstance(patch.get("props"), dict):
+            props = node.get("props") if isinstance(node.get("props"), dict) else {}
+            node["props"] = dict(props, **_copy(patch["props"]))
+        return True
+
+    def _delete_node(self, payload: Dict[str, Any], _center: Optional[Dict[str, Any]]) -> bool:
+        ids = [payload.get("nodeId")] + (payload["nodeIds"] if isinstance(payload.get("nodeIds"), list) else [])
+        deleted = False
+        for node_id in dict.fromkeys(s.strip() for s in ids if isinstance(s, str) and s.strip()):
+            node = self._index.get(node_id)
+            if node is None:
+                continue
+            parent_id = self._parent[node_id]
+            siblings = self.roots if parent_id is None else self._index[parent_id].get("children") or []
+            for i, n in enumerate(siblings):
+                if n is node:
+                    del siblings[i]
+                    break
+            for n, p in _walk([node], parent_id):
+                self._untrack(n, p)
+            deleted = True
+        return deleted
+
+    # --- persistence -------------------------------------------------------
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "layerId": self.layer_id,
+                "layerName": self.layer_name,
+                "otherLayers": sorted(self.other_layers),
+                "version": self.version,
+                "edits": self.edits,
+                "stageHash": self.stage_hash,
+                "nodes": self._count,
+                "nodeTree": _copy(self.roots),
+            }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "StageMirror":
+        return cls(
+            str(data.get("layerId") or ""),
+            data.get("nodeTree") or [],
+            layer_name=data.get("layerName"),
+            other_layers=frozenset(data.get("otherLayers") or ()),
+            version=int(data.get("version") or 0),
+            edits=int(data.get("edits") or 0),
+        )
+
+
+_APPLIERS = {
+    "agentToUi/insertNode": StageMirror._insert_node,
+    "agentToUi/componentTemplate": StageMirror._component_template,
+    "agentToUi/patchNode": StageMirror._patch_node,
+    "agentToUi/deleteNode": StageMirror._delete_node,
+}
+
+
+def _center_root(template: Dict[str, Any], center: Dict[str, Any]) -> Dict[str, Any]:
+    """normalizeTemplateForViewport: a root without x/y goes to the viewport center."""
+
+    nodes = template.get("nodes")
+    if not isinstance(nodes, list):
+        return template
+    for i, node in enumerate(nodes):
+        if isinstance(node, dict) and node.get("localId") == template.get("rootLocalId"):
+            t = node.get("transform") if isinstance(node.get("transform"), dict) else {}
+            if _finite(t.get("x")) and _finite(t.get("y")):
+                return template
+            placed = dict(t, x=t["x"] if _finite(t.get("x")) else center["x"], y=t["y"] if _finite(t.get("y")) else center["y"])
+            nodes = list(nodes)
+            nodes[i] = dict(node, transform=placed)
+            return dict(template, nodes=nodes)
+    return template
+
+
+# --- per-conversation store ---------------------------------------------------
+
+
+def load(conversation_id: str) -> Optional[StageMirror]:
+    """The conversation's mirror: this worker's copy, or the shared one when it is newer."""
+
+    from ..shared_state.base import SharedStateError, get_shared_state, is_shared
+
+    local = _MIRRORS.get(conversation_id)
+    if not is_shared():
+        return local
+    try:
+        raw = get_shared_state().get(_KEY_PREFIX + conversation_id)
+    except SharedStateError:
+        return local
+    if raw is None:
+        return local
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return local
+    if local is not None and data.get("stageHash") == local.stage_hash and data.get("version") == local.version:
+        return local
+    mirror = StageMirror.from_dict(data)
+    _MIRRORS.put(conversation_id, mirror)
+    return mirror
+
+
+def save(conversation_id: str, mirror: StageMirror) -> None:
+    from ..shared_state.base import SharedStateError, get_shared_state, is_shared
+
+    _MIRRORS.put(conversation_id, mirror)
+    if not is_shared():
+        return
+    try:
+        get_shared_state().set(_KEY_PREFIX + conversation_id, json.dumps(mirror.to_dict(), ensure_ascii=False), ttl=TTL_S)
+    except SharedStateError:
+        pass  # the local copy still serves turns routed to this worker
+
+
+def cache_stats() -> Dict[str, Any]:
+    return _MIRRORS.stats()
+
+
+def resolve(
+    conversation_id: str, context_pack: Any, client_hash: Any
+) -> Tuple[Optional[StageMirror], Any, Dict[str, Any]]:
+    """(mirror, contextPack, report) for a new turn.
+
+    report["status"]:
+      off       - no `stageHash`: the client did not opt in, the turn runs without a mirror
+      seeded    - nodeTree uploaded and it hashes to `stageHash`; the mirror now holds it
+                  (`reused`: the mirror already had this stage, nothing was copied)
+      unmatched - nodeTree uploaded but `stageHash` disagrees with it (client hash bug);
+                  the turn runs without a mirror
+      mirror    - no nodeTree, `stageHash` matched: the contextPack now carries the mirror's tree
+      missing   - no nodeTree, but no mirror for this conversation
+      diverged  - no nodeTree, `stageHash` differs from the mirror
+    The caller rejects `missing` / `diverged` turns so the client re-uploads.
+    """
+
+    if not isinstance(client_hash, str) or not client_hash:
+        return None, context_pack, {"status": "off"}
+    edits = parse_edits(client_hash)
+    layer = context_pack.get("activeLayer") if isinstance(context_pack, dict) else None
+    if isinstance(layer, dict) and isinstance(layer.get("nodeTree"), list):
+        previous = _MIRRORS.get(conversation_id)
+        if previous is not None and previous.stage_hash == client_hash:
+            return previous, context_pack, {"status": "seeded", "stageHash": client_hash, "nodes": len(previous), "reused": True}
+        # Hash before copying: a client whose hash disagrees never pays for the mirror.
+        uploaded = hash_tree(layer["nodeTree"], edits or 0)
+        if edits is None or uploaded != client_hash:
+            return None, context_pack, {"status": "unmatched", "clientHash": client_hash, "stageHash": uploaded}
+        seeded = StageMirror.from_context_pack(context_pack, edits=edits)
+        if seeded is None:
+            return None, context_pack, {"status": "off"}
+        return seeded, context_pack, {"status": "seeded", "stageHash": seeded.stage_hash, "nodes": len(seeded)}
+    mirror = load(conversation_id)
+    if mirror is None:
+        return None, context_pack, {"status": "missing", "clientHash": client_hash}
+    if mirror.stage_hash != client_hash:
+        return None, context_pack, {"status": "diverged", "clientHash": client_hash, "mirrorHash": mirror.stage_hash}
+
+    pack = dict(context_pack) if isinstance(context_pack, dict) else {}
+    tree = mirror.node_tree()
+    active = pack.get("activeLayer") if isinstance(pack.get("activeLayer"), dict) else {}
+    pack["activeLayer"] = dict(active, id=active.get("id") or mirror.layer_id, name=active.get("name") or mirror.layer_name, nodeTree=tree)
+    pack.setdefault("activeLayerId", mirror.layer_id)
+    selected = pack.get("selectedNodeIds")
+    if isinstance(selected, list) and not isinstance(pack.get("selectedNodes"), list):
+        pack["selectedNodes"] = [_copy(n) for n in (mirror.get(s) for s in selected if isinstance(s, str)) if n is not None]
+    return mirror, pack, {"status": "mirror", "stageHash": mirror.stage_hash, "nodes": len(mirror), "version": mirror.version}
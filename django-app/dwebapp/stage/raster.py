@@ -0,0 +1,518 @@
+"""CPU rasterizer for EditorSnapshot stages (NumPy).
+
+This is an approximation of the WebGL renderer (src/engine/webgl) good enough
+for thumbnails, version history previews and visual context:
+- rect: fill + border with cornerRadius (signed distance field, anti-aliased)
+- line: quadratic bezier start/anchor/end, lineWidth, solid/dashed
+- image: data: URLs / package bytes decoded with Pillow; images that do not
+  decode (or remote URLs, which are never fetched) draw a neutral placeholder box
+- text: glyphs are approximated as boxes laid out like TextRenderer
+- filters (glow/blur) are ignored
+
+Like the editor, border widths, line widths and dash lengths are screen-space
+pixels (they do not scale with the output resolution).
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import os
+import struct
+import zlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..caching import LruCache
+from . import text_metrics
+from .color import parse_color_or
+from .snapshot import (
+    find_layer,
+    get_image_assets,
+    get_layers,
+    get_stage_info,
+    iter_world_nodes,
+    snapshot_hash,
+    text_auto_size,
+    unwrap_snapshot,
+)
+
+MAX_RENDER_SIZE = 4096
+
+_RENDER_CACHE: LruCache[bytes] = LruCache(maxsize=int(os.environ.get("DWEB_RENDER_CACHE_SIZE", "256")))
+_IMAGE_CACHE: LruCache[Optional[np.ndarray]] = LruCache(maxsize=64)
+
+
+def _num(v: Any, fallback: float) -> float:
+    if isinstance(v, bool) or not isinstance(v, (int, float)):
+        return fallback
+    f = float(v)
+    return f if np.isfinite(f) else fallback
+
+
+def _clamp01(v: float) -> float:
+    return max(0.0, min(1.0, v))
+
+
+class _ImageResolver:
+    """Maps image nodes to decoded RGBA arrays (imageAssets urls or package bytes)."""
+
+    def __init__(self, source: Any) -> None:
+        self.assets = get_image_assets(source)
+        self.package_files: Dict[str, str] = {}
+        if isinstance(source, dict) and isinstance(source.get("manifest"), dict):
+            entries = source["manifest"].get("assets") or {}
+            files = (source.get("assets") or {}).get("files") or {}
+            for asset_id, entry in entries.items() if isinstance(entries, dict) else []:
+                f = files.get(entry.get("fileKey")) if isinstance(entry, dict) else None
+                if isinstance(f, dict) and isinstance(f.get("bytesBase64"), str):
+                    self.package_files[asset_id] = f"data:{f.get('mime') or 'image/png'};base64,{f['bytesBase64']}"
+
+    def resolve(self, props: Dict[str, Any]) -> Optional[np.ndarray]:
+        image_id = str(props.get("imageId") or "").strip()
+        src = ""
+        if image_id and image_id in self.package_files:
+            src = self.package_files[image_id]
+        elif image_id and isinstance(self.assets.get(image_id), dict):
+            src = str(self.assets[image_id].get("url") or "")
+        if not src:
+            src = str(props.get("imagePath") or "")
+        return _decode_image(src.strip())
+
+
+def _decode_image(src: str) -> Optional[np.ndarray]:
+    if not src.startswith("data:image/") or ";base64," not in src:
+        # Remote/relative URLs are never fetched from the render path.
+        return None
+    key = snapshot_hash(src) if len(src) > 256 else src
+    cached = _IMAGE_CACHE.get(key)
+    if cached is not None:
+        return cached
+    try:
+        from io import BytesIO
+
+        from PIL import Image  # imported on first use: only image nodes need it
+    except ImportError:
+        return None
+    try:
+        raw = base64.b64decode(src.split(";base64,", 1)[1])
+        with Image.open(BytesIO(raw)) as im:
+            arr = np.asarray(im.convert("RGBA"), dtype=np.uint8)
+    except Exception:
+        return None
+    _IMAGE_CACHE.put(key, arr)
+    return arr
+
+
+class _Canvas:
+    """Premultiplied float32 RGBA buffer. World origin maps to the canvas center."""
+
+    def __init__(self, width: int, height: int, scale: float) -> None:
+        self.width = width
+        self.height = height
+        self.scale = scale
+        self.buf = np.zeros((height, width, 4), dtype=np.float32)
+
+    def window(self, x0: float, y0: float, x1: float, y1: float) -> Optional[Tuple[slice, slice, np.ndarray, np.ndarray]]:
+        """Pixel window covering a world bbox, with world coords of pixel centers."""
+
+        s = self.scale
+        px0 = max(0, int(np.floor(x0 * s + self.width / 2)) - 1)
+        px1 = min(self.width, int(np.ceil(x1 * s + self.width / 2)) + 1)
+        py0 = max(0, int(np.floor(y0 * s + self.height / 2)) - 1)
+        py1 = min(self.height, int(np.ceil(y1 * s + self.height / 2)) + 1)
+        if px0 >= px1 or py0 >= py1:
+            return None
+        xs = (np.arange(px0, px1, dtype=np.float32) + 0.5 - self.width / 2) / s
+        ys = (np.arange(py0, py1, dtype=np.float32) + 0.5 - self.height / 2) / s
+        wx, wy = np.meshgrid(xs, ys)
+        return slice(py0, py1), slice(px0, px1), wx, wy
+
+    def coverage(self, dist: np.ndarray) -> np.ndarray:
+        """Anti-aliased coverage from a signed distance in world units."""
+
+        return np.clip(0.5 - dist * self.scale, 0.0, 1.0)
+
+    def composite(self, ys: slice, xs: slice, alpha: np.ndarray, rgb: Any) -> None:
+        dst = self.buf[ys, xs]
+        a = alpha[..., None]
+        src = np.asarray(rgb, dtype=np.float32) / 255.0
+        dst[..., :3] = src * a + dst[..., :3] * (1.0 - a)
+        dst[..., 3:] = a + dst[..., 3:] * (1.0 - a)
+
+    def to_uint8(self) -> np.ndarray:
+        a = self.buf[..., 3:]
+        rgb = np.where(a > 1e-6, self.buf[..., :3] / np.maximum(a, 1e-6), 0.0)
+        out = np.concatenate([rgb, a], axis=-1)
+        return (np.clip(out, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+
+def _to_local(wx: np.ndarray, wy: np.ndarray, cx: float, cy: float, rotation: float) -> Tuple[np.ndarray, np.ndarray]:
+    dx = wx - cx
+    dy = wy - cy
+    if rotation == 0.0:
+        return dx, dy
+    c = np.cos(-rotation)
+    s = np.sin(-rotation)
+    return dx * c - dy * s, dx * s + dy * c
+
+
+def _rotated_bbox(cx: float, cy: float, w: float, h: float, rotation: float) -> Tuple[float, float, float, float]:
+    c = abs(np.cos(rotation))
+    s = abs(np.sin(rotation))
+    hw = (w * c + h * s) / 2
+    hh = (w * s + h * c) / 2
+    return cx - hw, cy - hh, cx + hw, cy + hh
+
+
+def _rounded_box_sdf(lx: np.ndarray, ly: np.ndarray, hw: float, hh: float, r: float) -> np.ndarray:
+    r = max(0.0, min(r, hw, hh))
+    qx = np.abs(lx) - (hw - r)
+    qy = np.abs(ly) - (hh - r)
+    outside = np.hypot(np.maximum(qx, 0.0), np.maximum(qy, 0.0))
+    inside = np.minimum(np.maximum(qx, qy), 0.0)
+    return outside + inside - r
+
+
+def _draw_rect(cv: _Canvas, cx: float, cy: float, t: Dict[str, Any], props: Dict[str, Any], opacity: float, rotation: float) -> None:
+    w = max(1.0, _num(t.get("width"), 1.0))
+    h = max(1.0, _num(t.get("height"), 1.0))
+    win = cv.window(*_rotated_bbox(cx, cy, w, h, rotation))
+    if win is None:
+        return
+    ys, xs, wx, wy = win
+    lx, ly = _to_local(wx, wy, cx, cy, rotation)
+    radius = max(0.0, _num(props.get("cornerRadius"), 0.0))
+    d = _rounded_box_sdf(lx, ly, w / 2, h / 2, radius if radius > 0.5 else 0.0)
+    outer = cv.coverage(d)
+
+    fill_a = _clamp01(opacity * _clamp01(_num(props.get("fillOpacity"), 1.0)))
+    fill = parse_color_or(props.get("fillColor"), "#3aa1ff")
+    if fill_a * fill[3] > 0:
+        cv.composite(ys, xs, outer * (fill_a * fill[3]), fill[:3])
+
+    border_a = _clamp01(opacity * _clamp01(_num(props.get("borderOpacity"), 1.0)))
+    bw = max(0.0, _num(props.get("borderWidth"), 1.0)) / cv.scale
+    bw = min(bw, min(w, h) / 2)
+    border = parse_color_or(props.get("borderColor"), "#9cdcfe")
+    if bw > 0 and border_a * border[3] > 0:
+        ring = np.clip(outer - cv.coverage(d + bw), 0.0, 1.0)
+        cv.composite(ys, xs, ring * (border_a * border[3]), border[:3])
+
+
+def _quad_points(p0: Tuple[float, float], p1: Tuple[float, float], p2: Tuple[float, float]) -> np.ndarray:
+    approx_len = np.hypot(p1[0] - p0[0], p1[1] - p0[1]) + np.hypot(p2[0] - p1[0], p2[1] - p1[1])
+    seg_count = int(max(8, min(96, np.floor(approx_len / 18) + 12)))
+    tt = np.linspace(0.0, 1.0, seg_count + 1)[:, None]
+    mt = 1.0 - tt
+    return mt * mt * np.array(p0) + 2 * mt * tt * np.array(p1) + tt * tt * np.array(p2)
+
+
+def _dash_segments(pts: np.ndarray, dash: float, gap: float) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Split a polyline into dash segments (same phase rules as LineRenderer)."""
+
+    period = max(1e-3, dash + gap)
+    out: List[Tuple[np.ndarray, np.ndarray]] = []
+    s = 0.0
+    for a, b in zip(pts[:-1], pts[1:]):
+        seg_len = float(np.hypot(*(b - a)))
+        if seg_len < 1e-3:
+            continue
+        pos = 0.0
+        while pos < seg_len - 1e-6:
+            phase = (s + pos) % period
+            in_dash = phase < dash
+            step = min((dash - phase) if in_dash else (period - phase), seg_len - pos)
+            if in_dash and step > 1e-3:
+                out.append((a + (b - a) * (pos / seg_len), a + (b - a) * ((pos + step) / seg_len)))
+            pos += step
+        s += seg_len
+    return out
+
+
+def _draw_line(cv: _Canvas, cx: float, cy: float, t: Dict[str, Any], props: Dict[str, Any], opacity: float, rotation: float) -> None:
+    w = max(1.0, _num(t.get("width"), 1.0))
+    h = max(1.0, _num(t.get("height"), 1.0))
+    local = _quad_points(
+        (_num(props.get("startX"), -w / 2), _num(props.get("startY"), 0.0)),
+        (_num(props.get("anchorX"), 0.0), _num(props.get("anchorY"), -h / 4)),
+        (_num(props.get("endX"), w / 2), _num(props.get("endY"), 0.0)),
+    )
+    c, s = np.cos(rotation), np.sin(rotation)
+    pts = np.stack([cx + local[:, 0] * c - local[:, 1] * s, cy + local[:, 0] * s + local[:, 1] * c], axis=1)
+
+    color = parse_color_or(props.get("lineColor"), "#ffffff")
+    alpha = _clamp01(opacity) * color[3]
+    if alpha <= 0:
+        return
+    half = max(1.0, _num(props.get("lineWidth"), 4.0)) / 2 / cv.scale
+    if str(props.get("lineStyle") or "solid") == "dashed":
+        segs = _dash_segments(pts, 14 / cv.scale, 10 / cv.scale)
+    else:
+        segs = list(zip(pts[:-1], pts[1:]))
+    if not segs:
+        return
+    a = np.array([sg[0] for sg in segs], dtype=np.float32)
+    b = np.array([sg[1] for sg in segs], dtype=np.float32)
+
+    win = cv.window(pts[:, 0].min() - half, pts[:, 1].min() - half, pts[:, 0].max() + half, pts[:, 1].max() + half)
+    if win is None:
+        return
+    ys, xs, wx, wy = win
+    p = np.stack([wx.ravel(), wy.ravel()], axis=1)
+    dist = np.full(p.shape[0], np.inf, dtype=np.float32)
+    ab = b - a
+    ab_len2 = np.maximum((ab * ab).sum(axis=1), 1e-12)
+    # Chunk segments to bound the (pixels x segments) temporaries.
+    chunk = max(1, 4_000_000 // max(1, p.shape[0]))
+    for i in range(0, len(a), chunk):
+        ap = p[:, None, :] - a[None, i : i + chunk, :]
+        tt = np.clip((ap * ab[None, i : i + chunk, :]).sum(axis=2) / ab_len2[None, i : i + chunk], 0.0, 1.0)
+        proj = ap - tt[..., None] * ab[None, i : i + chunk, :]
+        dist = np.minimum(dist, np.sqrt((proj * proj).sum(axis=2)).min(axis=1))
+    cov = cv.coverage(dist.reshape(wx.shape) - half)
+    cv.composite(ys, xs, cov * alpha, color[:3])
+
+
+def _draw_image(
+    cv: _Canvas,
+    cx: float,
+    cy: float,
+    t: Dict[str, Any],
+    props: Dict[str, Any],
+    opacity: float,
+    rotation: float,
+    images: _ImageResolver,
+) -> None:
+    w = max(1.0, _num(t.get("width"), 1.0))
+    h = max(1.0, _num(t.get("height"), 1.0))
+    img = images.resolve(props)
+    if img is None:
+        _draw_rect(
+            cv,
+            cx,
+            cy,
+            {"width": w, "height": h},
+            {"fillColor": "#3c3c3c", "fillOpacity": 0.6, "borderColor": "#5a5a5a", "borderWidth": 1},
+            opacity,
+            rotation,
+        )
+        return
+
+    ih, iw = img.shape[0], img.shape[1]
+    fit = str(props.get("imageFit") or "contain")
+    u0, v0, u1, v1 = 0.0, 0.0, 1.0, 1.0
+    dw, dh = w, h
+    if fit == "cover":
+        sc = max(w / iw, h / ih)
+        vis_u, vis_v = min(1.0, w / (iw * sc)), min(1.0, h / (ih * sc))
+        u0, v0 = (1 - vis_u) / 2, (1 - vis_v) / 2
+        u1, v1 = u0 + vis_u, v0 + vis_v
+    elif fit == "none":
+        if iw <= w and ih <= h:
+            dw, dh = float(iw), float(ih)
+        else:
+            vis_u, vis_v = min(1.0, w / iw), min(1.0, h / ih)
+            u0, v0 = (1 - vis_u) / 2, (1 - vis_v) / 2
+            u1, v1 = u0 + vis_u, v0 + vis_v
+    elif fit != "fill":
+        sc = min(w / iw, h / ih)
+        if fit == "scale-down":
+            sc = min(1.0, sc)
+        dw, dh = iw * sc, ih * sc
+
+    win = cv.window(*_rotated_bbox(cx, cy, dw, dh, rotation))
+    if win is None:
+        return
+    ys, xs, wx, wy = win
+    lx, ly = _to_local(wx, wy, cx, cy, rotation)
+    cov = cv.coverage(_rounded_box_sdf(lx, ly, dw / 2, dh / 2, 0.0))
+    u = u0 + (lx / dw + 0.5) * (u1 - u0)
+    v = v0 + (ly / dh + 0.5) * (v1 - v0)
+    ix = np.clip((u * iw).astype(np.int32), 0, iw - 1)
+    iy = np.clip((v * ih).astype(np.int32), 0, ih - 1)
+    texel = img[iy, ix].astype(np.float32)
+    cv.composite(ys, xs, cov * (texel[..., 3] / 255.0) * _clamp01(opacity), texel[..., :3])
+
+
+def _draw_text(cv: _Canvas, cx: float, cy: float, t: Dict[str, Any], props: Dict[str, Any], opacity: float, rotation: float) -> None:
+    raw = props.get("textContent")
+    text = raw if isinstance(raw, str) else str(raw if raw is not None else "")
+    font_size = max(1.0, _num(props.get("fontSize"), 24.0))
+    auto_w, auto_h = text_auto_size(props)
+    w = max(1.0, _num(t.get("width"), auto_w))
+    h = max(1.0, _num(t.get("height"), auto_h))
+    color = parse_color_or(props.get("fontColor"), "#ffffff")
+    alpha = _clamp01(opacity) * color[3]
+    if alpha <= 0 or not text.strip():
+        return
+    win = cv.window(*_rotated_bbox(cx, cy, w, h, rotation))
+    if win is None:
+        return
+    ys, xs, wx, wy = win
+    lx, ly = _to_local(wx, wy, cx, cy, rotation)
+
+    align = str(props.get("textAlign") or "center")
+    weight = 0.8 if str(props.get("fontStyle") or "normal") == "bold" else 0.68
+    pad_x = max(2, round(font_size * 0.6))
+    lines = text.replace("\r\n", "\n").split("\n")
+    line_h = font_size * 1.4
+    total_h = len(lines) * line_h
+
+    cov = np.zeros_like(lx)
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        yc = -total_h / 2 + line_h / 2 + i * line_h
+        advances = np.array([text_metrics.advance(ch, font_style=props.get("fontStyle")) * font_size for ch in line], dtype=np.float32)
+        line_w = float(advances.sum())
+        x0 = -w / 2 + pad_x if align == "left" else (w / 2 - pad_x - line_w if align == "right" else -line_w / 2)
+        starts = x0 + np.concatenate([[0.0], np.cumsum(advances)[:-1]])
+        visible = np.array([not ch.isspace() for ch in line])
+        g_start = (starts + advances * (1 - weight) / 2)[visible]
+        g_end = (starts + advances * (1 + weight) / 2)[visible]
+        if g_start.size == 0:
+            continue
+        band = np.abs(ly - yc) - font_size * 0.32
+        idx = np.clip(np.searchsorted(g_start, lx, side="right") - 1, 0, g_start.size - 1)
+        dx = np.maximum(g_start[idx] - lx, lx - g_end[idx])
+        cov = np.maximum(cov, cv.coverage(np.maximum(dx, band)))
+    clip = cv.coverage(_rounded_box_sdf(lx, ly, w / 2, h / 2, 0.0))
+    cv.composite(ys, xs, cov * clip * alpha * 0.85, color[:3])
+
+
+def _draw_layer(cv: _Canvas, layer: Dict[str, Any], images: _ImageResolver) -> None:
+    for wn in iter_world_nodes(layer.get("nodeTree")):
+        n = wn.node
+        t = n.get("transform")
+        if n.get("category") != "user" or not isinstance(t, dict):
+            continue
+        props = n.get("props") if isinstance(n.get("props"), dict) else {}
+        opacity = _clamp01(_num(t.get("opacity"), 1.0))
+        rotation = _num(t.get("rotation"), 0.0)
+        if opacity <= 0:
+            continue
+        kind = n.get("userType") or "base"
+        if kind == "rect":
+            _draw_rect(cv, wn.world_x, wn.world_y, t, props, opacity, rotation)
+        elif kind == "line":
+            _draw_line(cv, wn.world_x, wn.world_y, t, props, opacity, rotation)
+        elif kind == "image":
+            _draw_image(cv, wn.world_x, wn.world_y, t, props, opacity, rotation, images)
+        elif kind == "text":
+            _draw_text(cv, wn.world_x, wn.world_y, t, props, opacity, rotation)
+        # base nodes are invisible structural containers
+
+
+def render_snapshot(
+    snapshot: Any,
+    *,
+    width: int,
+    height: int,
+    layer_id: Optional[str] = None,
+    layers: Optional[Sequence[Dict[str, Any]]] = None,
+    background: bool = True,
+) -> np.ndarray:
+    """Render the stage (or one layer) into an (height, width, 4) uint8 RGBA array.
+
+    The stage rectangle is scaled uniformly to fit the output and centered;
+    pixels outside the stage stay transparent. `layers` overrides the layers
+    read from `snapshot` (used for per-frame renders of animated stages).
+    """
+
+    width = max(1, min(MAX_RENDER_SIZE, int(width)))
+    height = max(1, min(MAX_RENDER_SIZE, int(height)))
+    stage = get_stage_info(snapshot)
+    scale = min(width / stage.width, height / stage.height)
+    cv = _Canvas(width, height, scale)
+
+    if background:
+        bg = parse_color_or(stage.background_color, "#111111")
+        win = cv.window(-stage.width / 2, -stage.height / 2, stage.width / 2, stage.height / 2)
+        if win is not None:
+            ys, xs, wx, wy = win
+            cov = cv.coverage(_rounded_box_sdf(wx, wy, stage.width / 2, stage.height / 2, 0.0))
+            cv.composite(ys, xs, cov * (bg[3] * stage.background_opacity), bg[:3])
+
+    if layers is None:
+        if layer_id:
+            one = find_layer(snapshot, layer_id)
+            layers = [one] if one is not None else []
+        else:
+            layers = get_layers(snapshot)
+    images = _ImageResolver(snapshot)
+    for layer in layers:
+        _draw_layer(cv, layer, images)
+    return cv.to_uint8()
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """Encode an (h, w, 4) uint8 array as PNG (stdlib zlib, no Pillow needed)."""
+
+    h, w = rgba.shape[0], rgba.shape[1]
+    raw = np.zeros((h, w * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(h, w * 4)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    ihdr = struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0)
+    return b"".join(
+        [b"\x89PNG\r\n\x1a\n", chunk(b"IHDR", ihdr), chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)), chunk(b"IEND", b"")]
+    )
+
+
+def _package_file_digests(snapshot: Any) -> Dict[str, str]:
+    """sha256 of each package file's bytes, by fileKey; the manifest only names them."""
+
+    files = (snapshot.get("assets") or {}).get("files") if isinstance(snapshot, dict) else None
+    out: Dict[str, str] = {}
+    for file_key, f in files.items() if isinstance(files, dict) else []:
+        if isinstance(f, dict) and isinstance(f.get("bytesBase64"), str):
+            out[str(file_key)] = hashlib.sha256(f["bytesBase64"].encode("ascii", "replace")).hexdigest()
+    return out
+
+
+def render_cache_key(snapshot: Any, layer_id: Optional[str]) -> str:
+    """Hash of the render-relevant parts only, so timeline/UI edits keep the cache warm."""
+
+    snap = unwrap_snapshot(snapshot)
+    studio = snap.get("videoStudio") if isinstance(snap.get("videoStudio"), dict) else {}
+    relevant: Dict[str, Any] = {
+        "layers": [find_layer(snapshot, layer_id)] if layer_id else get_layers(snapshot),
+        "stage": get_stage_info(snapshot)._asdict(),
+        "imageAssets": get_image_assets(snapshot),
+        "manifest": snapshot.get("manifest") if isinstance(snapshot, dict) else None,
+        "packageFiles": _package_file_digests(snapshot),
+    }
+    if not studio:
+        relevant["stage"]["implicit"] = True
+    return snapshot_hash(relevant)
+
+
+def render_snapshot_png(
+    snapshot: Any,
+    *,
+    width: int,
+    height: int,
+    layer_id: Optional[str] = None,
+) -> Tuple[bytes, str, bool]:
+    """Render to PNG with an LRU cache keyed by snapshot hash.
+
+    Returns (png_bytes, snapshot_hash, cache_hit).
+    """
+
+    digest = render_cache_key(snapshot, layer_id)
+    key = (digest, layer_id or "", int(width), int(height))
+    hit = _RENDER_CACHE.get(key)
+    if hit is not None:
+        return hit, digest, True
+    png = encode_png(render_snapshot(snapshot, width=width, height=height, layer_id=layer_id))
+    _RENDER_CACHE.put(key, png)
+    return png, digest, False
+
+
+def render_cache_stats() -> Dict[str, Any]:
+    return _RENDER_CACHE.stats()
+
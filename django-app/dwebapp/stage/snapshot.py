@@ -0,0 +1,151 @@
+"""EditorSnapshot access helpers.
+
+Accepted inputs (the frontend sends several shapes):
+- EditorSnapshot: {videoScene: {layers, ...}, videoStudio: {stage, ...}, timeline}
+- ProjectPackageV1: {project: {snapshot: EditorSnapshot}, manifest, assets}
+- VideoSceneState-like: {layers: [...]}
+- a single layer: {nodeTree: [...]}
+
+Coordinates follow the editor convention: a child's transform.x/y is relative to
+its parent's center, world (0,0) is the stage center and y grows downwards.
+Rotation and opacity do NOT propagate to children.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+DEFAULT_STAGE_WIDTH = 1920
+DEFAULT_STAGE_HEIGHT = 1080
+DEFAULT_STAGE_BACKGROUND = "#111111"
+
+
+def _num(v: Any, fallback: float) -> float:
+    if isinstance(v, bool):
+        return fallback
+    if isinstance(v, (int, float)) and v == v and v not in (float("inf"), float("-inf")):
+        return float(v)
+    return fallback
+
+
+def snapshot_hash(obj: Any) -> str:
+    """Stable content hash (sha256 of canonical JSON)."""
+
+    raw = json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def text_auto_size(props: Dict[str, Any]) -> Tuple[float, float]:
+    """(width, height) the editor's computeTextAutoSize gives a text node (see text_metrics.py)."""
+
+    from .text_metrics import measure_props
+
+    box = measure_props(props)
+    return box.width, box.height
+
+
+def unwrap_snapshot(obj: Any) -> Dict[str, Any]:
+    """Return the EditorSnapshot-like dict inside a ProjectPackage (or obj itself)."""
+
+    if not isinstance(obj, dict):
+        return {}
+    project = obj.get("project")
+    if isinstance(project, dict) and isinstance(project.get("snapshot"), dict):
+        return project["snapshot"]
+    return obj
+
+
+def get_layers(obj: Any) -> List[Dict[str, Any]]:
+    snap = unwrap_snapshot(obj)
+    scene = snap.get("videoScene") if isinstance(snap.get("videoScene"), dict) else snap
+    layers = scene.get("layers")
+    if isinstance(layers, list):
+        return [l for l in layers if isinstance(l, dict)]
+    if isinstance(snap.get("nodeTree"), list):
+        return [snap]
+    return []
+
+
+def find_layer(obj: Any, layer_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    layers = get_layers(obj)
+    if not layers:
+        return None
+    if not layer_id:
+        return layers[0]
+    for layer in layers:
+        if layer.get("id") == layer_id:
+            return layer
+    return None
+
+
+def get_image_assets(obj: Any) -> Dict[str, Any]:
+    snap = unwrap_snapshot(obj)
+    scene = snap.get("videoScene") if isinstance(snap.get("videoScene"), dict) else snap
+    assets = scene.get("imageAssets")
+    return assets if isinstance(assets, dict) else {}
+
+
+class StageInfo(NamedTuple):
+    width: float
+    height: float
+    background_color: str
+    background_opacity: float
+
+
+def get_stage_info(obj: Any) -> StageInfo:
+    snap = unwrap_snapshot(obj)
+    studio = snap.get("videoStudio") if isinstance(snap.get("videoStudio"), dict) else {}
+    stage = studio.get("stage") if isinstance(studio.get("stage"), dict) else {}
+    bg = stage.get("background") if isinstance(stage.get("background"), dict) else {}
+    color = bg.get("color") if isinstance(bg.get("color"), str) and bg.get("color") else DEFAULT_STAGE_BACKGROUND
+    return StageInfo(
+        width=max(1.0, _num(stage.get("width"), DEFAULT_STAGE_WIDTH)),
+        height=max(1.0, _num(stage.get("height"), DEFAULT_STAGE_HEIGHT)),
+        background_color=color,
+        background_opacity=min(1.0, max(0.0, _num(bg.get("opacity"), 1.0))),
+    )
+
+
+class WorldNode(NamedTuple):
+    node: Dict[str, Any]
+    world_x: float
+    world_y: float
+    parent_id: Optional[str]
+    depth: int
+
+
+def iter_world_nodes(node_tree: Any) -> Iterator[WorldNode]:
+    """DFS over a nodeTree in render order, resolving parent-center world positions.
+
+    Like findWorldPos/walkBuildRenderOrder in the frontend, nodes without a
+    transform (project groups) do not move their children.
+    """
+
+    if not isinstance(node_tree, list):
+        return
+    stack: List[Any] = [(node_tree, 0, 0.0, 0.0, None, 0)]
+    while stack:
+        nodes, i, px, py, parent_id, depth = stack.pop()
+        if i >= len(nodes):
+            continue
+        stack.append((nodes, i + 1, px, py, parent_id, depth))
+        n = nodes[i]
+        if not isinstance(n, dict):
+            continue
+        t = n.get("transform")
+        if isinstance(t, dict):
+            wx = px + _num(t.get("x"), 0.0)
+            wy = py + _num(t.get("y"), 0.0)
+        else:
+            wx, wy = px, py
+        yield WorldNode(n, wx, wy, parent_id, depth)
+        children = n.get("children")
+        if isinstance(children, list) and children:
+            nid = n.get("id") if isinstance(n.get("id"), str) else parent_id
+            stack.append((children, 0, wx, wy, nid, depth + 1))
+
+
+def count_nodes(node_tree: Any) -> int:
+    return sum(1 for _ in iter_world_nodes(node_tree))
@@ -0,0 +1,316 @@
+"""Uniform-grid spatial index over world-space node bounding boxes.
+
+Boxes come from the same parent-center resolution as the rasterizer
+(iter_world_nodes): rect/image/base use transform width/height, text falls
+back to the auto-size estimate, lines use the hull of their bezier control
+points; rotation expands the box. Nodes without a transform (project groups)
+have no box of their own but still take part in ancestor chains.
+
+The index is immutable and cached per nodeTree content hash, so repeated
+turns on an unchanged canvas only pay for the query.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from ..caching import LruCache
+from .snapshot import _num, iter_world_nodes, snapshot_hash, text_auto_size
+
+Box = Tuple[float, float, float, float]
+
+# Boxes covering more cells than this go to a list that every query scans
+# (stage-sized backgrounds would otherwise be copied into thousands of cells).
+_MAX_CELLS_PER_BOX = 256
+
+_INDEX_CACHE: LruCache["SpatialIndex"] = LruCache(maxsize=int(os.environ.get("DWEB_SPATIAL_CACHE_SIZE", "16")))
+
+
+def _rotated_box(cx: float, cy: float, w: float, h: float, rotation: float) -> Box:
+    if rotation:
+        c, s = abs(math.cos(rotation)), abs(math.sin(rotation))
+        w, h = w * c + h * s, w * s + h * c
+    return cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2
+
+
+def node_world_box(node: Dict[str, Any], world_x: float, world_y: float) -> Optional[Box]:
+    t = node.get("transform")
+    if not isinstance(t, dict):
+        return None
+    props = node.get("props") if isinstance(node.get("props"), dict) else {}
+    rotation = _num(t.get("rotation"), 0.0)
+    kind = node.get("userType") or "base"
+    if kind == "text":
+        auto_w, auto_h = text_auto_size(props)
+        w, h = _num(t.get("width"), auto_w), _num(t.get("height"), auto_h)
+        return _rotated_box(world_x, world_y, max(1.0, w), max(1.0, h), rotation)
+    w = max(1.0, _num(t.get("width"), 1.0))
+    h = max(1.0, _num(t.get("height"), 1.0))
+    if kind == "line":
+        pts = [
+            (_num(props.get("startX"), -w / 2), _num(props.get("startY"), 0.0)),
+            (_num(props.get("anchorX"), 0.0), _num(props.get("anchorY"), -h / 4)),
+            (_num(props.get("endX"), w / 2), _num(props.get("endY"), 0.0)),
+        ]
+        c, s = math.cos(rotation), math.sin(rotation)
+        xs = [world_x + x * c - y * s for x, y in pts]
+        ys = [world_y + x * s + y * c for x, y in pts]
+        half = max(1.0, _num(props.get("lineWidth"), 4.0)) / 2
+        return min(xs) - half, min(ys) - half, max(xs) + half, max(ys) + half
+    return _rotated_box(world_x, world_y, w, h, rotation)
+
+
+def box_union(boxes: Iterable[Box]) -> Optional[Box]:
+    out: Optional[Box] = None
+    for b in boxes:
+        out = b if out is None else (min(out[0], b[0]), min(out[1], b[1]), max(out[2], b[2]), max(out[3], b[3]))
+    return out
+
+
+def expand_box(b: Box, margin: float) -> Box:
+    return b[0] - margin, b[1] - margin, b[2] + margin, b[3] + margin
+
+
+def _intersects(a: Box, b: Box) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def box_center(b: Box) -> Tuple[float, float]:
+    return (b[0] + b[2]) / 2, (b[1] + b[3]) / 2
+
+
+class SpatialIndex:
+    """Nodes in DFS (render) order; `boxes[i]` is None for transform-less nodes."""
+
+    def __init__(self, node_tree: Any) -> None:
+        self.ids: List[Optional[str]] = []
+        self.nodes: List[Dict[str, Any]] = []
+        self.parents: List[int] = []
+        self.boxes: List[Optional[Box]] = []
+        self.index_of: Dict[str, int] = {}
+        # Pre-order DFS: a node's parent is the latest node seen one level up
+        # (structural, so id-less groups still link their children).
+        last_at_depth: List[int] = []
+        for wn in iter_world_nodes(node_tree):
+            nid = wn.node.get("id") if isinstance(wn.node.get("id"), str) else None
+            i = len(self.ids)
+            self.ids.append(nid)
+            self.nodes.append(wn.node)
+            self.parents.append(last_at_depth[wn.depth - 1] if wn.depth > 0 else -1)
+            del last_at_depth[wn.depth :]
+            last_at_depth.append(i)
+            self.boxes.append(node_world_box(wn.node, wn.world_x, wn.world_y))
+            if nid is not None:
+                self.index_of[nid] = i
+
+        boxed = [b for b in self.boxes if b is not None]
+        self.bounds: Optional[Box] = box_union(boxed)
+        if self.bounds is not None and boxed:
+            area = max(1.0, (self.bounds[2] - self.bounds[0]) * (self.bounds[3] - self.bounds[1]))
+            # ~4 boxes per cell on a uniformly filled canvas
+            self.cell = max(32.0, math.sqrt(area * 4 / len(boxed)))
+        else:
+            self.cell = 256.0
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        self._large: List[int] = []
+        for i, b in enumerate(self.boxes):
+            if b is None:
+                continue
+            x0, y0, x1, y1 = self._cells(b)
+            if (x1 - x0 + 1) * (y1 - y0 + 1) > _MAX_CELLS_PER_BOX:
+                self._large.append(i)
+                continue
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    self._grid.setdefault((cx, cy), []).append(i)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _cells(self, b: Box) -> Tuple[int, int, int, int]:
+        c = self.cell
+        return math.floor(b[0] / c), math.floor(b[1] / c), math.floor(b[2] / c), math.floor(b[3] / c)
+
+    def query(self, box: Box) -> List[int]:
+        """Indexes of nodes whose box intersects `box`, in render order."""
+
+        x0, y0, x1, y1 = self._cells(box)
+        if self.bounds is not None:
+            bx0, by0, bx1, by1 = self._cells(self.bounds)
+            x0, y0, x1, y1 = max(x0, bx0), max(y0, by0), min(x1, bx1), min(y1, by1)
+        found: Set[int] = set()
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                for i in self._grid.get((cx, cy), ()):
+                    if i not in found and _intersects(self.boxes[i], box):  # type: ignore[arg-type]
+                        found.add(i)
+        found.update(i for i in self._large if _intersects(self.boxes[i], box))  # type: ignore[arg-type]
+        return sorted(found)
+
+    def ancestors(self, i: int) -> List[int]:
+        out: List[int] = []
+        p = self.parents[i]
+        while p >= 0:
+            out.append(p)
+            p = self.parents[p]
+        return out
+
+
+def get_spatial_index(node_tree: Any) -> Tuple[SpatialIndex, bool]:
+    """(index, cache hit) for a nodeTree, cached by content hash."""
+
+    key = snapshot_hash(node_tree)
+    index = _INDEX_CACHE.get(key)
+    if index is not None:
+        return index, True
+    index = SpatialIndex(node_tree)
+    _INDEX_CACHE.put(key, index)
+    return index, False
+
+
+def viewport_world_box(viewport: Any) -> Optional[Box]:
+    """World rect visible in the editor viewport ({centerWorld, zoom, screenW, screenH})."""
+
+    if not isinstance(viewport, dict) or not isinstance(viewport.get("centerWorld"), dict):
+        return None
+    cx = _num(viewport["centerWorld"].get("x"), 0.0)
+    cy = _num(viewport["centerWorld"].get("y"), 0.0)
+    zoom = max(1e-3, _num(viewport.get("zoom"), 1.0))
+    hw = max(1.0, _num(viewport.get("screenW"), 1920.0)) / zoom / 2
+    hh = max(1.0, _num(viewport.get("screenH"), 1080.0)) / zoom / 2
+    return cx - hw, cy - hh, cx + hw, cy + hh
+
+
+class ContextSelection(NamedTuple):
+    keep: Set[int]
+    regions: List[Dict[str, Any]]
+    focus: Optional[Box]
+
+
+_REGION_NAMES = {
+    (-1, -1): "northwest",
+    (0, -1): "north",
+    (1, -1): "northeast",
+    (-1, 0): "west",
+    (0, 0): "view",
+    (1, 0): "east",
+    (-1, 1): "southwest",
+    (0, 1): "south",
+    (1, 1): "southeast",
+}
+
+
+def select_context(
+    index: SpatialIndex,
+    *,
+    view: Optional[Box],
+    selected_ids: Sequence[str] = (),
+    budget: int,
+    near_margin: float = 0.5,
+) -> ContextSelection:
+    """Pick at most `budget` nodes relevant to the viewport and the selection.
+
+    Priority tiers: selected nodes, nodes around the selection, nodes inside
+    the viewport, nodes near it (viewport grown by `near_margin` of its size);
+    inside a tier the closest box center to the focus wins. Every picked node
+    brings its ancestor chain (counted against the budget) so the pruned tree
+    stays a tree. Unpicked boxed nodes are summarized per compass region
+    around the focus box.
+    """
+
+    selected = [index.index_of[s] for s in selected_ids if s in index.index_of]
+    sel_box = box_union(index.boxes[i] for i in selected if index.boxes[i] is not None)
+    focus = view or sel_box or index.bounds
+    if focus is None:
+        return ContextSelection(set(range(min(len(index), budget))), [], None)
+    fx, fy = box_center(sel_box or focus)
+    fw, fh = focus[2] - focus[0], focus[3] - focus[1]
+
+    tiers: List[List[int]] = [selected]
+    if sel_box is not None:
+        tiers.append(index.query(expand_box(sel_box, max(sel_box[2] - sel_box[0], sel_box[3] - sel_box[1], 200.0))))
+    if view is not None:
+        tiers.append(index.query(view))
+        grow = max(fw, fh) * near_margin
+        tiers.append(index.query(expand_box(view, grow)))
+    elif sel_box is None:
+        tiers.append(index.query(focus))
+
+    def dist(i: int) -> float:
+        b = index.boxes[i]
+        if b is None:
+            return math.inf
+        cx, cy = box_center(b)
+        return math.hypot(cx - fx, cy - fy)
+
+    keep: Set[int] = set()
+    for tier in tiers:
+        for i in sorted(tier, key=dist):
+            if i in keep:
+                continue
+            chain = [i] + [a for a in index.ancestors(i) if a not in keep]
+            if len(keep) + len(chain) > budget:
+                if tier is selected:
+                    continue  # a deep selected node may not fit; later ones might
+                break
+            keep.update(chain)
+
+    regions: Dict[str, Dict[str, Any]] = {}
+    for i, b in enumerate(index.boxes):
+        if i in keep or b is None:
+            continue
+        cx, cy = box_center(b)
+        rx = -1 if cx < focus[0] else (1 if cx > focus[2] else 0)
+        ry = -1 if cy < focus[1] else (1 if cy > focus[3] else 0)
+        name = _REGION_NAMES[(rx, ry)]
+        r = regions.get(name)
+        if r is None:
+            r = regions[name] = {"region": name, "count": 0, "types": {}, "bbox": list(b)}
+        r["count"] += 1
+        kind = str(index.nodes[i].get("userType") or "base")
+        r["types"][kind] = r["types"].get(kind, 0) + 1
+        rb = r["bbox"]
+        r["bbox"] = [min(rb[0], b[0]), min(rb[1], b[1]), max(rb[2], b[2]), max(rb[3], b[3])]
+    out = sorted(regions.values(), key=lambda r: -r["count"])
+    for r in out:
+        r["bbox"] = [round(v, 1) for v in r["bbox"]]
+    return ContextSelection(keep, out, focus)
+
+
+def prune_node_tree(node_tree: Any, index: SpatialIndex, keep: Set[int]) -> List[Dict[str, Any]]:
+    """Copy of `node_tree` with only the kept nodes; parents record how many
+    children were dropped in `omittedChildren`."""
+
+    # Same pre-order as iter_world_nodes, so a running counter is the index.
+    order = iter(range(len(index)))
+
+    def skip(nodes: Any) -> None:
+        for n in nodes if isinstance(nodes, list) else []:
+            if isinstance(n, dict):
+                next(order)
+                skip(n.get("children"))
+
+    def walk(nodes: Any) -> Tuple[List[Dict[str, Any]], int]:
+        out: List[Dict[str, Any]] = []
+        omitted = 0
+        for n in nodes if isinstance(nodes, list) else []:
+            if not isinstance(n, dict):
+                continue
+            children = n.get("children")
+            if next(order) not in keep:
+                skip(children)
+                omitted += 1
+                continue
+            copy = {k: v for k, v in n.items() if k != "children"}
+            if isinstance(children, list) and children:
+                kept_children, dropped = walk(children)
+                if kept_children:
+                    copy["children"] = kept_children
+                if dropped:
+                    copy["omittedChildren"] = dropped
+            out.append(copy)
+        return out, omitted
+
+    return walk(node_tree)[0]
@@ -0,0 +1,207 @@
+"""Text measurement matching the editor's text auto-size (computeTextAutoSize).
+
+The editor measures each line with canvas measureText in
+`${fontStyle} ${fontSize}px sans-serif` and sizes a text node to
+
+    width  = ceil(widest line + padX * 2)           padX = max(2, round(fontSize * 0.6))
+    height = ceil(lines * fontSize * 1.4 + padY * 2) padY = max(2, round(fontSize * 0.4))
+
+Here line widths come from per-font glyph advance tables instead of a canvas:
+the generic sans-serif family resolves to Helvetica-metric fonts (Arial,
+Liberation Sans) for Latin text, and wide (CJK / full-width) characters take
+one em as in the CJK fallback fonts. Italic shares the upright advances.
+
+Results are kept in an LRU keyed by (font, size, style, text); measure_many()
+sizes a batch of text props with one cache pass, for the stages (layout,
+spatial index, context summaries) that measure whole templates or scenes.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import unicodedata
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
+
+from ..caching import LruCache
+from .snapshot import _num
+
+DEFAULT_FONT = "sans-serif"
+DEFAULT_FONT_SIZE = 24.0
+LINE_HEIGHT = 1.4  # editor line box, in em
+
+# Advances in 1/1000 em for U+0020..U+007E (Adobe Helvetica / Helvetica-Bold AFM).
+_HELVETICA = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+_HELVETICA_BOLD = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+)
+# Common punctuation outside ASCII that the Latin font still draws (typographic quotes, dashes, ...).
+_PUNCT = {"‘": 222, "’": 222, "“": 333, "”": 333, "–": 556, "—": 1000, "•": 350, "…": 1000, "\u00a0": 278, "·": 278}
+_PUNCT_BOLD = dict(_PUNCT, **{"‘": 278, "’": 278, "“": 500, "”": 500})
+
+
+class Font(NamedTuple):
+    name: str
+    ascii: Tuple[int, ...]
+    extra: Dict[str, int]
+    fallback: int  # advance of glyphs neither table knows (average lowercase width)
+    ascent: int
+    descent: int
+
+
+FONTS: Dict[Tuple[str, str], Font] = {
+    (DEFAULT_FONT, "normal"): Font("Helvetica", _HELVETICA, _PUNCT, 556, 718, 207),
+    (DEFAULT_FONT, "bold"): Font("Helvetica-Bold", _HELVETICA_BOLD, _PUNCT_BOLD, 611, 718, 207),
+}
+
+_CACHE: LruCache["TextBox"] = LruCache(maxsize=int(os.environ.get("DWEB_TEXT_METRICS_CACHE_SIZE", "4096")))
+_ADVANCES: Dict[Tuple[str, str], Dict[str, float]] = {}
+
+
+class TextBox(NamedTuple):
+    width: float  # auto-size box, padding included (what the editor assigns)
+    height: float
+    content_width: float  # widest line
+    line_height: float
+    lines: int
+
+
+def _family(font: str) -> str:
+    return font if (font, "normal") in FONTS else DEFAULT_FONT
+
+
+def _js_round(v: float) -> int:
+    return math.floor(v + 0.5)
+
+
+def weight_of(font_style: Any) -> str:
+    """Weight ("bold" | "normal") of a CSS font-style prefix such as "italic bold" or "600"."""
+
+    for token in str(font_style or "normal").lower().split():
+        if token in ("bold", "bolder") or (token.isdigit() and int(token) >= 600):
+            return "bold"
+    return "normal"
+
+
+def _advance(ch: str, font: Font) -> float:
+    o = ord(ch)
+    if 32 <= o < 127:
+        return font.ascii[o - 32] / 1000
+    if ch in font.extra:
+        return font.extra[ch] / 1000
+    if ch == "\t":
+        return font.ascii[0] / 1000
+    if unicodedata.combining(ch) or unicodedata.category(ch) in ("Mn", "Me", "Cf", "Cc"):
+        return 0.0
+    if unicodedata.east_asian_width(ch) in ("W", "F"):
+        return 1.0
+    base = unicodedata.normalize("NFD", ch)[0]
+    if base != ch and 32 <= ord(base) < 127:
+        return font.ascii[ord(base) - 32] / 1000  # accented Latin letters
+    return font.fallback / 1000
+
+
+def advance(ch: str, *, font_style: Any = "normal", font: str = DEFAULT_FONT) -> float:
+    """Advance width of one character in em."""
+
+    key = (_family(font), weight_of(font_style))
+    table = _ADVANCES.setdefault(key, {})
+    a = table.get(ch)
+    if a is None:
+        a = table[ch] = _advance(ch, FONTS[key])
+    return a
+
+
+def line_width(text: str, *, font_size: float = DEFAULT_FONT_SIZE, font_style: Any = "normal", font: str = DEFAULT_FONT) -> float:
+    """Width in px of a single line (no padding)."""
+
+    key = (_family(font), weight_of(font_style))
+    table = _ADVANCES.setdefault(key, {})
+    total = 0.0
+    for ch in text:
+        a = table.get(ch)
+        if a is None:
+            a = table[ch] = _advance(ch, FONTS[key])
+        total += a
+    return total * font_size
+
+
+def _compute(text: str, font_size: float, style: str, font: str) -> TextBox:
+    lines = text.replace("\r\n", "\n").split("\n")
+    content = max(line_width(line, font_size=font_size, font_style=style, font=font) for line in lines)
+    pad_x = max(2, _js_round(font_size * 0.6))
+    pad_y = max(2, _js_round(font_size * 0.4))
+    line_h = font_size * LINE_HEIGHT
+    return TextBox(
+        width=float(max(1, math.ceil(content + pad_x * 2))),
+        height=float(max(1, math.ceil(len(lines) * line_h + pad_y * 2))),
+        content_width=content,
+        line_height=line_h,
+        lines=len(lines),
+    )
+
+
+def _key(text: str, font_size: float, font_style: Any, font: str) -> Tuple[str, float, str, str]:
+    return _family(font), font_size, weight_of(font_style), text
+
+
+def measure(text: str, *, font_size: float = DEFAULT_FONT_SIZE, font_style: Any = "normal", font: str = DEFAULT_FONT) -> TextBox:
+    key = _key(text, max(1.0, float(font_size)), font_style, font)
+    box = _CACHE.get(key)
+    if box is None:
+        box = _compute(key[3], key[1], key[2], key[0])
+        _CACHE.put(key, box)
+    return box
+
+
+def _props_key(props: Any) -> Tuple[str, float, str, str]:
+    p = props if isinstance(props, dict) else {}
+    raw = p.get("textContent")
+    text = raw if isinstance(raw, str) else str(raw if raw is not None else "")
+    return _key(text, max(1.0, _num(p.get("fontSize"), DEFAULT_FONT_SIZE)), p.get("fontStyle"), DEFAULT_FONT)
+
+
+def measure_props(props: Any) -> TextBox:
+    """Auto-size box of a text node's props (textContent, fontSize, fontStyle)."""
+
+    key = _props_key(props)
+    return measure(key[3], font_size=key[1], font_style=key[2], font=key[0])
+
+
+def measure_many(props_list: Iterable[Any]) -> List[TextBox]:
+    """measure_props() for a batch; each distinct key is looked up / computed once."""
+
+    keys = [_props_key(p) for p in props_list]
+    found: Dict[Tuple[str, float, str, str], TextBox] = {}
+    for key in keys:
+        if key in found:
+            continue
+        box = _CACHE.get(key)
+        if box is None:
+            box = _compute(key[3], key[1], key[2], key[0])
+            _CACHE.put(key, box)
+        found[key] = box
+    return [found[k] for k in keys]
+
+
+def cache_stats() -> Dict[str, Any]:
+    return _CACHE.stats()
+
+
+def font_metrics(font_style: Any = "normal", font: str = DEFAULT_FONT) -> Dict[str, Any]:
+    """Vertical metrics (1/1000 em) of the resolved font."""
+
+    f = FONTS[(_family(font), weight_of(font_style))]
+    return {"name": f.name, "ascent": f.ascent, "descent": f.descent, "lineHeight": LINE_HEIGHT}
@@ -0,0 +1,251 @@
+"""Stage lookup tools answered server-side during a chat turn.
+
+In stage-tools mode the model gets a short summary of the active layer
+instead of its nodeTree, plus four OpenAI-style function tools it can call
+while generating. The backend answers them from the cached SpatialIndex of
+the snapshot (see spatial.py) and feeds the result back in the same turn;
+tool calls never reach the client.
+
+- get_node(id)                      one node: transform, props, world box
+- list_children(id?, offset?)       direct children (top level without id)
+- find_nodes(name?, type?, text?)   substring / type search in render order
+- subtree_bbox(id)                  world box of a node and all descendants
+"""
+
+from __future__ import annotations
+
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from .spatial import Box, SpatialIndex, box_union, get_spatial_index
+
+_MAX_STRING = 160
+_MAX_LIST = 50
+
+TOOL_SPECS: List[Dict[str, Any]] = [
+    {
+        "type": "function",
+        "function": {
+            "name": "get_node",
+            "description": "按 nodeId 读取当前图层中的一个节点（transform、props、世界坐标包围盒、父节点、子节点数）。",
+            "parameters": {
+                "type": "object",
+                "properties": {"id": {"type": "string", "description": "nodeId"}},
+                "required": ["id"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "list_children",
+            "description": "列出节点的直接子节点（省略 id 时列出图层顶层节点），每页最多 50 个。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string", "description": "父节点 nodeId；省略表示图层顶层"},
+                    "offset": {"type": "integer", "description": "分页偏移，默认 0"},
+                },
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "find_nodes",
+            "description": "按名称/类型/文本内容查找节点（子串匹配，不区分大小写），最多返回 limit 个。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string", "description": "节点 name 包含的文字"},
+                    "type": {"type": "string", "enum": ["rect", "text", "image", "line", "base"]},
+                    "text": {"type": "string", "description": "text 节点 textContent 包含的文字"},
+                    "limit": {"type": "integer", "description": "默认 20，最大 50"},
+                },
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "subtree_bbox",
+            "description": "计算节点及其全部后代在世界坐标下的包围盒 [minX, minY, maxX, maxY] 与中心点。",
+            "parameters": {
+                "type": "object",
+                "properties": {"id": {"type": "string", "description": "nodeId"}},
+                "required": ["id"],
+            },
+        },
+    },
+]
+
+
+def _clip(v: Any) -> Any:
+    if isinstance(v, str) and len(v) > _MAX_STRING:
+        return v[:_MAX_STRING] + f"…({len(v)} chars)"
+    return v
+
+
+def _round_box(b: Optional[Box]) -> Optional[List[float]]:
+    return [round(v, 1) for v in b] if b is not None else None
+
+
+class StageTools:
+    """Tool runtime over one nodeTree; `calls` records what the model asked."""
+
+    def __init__(self, node_tree: Any) -> None:
+        self.index: SpatialIndex
+        self.index, self.index_cache_hit = get_spatial_index(node_tree)
+        self._children: Optional[Dict[int, List[int]]] = None
+        self.calls: List[Dict[str, Any]] = []
+
+    def children_of(self, i: int) -> List[int]:
+        if self._children is None:
+            children: Dict[int, List[int]] = {}
+            for j, p in enumerate(self.index.parents):
+                children.setdefault(p, []).append(j)
+            self._children = children
+        return self._children.get(i, [])
+
+    def brief(self, i: int) -> Dict[str, Any]:
+        node = self.index.nodes[i]
+        out: Dict[str, Any] = {"id": self.index.ids[i], "name": node.get("name"), "type": node.get("userType") or "base"}
+        props = node.get("props")
+        if isinstance(props, dict) and isinstance(props.get("textContent"), str):
+            out["text"] = _clip(props["textContent"])
+        n = len(self.children_of(i))
+        if n:
+            out["childCount"] = n
+        return out
+
+    def describe(self, i: int) -> Dict[str, Any]:
+        node = self.index.nodes[i]
+        out = self.brief(i)
+        if isinstance(node.get("transform"), dict):
+            out["transform"] = node["transform"]
+        if isinstance(node.get("props"), dict):
+            out["props"] = {k: _clip(v) for k, v in node["props"].items()}
+        if isinstance(node.get("filters"), list):
+            out["filters"] = node["filters"]
+        p = self.index.parents[i]
+        out["parentId"] = self.index.ids[p] if p >= 0 else None
+        out["worldBox"] = _round_box(self.index.boxes[i])
+        return out
+
+    # -- tools -------------------------------------------------------------
+
+    def get_node(self, id: str) -> Dict[str, Any]:
+        i = self.index.index_of.get(id)
+        if i is None:
+            return {"error": f"node not found: {id}"}
+        return self.describe(i)
+
+    def list_children(self, id: Optional[str] = None, offset: int = 0) -> Dict[str, Any]:
+        parent = -1
+        if id:
+            found = self.index.index_of.get(id)
+            if found is None:
+                return {"error": f"node not found: {id}"}
+            parent = found
+        kids = self.children_of(parent)
+        offset = max(0, int(offset))
+        page = kids[offset : offset + _MAX_LIST]
+        return {"parentId": id or None, "total": len(kids), "offset": offset, "children": [self.brief(i) for i in page]}
+
+    def find_nodes(
+        self, name: Optional[str] = None, type: Optional[str] = None, text: Optional[str] = None, limit: int = 20
+    ) -> Dict[str, Any]:
+        if not name and not type and not text:
+            return {"error": "give at least one of name / type / text"}
+        limit = max(1, min(_MAX_LIST, int(limit)))
+        name_q, text_q = (name or "").lower(), (text or "").lower()
+        hits: List[int] = []
+        total = 0
+        for i, node in enumerate(self.index.nodes):
+            if type and (node.get("userType") or "base") != type:
+                continue
+            if name_q and name_q not in str(node.get("name") or "").lower():
+                continue
+            if text_q:
+                props = node.get("props") if isinstance(node.get("props"), dict) else {}
+                if text_q not in str(props.get("textContent") or "").lower():
+                    continue
+            total += 1
+            if len(hits) < limit:
+                hits.append(i)
+        return {"total": total, "nodes": [dict(self.brief(i), worldBox=_round_box(self.index.boxes[i])) for i in hits]}
+
+    def subtree_bbox(self, id: str) -> Dict[str, Any]:
+        root = self.index.index_of.get(id)
+        if root is None:
+            return {"error": f"node not found: {id}"}
+        boxes: List[Box] = []
+        count = 0
+        stack = [root]
+        while stack:
+            i = stack.pop()
+            count += 1
+            if self.index.boxes[i] is not None:
+                boxes.append(self.index.boxes[i])  # type: ignore[arg-type]
+            stack.extend(self.children_of(i))
+        box = box_union(boxes)
+        if box is None:
+            return {"id": id, "nodes": count, "bbox": None}
+        return {
+            "id": id,
+            "nodes": count,
+            "bbox": _round_box(box),
+            "center": [round((box[0] + box[2]) / 2, 1), round((box[1] + box[3]) / 2, 1)],
+            "size": [round(box[2] - box[0], 1), round(box[3] - box[1], 1)],
+        }
+
+    def call(self, name: str, arguments: str) -> Dict[str, Any]:
+        """Run one tool call (arguments as the model sent them, a JSON string)."""
+
+        t0 = time.perf_counter()
+        result = self._dispatch(name, arguments)
+        self.calls.append({"tool": name, "ms": round((time.perf_counter() - t0) * 1000, 3), "ok": "error" not in result})
+        return result
+
+    def _dispatch(self, name: str, arguments: str) -> Dict[str, Any]:
+        try:
+            args = json.loads(arguments) if arguments else {}
+        except ValueError:
+            return {"error": "arguments must be a JSON object"}
+        fn = {
+            "get_node": self.get_node,
+            "list_children": self.list_children,
+            "find_nodes": self.find_nodes,
+            "subtree_bbox": self.subtree_bbox,
+        }.get(name)
+        if fn is None or not isinstance(args, dict):
+            return {"error": f"unknown tool or bad arguments: {name}"}
+        try:
+            return fn(**args)
+        except (TypeError, ValueError) as e:
+            return {"error": f"bad arguments for {name}: {e}"}
+
+    def summary(self, *, max_top_level: int = 20) -> Dict[str, Any]:
+        """Short stand-in for the nodeTree in the prompt."""
+
+        types: Dict[str, int] = {}
+        for node in self.index.nodes:
+            kind = str(node.get("userType") or "base")
+            types[kind] = types.get(kind, 0) + 1
+        top = self.children_of(-1)
+        out: Dict[str, Any] = {
+            "totalNodes": len(self.index),
+            "types": types,
+            "bounds": _round_box(self.index.bounds),
+            "topLevel": [self.brief(i) for i in top[:max_top_level]],
+        }
+        if len(top) > max_top_level:
+            out["topLevelOmitted"] = len(top) - max_top_level
+        if len(top) == 1:
+            # Layers usually hang everything off one project group; show its children too.
+            kids = self.children_of(top[0])
+            out["rootChildren"] = [self.brief(i) for i in kids[:max_top_level]]
+            if len(kids) > max_top_level:
+                out["rootChildrenOmitted"] = len(kids) - max_top_level
+        return out
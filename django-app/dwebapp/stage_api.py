@@ -0,0 +1,165 @@
+"""Stage APIs (plain Django views; responses may be binary).
+
+Endpoints (no trailing slashes; APPEND_SLASH=False):
+- POST /api/stage/render   (PNG thumbnail / raw RGBA of a snapshot or layer)
+- POST /api/timeline/bake  (baked keyframe tracks as a memory-mappable binary payload)
+- POST /api/stage/instantiate (ComponentTemplate x N parameter rows -> node trees / insertNode envelopes)
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+from typing import Any, Dict, Optional
+
+from django.http import FileResponse, HttpRequest, HttpResponse, HttpResponseNotAllowed, JsonResponse
+from django.http.response import HttpResponseBase
+from django.views.decorators.csrf import csrf_exempt
+
+
+def _error(code: str, message: str, *, status: int = 400, details: Optional[Dict[str, Any]] = None) -> JsonResponse:
+    out: Dict[str, Any] = {"code": code, "message": message}
+    if details is not None:
+        out["details"] = details
+    return JsonResponse({"error": out}, status=status)
+
+
+def _read_json_body(request: HttpRequest) -> Dict[str, Any]:
+    try:
+        raw = request.body.decode("utf-8") if request.body else ""
+        data: Any = json.loads(raw) if raw else {}
+    except Exception:
+        data = {}
+    return data if isinstance(data, dict) else {}
+
+
+def _int_param(v: Any, fallback: int) -> int:
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return fallback
+
+
+@csrf_exempt
+def render_stage(request: HttpRequest) -> HttpResponseBase:
+    """Rasterize a snapshot.
+
+    Body: {snapshot, width?, height?, layerId?, format?: "png" | "rgba" | "dataUrl"}
+    `snapshot` may be an EditorSnapshot, a ProjectPackage or a single layer.
+    """
+
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    body = _read_json_body(request)
+    snapshot = body.get("snapshot")
+    if not isinstance(snapshot, dict):
+        return _error("bad_request", "snapshot is required")
+
+    # Heavy import kept local so the chat endpoints do not pay for NumPy.
+    from .stage.raster import MAX_RENDER_SIZE, render_cache_key, render_snapshot, render_snapshot_png
+
+    width = _int_param(body.get("width"), 320)
+    height = _int_param(body.get("height"), 180)
+    if not (0 < width <= MAX_RENDER_SIZE and 0 < height <= MAX_RENDER_SIZE):
+        return _error("bad_request", f"width/height must be within 1..{MAX_RENDER_SIZE}")
+    layer_id = body.get("layerId") if isinstance(body.get("layerId"), str) else None
+    fmt = str(body.get("format") or "png")
+
+    if fmt == "rgba":
+        rgba = render_snapshot(snapshot, width=width, height=height, layer_id=layer_id)
+        resp = HttpResponse(rgba.tobytes(), content_type="application/octet-stream")
+        resp["X-Dweb-Image-Size"] = f"{width}x{height}"
+        resp["X-Dweb-Snapshot-Hash"] = render_cache_key(snapshot, layer_id)
+        return resp
+
+    png, digest, hit = render_snapshot_png(snapshot, width=width, height=height, layer_id=layer_id)
+    if fmt == "dataUrl":
+        return JsonResponse(
+            {
+                "snapshotHash": digest,
+                "width": width,
+                "height": height,
+                "cache": "hit" if hit else "miss",
+                "dataUrl": "data:image/png;base64," + base64.b64encode(png).decode("ascii"),
+            }
+        )
+    if fmt != "png":
+        return _error("bad_request", f"unsupported format: {fmt}")
+
+    resp = HttpResponse(png, content_type="image/png")
+    resp["X-Dweb-Snapshot-Hash"] = digest
+    resp["X-Dweb-Cache"] = "hit" if hit else "miss"
+    resp["Cache-Control"] = "private, max-age=3600"
+    resp["ETag"] = f'"{digest}-{width}x{height}"'
+    return resp
+
+
+@csrf_exempt
+def bake_timeline(request: HttpRequest) -> HttpResponseBase:
+    """Bake all node tracks of a snapshot's timeline.
+
+    Body: {snapshot}  (EditorSnapshot or ProjectPackage)
+    Response: application/octet-stream, see dwebapp/timeline/bake.py for the layout.
+    """
+
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    body = _read_json_body(request)
+    snapshot = body.get("snapshot")
+    if not isinstance(snapshot, dict):
+        return _error("bad_request", "snapshot is required")
+
+    from .export.jobs import maybe_sweep
+    from .timeline.bake import get_baked_timeline
+
+    maybe_sweep()
+    baked, path, hit = get_baked_timeline(snapshot)
+    resp = FileResponse(open(path, "rb"), content_type="application/octet-stream")
+    resp["X-Dweb-Timeline-Key"] = baked.cache_key
+    resp["X-Dweb-Cache"] = "hit" if hit else "miss"
+    resp["X-Dweb-Baked-Tracks"] = str(baked.track_index.shape[0])
+    return resp
+
+
+@csrf_exempt
+def instantiate_template(request: HttpRequest) -> HttpResponseBase:
+    """Instantiate a ComponentTemplate for N parameter rows (see stage/instantiate.py).
+
+    Body: {template? | templateId, rows?: [params...] | params?: {...}, takenIds?: [stage ids],
+           format?: "tree" | "envelopes", parentId?, layerId?}
+    Response: {instances: [{rootNodeId, localIdToNodeId, root}], info} or, with
+    format "envelopes", {envelopes: [insertNode...], info}.
+    """
+
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    from .stage.instantiate import InvalidTemplate, insert_node_envelopes, instantiate, parse_rows, resolve_template
+
+    body = _read_json_body(request)
+    template = resolve_template(body.get("template"), body.get("templateId"))
+    if template is None:
+        if body.get("template") is None and body.get("templateId") is None:
+            return _error("bad_request", "template or templateId is required")
+        return _error("template_not_found", "template not found", status=404, details={"templateId": body.get("templateId")})
+    rows, reason = parse_rows(body)
+    if rows is None:
+        return _error("bad_request", str(reason))
+    taken_raw = body.get("takenIds")
+    taken = {t for t in taken_raw if isinstance(t, str)} if isinstance(taken_raw, list) else set()
+    try:
+        instances, info = instantiate(template, rows, taken=taken)
+    except InvalidTemplate as e:
+        return _error("invalid_template", "template is invalid", details={"errors": e.errors})
+    if body.get("format") == "envelopes":
+        envelopes = insert_node_envelopes(
+            instances,
+            template_id=info["templateId"],
+            parent_id=body.get("parentId"),
+            layer_id=body.get("layerId"),
+            source={"agentName": "backend"},
+        )
+        return JsonResponse({"envelopes": envelopes, "info": info})
+    return JsonResponse({"instances": instances, "info": info})
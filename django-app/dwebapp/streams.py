@@ -0,0 +1,322 @@
+"""In-process registry of live messages:stream generations (per worker process).
+
+stream_message registers a LiveStream once its response starts iterating and
+drops it when the response closes. The generation pipeline reports phase,
+time-to-first-token and buffer size into it; the SSE writer reports envelopes,
+bytes and client liveness. cancel() flags the stream and shuts down its
+upstream sockets, so the blocked upstream read returns at once and the
+pipeline ends the turn with a "canceled" status instead of paying for the
+rest of the generation.
+
+The registry itself is per process. With a shared-state backend configured
+(DWEB_SHARED_STATE_URL, see shared_state/base.py) a cancel for a stream this
+process does not hold is published on CANCEL_CHANNEL, and every process
+that has registered a stream listens there and cancels its own copy.
+"""
+
+from __future__ import annotations
+
+import json
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Union
+
+from . import metrics
+
+
+class StreamCanceled(Exception):
+    """Raised out of the upstream read loop once a stream has been canceled."""
+
+
+class LiveStream:
+    def __init__(
+        self,
+        *,
+        conversation_id: str,
+        model: str,
+        response_mode: str,
+        intent: Optional[str] = None,
+        planner: bool = False,
+    ) -> None:
+        self.id = uuid.uuid4().hex[:12]
+        self.conversation_id = conversation_id
+        self.model = model
+        self.response_mode = response_mode
+        self.intent = intent
+        self.planner = planner
+        self.created_at = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        self.started_at = time.monotonic()
+        self.phase: Optional[str] = None
+        self.phase_at = self.started_at
+        self.ttft_ms: Optional[int] = None
+        self.upstream_chars = 0
+        self.buffer_chars = 0
+        self.envelopes = 0
+        self.bytes_sent = 0
+        self.last_write_at: Optional[float] = None
+        self.write_started_at: Optional[float] = None  # set while the server is blocked writing to the client
+        self.client_connected = True
+        self.acked = 0  # stage ops the client reported as applied (WebSocket transport only)
+        self.ack_failed = 0
+        self.cancel_reason: Optional[str] = None
+        self._canceled = threading.Event()
+        self._lock = threading.Lock()
+        self._upstreams: Set[Any] = set()
+        self.modules: List["LiveModule"] = []
+
+    # -- generation side -------------------------------------------------
+
+    @property
+    def canceled(self) -> bool:
+        return self._canceled.is_set()
+
+    def set_phase(self, phase: str) -> None:
+        self.phase = phase
+        self.phase_at = time.monotonic()
+
+    def note_first_token(self, ttft_ms: int) -> None:
+        if self.ttft_ms is None:
+            self.ttft_ms = ttft_ms
+
+    def note_delta(self, chars: int, buffer_chars: Optional[int] = None) -> None:
+        self.upstream_chars += chars
+        if buffer_chars is not None:
+            self.buffer_chars = buffer_chars
+
+    def attach_upstream(self, resp: Any) -> None:
+        """Track an open upstream response (planner mode has several at once)."""
+
+        with self._lock:
+            self._upstreams.add(resp)
+        if self.canceled:
+            _shutdown_upstream(resp)
+
+    def detach_upstream(self, resp: Any) -> None:
+        with self._lock:
+            self._upstreams.discard(resp)
+
+    def module(self, name: str) -> "LiveModule":
+        """Progress sink for one planner module (shares cancel + upstream tracking)."""
+
+        m = LiveModule(self, name)
+        self.modules.append(m)
+        return m
+
+    # -- client side ------------------------------------------------------
+
+    def before_write(self, chunk: bytes, *, envelope: bool) -> None:
+        if envelope:
+            self.envelopes += 1
+        self.bytes_sent += len(chunk)
+        self.write_started_at = time.monotonic()
+
+    def after_write(self) -> None:
+        self.last_write_at = time.monotonic()
+        self.write_started_at = None
+
+    def note_ack(self, count: int, *, ok: bool) -> None:
+        if ok:
+            self.acked += count
+        else:
+            self.ack_failed += count
+
+    # -- ops side ---------------------------------------------------------
+
+    def cancel(self, reason: str = "ops") -> None:
+        if self.canceled:
+            return
+        self.cancel_reason = reason
+        self._canceled.set()
+        with self._lock:
+            upstreams = list(self._upstreams)
+        for resp in upstreams:
+            _shutdown_upstream(resp)
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            upstreams = len(self._upstreams)
+        return {
+            "id": self.id,
+            "conversationId": self.conversation_id,
+            "model": self.model,
+            "responseMode": self.response_mode,
+            "intent": self.intent,
+            "planner": self.planner,
+            "createdAt": self.created_at,
+            "ageMs": int((now - self.started_at) * 1000),
+            "phase": self.phase,
+            "phaseAgeMs": int((now - self.phase_at) * 1000),
+            "ttftMs": self.ttft_ms,
+            "upstreamChars": self.upstream_chars,
+            "bufferChars": self.buffer_chars,
+            "envelopes": self.envelopes,
+            "bytesSent": self.bytes_sent,
+            "openUpstreams": upstreams,
+            "modules": [m.to_dict() for m in self.modules] or None,
+            "client": {
+                "connected": self.client_connected,
+                "lastWriteAgoMs": int((now - self.last_write_at) * 1000) if self.last_write_at is not None else None,
+                "blockedWriteMs": int((now - self.write_started_at) * 1000) if self.write_started_at is not None else None,
+                "acked": self.acked,
+                "ackFailed": self.ack_failed,
+            },
+            "canceled": self.canceled,
+            "cancelReason": self.cancel_reason,
+        }
+
+
+class LiveModule:
+    """Same generation-side interface as LiveStream, for a planner sub-stream.
+
+    Module phases and buffers are kept per module so they do not overwrite the
+    planner's own phase; cancel state and upstream sockets are the parent's.
+    """
+
+    def __init__(self, parent: LiveStream, name: str) -> None:
+        self.parent = parent
+        self.name = name
+        self.phase: Optional[str] = None
+        self.ttft_ms: Optional[int] = None
+        self.buffer_chars = 0
+
+    @property
+    def canceled(self) -> bool:
+        return self.parent.canceled
+
+    @property
+    def cancel_reason(self) -> Optional[str]:
+        return self.parent.cancel_reason
+
+    def set_phase(self, phase: str) -> None:
+        self.phase = phase
+
+    def note_first_token(self, ttft_ms: int) -> None:
+        if self.ttft_ms is None:
+            self.ttft_ms = ttft_ms
+
+    def note_delta(self, chars: int, buffer_chars: Optional[int] = None) -> None:
+        self.parent.upstream_chars += chars
+        if buffer_chars is not None:
+            self.buffer_chars = buffer_chars
+
+    def attach_upstream(self, resp: Any) -> None:
+        self.parent.attach_upstream(resp)
+
+    def detach_upstream(self, resp: Any) -> None:
+        self.parent.detach_upstream(resp)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "phase": self.phase, "ttftMs": self.ttft_ms, "bufferChars": self.buffer_chars}
+
+
+LiveProgress = Union[LiveStream, LiveModule]
+
+
+def _shutdown_upstream(resp: Any) -> None:
+    """Unblock a reader stuck in recv() on another thread, then close.
+
+    HTTPResponse.close() alone does not wake a thread blocked in a socket read;
+    shutdown(SHUT_RDWR) does (plain and TLS sockets alike).
+    """
+
+    sock = getattr(getattr(getattr(resp, "fp", None), "raw", None), "_sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    try:
+        resp.close()
+    except Exception:
+        pass
+
+
+_LOCK = threading.Lock()
+_STREAMS: Dict[str, LiveStream] = {}
+
+CANCEL_CHANNEL = "dweb:streams:cancel"
+_RESUBSCRIBE_S = 5.0
+_listener: Optional[threading.Thread] = None
+
+
+def _listen_for_cancels() -> None:
+    from .shared_state.base import SharedStateError, get_shared_state
+
+    while True:
+        try:
+            with get_shared_state().subscribe(CANCEL_CHANNEL) as sub:
+                for raw in sub:
+                    try:
+                        msg = json.loads(raw)
+                    except ValueError:
+                        continue
+                    if isinstance(msg, dict) and isinstance(msg.get("id"), str):
+                        if cancel_stream(msg["id"], str(msg.get("reason") or "ops")) is not None:
+                            metrics.incr("chat.streams_remote_cancels")
+        except SharedStateError:
+            pass
+        time.sleep(_RESUBSCRIBE_S)
+
+
+def _ensure_listener() -> None:
+    global _listener
+    if _listener is not None:
+        return
+    from .shared_state.base import is_shared
+
+    if not is_shared():
+        _listener = threading.current_thread()  # nothing to listen to; do not check again
+        return
+    _listener = threading.Thread(target=_listen_for_cancels, name="stream-cancel-listener", daemon=True)
+    _listener.start()
+
+
+def register(live: LiveStream) -> LiveStream:
+    with _LOCK:
+        _STREAMS[live.id] = live
+        _ensure_listener()
+    metrics.incr("chat.streams_started", planner=live.planner)
+    return live
+
+
+def unregister(live: LiveStream) -> None:
+    with _LOCK:
+        _STREAMS.pop(live.id, None)
+    outcome = "client_gone" if not live.client_connected else ("canceled" if live.canceled else "ok")
+    metrics.incr("chat.streams_finished", outcome=outcome)
+
+
+def get_stream(stream_id: str) -> Optional[LiveStream]:
+    with _LOCK:
+        return _STREAMS.get(stream_id)
+
+
+def list_streams() -> List[Dict[str, Any]]:
+    with _LOCK:
+        live = list(_STREAMS.values())
+    live.sort(key=lambda s: s.started_at)
+    return [s.to_dict() for s in live]
+
+
+def cancel_stream(stream_id: str, reason: str = "ops") -> Optional[LiveStream]:
+    live = get_stream(stream_id)
+    if live is not None:
+        live.cancel(reason)
+    return live
+
+
+def broadcast_cancel(stream_id: str, reason: str = "ops") -> Optional[int]:
+    """Ask the other processes to cancel `stream_id`; None without a shared backend.
+
+    Returns the number of listeners reached (-1 when the backend cannot tell).
+    """
+
+    from .shared_state.base import get_shared_state, is_shared
+
+    if not is_shared():
+        return None
+    return get_shared_state().publish(CANCEL_CHANNEL, json.dumps({"id": stream_id, "reason": reason}))
@@ -1 +1,1104 @@
-from django.test import TestCase  # noqa: F401
+import base64
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+import unittest.mock
+from pathlib import Path
+
+import numpy as np
+
+from django.test import SimpleTestCase, override_settings
+
+from . import ai_chat_api, capture, chat_batch, chat_jobs, compact_dialect, fast_path, ratelimit, routing, similar_cache, streams
+from .export import jobs as export_jobs
+from .prompts.intent import RequestScope
+from .shared_state import base as shared_state
+from .shared_state.memory import MemoryState
+from .shared_state.resp_server import RespServer
+from .stage import instantiate, layout, raster, spatial, text_metrics
+from .stage import mirror as stage_mirror
+from .stage.tools import StageTools
+from .timeline import bake
+
+
+def _template_turn(text: str):
+    return [
+        {"type": "agentToUi/chatMessage", "payload": {"content": "好的"}},
+        {
+            "type": "agentToUi/componentTemplate",
+            "payload": {
+                "intent": "insert",
+                "template": {
+                    "templateId": "tmpl_card",
+                    "rootLocalId": "root",
+                    "nodes": [{"localId": "root", "type": "text", "props": {"textContent": text}}],
+                },
+            },
+        },
+    ]
+
+
+class SimilarCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = similar_cache.SimilarCache(threshold=0.8)
+
+    def _partition(self, conversation="c1", **scope):
+        return similar_cache.partition_key(
+            scope=similar_cache.resolve_scope(conversation_id=conversation, **scope),
+            response_mode="agentToUi-jsonl",
+            intent="insert",
+            model="m",
+            context_pack={},
+        )
+
+    def _remember(self, content, conversation="c1", **scope):
+        key = self.cache.remember(
+            content, partition=self._partition(conversation, **scope), viewport=None, envelopes=_template_turn(content)
+        )
+        self.assertIsNotNone(key)
+
+    def test_normalize_drops_fillers_and_slots_literals(self):
+        self.assertEqual(similar_cache.normalize("帮我生成一个登录框吧"), similar_cache.normalize("创建登录框"))
+        self.assertEqual(similar_cache.normalize("插入标题「你好」"), "标题§")
+
+    def test_features_cover_colours_styles_numbers_and_negations(self):
+        self.assertEqual(similar_cache.features("3 个深色圆角卡片"), ("3", "深", "圆角"))
+        self.assertEqual(similar_cache.features("不要注册按钮"), ("¬",))
+        self.assertEqual(similar_cache.features("a dark login card without border"), ("dark", "¬", "border"))
+        self.assertEqual(similar_cache.features("标题「红色」"), ())
+
+    def test_paraphrase_hits(self):
+        self._remember("生成一个深色登录卡片")
+        match, report = self.cache.lookup("帮我做一个深色登录卡片吧", partition=self._partition())
+        self.assertIsNotNone(match)
+        self.assertEqual(report["outcome"], "hit")
+
+    def test_near_miss_pairs_do_not_hit(self):
+        pairs = [
+            ("生成深色登录卡片", "生成浅色登录卡片"),
+            ("生成红色主按钮", "生成蓝色主按钮"),
+            ("生成登录表单，不要注册按钮", "生成登录表单，要注册按钮"),
+            ("dark login card", "light login card"),
+            ("生成 3 个卡片", "生成 5 个卡片"),
+        ]
+        for remembered, asked in pairs:
+            with self.subTest(asked=asked):
+                self.cache.clear()
+                self._remember(remembered)
+                match, _ = self.cache.lookup(asked, partition=self._partition())
+                self.assertIsNone(match)
+
+    def test_entries_stay_in_their_conversation(self):
+        self._remember("生成一个深色登录卡片", conversation="c1")
+        match, _ = self.cache.lookup("生成一个深色登录卡片", partition=self._partition("c2"))
+        self.assertIsNone(match)
+        match, _ = self.cache.lookup("生成一个深色登录卡片", partition=self._partition("c1"))
+        self.assertIsNotNone(match)
+
+    def test_tenant_and_global_scopes_share_across_conversations(self):
+        self._remember("生成一个深色登录卡片", conversation="c1", scope="tenant", tenant="acme")
+        self._remember("生成一个深色登录卡片", conversation="c1", scope="global")
+        cases = [
+            ({"scope": "tenant", "tenant": "acme"}, True),
+            ({"scope": "tenant", "tenant": "other"}, False),
+            ({"scope": "tenant"}, False),  # no tenant: falls back to the conversation
+            ({"scope": "global"}, True),
+            ({"scope": "conversation"}, False),
+        ]
+        for scope, hit in cases:
+            with self.subTest(**scope):
+                match, report = self.cache.lookup("帮我做一个深色登录卡片", partition=self._partition("c2", **scope))
+                self.assertEqual(match is not None, hit)
+        self.assertEqual(report["scope"], "conversation")
+
+        by_scope = self.cache.stats()["byScope"]
+        self.assertEqual(by_scope["tenant"], {"lookups": 2, "hits": 1, "hitRate": 0.5})
+        self.assertEqual(by_scope["global"], {"lookups": 1, "hits": 1, "hitRate": 1.0})
+        self.assertEqual(by_scope["conversation"]["hits"], 0)
+
+    def test_scope_defaults_to_the_conversation(self):
+        with unittest.mock.patch.object(similar_cache, "SCOPE", "conversation"):
+            self.assertEqual(similar_cache.resolve_scope(conversation_id="c1", tenant="acme"), ("conversation", "c1"))
+        with unittest.mock.patch.object(similar_cache, "SCOPE", "tenant"):
+            self.assertEqual(similar_cache.resolve_scope(conversation_id="c1", tenant="acme"), ("tenant", "acme"))
+        with unittest.mock.patch.object(similar_cache, "SCOPE", "bogus"):
+            self.assertEqual(similar_cache.resolve_scope(conversation_id="c1"), ("conversation", "c1"))
+
+
+class StageMirrorTests(SimpleTestCase):
+    def _pack(self, x=0, fill="#fff"):
+        node = {"id": "a", "category": "user", "userType": "rect", "transform": {"x": x}, "props": {"fillColor": fill}}
+        return {"activeLayerId": "L1", "activeLayer": {"id": "L1", "nodeTree": [node]}}
+
+    def test_without_stage_hash_nothing_is_seeded(self):
+        mirror, _, report = stage_mirror.resolve("m-off", self._pack(), None)
+        self.assertIsNone(mirror)
+        self.assertEqual(report["status"], "off")
+
+    def test_mirror_follows_envelopes(self):
+        pack = self._pack()
+        stage_hash = stage_mirror.hash_tree(pack["activeLayer"]["nodeTree"], 0)
+        mirror, _, report = stage_mirror.resolve("m-apply", pack, stage_hash)
+        self.assertEqual(report["status"], "seeded")
+        mirror.apply({"type": "agentToUi/insertNode", "payload": {"node": {"id": "b", "userType": "text"}, "parentId": "a"}})
+        mirror.apply({"type": "agentToUi/patchNode", "payload": {"nodeId": "a", "patch": {"transform": {"x": 5}}}})
+        stage_mirror.save("m-apply", mirror)
+        client_tree = [{"id": "a", "userType": "rect", "children": [{"id": "b", "userType": "text"}]}]
+        mirror, pack, report = stage_mirror.resolve("m-apply", {"activeLayerId": "L1"}, stage_mirror.hash_tree(client_tree, 0))
+        self.assertEqual(report["status"], "mirror")
+        self.assertEqual(pack["activeLayer"]["nodeTree"][0]["transform"]["x"], 5)
+
+    def test_local_edit_diverges(self):
+        pack = self._pack()
+        mirror, _, _ = stage_mirror.resolve("m-edit", pack, stage_mirror.hash_tree(pack["activeLayer"]["nodeTree"], 3))
+        stage_mirror.save("m-edit", mirror)
+        # The user moves and recolors the node: same structure, the client's edit counter moves on.
+        edited = self._pack(x=999, fill="#f00")["activeLayer"]["nodeTree"]
+        _, _, report = stage_mirror.resolve("m-edit", {"activeLayerId": "L1"}, stage_mirror.hash_tree(edited, 5))
+        self.assertEqual(report["status"], "diverged")
+
+    def test_upload_with_wrong_hash_is_not_kept(self):
+        mirror, _, report = stage_mirror.resolve("m-bad", self._pack(), "s2-9-00000000-0")
+        self.assertIsNone(mirror)
+        self.assertEqual(report["status"], "unmatched")
+
+
+class TemplatePlanCacheTests(SimpleTestCase):
+    def setUp(self):
+        instantiate._PLANS.clear()
+        instantiate._BY_IDENTITY.clear()
+
+    def _template(self):
+        return {
+            "schemaVersion": 1,
+            "templateId": "tmpl_badge",
+            "name": "Badge",
+            "rootLocalId": "root",
+            "params": [{"key": "label", "type": "string", "default": "新"}],
+            "nodes": [{"localId": "root", "type": "text", "props": {"textContent": "{{label}}"}}],
+        }
+
+    def test_same_template_object_hits(self):
+        template = self._template()
+        plan, cached = instantiate.compile_template(template)
+        self.assertFalse(cached)
+        again, cached = instantiate.compile_template(dict(template))  # resolve_template copies the top level only
+        self.assertTrue(cached)
+        self.assertIs(again, plan)
+        self.assertEqual(plan.hash, instantiate.template_hash(template))
+
+    def test_reparsed_template_hits_by_hash(self):
+        template = self._template()
+        plan, _ = instantiate.compile_template(template)
+        for _ in range(3):
+            other, cached = instantiate.compile_template(json.loads(json.dumps(template)))
+            self.assertTrue(cached)
+            self.assertIs(other, plan)
+        self.assertEqual(instantiate.cache_stats()["size"], 1)
+        edited = json.loads(json.dumps(template))
+        edited["nodes"][0]["props"]["textContent"] = "固定"
+        _, cached = instantiate.compile_template(edited)
+        self.assertFalse(cached)
+        with self.assertRaises(instantiate.InvalidTemplate):
+            instantiate.compile_template(dict(template, rootLocalId="missing"))
+
+
+def _selection(*types):
+    ids = [f"n{i}" for i in range(len(types))]
+    return {"selectedNodeIds": ids, "selectedNodes": [{"id": i, "userType": t} for i, t in zip(ids, types)]}
+
+
+class FastPathTests(SimpleTestCase):
+    def test_normalize_drops_fillers_and_selection_words(self):
+        self.assertEqual(fast_path.normalize("请帮我把选中的节点删除掉。"), ("", "删除掉"))
+        self.assertEqual(fast_path.normalize("字体改成 24"), ("", "字体改成24"))
+        self.assertEqual(fast_path.normalize("删除选中并新建一个按钮"), ("", "删除并新建一个按钮"))
+
+    def test_hits(self):
+        plan, report = fast_path.match("删除选中的节点", _selection("rect", "text"))
+        self.assertEqual(report["rule"], "delete")
+        self.assertEqual(plan.envelopes, [{"type": "agentToUi/deleteNode", "payload": {"nodeIds": ["n0", "n1"]}}])
+
+        plan, _ = fast_path.match("把选中节点变成红色", _selection("rect", "text"))
+        self.assertEqual(
+            [e["payload"]["patch"]["props"] for e in plan.envelopes], [{"fillColor": "#ff4d4f"}, {"fontColor": "#ff4d4f"}]
+        )
+
+        plan, _ = fast_path.match("给选中的节点加一个青色发光", _selection("rect", "line"))
+        self.assertEqual([e["payload"]["filter"]["intensity"] for e in plan.envelopes], [1, 4])
+
+        plan, _ = fast_path.match("字体改成 24", _selection("text"))
+        self.assertEqual(plan.envelopes[0]["payload"]["patch"]["props"], {"fontSize": 24})
+
+    def test_fall_throughs(self):
+        cases = [
+            ("删除选中并新建一个按钮", _selection("rect"), None, "no_rule"),
+            ("把选中节点变成红色", _selection("rect", "image"), "recolor", "unsupported_type"),
+            ("字体改成 24", _selection("rect"), "fontSize", "unsupported_type"),
+            ("字体改成 600", _selection("text"), "fontSize", "out_of_range"),
+            ("删除", {}, "delete", "no_selection"),
+        ]
+        for content, pack, rule, reason in cases:
+            with self.subTest(content=content):
+                plan, report = fast_path.match(content, pack)
+                self.assertIsNone(plan)
+                self.assertEqual((report["rule"], report["reason"]), (rule, reason))
+
+
+class ExportSweepTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.data_dir = Path(tmp.name)
+        self.enterContext(override_settings(DWEB_DATA_DIR=str(self.data_dir)))
+
+    def _bake(self, name, size, age_s):
+        path = self.data_dir / "timeline-bake" / f"{name}.dvsbake"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * size)
+        t = time.time() - age_s
+        os.utime(path, (t, t))
+        return path
+
+    def test_bakes_past_retention_are_removed(self):
+        old = self._bake("old", 10, export_jobs._RETENTION_S + 60)
+        fresh = self._bake("fresh", 10, 0)
+        self.assertEqual(export_jobs.sweep()["bakes"], 1)
+        self.assertFalse(old.exists())
+        self.assertTrue(fresh.exists())
+
+    def test_bakes_over_the_size_cap_go_least_recently_used_first(self):
+        paths = [self._bake(f"b{i}", 100, 300 - i * 100) for i in range(3)]
+        with unittest.mock.patch.object(export_jobs, "_BAKE_MAX_BYTES", 150):
+            self.assertEqual(export_jobs.sweep()["bakes"], 2)
+        self.assertEqual([p.exists() for p in paths], [False, False, True])
+
+
+def _timeline_snapshot(**timeline):
+    node = {
+        "id": "n1",
+        "category": "user",
+        "transform": {"x": 0, "y": 0, "width": 100, "height": 50, "rotation": 0, "opacity": 1},
+        "props": {"fillColor": "#ff0000"},
+    }
+    keyframes = {
+        "0": {"n1": {"transform": {"x": 0}}},
+        "10": {"n1": {"transform": {"x": 100}}},
+        "20": {"n1": {"transform": {"x": 40, "opacity": 0.5}}},
+    }
+    tl = {
+        "frameCount": 30,
+        "keyframeSpansByLayer": {"L1": [0, 10, 20]},
+        "easingSegmentKeys": ["L1:0:10"],
+        "nodeKeyframesByLayer": {"L1": keyframes},
+    }
+    tl.update(timeline)
+    return {"layers": [{"id": "L1", "nodeTree": [node]}], "timeline": tl}
+
+
+class TimelineBakeTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.data_dir = Path(tmp.name)
+        self.enterContext(override_settings(DWEB_DATA_DIR=str(self.data_dir)))
+        bake._BAKE_CACHE.clear()
+        self.addCleanup(bake._BAKE_CACHE.clear)
+
+    def _channel(self, baked, name, frames):
+        col = baked.channels.index(name)
+        return [round(float(baked.frame_values(f)[baked.node_index("n1"), col]), 3) for f in frames]
+
+    def test_interpolation_at_keyframe_boundaries(self):
+        baked = bake.bake_timeline(_timeline_snapshot())
+        self.assertEqual(baked.mode, "legacy")
+        self.assertEqual(baked.track_index.tolist(), [[0, 0], [0, 5]])  # only x and opacity change
+        # Eased 0..10, held 10..20 (no easing key), set at 20 and held to the end.
+        self.assertEqual(self._channel(baked, "x", [0, 1, 9, 10, 11, 19, 20, 29]), [0, 10, 90, 100, 100, 100, 40, 40])
+        self.assertEqual(self._channel(baked, "opacity", [0, 19, 20, 29]), [1, 1, 0.5, 0.5])
+        self.assertEqual(self._channel(baked, "width", [0, 29]), [100, 100])
+        # Frames outside the timeline clamp to its ends.
+        self.assertEqual(self._channel(baked, "x", [-5, 99]), [0, 40])
+
+    def test_write_and_load_round_trip(self):
+        baked = bake.bake_timeline(_timeline_snapshot(), cache_key="key1")
+        data = bake.encode_baked(baked)
+        self.assertEqual(len(data) % 64, 0)
+        path = self.data_dir / "t.dvsbake"
+        with open(path, "wb") as fp:
+            self.assertEqual(bake.write_baked(baked, fp), len(data))
+        for source in (data, path):
+            with self.subTest(source=type(source).__name__):
+                loaded = bake.load_baked(source)
+                self.assertEqual(
+                    (loaded.frame_count, loaded.mode, loaded.node_ids, loaded.node_layers, loaded.cache_key, loaded.channels),
+                    (baked.frame_count, baked.mode, baked.node_ids, baked.node_layers, "key1", baked.channels),
+                )
+                for name in ("static", "track_index", "tracks"):
+                    self.assertTrue(np.array_equal(getattr(loaded, name), getattr(baked, name), equal_nan=True), name)
+                self.assertEqual(loaded.frame_digest(15), baked.frame_digest(15))
+        with self.assertRaises(ValueError):
+            bake.load_baked(b"not a payload")
+
+    def test_cache_key_stability(self):
+        snapshot = _timeline_snapshot()
+        key = bake.timeline_cache_key(snapshot)
+        self.assertEqual(bake.timeline_cache_key(json.loads(json.dumps(snapshot))), key)
+        self.assertEqual(bake.timeline_cache_key({"project": {"snapshot": snapshot}}), key)
+        self.assertEqual(bake.timeline_cache_key(dict(snapshot, selection=["n1"])), key)  # not read by the bake
+        self.assertNotEqual(bake.timeline_cache_key(_timeline_snapshot(easingSegmentKeys=[])), key)
+        self.assertNotEqual(bake.timeline_cache_key(_timeline_snapshot(frameCount=31)), key)
+
+    def test_get_baked_timeline_reuses_the_payload_file(self):
+        snapshot = _timeline_snapshot()
+        baked, path, hit = bake.get_baked_timeline(snapshot)
+        self.assertFalse(hit)
+        self.assertEqual(path, self.data_dir / "timeline-bake" / f"{bake.timeline_cache_key(snapshot)}.dvsbake")
+        bake._BAKE_CACHE.clear()
+        loaded, same_path, hit = bake.get_baked_timeline(json.loads(json.dumps(snapshot)))
+        self.assertTrue(hit)
+        self.assertEqual(same_path, path)
+        self.assertEqual(loaded.frame_digest(5), baked.frame_digest(5))
+
+
+def _rect(local_id, w, h, parent="box", **extra):
+    return dict({"localId": local_id, "type": "rect", "parentLocalId": parent, "transform": {"width": w, "height": h}, "props": {}}, **extra)
+
+
+def _stack(box_layout, kids, **transform):
+    box = {"localId": "box", "type": "rect", "layout": box_layout, "transform": dict(transform), "props": {}}
+    return {"templateId": "tmpl_stack", "rootLocalId": "box", "nodes": [box, *kids]}
+
+
+class LayoutSolverTests(SimpleTestCase):
+    def _solve(self, template):
+        solved, stats = layout.solve_template(template)
+        return {n["localId"]: n["transform"] for n in solved["nodes"]}, stats, solved
+
+    def test_vstack_with_padding_and_gap(self):
+        template = _stack({"type": "vstack", "gap": 8, "padding": [10, 20]}, [_rect("a", 100, 40), _rect("b", 60, 20)])
+        t, stats, solved = self._solve(template)
+        self.assertEqual((t["box"]["width"], t["box"]["height"]), (140, 88))
+        self.assertEqual((t["a"]["x"], t["a"]["y"]), (0, -14))
+        self.assertEqual((t["b"]["x"], t["b"]["y"]), (-20, 24))
+        self.assertNotIn("layout", solved["nodes"][0])
+        self.assertIn("layout", template["nodes"][0])  # the input is left alone
+        self.assertEqual(stats["overflow"], [])
+
+    def test_hstack_centers_on_the_cross_axis(self):
+        t, _, _ = self._solve(_stack({"type": "hstack", "gap": 10, "align": "center"}, [_rect("a", 50, 20), _rect("b", 30, 40)]))
+        self.assertEqual((t["box"]["width"], t["box"]["height"]), (90, 40))
+        self.assertEqual([(t[k]["x"], t[k]["y"]) for k in "ab"], [(-20, 0), (30, 0)])
+
+    def test_align_stretch_fills_the_inner_cross_size(self):
+        t, _, _ = self._solve(_stack({"type": "vstack", "padding": 10, "align": "stretch"}, [_rect("a", 50, 20)], width=200))
+        self.assertEqual(t["box"]["width"], 200)
+        self.assertEqual((t["a"]["width"], t["a"]["x"]), (180, 0))
+
+    def test_justify_space_between_spreads_the_free_space(self):
+        kids = [_rect(k, 40, 20) for k in "abc"]
+        t, _, _ = self._solve(_stack({"type": "vstack", "justify": "space-between"}, kids, height=200))
+        self.assertEqual([t[k]["y"] for k in "abc"], [-90, 0, 90])
+
+    def test_fit_content_overrides_a_given_size(self):
+        t, _, _ = self._solve(_stack({"type": "hstack", "fit": "content"}, [_rect("a", 50, 20)], width=500, height=300))
+        self.assertEqual((t["box"]["width"], t["box"]["height"]), (50, 20))
+
+    def test_absolute_children_stay_out_of_the_flow(self):
+        pinned = _rect("p", 500, 500, layout={"position": "absolute"})
+        pinned["transform"].update(x=7, y=9)
+        t, _, _ = self._solve(_stack({"type": "vstack"}, [_rect("a", 50, 20), pinned]))
+        self.assertEqual((t["box"]["width"], t["box"]["height"]), (50, 20))
+        self.assertEqual((t["p"]["x"], t["p"]["y"]), (7, 9))
+
+    def test_fixed_containers_smaller_than_their_content_are_reported(self):
+        _, stats, _ = self._solve(_stack({"type": "vstack"}, [_rect("a", 50, 40), _rect("b", 50, 40)], height=30))
+        self.assertEqual(stats["overflow"], [{"localId": "box", "axis": "height", "need": 80, "given": 30}])
+
+
+
+def _envelope(type_, payload):
+    return {
+        "schemaVersion": 1,
+        "type": type_,
+        "id": "e",
+        "createdAt": "2026-01-01T00:00:00Z",
+        "payload": payload,
+        "source": {"agentName": "deepseek", "model": "m"},
+    }
+
+
+def _without_ids(env):
+    return {k: v for k, v in env.items() if k not in ("id", "createdAt")}
+
+
+class CompactDialectTests(SimpleTestCase):
+    def test_round_trip(self):
+        rect_props = {"fillColor": "#1e1e1e", "fillOpacity": 1, "borderColor": "#9cdcfe", "borderOpacity": 1, "borderWidth": 2, "cornerRadius": 12}
+        text_props = {"textContent": "欢迎", "fontSize": 36, "fontColor": "#ffffff", "fontStyle": "normal", "textAlign": "left"}
+        envelopes = [
+            _envelope("agentToUi/chatMessage", {"content": "好的"}),
+            _envelope("agentToUi/taskStatus", {"message": "生成中", "phase": "writing"}),
+            _envelope(
+                "agentToUi/componentTemplate",
+                {
+                    "intent": "insert",
+                    "template": {
+                        "schemaVersion": 1,
+                        "templateId": "tmpl_title",
+                        "name": "标题卡片",
+                        "params": [],
+                        "nodes": [
+                            {"localId": "root", "type": "rect", "transform": {"x": 0, "y": 0, "width": 480, "height": 160}, "props": rect_props},
+                            {
+                                "localId": "title",
+                                "type": "text",
+                                "parentLocalId": "root",
+                                "name": "标题",
+                                "layout": {"position": "absolute"},
+                                "transform": {"x": 0, "y": -40},
+                                "props": text_props,
+                            },
+                        ],
+                        "rootLocalId": "root",
+                    },
+                    "parentId": "group1",
+                },
+            ),
+            _envelope(
+                "agentToUi/insertNode",
+                {
+                    "node": {
+                        "category": "user",
+                        "userType": "rect",
+                        "name": "卡片",
+                        "transform": {"x": 10, "y": 20, "width": 200, "height": 100, "rotation": 15, "opacity": 0.5},
+                        "props": dict(rect_props, fillColor="#ff0000"),
+                    },
+                    "layerId": "layer1",
+                },
+            ),
+            _envelope("agentToUi/patchNode", {"nodeId": "n1", "patch": {"name": "新名字", "transform": {"width": 320}, "props": {"fontSize": 18}}}),
+            _envelope("agentToUi/deleteNode", {"nodeIds": ["n1", "n2"]}),
+            _envelope("agentToUi/applyFilter", {"target": "nodeId", "nodeId": "n1", "mode": "replace", "filter": {"type": "glow"}}),
+        ]
+        for env in envelopes:
+            with self.subTest(type=env["type"]):
+                line = compact_dialect.compress(env)
+                self.assertTrue(compact_dialect.is_compact_line(line))
+                self.assertEqual(_without_ids(compact_dialect.expand(line, model="m")), _without_ids(env))
+
+    def test_expand_fills_default_props(self):
+        env = compact_dialect.expand({"t": "n", "nd": {"k": "l", "x": [10, 20, 200, 40]}, "p": "parent1"})
+        self.assertEqual(env["source"], {"agentName": "deepseek"})
+        node = env["payload"]["node"]
+        self.assertEqual(node["transform"], {"x": 10, "y": 20, "width": 200, "height": 40, "rotation": 0, "opacity": 1})
+        self.assertEqual(
+            node["props"],
+            {"startX": -88, "endX": 88, "startY": 0, "endY": 0, "anchorX": 0, "anchorY": 0, "lineColor": "#ffffff", "lineWidth": 4, "lineStyle": "solid"},
+        )
+        template = compact_dialect.expand({"t": "c", "ns": [{"i": "t", "k": "t", "x": [0, -40], "p": {"tx": "欢迎"}}]})["payload"]["template"]
+        self.assertEqual(template["rootLocalId"], "t")
+        self.assertEqual(template["nodes"][0]["transform"], {"x": 0, "y": -40})  # template transforms are not filled
+        self.assertEqual(
+            template["nodes"][0]["props"],
+            {"textContent": "欢迎", "fontSize": 24, "fontColor": "#ffffff", "fontStyle": "normal", "textAlign": "center"},
+        )
+        self.assertIsNone(compact_dialect.expand({"t": "c", "ns": []}))
+
+    def test_envelopes_are_not_compact_lines(self):
+        env = _envelope("agentToUi/deleteNode", {"nodeId": "n1"})
+        self.assertFalse(compact_dialect.is_compact_line(env))
+        self.assertFalse(compact_dialect.is_compact_line({"t": "x"}))
+        self.assertIsNone(compact_dialect.compress(_envelope("agentToUi/error", {"code": "x"})))
+
+    def test_stream_expands_compact_lines(self):
+        from .ai_chat_api import _iter_stream_events
+        from .mock_upstream import MockUpstream
+
+        passthrough = _envelope("agentToUi/deleteNode", {"nodeId": "c"})
+        lines = [{"t": "m", "c": "好的"}, {"t": "d", "ids": ["a", "b"]}, passthrough, {"t": "n"}]
+        reply = "\n".join(json.dumps(line, ensure_ascii=False) for line in lines) + "\n"
+        upstream = MockUpstream(reply=lambda _body: reply, base_ms=0, prefill_ms_per_1k=0, chunk_chars=7).start()
+        self.addCleanup(upstream.stop)
+        out = [
+            data
+            for event, data in _iter_stream_events(
+                cfg={"base_url": upstream.base_url, "api_key": "k", "model": "m"},
+                provider="deepseek",
+                model="m",
+                response_mode="agentToUi-jsonl",
+                msgs=[{"role": "user", "content": "删除"}],
+                prompt_report={},
+                started_at=time.monotonic(),
+                output_dialect="compact",
+            )
+            if event == "msg" and data.get("type") != "agentToUi/taskStatus"
+        ]
+        self.assertEqual(
+            [(e["type"], e["payload"]) for e in out],
+            [
+                ("agentToUi/chatMessage", {"content": "好的"}),
+                ("agentToUi/deleteNode", {"nodeIds": ["a", "b"]}),
+                ("agentToUi/deleteNode", {"nodeId": "c"}),
+                ("agentToUi/error", out[3]["payload"]),
+            ],
+        )
+        self.assertEqual(out[0]["source"], {"agentName": "deepseek", "model": "m"})
+        self.assertEqual(out[2], passthrough)  # full envelopes pass through untouched
+        self.assertEqual(out[3]["payload"]["code"], "compact_expand_error")
+
+
+class _SharedStateContract:
+    """Backend behaviour every SharedState has to provide; subclasses set self.state in setUp."""
+
+    def test_get_set_delete_and_ttl_expiry(self):
+        self.state.set("k", "v")
+        self.state.set("short", b"x", ttl=0.2)
+        self.assertEqual((self.state.get("k"), self.state.get("short")), (b"v", b"x"))
+        time.sleep(0.3)
+        self.assertIsNone(self.state.get("short"))
+        self.assertFalse(self.state.delete("short"))
+        self.assertTrue(self.state.delete("k"))
+        self.assertIsNone(self.state.get("k"))
+
+    def test_incr_is_atomic_across_threads(self):
+        def work():
+            for _ in range(50):
+                self.state.incr("counter")
+            self.state.close()  # per-thread connection
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.state.incr("counter", 0), 400)
+
+    def test_incr_window_expires(self):
+        self.assertEqual(self.state.incr("window", ttl=0.2), 1)
+        self.assertEqual(self.state.incr("window", 2, ttl=0.2), 3)  # the ttl is only set on creation
+        time.sleep(0.3)
+        self.assertEqual(self.state.incr("window", ttl=0.2), 1)
+
+    def test_pubsub_delivers_in_order(self):
+        self.state.publish("ch", "before")  # nobody listens yet: dropped
+        subs = [self.state.subscribe("ch"), self.state.subscribe("ch")]
+        for sub in subs:
+            self.addCleanup(sub.close)
+        for i in range(20):
+            self.state.publish("ch", str(i))
+        self.state.publish("other", "x")
+        for sub in subs:
+            self.assertEqual([sub.get(timeout=2) for _ in range(20)], [str(i).encode() for i in range(20)])
+            self.assertIsNone(sub.get(timeout=0.1))
+
+
+class MemoryStateTests(_SharedStateContract, SimpleTestCase):
+    def setUp(self):
+        self.state = shared_state.from_url("memory://")
+
+
+class SqliteStateTests(_SharedStateContract, SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.state = shared_state.from_url(f"sqlite:///{tmp.name}/shared.sqlite3")
+        self.addCleanup(self.state.close)
+
+
+class RespStateTests(_SharedStateContract, SimpleTestCase):
+    def setUp(self):
+        server = RespServer(port=0).start()
+        self.addCleanup(server.stop)
+        self.state = shared_state.from_url(server.url)
+        self.addCleanup(self.state.close)
+
+
+class SharedWindowLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.state = MemoryState()
+        self.enterContext(unittest.mock.patch.object(shared_state, "_STATE", self.state))
+
+    def test_limit_per_window(self):
+        limiter = ratelimit.SharedWindowLimiter("test:limit", 3, window=60)
+        other = ratelimit.SharedWindowLimiter("test:limit", 3, window=60)  # another worker, same key
+        self.assertEqual([limiter.acquire(timeout=0), other.acquire(timeout=0), limiter.acquire(timeout=0)], [True] * 3)
+        self.assertFalse(other.acquire(timeout=0))
+        self.assertTrue(ratelimit.SharedWindowLimiter("test:other", 3, window=60).acquire(timeout=0))
+
+    def test_waits_for_the_next_window(self):
+        limiter = ratelimit.SharedWindowLimiter("test:wait", 1, window=0.2)
+        self.assertTrue(limiter.acquire())
+        t0 = time.monotonic()
+        self.assertTrue(limiter.acquire(timeout=1))
+        self.assertLess(time.monotonic() - t0, 0.5)
+
+    def test_falls_back_to_the_local_bucket(self):
+        fallback = ratelimit.TokenBucket(1 / 60, burst=1)
+        limiter = ratelimit.SharedWindowLimiter("test:down", 100, window=60, fallback=fallback)
+        with unittest.mock.patch.object(self.state, "incr", side_effect=shared_state.SharedStateError("down")):
+            self.assertTrue(limiter.acquire(timeout=0))
+            self.assertFalse(limiter.acquire(timeout=0))
+
+
+class ChatJobQueueTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.enterContext(override_settings(DWEB_DATA_DIR=tmp.name))
+        self.enterContext(unittest.mock.patch.object(chat_jobs, "ensure_dispatcher"))
+        self.addCleanup(lambda: chat_jobs._conn().close())
+
+    def _enqueue(self):
+        return chat_jobs.enqueue_job("conv1", {"model": "m", "responseMode": "agentToUi-jsonl", "body": {"content": "hi"}})["jobId"]
+
+    def _set(self, job_id, **columns):
+        assignments = ", ".join(f"{k} = ?" for k in columns)
+        chat_jobs._conn().execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*columns.values(), job_id))
+
+    def test_follow_events_replays_from_an_offset_and_tails(self):
+        job_id = self._enqueue()
+        chat_jobs._append_events(job_id, [("msg", {"n": 1}), ("msg", {"n": 2}), ("msg", {"n": 3})])
+        with open(chat_jobs.log_path(job_id), "a", encoding="utf-8") as fp:
+            fp.write('{"event": "msg", "data": {"n": 4}')  # still being written
+
+        def finish():
+            time.sleep(0.2)
+            with open(chat_jobs.log_path(job_id), "a", encoding="utf-8") as fp:
+                fp.write("}\n")
+            chat_jobs._append_events(job_id, [("done", "{}")])
+            self._set(job_id, status="done", finished_at=time.time())
+
+        writer = threading.Thread(target=finish)
+        writer.start()
+        items = list(chat_jobs.follow_events(job_id, offset=1))
+        writer.join()
+        self.assertIn(None, items)  # idle polls while the job runs
+        self.assertEqual(
+            [i for i in items if i is not None],
+            [(2, "msg", {"n": 2}), (3, "msg", {"n": 3}), (4, "msg", {"n": 4}), (5, "done", "{}")],
+        )
+        # A finished job replays and returns without polling.
+        self.assertEqual(list(chat_jobs.follow_events(job_id, offset=4)), [(5, "done", "{}")])
+
+    def test_claim_takes_the_oldest_queued_job(self):
+        first, second = self._enqueue(), self._enqueue()
+        self._set(first, created_at=time.time() - 10)
+        self.assertEqual(chat_jobs._claim("w1"), first)
+        self.assertEqual(chat_jobs._claim("w2"), second)
+        self.assertIsNone(chat_jobs._claim("w3"))
+        row = chat_jobs._conn().execute("SELECT status, worker, started_at FROM jobs WHERE id = ?", (second,)).fetchone()
+        self.assertEqual((row["status"], row["worker"]), ("running", "w2"))
+        self.assertIsNotNone(row["started_at"])
+
+    def test_sweep_closes_lost_workers_and_purges_expired_jobs(self):
+        lost, alive, expired, recent = (self._enqueue() for _ in range(4))
+        now = time.time()
+        self._set(lost, status="running", heartbeat_at=now - chat_jobs._STALE_S - 5)
+        self._set(alive, status="running", heartbeat_at=now)
+        self._set(expired, status="done", finished_at=now - chat_jobs._RETENTION_S - 5)
+        self._set(recent, status="done", finished_at=now)
+
+        self.assertEqual(chat_jobs.sweep(), {"lost": 1, "purged": 1})
+        self.assertEqual(chat_jobs.get_job(lost)["status"], "error")
+        events = list(chat_jobs.follow_events(lost))
+        self.assertEqual(events[0][2]["payload"]["code"], "worker_lost")
+        self.assertEqual(events[-1][1], "done")
+        self.assertEqual(chat_jobs.get_job(alive)["status"], "running")
+        self.assertIsNone(chat_jobs.get_job(expired))
+        self.assertFalse(chat_jobs.log_path(expired).exists())
+        self.assertEqual(chat_jobs.get_job(recent)["status"], "done")
+
+
+def _sse_lines(*deltas):
+    lines = []
+    for d in deltas:
+        lines += [f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'content': d}}]}, ensure_ascii=False)}\n".encode(), b"\n"]
+    return lines + [b"data: [DONE]\n", b"\n"]
+
+
+class CaptureTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = Path(tmp.name)
+
+    def _writer(self, **kwargs):
+        writer = capture.CaptureWriter(self.directory, **kwargs)
+        self.addCleanup(writer.close)
+        return writer
+
+    def _record(self, lines, outcome="done"):
+        rec = capture.Recording(conversation_id="conv1", response_mode="agentToUi-jsonl", output_dialect="verbose", intent="create")
+        call = rec.begin_call(model="m", messages=[{"role": "user", "content": "hi"}])
+        self.assertEqual(list(rec.tap(call, lines)), lines)  # passed through unchanged
+        rec.note_envelope({"id": "env1"})
+        rec.outcome = outcome
+        return rec
+
+    def test_rotation_and_pruning(self):
+        writer = self._writer(max_file_bytes=1024, max_files=2)
+        recs = [self._record(_sse_lines(os.urandom(1500).hex())) for _ in range(5)]
+        for rec in recs:
+            writer.submit(rec)
+            writer.flush()  # one file per record: each is past max_file_bytes compressed
+        self.assertEqual(writer.written, 5)
+        self.assertEqual(len(capture.list_files(self.directory)), 2)
+        self.assertEqual([r["id"] for r in capture.iter_records(capture.list_files(self.directory))], [r.id for r in recs[3:]])
+
+    def test_records_share_a_file_below_the_size_cap(self):
+        writer = self._writer()
+        recs = [self._record(_sse_lines("a")) for _ in range(3)]
+        for rec in recs:
+            writer.submit(rec)
+        writer.flush()
+        self.assertEqual(len(capture.list_files(self.directory)), 1)
+        self.assertEqual(capture.find_record(recs[1].id, self.directory)["envelopeIds"], ["env1"])
+        self.assertIsNone(capture.find_record("cap_missing", self.directory))
+
+    def test_replay_lines_reproduce_the_stream(self):
+        from .ai_chat_api import _iter_sse_deltas
+
+        lines = _sse_lines('{"type":', '"agentToUi/chatMessage"}', "中文\n换行")
+        writer = self._writer()
+        rec = self._record(lines)
+        writer.submit(rec)
+        writer.flush()
+        stored = capture.find_record(rec.id, self.directory)
+        self.assertEqual(stored["calls"][0]["messagesHash"], capture.messages_hash([{"role": "user", "content": "hi"}]))
+        self.assertEqual(len(stored["calls"][0]["lines"]), 4)  # blank lines are not recorded
+        replayed = capture.replay_lines(stored)
+        self.assertEqual(list(_iter_sse_deltas(replayed)), list(_iter_sse_deltas(lines)))
+        self.assertEqual(replayed, [line for line in lines if line.strip()])
+
+
+def _status(phase, message=""):
+    return {"type": "agentToUi/taskStatus", "payload": {"phase": phase, "message": message}}
+
+
+def _msg(type_, **payload):
+    return ("msg", {"type": type_, "payload": payload})
+
+
+_ROUTES = {"light": {"model": "small", "maxTokens": 1024}, "heavy": {"model": "big"}}
+
+
+class ModelRoutingTests(SimpleTestCase):
+    def test_off_when_unset(self):
+        with unittest.mock.patch.dict(os.environ, {"DWEB_MODEL_ROUTES": ""}):
+            self.assertFalse(routing.enabled())
+        for raw in ("not json", "[1]", '{"tiny": {"model": "x"}}'):
+            with self.subTest(raw=raw), unittest.mock.patch.dict(os.environ, {"DWEB_MODEL_ROUTES": raw}):
+                self.assertFalse(routing.enabled())
+        with unittest.mock.patch.dict(os.environ, {"DWEB_MODEL_ROUTES": json.dumps(_ROUTES)}):
+            self.assertTrue(routing.enabled())
+
+    def test_classify_tier(self):
+        cases = [
+            ("删除它", "delete", 1, (), "light"),
+            ("加个模糊", "filter", 8, (), "light"),
+            ("改成红色", "modify", 2, (), "light"),
+            ("改成红色", "modify", 5, (), "standard"),
+            ("左右排开", "modify", 2, ("layout",), "standard"),
+            ("插入一个按钮", "insert", 0, (), "standard"),
+            ("做一个登录页面", "insert", 0, (), "heavy"),
+            ("红色方块、蓝色圆角、绿色标签", "insert", 0, (), "heavy"),
+            ("插入" + "很" * 80 + "大的按钮", "insert", 0, (), "heavy"),
+        ]
+        for content, intent, selected, tags, tier in cases:
+            with self.subTest(content=content[:12], intent=intent):
+                scope = RequestScope(intent=intent, tags=frozenset(tags), signals={"selected": selected})
+                self.assertEqual(routing.classify_tier(content, scope)[0], tier)
+
+    def test_routes_and_escalation_chain(self):
+        light, standard = routing.escalation_chain("light", default_model="default", routes=_ROUTES)
+        self.assertEqual((light.model, light.max_tokens), ("small", 1024))
+        self.assertEqual((standard.tier, standard.model, standard.max_tokens), ("standard", "default", None))
+        self.assertEqual([r.model for r in routing.escalation_chain("heavy", default_model="default", routes=_ROUTES)], ["big"])
+
+    def test_validation(self):
+        template = {"rootLocalId": "root", "nodes": [{"localId": "root", "type": "rect", "props": {}}]}
+        self.assertEqual(routing.envelope_problems(_msg("agentToUi/componentTemplate", template=template)[1]), [])
+        bad = dict(template, rootLocalId="x", nodes=template["nodes"] + [{"localId": "a", "type": "circle", "props": {}}])
+        self.assertEqual(routing.envelope_problems(_msg("agentToUi/componentTemplate", template=bad)[1]), ["node_type", "root_not_found"])
+        self.assertEqual(routing.envelope_problems(_msg("agentToUi/patchNode", nodeId="n1")[1]), ["patch_shape"])
+        self.assertEqual(routing.envelope_problems(_msg("agentToUi/error", code="jsonl_parse_error")[1]), ["error:jsonl_parse_error"])
+        self.assertEqual(routing.envelope_problems(_msg("agentToUi/error", code="upstream_http_error")[1]), [])
+        chat = _msg("agentToUi/chatMessage", content="好的")[1]
+        self.assertEqual(routing.validate_output([chat], intent="insert"), ["no_template"])
+        self.assertEqual(routing.validate_output([chat], intent="delete"), ["no_action"])
+        self.assertEqual(routing.validate_output([chat, _msg("agentToUi/deleteNode", nodeIds=["n1"])[1]], intent="delete"), [])
+
+    def _run_chain(self, outputs):
+        chain = routing.escalation_chain("light", default_model="default", routes=_ROUTES)
+        closed = []
+
+        def run(route):
+            try:
+                yield from outputs[route.tier]
+            finally:
+                closed.append(route.tier)
+
+        events = list(routing.iter_routed_events(chain, run, intent="delete", status=_status))
+        return [data for _, data in events], closed
+
+    def test_accepted_light_attempt_streams_without_retry(self):
+        out, closed = self._run_chain(
+            {"light": [_msg("agentToUi/chatMessage", content="好的"), _msg("agentToUi/deleteNode", nodeIds=["n1"]), ("msg", _status("done"))]}
+        )
+        self.assertTrue(routing.is_provisional(out[0]))
+        self.assertEqual([d["type"] for d in out[1:3]], ["agentToUi/chatMessage", "agentToUi/deleteNode"])
+        self.assertFalse(any(routing.is_retry(d) for d in out))
+        self.assertEqual((out[-1]["meta"]["route"]["tier"], out[-1]["meta"]["route"]["attempt"]), ("light", 1))
+        self.assertEqual(closed, ["light"])
+
+    def test_bad_envelope_escalates_and_asks_for_a_rollback(self):
+        out, closed = self._run_chain(
+            {
+                "light": [
+                    _msg("agentToUi/chatMessage", content="好的"),
+                    _msg("agentToUi/patchNode", nodeId="n1"),
+                    _msg("agentToUi/deleteNode", nodeIds=["never sent"]),
+                ],
+                "standard": [_msg("agentToUi/deleteNode", nodeIds=["n1"]), ("msg", _status("done"))],
+            }
+        )
+        phases = [d["payload"].get("phase") if d["type"] == "agentToUi/taskStatus" else d["type"] for d in out]
+        self.assertEqual(phases, ["streaming", "agentToUi/chatMessage", "retry", "agentToUi/deleteNode", "done"])
+        self.assertEqual(out[3]["payload"], {"nodeIds": ["n1"]})
+        route = out[-1]["meta"]["route"]
+        self.assertEqual((route["tier"], route["attempt"]), ("standard", 2))
+        self.assertEqual([(e["tier"], e["problems"]) for e in route["escalatedFrom"]], [("light", ["patch_shape"])])
+        self.assertEqual(closed, ["light", "standard"])
+
+    def test_turn_without_an_action_escalates(self):
+        out, _ = self._run_chain(
+            {
+                "light": [_msg("agentToUi/chatMessage", content="好的"), ("msg", _status("done"))],
+                "standard": [_msg("agentToUi/deleteNode", nodeIds=["n1"]), ("msg", _status("done"))],
+            }
+        )
+        self.assertTrue(routing.is_retry(out[2]))
+        self.assertEqual(out[-1]["meta"]["route"]["escalatedFrom"][0]["problems"], ["no_action"])
+
+
+def _editor_auto_size(text, font_size, font_style="normal"):
+    """computeTextAutoSize (src/core/scene/commands/nodes/textAutoSize.ts), with measureText = line_width."""
+
+    js_round = lambda v: math.floor(v + 0.5)  # noqa: E731 - Math.round
+    pad_x = max(2, js_round(font_size * 0.6))
+    pad_y = max(2, js_round(font_size * 0.4))
+    lines = re.split(r"\r?\n", text)
+    max_w = max(text_metrics.line_width(line, font_size=font_size, font_style=font_style) for line in lines)
+    return max(1, math.ceil(max_w + pad_x * 2)), max(1, math.ceil(len(lines) * font_size * 1.4 + pad_y * 2))
+
+
+class TextMetricsTests(SimpleTestCase):
+    def test_measure_matches_the_editor_formula(self):
+        cases = [
+            ("Hi", 24, "normal"),
+            ("Hi\r\n中文字", 24, "normal"),
+            ("a\n\nlonger line", 15, "bold"),
+            ("x", 7.5, "italic"),  # padX 4.5 rounds half up as in JS
+            ("", 2, "normal"),  # minimum padding
+        ]
+        for text, size, style in cases:
+            with self.subTest(text=text, size=size):
+                box = text_metrics.measure(text, font_size=size, font_style=style)
+                self.assertEqual((box.width, box.height), _editor_auto_size(text, size, style))
+                self.assertEqual(box.lines, len(re.split(r"\r?\n", text)))
+
+    def test_known_sizes(self):
+        box = text_metrics.measure("Hi")  # (722 + 222) / 1000 em * 24 + 2 * 14 padding
+        self.assertEqual((box.width, box.height, box.line_height), (51, 54, 24 * 1.4))
+        box = text_metrics.measure("Hi\n中文字")  # CJK glyphs are one em wide; two 33.6px lines + 2 * 10
+        self.assertEqual((box.width, box.height), (100, 88))
+        self.assertEqual(text_metrics.measure("x", font_size=7.5).width, 14)  # ceil(3.75 + 2 * 5)
+        self.assertEqual(text_metrics.measure("Hi", font_style="600").content_width, (722 + 278) / 1000 * 24)
+
+    def test_measure_props_uses_editor_defaults(self):
+        self.assertEqual(text_metrics.measure_props({}), text_metrics.measure("", font_size=24))
+        self.assertEqual(text_metrics.measure_props({"textContent": 42, "fontSize": 0}), text_metrics.measure("42", font_size=1))
+        boxes = text_metrics.measure_many([{"textContent": "a"}, None, {"textContent": "a"}])
+        self.assertEqual(boxes[0], boxes[2])
+
+
+def _user_rect(node_id, x, y, size=40, **extra):
+    return dict(id=node_id, category="user", userType="rect", transform={"x": x, "y": y, "width": size, "height": size}, props={}, **extra)
+
+
+def _canvas():
+    # A project group (no transform) holding a frame far from the viewport with the selected node inside.
+    frame = _user_rect("frame", 2000, 2000, 200, children=[_user_rect("sel", 50, 50), _user_rect("sib", -50, -50)])
+    return [{"id": "g", "category": "project", "children": [frame]}] + [_user_rect(f"v{i}", i * 60, 0) for i in range(6)] + [
+        _user_rect("far", -3000, 0)
+    ]
+
+
+class ContextSelectionTests(SimpleTestCase):
+    _VIEW = (-100.0, -100.0, 400.0, 100.0)
+
+    def _select(self, tree, budget, selected=("sel",)):
+        index, _ = spatial.get_spatial_index(tree)
+        picked = spatial.select_context(index, view=self._VIEW, selected_ids=list(selected), budget=budget)
+        return index, picked, {index.nodes[i]["id"] for i in picked.keep}
+
+    def test_selected_nodes_keep_their_ancestors_within_the_budget(self):
+        tree = _canvas()
+        for budget in range(3, 11):
+            with self.subTest(budget=budget):
+                index, picked, ids = self._select(tree, budget)
+                self.assertLessEqual(len(picked.keep), budget)
+                self.assertLessEqual({"g", "frame", "sel"}, ids)
+                for i in picked.keep:
+                    self.assertLessEqual(set(index.ancestors(i)), picked.keep)
+                omitted = sum(r["count"] for r in picked.regions)
+                self.assertEqual(omitted, sum(1 for i, b in enumerate(index.boxes) if b is not None and i not in picked.keep))
+
+        _, picked, ids = self._select(tree, 3)
+        self.assertEqual(ids, {"g", "frame", "sel"})
+        self.assertEqual({r["region"]: r["count"] for r in picked.regions}, {"view": 6, "west": 1, "southeast": 1})
+
+    def test_a_selection_deeper_than_the_budget_is_skipped(self):
+        _, picked, ids = self._select(_canvas(), 2)
+        self.assertEqual(len(ids), 2)
+        self.assertNotIn("sel", ids)
+        self.assertFalse(ids & {"g", "frame"})  # no dangling ancestors either
+
+    def test_prune_node_tree_keeps_the_kept_subtree(self):
+        tree = _canvas()
+        index, picked, _ = self._select(tree, 3)
+        pruned = spatial.prune_node_tree(tree, index, picked.keep)
+        self.assertEqual([n["id"] for n in pruned], ["g"])
+        frame = pruned[0]["children"][0]
+        self.assertEqual([c["id"] for c in frame["children"]], ["sel"])
+        self.assertEqual(frame["omittedChildren"], 1)
+        self.assertEqual(frame["transform"], tree[0]["children"][0]["transform"])
+        self.assertIn("children", tree[0]["children"][0])  # the input is left alone
+        self.assertEqual(len(tree[0]["children"][0]["children"]), 2)
+
+
+class StageToolsTests(SimpleTestCase):
+    def setUp(self):
+        self.tools = StageTools(_canvas())
+
+    def test_dispatch(self):
+        node = self.tools.call("get_node", '{"id": "sel"}')
+        self.assertEqual((node["id"], node["type"], node["parentId"]), ("sel", "rect", "frame"))
+        self.assertEqual(node["worldBox"], [2030, 2030, 2070, 2070])  # parent-center coordinates resolved
+
+        top = self.tools.call("list_children", "")
+        self.assertEqual((top["parentId"], top["total"]), (None, 8))
+        self.assertEqual(top["children"][0], {"id": "g", "name": None, "type": "base", "childCount": 1})
+        page = self.tools.call("list_children", '{"id": "frame", "offset": 1}')
+        self.assertEqual((page["total"], [c["id"] for c in page["children"]]), (2, ["sib"]))
+
+        found = self.tools.call("find_nodes", '{"type": "rect", "limit": 3}')
+        self.assertEqual((found["total"], [n["id"] for n in found["nodes"]]), (10, ["frame", "sel", "sib"]))
+
+        bbox = self.tools.call("subtree_bbox", '{"id": "g"}')
+        self.assertEqual((bbox["nodes"], bbox["bbox"], bbox["center"]), (4, [1900, 1900, 2100, 2100], [2000, 2000]))
+        self.assertEqual([c["tool"] for c in self.tools.calls], ["get_node", "list_children", "list_children", "find_nodes", "subtree_bbox"])
+        self.assertTrue(all(c["ok"] for c in self.tools.calls))
+
+    def test_errors(self):
+        cases = [
+            ("get_node", '{"id": "missing"}', "node not found: missing"),
+            ("list_children", '{"id": "missing"}', "node not found: missing"),
+            ("subtree_bbox", '{"id": "missing"}', "node not found: missing"),
+            ("find_nodes", "{}", "give at least one of name / type / text"),
+            ("get_node", "{not json", "arguments must be a JSON object"),
+            ("get_node", '["sel"]', "unknown tool or bad arguments: get_node"),
+            ("move_node", '{"id": "sel"}', "unknown tool or bad arguments: move_node"),
+            ("get_node", "{}", "bad arguments for get_node: "),
+            ("get_node", '{"id": "sel", "depth": 2}', "bad arguments for get_node: "),
+            ("list_children", '{"offset": "x"}', "bad arguments for list_children: "),
+        ]
+        for name, arguments, error in cases:
+            with self.subTest(name=name, arguments=arguments):
+                result = self.tools.call(name, arguments)
+                self.assertEqual(list(result), ["error"])
+                self.assertTrue(result["error"].startswith(error), result["error"])
+        self.assertEqual([c["ok"] for c in self.tools.calls], [False] * len(cases))
+
+
+class RasterImageTests(SimpleTestCase):
+    def _render(self, image_path):
+        node = {
+            "id": "img",
+            "category": "user",
+            "userType": "image",
+            "transform": {"x": 0, "y": 0, "width": 60, "height": 60},
+            "props": {"imagePath": image_path, "imageFit": "fill"},
+        }
+        snapshot = {
+            "videoStudio": {"stage": {"width": 100, "height": 100, "background": {"color": "#000000"}}},
+            "layers": [{"id": "L1", "nodeTree": [node]}],
+        }
+        return raster.render_snapshot(snapshot, width=100, height=100)
+
+    def test_data_url_images_are_decoded(self):
+        red = np.zeros((8, 8, 4), dtype=np.uint8)
+        red[...] = (255, 0, 0, 255)
+        out = self._render("data:image/png;base64," + base64.b64encode(raster.encode_png(red)).decode("ascii"))
+        self.assertEqual(out[50, 50].tolist(), [255, 0, 0, 255])
+        self.assertEqual(out[5, 5].tolist(), [0, 0, 0, 255])  # stage background outside the image
+
+    def test_undecodable_images_draw_a_placeholder(self):
+        remote = self._render("https://example.com/a.png")  # never fetched
+        broken = self._render("data:image/png;base64,bm90IGEgcG5n")
+        self.assertTrue(np.array_equal(remote, broken))
+        self.assertNotIn(remote[50, 50].tolist(), ([255, 0, 0, 255], [0, 0, 0, 255]))
+
+
+class ChatBatchTests(SimpleTestCase):
+    def setUp(self):
+        tmp = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(DWEB_DATA_DIR=tmp))
+
+    def test_duplicate_item_ids_are_rejected(self):
+        items = [{"id": "a", "content": "one"}, {"id": "a", "content": "two"}, "three", {"id": "2", "content": "four"}]
+        resp = self.client.post("/api/chat/batches", data=json.dumps({"items": items}), content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json()["payload"]["details"], {"duplicateIds": ["2", "a"]})
+
+    def test_running_items_are_registered_and_cancelable(self):
+        from .mock_upstream import MockUpstream
+
+        upstream = MockUpstream(reply=lambda _body: "x" * 400, base_ms=0, prefill_ms_per_1k=0, chunk_chars=4, chunk_delay_ms=50).start()
+        self.addCleanup(upstream.stop)
+        cfg = {"base_url": upstream.base_url, "api_key": "k", "model": "m"}
+        self.enterContext(unittest.mock.patch.object(ai_chat_api, "_deepseek_cfg", return_value=cfg))
+        batch = chat_batch.create_batch(
+            items=[{"id": "only", "content": "hi"}],
+            system_prompt="sys",
+            prompt_report={},
+            model="m",
+            response_mode="agentToUi-jsonl",
+            concurrency=1,
+        )
+
+        deadline = time.monotonic() + 5
+        stream_id = None
+        while stream_id is None and time.monotonic() < deadline:
+            stream_id = batch.to_dict()["items"][0].get("streamId")
+            time.sleep(0.01)
+        self.assertIsNotNone(stream_id)
+        listed = {s["id"]: s for s in streams.list_streams()}
+        self.assertEqual(listed[stream_id]["conversationId"], f"batch:{batch.id}:only")
+
+        streams.cancel_stream(stream_id, "test")
+        while batch.status() == "running" and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(batch.counts()["canceled"], 1)
+        self.assertIsNone(streams.get_stream(stream_id))
+        row = json.loads(batch.results_path.read_text(encoding="utf-8"))
+        self.assertEqual((row["itemId"], row["status"], row["attempts"]), ("only", "canceled", 1))
+        self.assertEqual(row["errors"][-1]["details"], {"reason": "test"})
+        summary = batch.to_dict(with_items=False)
+        self.assertEqual((summary["status"], summary["done"], summary["canceled"]), ("done", 1, 1))
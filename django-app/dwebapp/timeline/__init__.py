@@ -0,0 +1 @@
+"""Server-side timeline evaluation (mirrors src/ui/VideoScene/anim/timelineAnimation.ts)."""
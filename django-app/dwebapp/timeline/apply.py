@@ -0,0 +1,90 @@
+"""Write baked frame values back into layer node trees (for per-frame renders)."""
+
+from __future__ import annotations
+
+import copy
+import math
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from ..stage.snapshot import iter_world_nodes
+from .bake import COLOR_PROPS, NUMERIC_PROPS, TRANSFORM_KEYS, BakedTimeline, _COLOR_COL, _NUMERIC_COL, _TRANSFORM_COL
+
+
+def _color_str(rgba: np.ndarray) -> str:
+    r, g, b = (int(round(float(v))) for v in rgba[:3])
+    return f"rgba({r}, {g}, {b}, {round(float(rgba[3]), 4)})"
+
+
+_MISSING = object()
+
+
+class FrameApplier:
+    """Applies animated tracks of a BakedTimeline onto a private copy of the layers.
+
+    Only channels that own a track are touched; everything else (text, image
+    src, structure) stays as in the base nodeTree. Where a track is unset
+    (NaN) the node's original value is restored, so frames may be applied in
+    any order.
+    """
+
+    def __init__(self, layers: Sequence[Dict[str, Any]], baked: BakedTimeline) -> None:
+        self.baked = baked
+        self.layers: List[Dict[str, Any]] = copy.deepcopy(list(layers))
+        by_id: Dict[str, Dict[str, Any]] = {}
+        for layer in self.layers:
+            for wn in iter_world_nodes(layer.get("nodeTree")):
+                if wn.node.get("category") == "user":
+                    by_id[str(wn.node.get("id"))] = wn.node
+        rows = np.unique(baked.track_index[:, 0]) if baked.track_index.size else np.zeros(0, dtype=np.int32)
+        # Position of each track within `rows`, so a frame update is one fancy-index.
+        self._track_row = np.searchsorted(rows, baked.track_index[:, 0]) if rows.size else rows
+        self._values = np.array(baked.static[rows], dtype=np.float32, copy=True)
+
+        cols_by_row: Dict[int, set] = {}
+        for pos, ch in zip(self._track_row.tolist(), baked.track_index[:, 1].tolist() if rows.size else []):
+            cols_by_row.setdefault(pos, set()).add(ch)
+        # (row position, target dict, key, kind, column, original value)
+        self._writes: List[Tuple[int, Dict[str, Any], str, str, int, Any]] = []
+        for pos, r in enumerate(rows.tolist()):
+            node = by_id.get(baked.node_ids[r])
+            if node is None:
+                continue
+            cols = cols_by_row.get(pos, set())
+            t = node.get("transform")
+            if isinstance(t, dict):
+                for k in TRANSFORM_KEYS:
+                    if _TRANSFORM_COL[k] in cols:
+                        self._writes.append((pos, t, k, "num", _TRANSFORM_COL[k], t.get(k, _MISSING)))
+            props = node.get("props")
+            if isinstance(props, dict):
+                for p in COLOR_PROPS:
+                    c = _COLOR_COL[p]
+                    if cols.intersection(range(c, c + 4)):
+                        self._writes.append((pos, props, p, "color", c, props.get(p, _MISSING)))
+                for p in NUMERIC_PROPS:
+                    if _NUMERIC_COL[p] in cols:
+                        self._writes.append((pos, props, p, "num", _NUMERIC_COL[p], props.get(p, _MISSING)))
+
+    def apply(self, frame: int) -> List[Dict[str, Any]]:
+        """Update the private layers in place to `frame` and return them."""
+
+        if not self._writes:
+            return self.layers
+        baked = self.baked
+        f = min(max(0, int(frame)), baked.frame_count - 1)
+        self._values[self._track_row, baked.track_index[:, 1]] = baked.tracks[f]
+        values = self._values
+        for pos, target, key, kind, col, original in self._writes:
+            v = float(values[pos, col])
+            if math.isnan(v):
+                if original is _MISSING:
+                    target.pop(key, None)
+                else:
+                    target[key] = original
+            elif kind == "color":
+                target[key] = _color_str(values[pos, col : col + 4])
+            else:
+                target[key] = v
+        return self.layers
@@ -0,0 +1,559 @@
+"""Bake keyframed node tracks for every frame in one vectorized pass.
+
+Semantics follow applyTimelineAnimationAtFrame in the browser, evaluated as a
+sequential playback starting from the base nodeTree:
+- stage mode (stageKeyframesByFrame non-empty): keyframes hold whole layer
+  snapshots; between two keyframes a layer is eased only if its segment key
+  `${layerId}:${prev}:${next}` is in easingSegmentKeys, otherwise it holds prev.
+- legacy mode: per-layer nodeKeyframesByLayer snapshots located by
+  keyframeSpansByLayer, with the same easing rule.
+A value that no keyframe sets keeps its previous value ("hold").
+
+Channels are transform x/y/width/height/rotation/opacity, the RGBA of the
+color props and the numeric geometry/style props. Only tracks that actually
+change are stored per frame; everything else lives in a static table.
+
+Binary payload layout (little endian, all blocks 64-byte aligned so they can
+be viewed as typed arrays or np.memmap'ed in place):
+    b"DVSBAKE1" | u32 header_len | header JSON | static f32[N,C]
+    | trackIndex i32[T,2] (node, channel) | tracks f32[F,T] (frame-major)
+Offsets and shapes of the blocks are listed in header["arrays"].
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import struct
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from ..caching import LruCache
+from ..stage.color import parse_color
+from ..stage.snapshot import get_layers, iter_world_nodes, snapshot_hash, unwrap_snapshot
+from .easing import LINEAR_CURVE, cubic_bezier_y_for_x
+
+MAGIC = b"DVSBAKE1"
+PAYLOAD_VERSION = 1
+_ALIGN = 64
+
+TRANSFORM_KEYS: Tuple[str, ...] = ("x", "y", "width", "height", "rotation", "opacity")
+COLOR_PROPS: Tuple[str, ...] = ("fillColor", "borderColor", "fontColor", "lineColor")
+NUMERIC_PROPS: Tuple[str, ...] = (
+    "fillOpacity",
+    "borderOpacity",
+    "borderWidth",
+    "cornerRadius",
+    "fontSize",
+    "lineWidth",
+    "startX",
+    "startY",
+    "endX",
+    "endY",
+    "anchorX",
+    "anchorY",
+)
+CHANNELS: Tuple[str, ...] = (
+    *TRANSFORM_KEYS,
+    *(f"{p}.{ch}" for p in COLOR_PROPS for ch in "rgba"),
+    *(f"props.{p}" for p in NUMERIC_PROPS),
+)
+_TRANSFORM_COL = {k: i for i, k in enumerate(TRANSFORM_KEYS)}
+_COLOR_COL = {p: len(TRANSFORM_KEYS) + 4 * i for i, p in enumerate(COLOR_PROPS)}
+_NUMERIC_COL = {p: len(TRANSFORM_KEYS) + 4 * len(COLOR_PROPS) + i for i, p in enumerate(NUMERIC_PROPS)}
+
+_HOLD, _SET, _LERP = 0, 1, 2
+# Track columns computed per chunk; bounds the (frames x tracks) temporaries.
+_TRACK_CHUNK = 2048
+
+_BAKE_CACHE: LruCache["BakedTimeline"] = LruCache(maxsize=int(os.environ.get("DWEB_BAKE_CACHE_SIZE", "8")))
+
+
+@dataclass
+class BakedTimeline:
+    frame_count: int
+    mode: str
+    node_ids: List[str]
+    node_layers: List[str]
+    static: np.ndarray  # f32 [N, C]
+    track_index: np.ndarray  # i32 [T, 2]
+    tracks: np.ndarray  # f32 [F, T]
+    cache_key: str = ""
+    channels: Tuple[str, ...] = CHANNELS
+    _node_pos: Dict[str, int] = field(default_factory=dict, repr=False)
+
+    def node_index(self, node_id: str) -> Optional[int]:
+        if not self._node_pos:
+            self._node_pos = {nid: i for i, nid in enumerate(self.node_ids)}
+        return self._node_pos.get(node_id)
+
+    def frame_values(self, frame: int) -> np.ndarray:
+        """[N, C] values at a frame (NaN where a channel is unset)."""
+
+        out = np.array(self.static, dtype=np.float32, copy=True)
+        if self.track_index.size:
+            f = min(max(0, int(frame)), self.frame_count - 1)
+            out[self.track_index[:, 0], self.track_index[:, 1]] = self.tracks[f]
+        return out
+
+    def frame_digest(self, frame: int) -> str:
+        """Hash of the animated state at a frame (static part is covered by cache_key)."""
+
+        if not self.track_index.size:
+            return snapshot_hash([self.cache_key, "static"])
+        f = min(max(0, int(frame)), self.frame_count - 1)
+        return hashlib.sha256(np.ascontiguousarray(self.tracks[f]).tobytes()).hexdigest()
+
+
+def _num(v: Any) -> float:
+    if isinstance(v, bool) or not isinstance(v, (int, float)):
+        return np.nan
+    return float(v)
+
+
+def _fill_row(row: np.ndarray, transform: Any, props: Any) -> None:
+    if isinstance(transform, dict):
+        for k, col in _TRANSFORM_COL.items():
+            if k in transform:
+                row[col] = _num(transform[k])
+    if isinstance(props, dict):
+        for p, col in _COLOR_COL.items():
+            if p in props:
+                c = parse_color(props[p])
+                if c is not None:
+                    row[col : col + 4] = c
+        for p, col in _NUMERIC_COL.items():
+            if p in props:
+                row[col] = _num(props[p])
+
+
+def _user_nodes(node_tree: Any) -> List[Dict[str, Any]]:
+    return [wn.node for wn in iter_world_nodes(node_tree) if wn.node.get("category") == "user" and isinstance(wn.node.get("id"), str)]
+
+
+def _to_segments(spans: Any) -> Tuple[np.ndarray, np.ndarray]:
+    """normalizeSpans() as sorted, merged inclusive (start, end) arrays."""
+
+    segs: List[Tuple[int, int]] = []
+    for s in spans if isinstance(spans, list) else []:
+        if isinstance(s, (int, float)) and not isinstance(s, bool):
+            segs.append((int(s), int(s)))
+        elif isinstance(s, dict):
+            try:
+                a, b = int(np.floor(float(s.get("start")))), int(np.floor(float(s.get("end"))))
+            except (TypeError, ValueError):
+                continue
+            segs.append((min(a, b), max(a, b)))
+    segs.sort()
+    merged: List[List[int]] = []
+    for a, b in segs:
+        if merged and a <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], b)
+        else:
+            merged.append([a, b])
+    starts = np.array([m[0] for m in merged], dtype=np.int64)
+    ends = np.array([m[1] for m in merged], dtype=np.int64)
+    return starts, ends
+
+
+class _Plan:
+    """Per-frame evaluation plan for one layer."""
+
+    def __init__(self, frame_count: int) -> None:
+        self.kind = np.zeros(frame_count, dtype=np.int8)
+        self.k0 = np.zeros(frame_count, dtype=np.int64)
+        self.k1 = np.zeros(frame_count, dtype=np.int64)
+        self.t = np.zeros(frame_count, dtype=np.float32)
+
+
+def _plan_between(
+    plan: _Plan,
+    frames: np.ndarray,
+    prev: np.ndarray,
+    nxt: np.ndarray,
+    key_of: Dict[int, int],
+    layer_id: str,
+    easing_keys: set,
+    curves: Dict[str, Any],
+) -> None:
+    """Fill plan rows for frames between keyframes (prev < f < next; -1 = none)."""
+
+    for pf, nf in set(zip(prev[frames].tolist(), nxt[frames].tolist())):
+        rows = frames[(prev[frames] == pf) & (nxt[frames] == nf)]
+        k0 = key_of.get(pf, -1) if pf >= 0 else -1
+        if k0 < 0:
+            continue  # no previous snapshot: hold
+        plan.kind[rows] = _SET
+        plan.k0[rows] = k0
+        if nf < 0:
+            continue
+        seg_key = f"{layer_id}:{pf}:{nf}"
+        k1 = key_of.get(nf, -1)
+        if seg_key not in easing_keys or k1 < 0:
+            continue
+        raw_t = (rows - pf) / float(nf - pf)
+        plan.kind[rows] = _LERP
+        plan.k1[rows] = k1
+        plan.t[rows] = cubic_bezier_y_for_x(curves.get(seg_key) or LINEAR_CURVE, raw_t)
+
+
+def _evaluate_tracks(
+    plan: _Plan,
+    keyvals: np.ndarray,
+    base: np.ndarray,
+    cols: np.ndarray,
+    out: np.ndarray,
+    *,
+    lerp_missing_from_next: bool,
+) -> None:
+    """Evaluate flattened track columns `cols` of one layer into `out` [F, len(cols)]."""
+
+    frame_count = plan.kind.shape[0]
+    flat_keys = keyvals.reshape(keyvals.shape[0], -1)
+    flat_base = base.reshape(-1)
+    set_rows = plan.kind == _SET
+    lerp_rows = plan.kind == _LERP
+    t = plan.t[lerp_rows][:, None]
+    seq = np.arange(frame_count + 1)[:, None]
+    for i in range(0, cols.size, _TRACK_CHUNK):
+        c = cols[i : i + _TRACK_CHUNK]
+        kv = flat_keys[:, c]
+        v = np.full((frame_count + 1, c.size), np.nan, dtype=np.float32)
+        v[0] = flat_base[c]
+        body = v[1:]
+        if kv.shape[0]:
+            body[set_rows] = kv[plan.k0[set_rows]]
+            a = kv[plan.k0[lerp_rows]]
+            b = kv[plan.k1[lerp_rows]]
+            both = ~np.isnan(a) & ~np.isnan(b)
+            fallback = np.where(np.isnan(b), a, b) if lerp_missing_from_next else a
+            body[lerp_rows] = np.where(both, a + (b - a) * t, fallback)
+        # Forward-fill NaN ("hold"), seeded with the base row.
+        idx = np.where(~np.isnan(v), seq, 0)
+        np.maximum.accumulate(idx, axis=0, out=idx)
+        out[:, i : i + c.size] = np.take_along_axis(v, idx, axis=0)[1:]
+
+
+def _animated_columns(keyvals: np.ndarray, base: np.ndarray) -> np.ndarray:
+    if keyvals.shape[0] == 0:
+        return np.zeros(0, dtype=np.int64)
+    kv = keyvals.reshape(keyvals.shape[0], -1)
+    b = base.reshape(-1)
+    present = ~np.isnan(kv)
+    differs = present & ((kv != b[None, :]) | np.isnan(b)[None, :])
+    return np.flatnonzero(differs.any(axis=0))
+
+
+def _collect_layer(
+    layer_id: str,
+    base_tree: Any,
+    key_snapshots: Sequence[Dict[str, Tuple[Any, Any]]],
+) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """Node ids, base values [N, C] and keyframe values [K, N, C] of one layer."""
+
+    ids: List[str] = []
+    pos: Dict[str, int] = {}
+    base_nodes = _user_nodes(base_tree)
+    for n in base_nodes:
+        if n["id"] not in pos:
+            pos[n["id"]] = len(ids)
+            ids.append(n["id"])
+    for snap in key_snapshots:
+        for nid in snap:
+            if nid not in pos:
+                pos[nid] = len(ids)
+                ids.append(nid)
+
+    base = np.full((len(ids), len(CHANNELS)), np.nan, dtype=np.float32)
+    for n in base_nodes:
+        _fill_row(base[pos[n["id"]]], n.get("transform"), n.get("props"))
+    keyvals = np.full((len(key_snapshots), len(ids), len(CHANNELS)), np.nan, dtype=np.float32)
+    for k, snap in enumerate(key_snapshots):
+        for nid, (transform, props) in snap.items():
+            _fill_row(keyvals[k, pos[nid]], transform, props)
+    return ids, base, keyvals
+
+
+def _stage_snapshot_nodes(layers: Any, layer_id: str) -> Optional[Dict[str, Tuple[Any, Any]]]:
+    for layer in layers if isinstance(layers, list) else []:
+        if isinstance(layer, dict) and str(layer.get("id")) == layer_id:
+            return {n["id"]: (n.get("transform"), n.get("props")) for n in _user_nodes(layer.get("nodeTree"))}
+    return None
+
+
+def timeline_cache_key(snapshot: Any) -> str:
+    """Cache key: timeline versions + hash of everything the bake reads."""
+
+    snap = unwrap_snapshot(snapshot)
+    tl = snap.get("timeline") if isinstance(snap.get("timeline"), dict) else {}
+    versions = "-".join(str(tl.get(k, 0)) for k in ("keyframeVersion", "nodeKeyframeVersion", "stageKeyframeVersion"))
+    relevant = {
+        "layers": get_layers(snap),
+        "timeline": {
+            k: tl.get(k)
+            for k in (
+                "frameCount",
+                "layers",
+                "keyframeSpansByLayer",
+                "easingSegmentKeys",
+                "easingCurves",
+                "nodeKeyframesByLayer",
+                "stageKeyframesByFrame",
+            )
+        },
+    }
+    return f"v{versions}-{snapshot_hash(relevant)[:32]}"
+
+
+def timeline_frame_count(snapshot: Any) -> int:
+    snap = unwrap_snapshot(snapshot)
+    tl = snap.get("timeline") if isinstance(snap.get("timeline"), dict) else {}
+    try:
+        return max(1, int(tl.get("frameCount") or 120))
+    except (TypeError, ValueError):
+        return 120
+
+
+def bake_timeline(snapshot: Any, *, cache_key: Optional[str] = None) -> BakedTimeline:
+    snap = unwrap_snapshot(snapshot)
+    tl = snap.get("timeline") if isinstance(snap.get("timeline"), dict) else {}
+    frame_count = timeline_frame_count(snap)
+    base_layers = get_layers(snap)
+    easing_keys = set(k for k in tl.get("easingSegmentKeys") or [] if isinstance(k, str))
+    curves = tl.get("easingCurves") if isinstance(tl.get("easingCurves"), dict) else {}
+    frames = np.arange(frame_count, dtype=np.int64)
+
+    stage_map = tl.get("stageKeyframesByFrame") if isinstance(tl.get("stageKeyframesByFrame"), dict) else {}
+    stage_frames = sorted({int(k) for k in stage_map if str(k).lstrip("-").isdigit()})
+    mode = "stage" if stage_frames else "legacy"
+
+    layer_jobs: List[Tuple[str, Any, List[Dict[str, Tuple[Any, Any]]], _Plan]] = []
+    if mode == "stage":
+        sf = np.array(stage_frames, dtype=np.int64)
+        lo = np.searchsorted(sf, frames, side="left")
+        on_key = (lo < sf.size) & (sf[np.minimum(lo, sf.size - 1)] == frames)
+        prev = np.where(lo > 0, sf[np.maximum(lo - 1, 0)], -1)
+        hi = np.searchsorted(sf, frames, side="right")
+        nxt = np.where(hi < sf.size, sf[np.minimum(hi, sf.size - 1)], -1)
+        for layer in base_layers:
+            layer_id = str(layer.get("id"))
+            snaps: List[Dict[str, Tuple[Any, Any]]] = []
+            key_of: Dict[int, int] = {}
+            for f in stage_frames:
+                hit = stage_map.get(str(f))
+                nodes = _stage_snapshot_nodes(hit.get("layers") if isinstance(hit, dict) else None, layer_id)
+                if nodes is not None:
+                    key_of[f] = len(snaps)
+                    snaps.append(nodes)
+            plan = _Plan(frame_count)
+            rows = frames[on_key]
+            ks = np.array([key_of.get(int(f), -1) for f in sf[lo[on_key]]], dtype=np.int64)
+            plan.kind[rows[ks >= 0]] = _SET
+            plan.k0[rows[ks >= 0]] = ks[ks >= 0]
+            _plan_between(plan, frames[~on_key], prev, nxt, key_of, layer_id, easing_keys, curves)
+            layer_jobs.append((layer_id, layer.get("nodeTree"), snaps, plan))
+    else:
+        by_layer = tl.get("nodeKeyframesByLayer") if isinstance(tl.get("nodeKeyframesByLayer"), dict) else {}
+        spans_by_layer = tl.get("keyframeSpansByLayer") if isinstance(tl.get("keyframeSpansByLayer"), dict) else {}
+        for layer in base_layers:
+            layer_id = str(layer.get("id"))
+            plan = _Plan(frame_count)
+            snaps = []
+            starts, ends = _to_segments(spans_by_layer.get(layer_id))
+            raw = by_layer.get(layer_id) if isinstance(by_layer.get(layer_id), dict) else {}
+            key_of = {}
+            for k in sorted(raw, key=lambda s: int(s) if str(s).lstrip("-").isdigit() else 0):
+                v = raw[k]
+                if not str(k).lstrip("-").isdigit() or not isinstance(v, dict):
+                    continue
+                key_of[int(k)] = len(snaps)
+                snaps.append({nid: (s.get("transform"), s.get("props")) for nid, s in v.items() if isinstance(s, dict)})
+            if starts.size:
+                idx = np.searchsorted(starts, frames, side="right") - 1
+                contained = (idx >= 0) & (frames <= ends[np.maximum(idx, 0)])
+                rows = frames[contained]
+                ks = np.array([key_of.get(int(f), -1) for f in rows], dtype=np.int64)
+                plan.kind[rows[ks >= 0]] = _SET
+                plan.k0[rows[ks >= 0]] = ks[ks >= 0]
+                lo = np.searchsorted(starts, frames, side="left")
+                nxt = np.where(lo < starts.size, starts[np.minimum(lo, starts.size - 1)], -1)
+                prev = np.where(lo > 0, ends[np.maximum(lo - 1, 0)], -1)
+                _plan_between(plan, frames[~contained], prev, nxt, key_of, layer_id, easing_keys, curves)
+            layer_jobs.append((layer_id, layer.get("nodeTree"), snaps, plan))
+
+    node_ids: List[str] = []
+    node_layers: List[str] = []
+    statics: List[np.ndarray] = []
+    index_parts: List[np.ndarray] = []
+    pending: List[Tuple[_Plan, np.ndarray, np.ndarray, np.ndarray]] = []
+    channel_count = len(CHANNELS)
+    for layer_id, tree, snaps, plan in layer_jobs:
+        ids, base, keyvals = _collect_layer(layer_id, tree, snaps)
+        offset = len(node_ids)
+        node_ids.extend(ids)
+        node_layers.extend([layer_id] * len(ids))
+        cols = _animated_columns(keyvals, base)
+        if cols.size:
+            index_parts.append(np.stack([cols // channel_count + offset, cols % channel_count], axis=1).astype(np.int32))
+            pending.append((plan, keyvals, base, cols))
+        statics.append(base)
+
+    track_index = np.concatenate(index_parts) if index_parts else np.zeros((0, 2), dtype=np.int32)
+    tracks = np.empty((frame_count, track_index.shape[0]), dtype=np.float32)
+    col = 0
+    for plan, keyvals, base, cols in pending:
+        _evaluate_tracks(plan, keyvals, base, cols, tracks[:, col : col + cols.size], lerp_missing_from_next=(mode == "legacy"))
+        col += cols.size
+
+    return BakedTimeline(
+        frame_count=frame_count,
+        mode=mode,
+        node_ids=node_ids,
+        node_layers=node_layers,
+        static=np.concatenate(statics) if statics else np.zeros((0, channel_count), dtype=np.float32),
+        track_index=track_index,
+        tracks=tracks,
+        cache_key=cache_key or "",
+    )
+
+
+def _aligned(n: int) -> int:
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _layout(baked: BakedTimeline) -> Tuple[bytes, List[Tuple[int, np.ndarray]]]:
+    blocks = [("static", baked.static.astype("<f4", copy=False)), ("trackIndex", baked.track_index.astype("<i4", copy=False)), ("tracks", baked.tracks.astype("<f4", copy=False))]
+    header: Dict[str, Any] = {
+        "version": PAYLOAD_VERSION,
+        "cacheKey": baked.cache_key,
+        "mode": baked.mode,
+        "frameCount": baked.frame_count,
+        "nodeIds": baked.node_ids,
+        "nodeLayers": baked.node_layers,
+        "channels": list(baked.channels),
+        "arrays": {},
+    }
+    # Offsets depend on header size; iterate until the header length is stable.
+    offsets: List[int] = []
+    header_bytes = b""
+    for _ in range(4):
+        start = _aligned(len(MAGIC) + 4 + len(header_bytes))
+        offsets = []
+        pos = start
+        for name, arr in blocks:
+            offsets.append(pos)
+            header["arrays"][name] = {"offset": pos, "shape": list(arr.shape), "dtype": arr.dtype.str}
+            pos = _aligned(pos + arr.nbytes)
+        nxt = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if len(nxt) == len(header_bytes):
+            break
+        header_bytes = nxt
+    pad = offsets[0] - (len(MAGIC) + 4 + len(header_bytes))
+    head = MAGIC + struct.pack("<I", len(header_bytes) + pad) + header_bytes + b" " * pad
+    return head, [(off, arr) for off, (_, arr) in zip(offsets, blocks)]
+
+
+def write_baked(baked: BakedTimeline, fp: BinaryIO) -> int:
+    head, blocks = _layout(baked)
+    fp.write(head)
+    pos = len(head)
+    for off, arr in blocks:
+        fp.write(b"\0" * (off - pos))
+        fp.write(np.ascontiguousarray(arr).tobytes())
+        pos = off + arr.nbytes
+    tail = _aligned(pos) - pos
+    fp.write(b"\0" * tail)
+    return pos + tail
+
+
+def encode_baked(baked: BakedTimeline) -> bytes:
+    import io
+
+    buf = io.BytesIO()
+    write_baked(baked, buf)
+    return buf.getvalue()
+
+
+def load_baked(source: Union[bytes, bytearray, memoryview, str, Path]) -> BakedTimeline:
+    """Open a payload from bytes or a file path (files are memory-mapped, not read)."""
+
+    if isinstance(source, (str, Path)):
+        data: Any = np.memmap(str(source), dtype=np.uint8, mode="r")
+    else:
+        data = np.frombuffer(source, dtype=np.uint8)
+    if bytes(data[: len(MAGIC)]) != MAGIC:
+        raise ValueError("not a baked timeline payload")
+    (header_len,) = struct.unpack("<I", bytes(data[len(MAGIC) : len(MAGIC) + 4]))
+    header = json.loads(bytes(data[len(MAGIC) + 4 : len(MAGIC) + 4 + header_len]).decode("utf-8"))
+
+    def view(name: str) -> np.ndarray:
+        spec = header["arrays"][name]
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"])) if spec["shape"] else 0
+        raw = data[spec["offset"] : spec["offset"] + count * dtype.itemsize]
+        return raw.view(dtype).reshape(spec["shape"])
+
+    return BakedTimeline(
+        frame_count=int(header["frameCount"]),
+        mode=str(header["mode"]),
+        node_ids=list(header["nodeIds"]),
+        node_layers=list(header["nodeLayers"]),
+        static=view("static"),
+        track_index=view("trackIndex"),
+        tracks=view("tracks"),
+        cache_key=str(header.get("cacheKey") or ""),
+        channels=tuple(header["channels"]),
+    )
+
+
+def _bake_dir() -> Path:
+    from django.conf import settings
+
+    return Path(getattr(settings, "DWEB_DATA_DIR")) / "timeline-bake"
+
+
+def _touch(path: Path) -> bool:
+    """Mark a payload file as used (export/jobs.py sweeps bakes LRU by mtime); False if it is gone."""
+
+    try:
+        os.utime(path)
+    except OSError:
+        return False
+    return True
+
+
+def get_baked_timeline(snapshot: Any) -> Tuple[BakedTimeline, Path, bool]:
+    """Bake with a two-level cache (in-process LRU + on-disk payload file).
+
+    Payload files are bounded by export.jobs.sweep().
+
+    Returns (baked, payload_path, cache_hit).
+    """
+
+    key = timeline_cache_key(snapshot)
+    path = _bake_dir() / f"{key}.dvsbake"
+    hit = _BAKE_CACHE.get(key)
+    if hit is not None and _touch(path):
+        return hit, path, True
+    if _touch(path):
+        baked = load_baked(path)
+        _BAKE_CACHE.put(key, baked)
+        return baked, path, True
+
+    baked = bake_timeline(snapshot, cache_key=key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            write_baked(baked, fp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    _BAKE_CACHE.put(key, baked)
+    return baked, path, False
@@ -0,0 +1,70 @@
+"""Vectorized cubic-bezier easing (port of src/ui/TimeLine/core/curveTick.ts)."""
+
+from __future__ import annotations
+
+from typing import Any, Dict
+
+import numpy as np
+
+LINEAR_CURVE: Dict[str, float] = {"x1": 0.0, "y1": 0.0, "x2": 1.0, "y2": 1.0}
+
+
+def _clamp01(v: Any) -> float:
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return 0.0
+    if f != f:
+        return 0.0
+    return max(0.0, min(1.0, f))
+
+
+def _calc(t: np.ndarray, a1: float, a2: float) -> np.ndarray:
+    a = 1.0 - 3.0 * a2 + 3.0 * a1
+    b = 3.0 * a2 - 6.0 * a1
+    c = 3.0 * a1
+    return ((a * t + b) * t + c) * t
+
+
+def _slope(t: np.ndarray, a1: float, a2: float) -> np.ndarray:
+    a = 1.0 - 3.0 * a2 + 3.0 * a1
+    b = 3.0 * a2 - 6.0 * a1
+    c = 3.0 * a1
+    return 3.0 * a * t * t + 2.0 * b * t + c
+
+
+def cubic_bezier_y_for_x(curve: Any, xs: np.ndarray) -> np.ndarray:
+    """Evaluate a CSS-style cubic-bezier timing curve for an array of x in [0, 1].
+
+    Newton-Raphson from a linear initial guess, then bisection to clean up
+    points where the slope is too flat; matches cubicBezierYforX within 1e-6.
+    """
+
+    c = curve if isinstance(curve, dict) else LINEAR_CURVE
+    x1, y1 = _clamp01(c.get("x1", 0)), _clamp01(c.get("y1", 0))
+    x2, y2 = _clamp01(c.get("x2", 1)), _clamp01(c.get("y2", 1))
+    x = np.clip(np.asarray(xs, dtype=np.float64), 0.0, 1.0)
+    if x1 == y1 and x2 == y2:
+        return x
+
+    t = x.copy()
+    for _ in range(8):
+        s = _slope(t, x1, x2)
+        ok = np.abs(s) >= 1e-6
+        t = np.where(ok, t - (_calc(t, x1, x2) - x) / np.where(ok, s, 1.0), t)
+    t = np.clip(t, 0.0, 1.0)
+
+    bad = np.abs(_calc(t, x1, x2) - x) > 1e-7
+    if bad.any():
+        lo = np.zeros(int(bad.sum()))
+        hi = np.ones_like(lo)
+        xb = x[bad]
+        for _ in range(30):
+            mid = (lo + hi) / 2
+            over = _calc(mid, x1, x2) > xb
+            hi = np.where(over, mid, hi)
+            lo = np.where(over, lo, mid)
+        t[bad] = (lo + hi) / 2
+
+    y = np.clip(_calc(t, y1, y2), 0.0, 1.0)
+    return np.where((x == 0.0) | (x == 1.0), x, y)
@@ -2,6 +2,11 @@ from django.urls import include, path
 
 from . import views
 from . import ai_chat_api
+from . import chat_batch_api
+from . import chat_job_api
+from . import export_api
+from . import ops_api
+from . import stage_api
 
 urlpatterns = [
     # Legacy sample endpoints (kept for quick smoke tests)
@@ -20,6 +25,38 @@ urlpatterns = [
         ai_chat_api.stream_message,
         name="chat-stream-message",
     ),
+    path(
+        "chat/conversations/<str:conversation_id>/stage",
+        ai_chat_api.stage_mirror_detail,
+        name="chat-stage-mirror",
+    ),
+    path(
+        "chat/conversations/<str:conversation_id>/jobs",
+        chat_job_api.create_chat_job,
+        name="chat-job-create",
+    ),
+    path("chat/jobs/<str:job_id>", chat_job_api.chat_job_status, name="chat-job-status"),
+    path("chat/jobs/<str:job_id>/events", chat_job_api.chat_job_events, name="chat-job-events"),
+    path("chat/batches", chat_batch_api.create_chat_batch, name="chat-batch-create"),
+    # `:resume` must precede the bare <batch_id> route (str converter would swallow it).
+    path("chat/batches/<str:batch_id>:resume", chat_batch_api.resume_chat_batch, name="chat-batch-resume"),
+    path("chat/batches/<str:batch_id>", chat_batch_api.chat_batch_status, name="chat-batch-status"),
+    path("chat/batches/<str:batch_id>/results", chat_batch_api.chat_batch_results, name="chat-batch-results"),
+    # Stage APIs
+    path("stage/render", stage_api.render_stage, name="stage-render"),
+    path("stage/instantiate", stage_api.instantiate_template, name="stage-instantiate"),
+    path("timeline/bake", stage_api.bake_timeline, name="timeline-bake"),
+    # Export jobs
+    path("export/frames", export_api.create_export, name="export-frames"),
+    path("export/jobs/<str:job_id>", export_api.export_status, name="export-status"),
+    path("export/jobs/<str:job_id>/events", export_api.export_events, name="export-events"),
+    # Ops (DWEB_OPS_TOKEN); `:cancel` must precede the bare <stream_id> route.
+    path("ops/metrics", ops_api.metrics_snapshot, name="ops-metrics"),
+    path("ops/streams", ops_api.list_streams, name="ops-streams"),
+    path("ops/streams/<str:stream_id>:cancel", ops_api.cancel_stream, name="ops-stream-cancel"),
+    path("ops/streams/<str:stream_id>", ops_api.stream_detail, name="ops-stream-detail"),
+    path("ops/profiles", ops_api.list_profiles, name="ops-profiles"),
+    path("ops/profiles/<str:profile_id>", ops_api.profile_detail, name="ops-profile-detail"),
     # Generated / user-defined APIs live here
     path("", include("dwebapp.dweb_urls")),
 ]
@@ -1,8 +1,23 @@
-"""ASGI config for the bundled Django project."""
+"""ASGI config for the bundled Django project.
+
+HTTP goes to Django; WebSocket connections go to the chat transport
+(dwebapp/chat_ws.py, path /api/chat/ws).
+"""
 from __future__ import annotations
 
 import os
+from typing import Any, Dict
+
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "dwebsite.settings")
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from dwebapp.chat_ws import websocket_app  # noqa: E402  (needs django.setup() above)
+
+
+async def application(scope: Dict[str, Any], receive: Any, send: Any) -> None:
+    if scope["type"] == "websocket":
+        await websocket_app(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
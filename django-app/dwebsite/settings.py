@@ -1,6 +1,7 @@
 """Minimal Django settings for the Dweb Studio backend template."""
 from __future__ import annotations
 
+import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -73,6 +74,9 @@ STATIC_URL = "static/"
 STATIC_ROOT = BASE_DIR / "static"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Working directory for backend caches/jobs (baked timelines, exports, ...)
+DWEB_DATA_DIR = Path(os.environ.get("DWEB_DATA_DIR") or (BASE_DIR / "var"))
+
 REST_FRAMEWORK = {
     "DEFAULT_RENDERER_CLASSES": [
         "rest_framework.renderers.JSONRenderer",
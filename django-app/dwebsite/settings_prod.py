@@ -0,0 +1,64 @@
+"""Lean production profile: DJANGO_SETTINGS_MODULE=dwebsite.settings_prod
+
+Only what the JSON/SSE API needs on the request path:
+- no admin / sessions / messages / auth apps (nothing here uses them)
+- middleware trimmed to CORS + security + common (the chat views are
+  csrf_exempt and DRF views skip CSRF without session auth anyway)
+- DRF renders JSON only (no BrowsableAPIRenderer template rendering)
+- URLconf and static prompt parts are built at boot (DWEB_WARM_START)
+
+DJANGO_SECRET_KEY and DJANGO_ALLOWED_HOSTS are required.
+
+`python manage.py startup_bench` compares this profile with the dev settings.
+"""
+from __future__ import annotations
+
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # noqa: F401,F403
+
+DEBUG = os.environ.get("DJANGO_DEBUG") == "1"
+# No fallbacks: the dev key is committed in settings.py and "*" accepts any Host header.
+SECRET_KEY = os.environ.get("DJANGO_SECRET_KEY") or ""
+if not SECRET_KEY:
+    raise ImproperlyConfigured("DJANGO_SECRET_KEY must be set for the production profile")
+ALLOWED_HOSTS = [h.strip() for h in os.environ.get("DJANGO_ALLOWED_HOSTS", "").split(",") if h.strip()]
+if not ALLOWED_HOSTS:
+    raise ImproperlyConfigured("DJANGO_ALLOWED_HOSTS must list the served host names (comma-separated)")
+
+INSTALLED_APPS = [
+    "django.contrib.staticfiles",
+    "rest_framework",
+    "dwebapp",
+    "corsheaders",
+]
+
+MIDDLEWARE = [
+    "corsheaders.middleware.CorsMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+    "django.middleware.common.CommonMiddleware",
+]
+
+TEMPLATES = [
+    {
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "DIRS": [],
+        "APP_DIRS": False,
+        "OPTIONS": {"context_processors": []},
+    },
+]
+
+AUTH_PASSWORD_VALIDATORS = []
+
+REST_FRAMEWORK = {
+    "DEFAULT_RENDERER_CLASSES": ["rest_framework.renderers.JSONRenderer"],
+    "DEFAULT_PARSER_CLASSES": ["rest_framework.parsers.JSONParser"],
+    # No contrib.auth: requests stay anonymous without touching the auth models.
+    "DEFAULT_AUTHENTICATION_CLASSES": [],
+    "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.AllowAny"],
+    "UNAUTHENTICATED_USER": None,
+}
+
+DWEB_WARM_START = True
@@ -1,10 +1,15 @@
 """dwebsite URL configuration."""
 from __future__ import annotations
 
-from django.contrib import admin
+from django.apps import apps
 from django.urls import include, path
 
 urlpatterns = [
-    path("admin/", admin.site.urls),
     path("api/", include("dwebapp.urls")),
 ]
+
+# The production profile drops the admin app (and its import cost).
+if apps.is_installed("django.contrib.admin"):
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path("admin/", admin.site.urls))
@@ -64,6 +64,12 @@ const replace = (snapshot: EditorSnapshot) => {
 	lastSavedAt.value = null
 }
 
+// 回滚到某个快照：作为一次普通修改进入历史（可撤销），不清空撤销栈。
+const restore = (snapshot: EditorSnapshot) => {
+	applySnapshot(snapshot)
+	dispatchDvsEditorStateRestored('replace')
+}
+
 const undo = () => {
 	historyCore.undo()
 }
@@ -80,6 +86,7 @@ export const editorPersistence = {
 	lastSavedAt,
 	getSnapshot,
 	replace,
+	restore,
 	canUndo: computed(() => {
 		void historyVersion.value
 		return historyCore.canUndo()
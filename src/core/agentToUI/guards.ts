@@ -136,6 +136,7 @@ export function isAgentToUiTaskStatusMessage(v: unknown): v is AgentToUiTaskStat
 		phase !== 'streaming' &&
 		phase !== 'writing' &&
 		phase !== 'template' &&
+		phase !== 'retry' &&
 		phase !== 'done' &&
 		phase !== 'canceled' &&
 		phase !== 'error'
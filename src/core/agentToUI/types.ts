@@ -51,7 +51,7 @@ export type AgentToUiComponentTemplatePayload = {
 	params?: Record<string, unknown>
 }
 
-export type AgentToUiTaskStatusPhase = 'started' | 'streaming' | 'writing' | 'template' | 'done' | 'canceled' | 'error'
+export type AgentToUiTaskStatusPhase = 'started' | 'streaming' | 'writing' | 'template' | 'retry' | 'done' | 'canceled' | 'error'
 
 export type AgentToUiTaskStatusPayload = {
 	phase: AgentToUiTaskStatusPhase